@@ -1,10 +1,11 @@
 import os
 import logging
 
-from flask import Flask
+from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
+from markupsafe import Markup
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Configure logging
@@ -17,153 +18,178 @@ class Base(DeclarativeBase):
 # Initialize database
 db = SQLAlchemy(model_class=Base)
 
-# Create the Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "riska_finance_enterprise_secret")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure database
-# Handle potential 'postgres://' URLs from some providers by converting to 'postgresql://'
-database_url = os.environ.get("DATABASE_URL", "sqlite:///riskas_finance.db")
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-    "pool_size": 10,  # Optimal for most PostgreSQL connections
-    "max_overflow": 20  # Allow additional temporary connections if needed
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize database with app
-db.init_app(app)
-
 # Setup login manager
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
-# Create database tables
-with app.app_context():
+def get_database_url():
+    """Get the database URL from the environment"""
+    # Handle potential 'postgres://' URLs from some providers by converting to 'postgresql://'
+    database_url = os.environ.get("DATABASE_URL", "sqlite:///riskas_finance.db")
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    return database_url
+
+def create_app(config=None):
+    """
+    Create and configure the Flask app.
+
+    No database I/O happens here: schema creation, seeding and PostgreSQL
+    tuning are done once per deployment with `flask riska init-db` and
+    `flask riska optimize-db`, not in every worker.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "riska_finance_enterprise_secret")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # Configure database
+    app.config["SQLALCHEMY_DATABASE_URI"] = get_database_url()
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        "pool_size": 10,  # Optimal for most PostgreSQL connections
+        "max_overflow": 20  # Allow additional temporary connections if needed
+    }
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Report cache: 'memory' (per process), 'sqlite' (shared on disk) or 'none'
+    app.config["REPORT_CACHE_BACKEND"] = os.environ.get("REPORT_CACHE_BACKEND", "memory")
+    app.config["REPORT_CACHE_PATH"] = os.environ.get("REPORT_CACHE_PATH", os.path.join(app.instance_path, "report_cache.sqlite"))
+    app.config["REPORT_CACHE_MAX_ENTRIES"] = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", 256))
+    app.config["REPORT_CACHE_MAX_BYTES"] = int(os.environ.get("REPORT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+    # Opt-in per-request SQL query counting (X-Query-Count / Server-Timing headers)
+    app.config["QUERY_PROFILING"] = os.environ.get("QUERY_PROFILING", "").lower() in ("1", "true", "yes")
+
+    if config:
+        app.config.update(config)
+
+    # Initialize extensions
+    db.init_app(app)
+    login_manager.init_app(app)
+
     import models  # noqa: F401
-    from models import User, Role
-    db.create_all()
-    
-    # Create default roles
-    Role.insert_roles()
-    
-    # Create a default admin user if none exists
-    if not User.query.filter_by(username='admin').first():
-        admin_role = Role.query.filter_by(name='Admin').first()
-        if admin_role:
-            admin = User(
-                username='admin',
-                email='admin@riskasfinance.com',
-                first_name='System',
-                last_name='Admin',
-                role=admin_role
-            )
-            admin.set_password('adminpassword')
-            db.session.add(admin)
-            db.session.commit()
-            print("Created default admin user: admin / adminpassword")
-    
-    # If using PostgreSQL, apply database optimizations
-    if database_url.startswith(("postgres://", "postgresql://")):
-        print("PostgreSQL detected - applying optimizations...")
-        try:
-            from utils.database import optimize_queries
-            optimize_queries()
-            print("PostgreSQL optimizations applied!")
-        except Exception as e:
-            print(f"Error applying PostgreSQL optimizations: {e}")
-    
+    from models import User
+
     # Setup user loader for Flask-Login
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
-
-# Import and register blueprint routes
-from routes.auth import auth_bp
-from routes.profile import profile_bp
-from routes.dashboard import dashboard_bp
-from routes.accounts import accounts_bp
-from routes.journals import journals_bp
-from routes.invoices import invoices_bp
-from routes.expenses import expenses_bp
-from routes.entities import entities_bp
-from routes.inventory import inventory_bp
-from routes.reports import reports_bp
-from routes.fixed_assets import setup_assets_blueprint
-from routes.budgeting import budgeting_bp
-from routes.bank_reconciliation import bank_reconciliation_bp
-from routes.projects import projects_bp
-from routes.financial_snapshot import snapshot
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(profile_bp)
-app.register_blueprint(dashboard_bp)
-app.register_blueprint(accounts_bp)
-app.register_blueprint(journals_bp)
-app.register_blueprint(invoices_bp)
-app.register_blueprint(expenses_bp)
-app.register_blueprint(entities_bp)
-app.register_blueprint(inventory_bp, url_prefix='/inventory')
-app.register_blueprint(reports_bp)
-app.register_blueprint(budgeting_bp, url_prefix='/budgeting')
-app.register_blueprint(bank_reconciliation_bp, url_prefix='/banking')
-app.register_blueprint(projects_bp, url_prefix='/projects')
-app.register_blueprint(snapshot, url_prefix='/snapshots')
-
-# Setup fixed assets blueprint
-setup_assets_blueprint(app)
-
-# Register error handlers
-@app.errorhandler(404)
-def page_not_found(e):
-    return render_template('layout.html', error="Page not found"), 404
-
-@app.errorhandler(500)
-def internal_server_error(e):
-    return render_template('layout.html', error="Internal server error"), 500
-
-# Import this after the app is created to avoid circular imports
-from flask import render_template
-from markupsafe import Markup
-
-# Register custom Jinja2 filters
-@app.template_filter('nl2br')
-def nl2br_filter(s):
-    if s is None:
-        return ""
-    return Markup(s.replace('\n', '<br>'))
-
-@app.template_filter('format_currency')
-def format_currency_filter(value, symbol='$', decimal_places=2):
-    """Format a number as currency"""
-    if value is None:
-        return ""
-    try:
-        value = float(value)
-        formatted = f"{symbol}{value:,.{decimal_places}f}"
-        return formatted
-    except (ValueError, TypeError):
-        return f"{symbol}0.00"
-
-# Add context processors
-@app.context_processor
-def inject_role():
-    """Make Role model and enumeration classes available in all templates"""
-    from models import Role, ProjectStatus
-    # Convert ProjectStatus to a dictionary for iteration in templates
-    status_dict = {
-        'PLANNED': 1,
-        'IN_PROGRESS': 2, 
-        'ON_HOLD': 3,
-        'COMPLETED': 4,
-        'CANCELLED': 5
-    }
-    return {'Role': Role, 'statuses': ProjectStatus, 'status_list': status_dict}
+        return db.session.get(User, int(user_id))
+
+    # Keep the per-period account balances in step with journal postings
+    from utils.balances import register_balance_listeners
+    register_balance_listeners()
+
+    # Keep the per-location stock levels in step with inventory movements
+    from utils.stock import register_stock_listeners
+    register_stock_listeners()
+
+    # Drop valuation snapshots that backdated inventory changes make stale
+    from utils.valuation_snapshots import register_snapshot_listeners
+    register_snapshot_listeners()
+
+    # Version the reconciliation rules so compiled rule sets are reused
+    from utils.rule_engine import register_rule_listeners
+    register_rule_listeners()
+
+    # Cache report results per ledger version
+    from utils.report_cache import init_report_cache
+    init_report_cache(app)
+
+    # Count queries per request and flag N+1 patterns when enabled
+    from utils.query_counter import init_query_profiler
+    init_query_profiler(app)
+
+    register_blueprints(app)
+    register_template_helpers(app)
+
+    # Register CLI commands
+    from commands import riska_cli
+    app.cli.add_command(riska_cli)
+
+    return app
+
+def register_blueprints(app):
+    """Import and register blueprint routes"""
+    from routes.auth import auth_bp
+    from routes.profile import profile_bp
+    from routes.dashboard import dashboard_bp
+    from routes.accounts import accounts_bp
+    from routes.journals import journals_bp
+    from routes.invoices import invoices_bp
+    from routes.expenses import expenses_bp
+    from routes.entities import entities_bp
+    from routes.inventory import inventory_bp
+    from routes.reports import reports_bp
+    from routes.fixed_assets import setup_assets_blueprint
+    from routes.budgeting import budgeting_bp
+    from routes.bank_reconciliation import bank_reconciliation_bp
+    from routes.projects import projects_bp
+    from routes.financial_snapshot import snapshot
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(profile_bp)
+    app.register_blueprint(dashboard_bp)
+    app.register_blueprint(accounts_bp)
+    app.register_blueprint(journals_bp)
+    app.register_blueprint(invoices_bp)
+    app.register_blueprint(expenses_bp)
+    app.register_blueprint(entities_bp)
+    app.register_blueprint(inventory_bp, url_prefix='/inventory')
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(budgeting_bp, url_prefix='/budgeting')
+    app.register_blueprint(bank_reconciliation_bp, url_prefix='/banking')
+    app.register_blueprint(projects_bp, url_prefix='/projects')
+    app.register_blueprint(snapshot, url_prefix='/snapshots')
+
+    # Setup fixed assets blueprint
+    setup_assets_blueprint(app)
+
+def register_template_helpers(app):
+    """Register error handlers, Jinja2 filters and context processors"""
+    # Register error handlers
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('layout.html', error="Page not found"), 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        return render_template('layout.html', error="Internal server error"), 500
+
+    # Register custom Jinja2 filters
+    @app.template_filter('nl2br')
+    def nl2br_filter(s):
+        if s is None:
+            return ""
+        return Markup(s.replace('\n', '<br>'))
+
+    @app.template_filter('format_currency')
+    def format_currency_filter(value, symbol='$', decimal_places=2):
+        """Format a number as currency"""
+        if value is None:
+            return ""
+        try:
+            value = float(value)
+            formatted = f"{symbol}{value:,.{decimal_places}f}"
+            return formatted
+        except (ValueError, TypeError):
+            return f"{symbol}0.00"
+
+    # Add context processors
+    @app.context_processor
+    def inject_role():
+        """Make Role model and enumeration classes available in all templates"""
+        from models import Role, ProjectStatus
+        # Convert ProjectStatus to a dictionary for iteration in templates
+        status_dict = {
+            'PLANNED': 1,
+            'IN_PROGRESS': 2,
+            'ON_HOLD': 3,
+            'COMPLETED': 4,
+            'CANCELLED': 5
+        }
+        return {'Role': Role, 'statuses': ProjectStatus, 'status_list': status_dict}
+
+# Application instance used by gunicorn (main:app) and existing imports
+app = create_app()
@@ -0,0 +1,144 @@
+"""
+Query plan benchmark for the ledger hot paths
+
+Runs the hot report and lookup queries, captures the SQL they emit and
+prints the database's plan for each one with and without the composite
+indexes declared in models.py (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on
+PostgreSQL), together with the query time.
+
+The "without" pass drops those indexes and re-creates them afterwards, so
+point DATABASE_URL at a benchmark database, not production.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_query_plans.py [--json plans.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, text  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import (  # noqa: E402
+    BankTransaction, InventoryTransaction, JournalEntry, JournalItem, Product, TimeEntry
+)
+from utils.balances import get_account_balances, get_account_type_balances  # noqa: E402
+from utils.database import create_model_indexes  # noqa: E402
+from utils.ledger import iter_general_ledger  # noqa: E402
+
+MODEL_INDEX_TABLES = ('journal_entry', 'journal_item', 'inventory_transaction', 'time_entry', 'bank_transaction')
+
+
+def workloads():
+    """(name, callable) pairs exercising the indexed access paths"""
+    today = date.today()
+    year_start = today.replace(month=1, day=1)
+    product = Product.query.first()
+    account_id = db.session.query(JournalItem.account_id).limit(1).scalar()
+
+    return [
+        ('account_balances', lambda: get_account_balances(None, year_start, today)),
+        ('single_account_balance', lambda: get_account_balances([account_id], year_start, today)),
+        ('account_type_balances', lambda: get_account_type_balances(None, None, today)),
+        ('general_ledger', lambda: list(iter_general_ledger(year_start, today))),
+        ('posted_entries_in_range', lambda: JournalEntry.query.filter(
+            JournalEntry.is_posted == True,
+            JournalEntry.entry_date >= year_start,
+            JournalEntry.entry_date <= today
+        ).count()),
+        ('product_stock', lambda: product.current_stock if product else None),
+        ('inventory_in_by_product', lambda: InventoryTransaction.query.filter_by(
+            product_id=product.id if product else 0, transaction_type='IN'
+        ).count()),
+        ('approved_time_by_project', lambda: TimeEntry.query.filter_by(project_id=1, is_approved=True).all()),
+        ('unreconciled_by_statement', lambda: BankTransaction.query.filter_by(
+            statement_id=1, is_reconciled=False
+        ).all()),
+    ]
+
+
+def capture_statements(func):
+    """Run func and return the SELECT statements it executed"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    db.session.rollback()
+    return statements
+
+
+def explain(statement, parameters):
+    """Return the plan for one statement as a list of lines"""
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    if db.engine.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def run_pass(label):
+    results = {}
+    for name, func in workloads():
+        statements = capture_statements(func)
+
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        db.session.rollback()
+
+        results[name] = {
+            'seconds': elapsed,
+            'plans': [explain(statement, parameters) for statement, parameters in statements],
+        }
+
+        print(f"\n[{label}] {name}: {elapsed * 1000:.1f} ms")
+        for plan in results[name]['plans']:
+            for line in plan:
+                print(f"    {line}")
+            print("    --")
+    return results
+
+
+def drop_model_indexes():
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name in MODEL_INDEX_TABLES:
+                for index in table.indexes:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', dest='json_path', help='write plans and timings to this file')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+        drop_model_indexes()
+        try:
+            before = run_pass('without composite indexes')
+        finally:
+            create_model_indexes()
+        after = run_pass('with composite indexes')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'without_indexes': before, 'with_indexes': after}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Route-level benchmark suite
+
+Boots the app against a seeded synthetic database (one per scale, created
+with utils.synthetic on first use and reused afterwards) and requests the key
+report, dashboard and list pages through the Flask test client. For every
+route it records wall time (min/median over --repeat runs), the number of SQL
+queries and the peak Python memory allocated while serving the request.
+
+Results are written to JSON and compared against a stored baseline; a route
+that got slower or more memory hungry than --threshold, or that issues more
+queries than before, is reported as a regression and the exit code is 1.
+
+Usage:
+    python benchmarks/bench_routes.py --scales tiny,small
+    python benchmarks/bench_routes.py --scales small --update-baseline
+    python benchmarks/bench_routes.py --scales small --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Keep the synthetic dataset stable between runs on different days
+DATA_END_DATE = date(2024, 12, 31)
+DATA_SEED = 42
+
+
+def route_list(project_id, statement_id):
+    """(name, url) pairs to benchmark"""
+    year_start = DATA_END_DATE.replace(month=1, day=1)
+    quarter_start = DATA_END_DATE.replace(month=10, day=1)
+    routes = [
+        ('dashboard', '/dashboard'),
+        ('profit_loss', f"/reports/profit-loss?start_date={year_start}&end_date={DATA_END_DATE}"),
+        ('balance_sheet', f"/reports/balance-sheet?as_of_date={DATA_END_DATE}"),
+        ('custom_general_ledger', f"/reports/custom?report_type=general_ledger"
+                                  f"&start_date={quarter_start}&end_date={DATA_END_DATE}"),
+        ('budget_variance', f"/budgeting/reports/variance?start_date={year_start}&end_date={DATA_END_DATE}"),
+        ('stock_valuation', '/inventory/reports/stock-valuation'),
+    ]
+    if project_id:
+        routes.append(('project_reports', f"/projects/{project_id}/reports"))
+    if statement_id:
+        routes.append(('statement_reconcile', f"/banking/statements/{statement_id}/reconcile"))
+    return routes
+
+
+def prepare_database(app, scale):
+    """Create and seed the scale's database if it is empty"""
+    from click.testing import CliRunner
+    from app import db
+    from commands import init_db_command
+    from models import Account
+    from utils.synthetic import generate_synthetic_data
+
+    with app.app_context():
+        result = CliRunner().invoke(init_db_command, [], catch_exceptions=False)
+        if result.exit_code != 0:
+            raise RuntimeError(result.output)
+
+        if Account.query.first() is None:
+            started = time.perf_counter()
+            generate_synthetic_data(scale=scale, seed=DATA_SEED, end_date=DATA_END_DATE, echo=lambda message: None)
+            print(f"  seeded {scale} dataset in {time.perf_counter() - started:.1f}s")
+        db.session.remove()
+
+
+def pick_ids(app):
+    """Busiest project and largest bank statement, so those pages do real work"""
+    from sqlalchemy import func
+    from app import db
+    from models import BankTransaction, TimeEntry
+
+    with app.app_context():
+        project_id = db.session.query(TimeEntry.project_id).group_by(TimeEntry.project_id).order_by(
+            func.count(TimeEntry.id).desc()).limit(1).scalar()
+        statement_id = db.session.query(BankTransaction.statement_id).group_by(BankTransaction.statement_id).order_by(
+            func.count(BankTransaction.id).desc()).limit(1).scalar()
+        db.session.remove()
+    return project_id, statement_id
+
+
+def measure_route(client, url, repeat):
+    """Time one route; returns wall times, query count and peak memory"""
+    from utils.query_counter import count_queries
+
+    # Warm-up request (template compilation, connection pool)
+    response = client.get(url)
+    status = response.status_code
+
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with count_queries() as stats:
+            started = time.perf_counter()
+            client.get(url)
+            timings.append(time.perf_counter() - started)
+        queries = stats.count
+
+    # Memory is measured in a separate pass because tracing slows requests down
+    tracemalloc.start()
+    client.get(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status': status,
+        'wall_seconds_min': min(timings),
+        'wall_seconds_median': statistics.median(timings),
+        'queries': queries,
+        'peak_memory_bytes': peak,
+    }
+
+
+def run_scale(scale, args):
+    from app import create_app
+
+    database_path = os.path.join(args.data_dir, f"bench_{scale}.db")
+    if args.reseed and os.path.exists(database_path):
+        os.remove(database_path)
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{database_path}",
+        'REPORT_CACHE_BACKEND': args.report_cache,
+        'TESTING': True,
+    })
+    prepare_database(app, scale)
+    project_id, statement_id = pick_ids(app)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'adminpassword'})
+
+    results = {}
+    for name, url in route_list(project_id, statement_id):
+        if args.routes and name not in args.routes:
+            continue
+        results[name] = measure_route(client, url, args.repeat)
+        results[name]['url'] = url
+        print(
+            f"  {name:24} {results[name]['status']}  "
+            f"{results[name]['wall_seconds_median'] * 1000:9.1f} ms  "
+            f"{results[name]['queries']:6d} queries  "
+            f"{results[name]['peak_memory_bytes'] / 1024 / 1024:8.1f} MiB"
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human-readable regressions against the baseline"""
+    regressions = []
+    for scale, routes in results.items():
+        for name, current in routes.items():
+            previous = baseline.get('results', {}).get(scale, {}).get(name)
+            if not previous:
+                continue
+            label = f"{scale}/{name}"
+            if current['wall_seconds_median'] > previous['wall_seconds_median'] * (1 + threshold):
+                regressions.append(
+                    f"{label}: median {current['wall_seconds_median'] * 1000:.1f} ms "
+                    f"vs baseline {previous['wall_seconds_median'] * 1000:.1f} ms"
+                )
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{label}: {current['queries']} queries vs baseline {previous['queries']}")
+            if current['peak_memory_bytes'] > previous['peak_memory_bytes'] * (1 + threshold):
+                regressions.append(
+                    f"{label}: peak memory {current['peak_memory_bytes'] / 1024 / 1024:.1f} MiB "
+                    f"vs baseline {previous['peak_memory_bytes'] / 1024 / 1024:.1f} MiB"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='tiny,small', help='comma-separated scales from utils.synthetic.SCALES')
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed requests per route')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='where the seeded databases are kept')
+    parser.add_argument('--reseed', action='store_true', help='rebuild the seeded databases')
+    parser.add_argument('--report-cache', default='none', help="report cache backend to use ('none' measures compute)")
+    parser.add_argument('--output', default=None, help='write results JSON here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown / memory growth (0.25 = 25%%)')
+    args = parser.parse_args()
+    args.routes = set(args.routes.split(',')) if args.routes else None
+
+    logging.disable(logging.WARNING)
+
+    results = {}
+    for scale in [value.strip() for value in args.scales.split(',') if value.strip()]:
+        print(f"[{scale}]")
+        results[scale] = run_scale(scale, args)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'report_cache': args.report_cache,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --update-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("Regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Worker startup benchmark
+
+Measures how long a fresh interpreter takes to import the WSGI app
+(`main:app`), which is what every gunicorn worker does at boot, and counts
+the database connections opened during the import. With the app factory
+this should be zero; schema setup is a one-time `flask riska init-db`.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run inside a fresh interpreter per sample so nothing is cached in-process
+WORKER_SCRIPT = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+
+start = time.perf_counter()
+import main  # noqa: F401
+elapsed = time.perf_counter() - start
+
+print(json.dumps({'seconds': elapsed, 'db_connections': len(connections)}))
+"""
+
+
+def time_worker_import(env):
+    """Import main:app in a new interpreter and return its timing"""
+    result = subprocess.run(
+        [sys.executable, '-c', WORKER_SCRIPT],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def time_init_db(env):
+    """Time the one-time `flask riska init-db` command"""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'main', 'riska', 'init-db'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='number of worker imports to time')
+    parser.add_argument('--skip-init-db', action='store_true', help='do not time flask riska init-db')
+    parser.add_argument('--json', dest='json_path', help='write results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('PYTHONDONTWRITEBYTECODE', '0')
+
+    # Warm the bytecode cache so the first sample is not an outlier
+    time_worker_import(env)
+
+    samples = [time_worker_import(env) for _ in range(args.runs)]
+    seconds = [sample['seconds'] for sample in samples]
+
+    results = {
+        'runs': args.runs,
+        'import_seconds_min': min(seconds),
+        'import_seconds_median': statistics.median(seconds),
+        'import_seconds_max': max(seconds),
+        'db_connections_at_import': max(sample['db_connections'] for sample in samples),
+    }
+    if not args.skip_init_db:
+        results['init_db_seconds'] = time_init_db(env)
+
+    for key, value in results.items():
+        print(f"{key:28} {value:.4f}" if isinstance(value, float) else f"{key:28} {value}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
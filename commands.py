@@ -0,0 +1,266 @@
+"""
+Command line tools for Riska's Finance Enterprise
+
+Usage: flask --app main riska <command>
+"""
+import click
+from flask.cli import AppGroup
+
+riska_cli = AppGroup('riska', help='Riska\'s Finance maintenance commands.')
+
+
+def create_default_admin():
+    """Create the default admin user if none exists. Returns True if created."""
+    from app import db
+    from models import Role, User
+
+    if User.query.filter_by(username='admin').first():
+        return False
+
+    admin_role = Role.query.filter_by(name='Admin').first()
+    if not admin_role:
+        return False
+
+    admin = User(
+        username='admin',
+        email='admin@riskasfinance.com',
+        first_name='System',
+        last_name='Admin',
+        role=admin_role
+    )
+    admin.set_password('adminpassword')
+    db.session.add(admin)
+    db.session.commit()
+    return True
+
+
+@riska_cli.command('init-db')
+@click.option('--optimize/--no-optimize', default=False,
+              help='Also create indexes and refresh planner statistics (ANALYZE).')
+def init_db_command(optimize):
+    """Create tables, default roles and the admin user. Safe to re-run."""
+    from app import db
+    from models import Role
+    from utils.balances import ensure_account_period_balances
+    from utils.stock import ensure_product_stock, ensure_transaction_warehouses
+
+    db.create_all()
+    click.echo("Database tables created.")
+
+    # Add columns and indexes declared on models since the tables were created
+    from utils.database import add_missing_columns, create_model_indexes
+    for column_name in add_missing_columns():
+        click.echo(f"Added column {column_name}.")
+    # Warehouse names must be unique before uq_warehouse_name goes on
+    from utils.stock import deduplicate_warehouse_names
+    for old_name, new_name in deduplicate_warehouse_names():
+        click.echo(f"Renamed duplicate warehouse {old_name} to {new_name}.")
+    for index_name in create_model_indexes():
+        click.echo(f"Created index {index_name}.")
+
+    # Create default roles
+    Role.insert_roles()
+    click.echo("Default roles ready.")
+
+    if create_default_admin():
+        click.echo("Created default admin user: admin / adminpassword")
+
+    # Fixed asset statuses, conditions and default locations
+    from routes.fixed_assets import init_asset_reference_data
+    init_asset_reference_data()
+
+    # Backfill the per-period account balances for existing ledgers
+    ensure_account_period_balances()
+
+    # Backfill the per-location stock levels for existing inventories
+    ensure_product_stock()
+
+    # Key transactions recorded before warehouse_id to their warehouses
+    result = ensure_transaction_warehouses()
+    if result:
+        click.echo(f"Mapped {result['mapped']} inventory transactions to warehouses.")
+        if result['unmatched']:
+            click.echo(
+                f"{len(result['unmatched'])} locations match no warehouse; "
+                f"run 'flask riska migrate-warehouses --create-missing' to create them."
+            )
+
+    if optimize:
+        _optimize_database()
+
+
+@riska_cli.command('optimize-db')
+def optimize_db_command():
+    """Create indexes and refresh planner statistics (ANALYZE)."""
+    _optimize_database()
+
+
+def _optimize_database():
+    from app import db
+    from utils.database import optimize_queries
+
+    # optimize_queries() picks what applies to the backend
+    dialect = db.engine.dialect.name
+    click.echo(f"Applying {dialect} optimizations...")
+    optimize_queries()
+    click.echo("Database optimizations applied!")
+
+
+@riska_cli.command('rebuild-balances')
+def rebuild_balances_command():
+    """Rebuild per-account, per-month balances from posted journal items."""
+    from utils.balances import rebuild_account_period_balances
+
+    count = rebuild_account_period_balances()
+    click.echo(f"Rebuilt {count} account period balances.")
+
+
+@riska_cli.command('rebuild-stock')
+def rebuild_stock_command():
+    """Rebuild per-product, per-location stock levels from inventory transactions."""
+    from utils.stock import rebuild_product_stock
+
+    count = rebuild_product_stock()
+    click.echo(f"Rebuilt {count} product stock rows.")
+
+
+@riska_cli.command('close-inventory-periods')
+@click.option('--through', type=click.DateTime(formats=['%Y-%m-%d']), help='Last month to close (default: the previous month).')
+@click.option('--method', 'methods', multiple=True, type=click.Choice(['standard', 'weighted_average', 'fifo']),
+              help='Costing method to snapshot; repeat for several (default: all).')
+@click.option('--rebuild', is_flag=True, help='Delete the existing snapshots and close every month again.')
+def close_inventory_periods_command(through, methods, rebuild):
+    """Write month-end inventory valuation snapshots for the months not yet closed."""
+    from app import db
+    from utils.valuation_snapshots import close_inventory_periods, invalidate_valuation_snapshots
+
+    if rebuild:
+        invalidate_valuation_snapshots(db.session.connection(), methods=methods or None)
+        db.session.commit()
+
+    try:
+        closed = close_inventory_periods(through=through.date() if through else None, methods=methods or None)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for period in closed:
+        click.echo(f"{period['period_end']} {period['method']}: {period['rows']} snapshot rows.")
+    click.echo(f"Closed {len(closed)} inventory valuation periods.")
+
+
+@riska_cli.command('migrate-warehouses')
+@click.option('--create-missing', is_flag=True, help='Create a warehouse for each location that matches none.')
+def migrate_warehouses_command(create_missing):
+    """Key inventory transactions to warehouses by their location names."""
+    from utils.stock import migrate_transaction_warehouses
+
+    result = migrate_transaction_warehouses(create_missing=create_missing)
+    click.echo(f"Mapped {result['mapped']} inventory transactions to warehouses.")
+    for name in result['created']:
+        click.echo(f"Created warehouse '{name}'.")
+    for name in result['unmatched']:
+        click.echo(f"No warehouse for location '{name}'.")
+
+
+@riska_cli.command('check-stock')
+@click.option('--fix', is_flag=True, help='Rebuild the stock levels if they are inconsistent.')
+def check_stock_command(fix):
+    """Compare stored stock levels with the inventory transactions."""
+    from utils.stock import check_product_stock, rebuild_product_stock
+
+    mismatches = check_product_stock()
+    if not mismatches:
+        click.echo("Stock levels are consistent.")
+        return
+
+    for row in mismatches:
+        click.echo(
+            f"Product {row['product_id']} at '{row['location'] or '-'}': "
+            f"quantity {row['stored_quantity']} (expected {row['expected_quantity']}), "
+            f"value {row['stored_value']} (expected {row['expected_value']})"
+        )
+
+    if fix:
+        count = rebuild_product_stock()
+        click.echo(f"Rebuilt {count} product stock rows.")
+        return
+
+    raise click.ClickException(f"{len(mismatches)} inconsistent stock rows; re-run with --fix to rebuild.")
+
+
+@riska_cli.command('cache-stats')
+def cache_stats_command():
+    """Show report cache hit/miss counts and size (sqlite backend)."""
+    from utils.report_cache import get_report_cache
+
+    cache = get_report_cache()
+    if not cache.shared:
+        raise click.ClickException(
+            f"The {cache.backend.name} report cache lives in each worker process; "
+            f"use GET /reports/api/cache for a worker's stats."
+        )
+
+    for key, value in cache.stats().items():
+        if key != 'pid':
+            click.echo(f"{key}: {value}")
+
+
+@riska_cli.command('clear-cache')
+def clear_cache_command():
+    """Remove every cached report result (sqlite backend)."""
+    from utils.report_cache import get_report_cache
+
+    cache = get_report_cache()
+    if not cache.shared:
+        raise click.ClickException(
+            f"The {cache.backend.name} report cache lives in each worker process; "
+            f"use POST /reports/api/cache/clear, or restart the workers."
+        )
+
+    cache.clear()
+    click.echo("Report cache cleared.")
+
+
+@riska_cli.command('seed-synthetic')
+@click.option('--scale', default='small', show_default=True,
+              help='Base dataset size: tiny, small, medium or large.')
+@click.option('--seed', default=42, show_default=True, help='Random seed; same seed gives the same data.')
+@click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='First transaction date (default: three years before --end).')
+@click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Last transaction date (default: today).')
+@click.option('--accounts', type=int, help='Override the number of accounts.')
+@click.option('--journal-entries', type=int, help='Override the number of general journal entries.')
+@click.option('--customers', type=int, help='Override the number of customers.')
+@click.option('--vendors', type=int, help='Override the number of vendors.')
+@click.option('--invoices', type=int, help='Override the number of invoices.')
+@click.option('--expenses', type=int, help='Override the number of expenses.')
+@click.option('--products', type=int, help='Override the number of products.')
+@click.option('--inventory-transactions', type=int, help='Override the number of stock movements.')
+@click.option('--fixed-assets', type=int, help='Override the number of fixed assets.')
+@click.option('--projects', type=int, help='Override the number of projects.')
+@click.option('--time-entries', type=int, help='Override the number of time entries.')
+@click.option('--bank-statements', type=int, help='Override the number of monthly bank statements.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per bulk insert.')
+def seed_synthetic_command(scale, seed, start_date, end_date, batch_size, **overrides):
+    """Bulk-generate a deterministic synthetic dataset for load testing."""
+    import time
+    from utils.synthetic import generate_synthetic_data
+
+    started = time.perf_counter()
+    try:
+        counts = generate_synthetic_data(
+            scale=scale,
+            seed=seed,
+            start_date=start_date.date() if start_date else None,
+            end_date=end_date.date() if end_date else None,
+            batch_size=batch_size,
+            echo=click.echo,
+            **overrides
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for table_name, count in sorted(counts.items()):
+        click.echo(f"  {table_name}: {count}")
+    click.echo(f"Synthetic data generated in {time.perf_counter() - started:.1f}s.")
@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
 import pandas as pd
 import numpy as np
+from decimal import Decimal
 from models import *
 from app import db
+from utils.balances import get_account_balances, get_account_type_balances
+from utils.stock import low_stock_condition, reorder_level_expression, stock_on_hand_subquery
 
 def get_financial_summary(start_date=None, end_date=None):
     """Get financial summary for dashboard"""
@@ -11,41 +15,14 @@ def get_financial_summary(start_date=None, end_date=None):
     if not end_date:
         end_date = datetime.now().date()  # Current date
     
-    # Get income (revenue accounts)
-    revenue_type = db.session.query(AccountType).filter_by(name=AccountType.REVENUE).first()
-    if revenue_type:
-        revenue_accounts = db.session.query(Account.id).filter_by(account_type_id=revenue_type.id).all()
-        revenue_account_ids = [acc.id for acc in revenue_accounts]
-        
-        income_entries = db.session.query(
-            db.func.sum(JournalItem.credit_amount - JournalItem.debit_amount)
-        ).join(
-            JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-        ).filter(
-            JournalItem.account_id.in_(revenue_account_ids),
-            JournalEntry.entry_date.between(start_date, end_date),
-            JournalEntry.is_posted == True
-        ).scalar() or 0
-    else:
-        income_entries = 0
-    
-    # Get expenses
-    expense_type = db.session.query(AccountType).filter_by(name=AccountType.EXPENSE).first()
-    if expense_type:
-        expense_accounts = db.session.query(Account.id).filter_by(account_type_id=expense_type.id).all()
-        expense_account_ids = [acc.id for acc in expense_accounts]
-        
-        expense_entries = db.session.query(
-            db.func.sum(JournalItem.debit_amount - JournalItem.credit_amount)
-        ).join(
-            JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-        ).filter(
-            JournalItem.account_id.in_(expense_account_ids),
-            JournalEntry.entry_date.between(start_date, end_date),
-            JournalEntry.is_posted == True
-        ).scalar() or 0
-    else:
-        expense_entries = 0
+    # Get income and expenses from revenue and expense account balances
+    type_balances = get_account_type_balances(
+        [AccountType.REVENUE, AccountType.EXPENSE],
+        start_date,
+        end_date
+    )
+    income_entries = type_balances.get(AccountType.REVENUE, 0)
+    expense_entries = type_balances.get(AccountType.EXPENSE, 0)
     
     # Get receivables (outstanding invoice amounts)
     outstanding_invoices = db.session.query(
@@ -64,67 +41,63 @@ def get_financial_summary(start_date=None, end_date=None):
         'accounts_receivable': float(outstanding_invoices)
     }
 
-def get_monthly_trends(months=6):
-    """Get monthly income and expense trends for the last X months"""
-    today = datetime.now().date()
-    data = []
+def get_income_expense_trends(start_date, end_date):
+    """Get income and expenses for every calendar month between two dates.
+    
+    All months are answered by a single GROUP BY over a month bucket of the
+    entry date; months without activity are filled with zero.
+    """
+    from utils.database import month_bucket, bucket_to_year_month
+    from utils.balances import is_debit_normal
+    
+    bucket = month_bucket(JournalEntry.entry_date)
+    rows = db.session.query(
+        bucket.label('bucket'),
+        AccountType.name,
+        db.func.sum(JournalItem.debit_amount),
+        db.func.sum(JournalItem.credit_amount)
+    ).join(
+        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
+    ).join(
+        Account, JournalItem.account_id == Account.id
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).filter(
+        AccountType.name.in_([AccountType.REVENUE, AccountType.EXPENSE]),
+        JournalEntry.entry_date.between(start_date, end_date),
+        JournalEntry.is_posted == True
+    ).group_by(
+        bucket, AccountType.name
+    ).all()
     
-    revenue_type = db.session.query(AccountType).filter_by(name=AccountType.REVENUE).first()
-    expense_type = db.session.query(AccountType).filter_by(name=AccountType.EXPENSE).first()
-    
-    revenue_account_ids = []
-    if revenue_type:
-        revenue_accounts = db.session.query(Account.id).filter_by(account_type_id=revenue_type.id).all()
-        revenue_account_ids = [acc.id for acc in revenue_accounts]
-    
-    expense_account_ids = []
-    if expense_type:
-        expense_accounts = db.session.query(Account.id).filter_by(account_type_id=expense_type.id).all()
-        expense_account_ids = [acc.id for acc in expense_accounts]
-    
-    # Loop through recent months
-    for i in range(months-1, -1, -1):
-        start_date = (today.replace(day=1) - timedelta(days=i*30)).replace(day=1)
-        if i > 0:
-            end_date = (today.replace(day=1) - timedelta(days=(i-1)*30)).replace(day=1) - timedelta(days=1)
-        else:
-            end_date = today
-        
-        # Get income for month
-        income = 0
-        if revenue_account_ids:
-            income = db.session.query(
-                db.func.sum(JournalItem.credit_amount - JournalItem.debit_amount)
-            ).join(
-                JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-            ).filter(
-                JournalItem.account_id.in_(revenue_account_ids),
-                JournalEntry.entry_date.between(start_date, end_date),
-                JournalEntry.is_posted == True
-            ).scalar() or 0
-        
-        # Get expenses for month
-        expenses = 0
-        if expense_account_ids:
-            expenses = db.session.query(
-                db.func.sum(JournalItem.debit_amount - JournalItem.credit_amount)
-            ).join(
-                JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-            ).filter(
-                JournalItem.account_id.in_(expense_account_ids),
-                JournalEntry.entry_date.between(start_date, end_date),
-                JournalEntry.is_posted == True
-            ).scalar() or 0
-        
-        month_name = start_date.strftime("%b %Y")
+    totals = {}
+    for bucket_value, type_name, debit, credit in rows:
+        debit = debit or 0
+        credit = credit or 0
+        balance = debit - credit if is_debit_normal(type_name) else credit - debit
+        totals[(bucket_to_year_month(bucket_value), type_name)] = balance
+    
+    # Fill in every month of the window, including months with no activity
+    data = []
+    month_start = start_date.replace(day=1)
+    while month_start <= end_date:
+        key = (month_start.year, month_start.month)
         data.append({
-            'month': month_name,
-            'income': float(income),
-            'expenses': float(expenses)
+            'month': month_start.strftime("%b %Y"),
+            'start_date': month_start,
+            'income': float(totals.get((key, AccountType.REVENUE), 0)),
+            'expenses': float(totals.get((key, AccountType.EXPENSE), 0))
         })
+        month_start = month_start + relativedelta(months=1)
     
     return data
 
+def get_monthly_trends(months=6):
+    """Get monthly income and expense trends for the last X months"""
+    today = datetime.now().date()
+    start_date = today.replace(day=1) - relativedelta(months=months - 1)
+    return get_income_expense_trends(start_date, today)
+
 def generate_pl_report(start_date=None, end_date=None):
     """Generate a Profit and Loss report for the given period"""
     if not start_date:
@@ -132,10 +105,6 @@ def generate_pl_report(start_date=None, end_date=None):
     if not end_date:
         end_date = datetime.now().date()  # Current date
     
-    # Get account types
-    revenue_type = db.session.query(AccountType).filter_by(name=AccountType.REVENUE).first()
-    expense_type = db.session.query(AccountType).filter_by(name=AccountType.EXPENSE).first()
-    
     report_data = {
         'period': f"{start_date.strftime('%b %d, %Y')} to {end_date.strftime('%b %d, %Y')}",
         'revenue': [],
@@ -147,59 +116,33 @@ def generate_pl_report(start_date=None, end_date=None):
         }
     }
     
-    # Get revenue data
-    if revenue_type:
-        revenue_accounts = db.session.query(Account).filter_by(account_type_id=revenue_type.id).all()
-        total_revenue = 0
-        
-        for account in revenue_accounts:
-            # Query journal items for this account in the date range
-            balance = db.session.query(
-                db.func.sum(JournalItem.credit_amount - JournalItem.debit_amount)
-            ).join(
-                JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-            ).filter(
-                JournalItem.account_id == account.id,
-                JournalEntry.entry_date.between(start_date, end_date),
-                JournalEntry.is_posted == True
-            ).scalar() or 0
-            
-            if balance != 0:
-                report_data['revenue'].append({
-                    'account_code': account.code,
-                    'account_name': account.name,
-                    'balance': float(balance)
-                })
-                total_revenue += float(balance)
-        
-        report_data['totals']['revenue'] = total_revenue
+    # Get revenue and expense accounts with their balances for the period
+    accounts = db.session.query(
+        Account.id, Account.code, Account.name, AccountType.name.label('account_type')
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).filter(
+        AccountType.name.in_([AccountType.REVENUE, AccountType.EXPENSE])
+    ).order_by(Account.id).all()
     
-    # Get expense data
-    if expense_type:
-        expense_accounts = db.session.query(Account).filter_by(account_type_id=expense_type.id).all()
-        total_expenses = 0
-        
-        for account in expense_accounts:
-            # Query journal items for this account in the date range
-            balance = db.session.query(
-                db.func.sum(JournalItem.debit_amount - JournalItem.credit_amount)
-            ).join(
-                JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-            ).filter(
-                JournalItem.account_id == account.id,
-                JournalEntry.entry_date.between(start_date, end_date),
-                JournalEntry.is_posted == True
-            ).scalar() or 0
-            
-            if balance != 0:
-                report_data['expenses'].append({
-                    'account_code': account.code,
-                    'account_name': account.name,
-                    'balance': float(balance)
-                })
-                total_expenses += float(balance)
+    balances = get_account_balances(
+        start_date=start_date,
+        end_date=end_date,
+        account_types=[AccountType.REVENUE, AccountType.EXPENSE]
+    )
+    
+    for account in accounts:
+        balance = balances.get(account.id, 0)
+        if balance == 0:
+            continue
         
-        report_data['totals']['expenses'] = total_expenses
+        section = 'revenue' if account.account_type == AccountType.REVENUE else 'expenses'
+        report_data[section].append({
+            'account_code': account.code,
+            'account_name': account.name,
+            'balance': float(balance)
+        })
+        report_data['totals'][section] += float(balance)
     
     # Calculate net income
     report_data['totals']['net_income'] = report_data['totals']['revenue'] - report_data['totals']['expenses']
@@ -291,8 +234,13 @@ def generate_po_number():
 
 def record_inventory_transaction(product_id, quantity, transaction_type, transaction_type_id=None, 
                                 unit_price=None, location=None, reference_type=None, reference_id=None, 
-                                notes=None, journal_entry_id=None, created_by_id=None):
+                                notes=None, journal_entry_id=None, created_by_id=None, warehouse_id=None):
     """Record an inventory transaction"""
+    # Book movements without a price at the product's cost price
+    if unit_price is None:
+        product = db.session.get(Product, product_id)
+        unit_price = product.cost_price if product else None
+    
     # Create inventory transaction
     transaction = InventoryTransaction(
         transaction_date=datetime.now(),
@@ -302,6 +250,7 @@ def record_inventory_transaction(product_id, quantity, transaction_type, transac
         quantity=quantity,
         unit_price=unit_price,
         location=location,
+        warehouse_id=warehouse_id,
         reference_type=reference_type,
         reference_id=reference_id,
         notes=notes,
@@ -318,40 +267,71 @@ def get_inventory_value():
     """Calculate the total value of inventory"""
     from sqlalchemy import func
     
-    # Get all products
-    products = db.session.query(Product).filter_by(is_active=True).all()
+    # Stock on hand per active product from the stock levels, valued at cost price
+    product_stock = db.session.query(
+        func.sum(ProductStock.quantity).label('quantity'),
+        Product.cost_price.label('cost_price')
+    ).join(
+        Product, ProductStock.product_id == Product.id
+    ).filter(
+        Product.is_active == True
+    ).group_by(
+        ProductStock.product_id, Product.cost_price
+    ).having(
+        func.sum(ProductStock.quantity) > 0
+    ).subquery()
+    
+    total_value = db.session.query(
+        func.sum(product_stock.c.quantity * product_stock.c.cost_price)
+    ).scalar()
+    
+    return float(total_value or 0)
+
+def get_low_stock_products(category_id=None, location=None, limit=None, warehouse_id=None):
+    """
+    Get products that are at or below their reorder level.
+    
+    Stock on hand is joined onto the products so the comparison, ordering
+    and limit all happen in one query. `warehouse_id` or `location` compares
+    the stock held in that warehouse or location only.
+    """
+    from sqlalchemy import func
+    from sqlalchemy.orm import joinedload
     
-    total_value = 0
+    stock = stock_on_hand_subquery(location, warehouse_id)
+    on_hand = func.coalesce(stock.c.quantity, 0)
     
-    for product in products:
-        # Get current stock quantity
-        current_stock = product.current_stock
-        
-        # Calculate value using cost price
-        if current_stock > 0:
-            total_value += float(current_stock) * float(product.cost_price)
+    query = db.session.query(Product, on_hand).outerjoin(
+        stock, stock.c.product_id == Product.id
+    ).options(
+        joinedload(Product.category),
+        joinedload(Product.uom)
+    ).filter(
+        Product.is_active == True,
+        low_stock_condition(on_hand)
+    )
     
-    return total_value
-
-def get_low_stock_products():
-    """Get products that are below their reorder level"""
-    # Get all active products
-    products = db.session.query(Product).filter_by(is_active=True).all()
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    
+    # Largest shortfall first
+    query = query.order_by((reorder_level_expression() - on_hand).desc(), Product.name)
+    
+    if limit:
+        query = query.limit(limit)
     
     low_stock = []
     
-    for product in products:
-        current_stock = product.current_stock
-        
-        if current_stock <= product.reorder_level:
-            low_stock.append({
-                'id': product.id,
-                'sku': product.sku,
-                'name': product.name,
-                'current_stock': float(current_stock),
-                'reorder_level': float(product.reorder_level),
-                'uom': product.uom.abbreviation
-            })
+    for product, current_stock in query.all():
+        low_stock.append({
+            'product': product,
+            'id': product.id,
+            'sku': product.sku,
+            'name': product.name,
+            'current_stock': float(current_stock or 0),
+            'reorder_level': float(product.reorder_level or 0),
+            'uom': product.uom.abbreviation
+        })
     
     return low_stock
 
@@ -483,185 +463,10 @@ def quarter_name(quarter_number, year=None):
 
 def get_account_balance(account_id, start_date=None, end_date=None):
     """Get the balance of an account for a specific date range"""
-    from models import Account, JournalItem, JournalEntry, AccountType
-    from sqlalchemy import func
     from decimal import Decimal
     
-    # Get the account
-    account = Account.query.get(account_id)
-    if not account:
-        return Decimal('0.00')
-    
-    # Base query
-    query = db.session.query(
-        func.sum(JournalItem.debit_amount).label('total_debit'),
-        func.sum(JournalItem.credit_amount).label('total_credit')
-    ).join(
-        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-    ).filter(
-        JournalItem.account_id == account_id,
-        JournalEntry.is_posted == True
-    )
-    
-    # Apply date filters
-    if start_date:
-        query = query.filter(JournalEntry.entry_date >= start_date)
-    if end_date:
-        query = query.filter(JournalEntry.entry_date <= end_date)
-    
-    # Execute query
-    result = query.first()
-    
-    # Calculate balance based on account type
-    total_debit = result.total_debit or Decimal('0.00')
-    total_credit = result.total_credit or Decimal('0.00')
-    
-    # For asset and expense accounts, debit increases the balance
-    if account.account_type.name in [AccountType.ASSET, AccountType.EXPENSE]:
-        balance = total_debit - total_credit
-    # For liability, equity, and revenue accounts, credit increases the balance
-    else:
-        balance = total_credit - total_debit
-    
-    return balance
-
-def generate_general_ledger(start_date=None, end_date=None, account_ids=None, account_type_ids=None, include_unposted=False):
-    """Generate a general ledger report with optional filters"""
-    from models import JournalEntry, JournalItem, Account, AccountType
-    from datetime import datetime
-    
-    # Build the query with filtering
-    query = db.session.query(
-        JournalEntry.id.label('entry_id'),
-        JournalEntry.entry_date,
-        JournalEntry.reference,
-        JournalEntry.description.label('entry_description'),
-        JournalEntry.is_posted,
-        Account.id.label('account_id'),
-        Account.code.label('account_code'),
-        Account.name.label('account_name'),
-        AccountType.name.label('account_type'),
-        JournalItem.description.label('item_description'),
-        JournalItem.debit_amount,
-        JournalItem.credit_amount
-    ).join(
-        JournalItem, JournalEntry.id == JournalItem.journal_entry_id
-    ).join(
-        Account, JournalItem.account_id == Account.id
-    ).join(
-        AccountType, Account.account_type_id == AccountType.id
-    )
-    
-    # Apply date filters
-    if start_date:
-        query = query.filter(JournalEntry.entry_date >= start_date)
-    if end_date:
-        query = query.filter(JournalEntry.entry_date <= end_date)
-    
-    # Apply account filters
-    if account_ids and any(account_ids):
-        account_ids = [int(id) for id in account_ids]
-        query = query.filter(Account.id.in_(account_ids))
-    
-    # Apply account type filters
-    if account_type_ids and any(account_type_ids):
-        account_type_ids = [int(id) for id in account_type_ids]
-        query = query.filter(Account.account_type_id.in_(account_type_ids))
-    
-    # Apply posted status filter
-    if not include_unposted:
-        query = query.filter(JournalEntry.is_posted == True)
-    
-    # Order by date and entry ID
-    query = query.order_by(JournalEntry.entry_date, JournalEntry.id, Account.code)
-    
-    # Execute the query
-    results = query.all()
-    
-    # Organize results by account with running balance
-    accounts = {}
-    entries = []
-    
-    for row in results:
-        entry = {
-            'entry_id': row.entry_id,
-            'entry_date': row.entry_date,
-            'reference': row.reference,
-            'entry_description': row.entry_description,
-            'is_posted': row.is_posted,
-            'account_id': row.account_id,
-            'account_code': row.account_code,
-            'account_name': row.account_name,
-            'account_type': row.account_type,
-            'item_description': row.item_description,
-            'debit_amount': float(row.debit_amount) if row.debit_amount else 0,
-            'credit_amount': float(row.credit_amount) if row.credit_amount else 0
-        }
-        
-        entries.append(entry)
-        
-        # Track account balances
-        if row.account_id not in accounts:
-            accounts[row.account_id] = {
-                'id': row.account_id,
-                'code': row.account_code,
-                'name': row.account_name,
-                'type': row.account_type,
-                'starting_balance': 0,  # Placeholder, will calculate running balances later
-                'debit_total': 0,
-                'credit_total': 0,
-                'entries': []
-            }
-        
-        accounts[row.account_id]['entries'].append(entry)
-        accounts[row.account_id]['debit_total'] += float(row.debit_amount) if row.debit_amount else 0
-        accounts[row.account_id]['credit_total'] += float(row.credit_amount) if row.credit_amount else 0
-    
-    # Calculate net movement and ending balance for each account
-    for account_id, account in accounts.items():
-        # Get the starting balance for this account (as of start_date - 1 day)
-        if start_date:
-            account['starting_balance'] = get_account_balance(account_id, end_date=start_date - timedelta(days=1))
-        else:
-            account['starting_balance'] = 0
-        
-        account_type = account['type']
-        
-        # Calculate balance based on account type
-        if account_type in [AccountType.ASSET, AccountType.EXPENSE]:
-            # Debit increases, credit decreases
-            account['net_movement'] = account['debit_total'] - account['credit_total']
-        else:
-            # Credit increases, debit decreases
-            account['net_movement'] = account['credit_total'] - account['debit_total']
-        
-        account['ending_balance'] = account['starting_balance'] + account['net_movement']
-        
-        # Calculate running balance for each entry
-        running_balance = account['starting_balance']
-        for entry in account['entries']:
-            if account_type in [AccountType.ASSET, AccountType.EXPENSE]:
-                # Debit increases, credit decreases
-                running_balance = running_balance + entry['debit_amount'] - entry['credit_amount']
-            else:
-                # Credit increases, debit decreases
-                running_balance = running_balance - entry['debit_amount'] + entry['credit_amount']
-            
-            entry['running_balance'] = running_balance
-    
-    # Build the final report data
-    report_data = {
-        'start_date': start_date.strftime('%Y-%m-%d') if start_date else None,
-        'end_date': end_date.strftime('%Y-%m-%d') if end_date else None,
-        'accounts': list(accounts.values()),
-        'entries': entries,
-        'totals': {
-            'debit_total': sum(account['debit_total'] for account in accounts.values()),
-            'credit_total': sum(account['credit_total'] for account in accounts.values())
-        }
-    }
-    
-    return report_data
+    balances = get_account_balances([account_id], start_date, end_date)
+    return balances.get(account_id, Decimal('0.00'))
 
 def generate_balance_sheet(as_of_date=None):
     """Generate a balance sheet as of a specific date"""
@@ -673,58 +478,48 @@ def generate_balance_sheet(as_of_date=None):
     if not as_of_date:
         as_of_date = datetime.now().date()
     
-    # Get all accounts
-    asset_accounts = Account.query.join(AccountType).filter(AccountType.name == AccountType.ASSET).order_by(Account.code).all()
-    liability_accounts = Account.query.join(AccountType).filter(AccountType.name == AccountType.LIABILITY).order_by(Account.code).all()
-    equity_accounts = Account.query.join(AccountType).filter(AccountType.name == AccountType.EQUITY).order_by(Account.code).all()
-    
-    # Calculate account balances
-    assets = []
-    total_assets = Decimal('0.00')
-    
-    for account in asset_accounts:
-        balance = get_account_balance(account.id, end_date=as_of_date)
-        if balance != 0:
-            assets.append({
-                'account_code': account.code,
-                'account_name': account.name,
-                'balance': balance
-            })
-            total_assets += balance
-    
-    liabilities = []
-    total_liabilities = Decimal('0.00')
+    # Get balance sheet accounts and every account balance in bulk
+    accounts = db.session.query(
+        Account.id, Account.code, Account.name, AccountType.name.label('account_type')
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).filter(
+        AccountType.name.in_([AccountType.ASSET, AccountType.LIABILITY, AccountType.EQUITY])
+    ).order_by(Account.code).all()
     
-    for account in liability_accounts:
-        balance = get_account_balance(account.id, end_date=as_of_date)
-        if balance != 0:
-            liabilities.append({
-                'account_code': account.code,
-                'account_name': account.name,
-                'balance': balance
-            })
-            total_liabilities += balance
+    balances = get_account_balances(
+        end_date=as_of_date,
+        account_types=[AccountType.ASSET, AccountType.LIABILITY, AccountType.EQUITY]
+    )
     
-    equity_items = []
-    total_equity = Decimal('0.00')
+    # Calculate account balances
+    section_items = {AccountType.ASSET: [], AccountType.LIABILITY: [], AccountType.EQUITY: []}
+    section_totals = {AccountType.ASSET: Decimal('0.00'), AccountType.LIABILITY: Decimal('0.00'), AccountType.EQUITY: Decimal('0.00')}
     
-    for account in equity_accounts:
-        balance = get_account_balance(account.id, end_date=as_of_date)
+    for account in accounts:
+        balance = balances.get(account.id, Decimal('0.00'))
         if balance != 0:
-            equity_items.append({
+            section_items[account.account_type].append({
                 'account_code': account.code,
                 'account_name': account.name,
                 'balance': balance
             })
-            total_equity += balance
-    
-    # Get revenue and expense accounts to calculate retained earnings
-    revenue_accounts = Account.query.join(AccountType).filter(AccountType.name == AccountType.REVENUE).all()
-    expense_accounts = Account.query.join(AccountType).filter(AccountType.name == AccountType.EXPENSE).all()
-    
-    # Calculate net income (for current period)
-    total_revenue = sum(get_account_balance(account.id, end_date=as_of_date) for account in revenue_accounts)
-    total_expenses = sum(get_account_balance(account.id, end_date=as_of_date) for account in expense_accounts)
+            section_totals[account.account_type] += balance
+    
+    assets = section_items[AccountType.ASSET]
+    liabilities = section_items[AccountType.LIABILITY]
+    equity_items = section_items[AccountType.EQUITY]
+    total_assets = section_totals[AccountType.ASSET]
+    total_liabilities = section_totals[AccountType.LIABILITY]
+    total_equity = section_totals[AccountType.EQUITY]
+    
+    # Calculate net income (for current period) from revenue and expense totals
+    type_balances = get_account_type_balances(
+        [AccountType.REVENUE, AccountType.EXPENSE],
+        end_date=as_of_date
+    )
+    total_revenue = type_balances.get(AccountType.REVENUE, Decimal('0.00'))
+    total_expenses = type_balances.get(AccountType.EXPENSE, Decimal('0.00'))
     net_income = total_revenue - total_expenses
     
     # Add net income to equity if it's not zero
@@ -754,9 +549,7 @@ def generate_balance_sheet(as_of_date=None):
 
 def generate_general_ledger(start_date=None, end_date=None, account_ids=None, account_type_ids=None, include_unposted=False):
     """Generate a general ledger report with optional filters"""
-    from models import Account, AccountType, JournalEntry, JournalItem
-    from datetime import datetime, timedelta
-    from decimal import Decimal
+    from utils.ledger import iter_general_ledger
     
     # Default dates if not provided
     if not start_date:
@@ -765,39 +558,6 @@ def generate_general_ledger(start_date=None, end_date=None, account_ids=None, ac
     if not end_date:
         end_date = datetime.now().date()
     
-    # Build account query
-    accounts_query = Account.query.filter_by(is_active=True)
-    
-    # Apply account filters if provided
-    if account_ids and len(account_ids) > 0:
-        # Convert string IDs to integers
-        account_ids = [int(id) for id in account_ids if id.isdigit()]
-        if account_ids:
-            accounts_query = accounts_query.filter(Account.id.in_(account_ids))
-    
-    # Apply account type filters if provided
-    if account_type_ids and len(account_type_ids) > 0:
-        # Convert string IDs to integers
-        account_type_ids = [int(id) for id in account_type_ids if id.isdigit()]
-        if account_type_ids:
-            accounts_query = accounts_query.filter(Account.account_type_id.in_(account_type_ids))
-    
-    # Get accounts based on filters
-    accounts = accounts_query.order_by(Account.code).all()
-    
-    # Build journal entries query for date range
-    journal_query = JournalEntry.query.filter(
-        JournalEntry.entry_date >= start_date,
-        JournalEntry.entry_date <= end_date
-    )
-    
-    # Apply posted filter unless including unposted entries
-    if not include_unposted:
-        journal_query = journal_query.filter_by(is_posted=True)
-    
-    # Get journal entries
-    journal_entries = journal_query.order_by(JournalEntry.entry_date, JournalEntry.id).all()
-    
     # Prepare report data
     report_data = {
         'start_date': start_date.strftime('%Y-%m-%d'),
@@ -809,90 +569,29 @@ def generate_general_ledger(start_date=None, end_date=None, account_ids=None, ac
         }
     }
     
-    # For each account, gather transactions
-    for account in accounts:
-        # Get starting balance (balance at start_date - 1 day)
-        starting_balance = get_account_balance(
-            account.id, 
-            end_date=(start_date - timedelta(days=1))
-        )
-        
-        # Initialize account data
-        account_data = {
-            'id': account.id,
-            'code': account.code,
-            'name': account.name,
-            'starting_balance': starting_balance,
-            'ending_balance': starting_balance,  # Will be updated as we process entries
-            'entries': []
-        }
-        
-        # Get all journal items for this account in the period
-        journal_items = (
-            JournalItem.query
-            .join(JournalEntry)
-            .filter(
-                JournalItem.account_id == account.id,
-                JournalEntry.entry_date >= start_date,
-                JournalEntry.entry_date <= end_date
-            )
-        )
-        
-        # Apply posted filter unless including unposted entries
-        if not include_unposted:
-            journal_items = journal_items.filter(JournalEntry.is_posted == True)
-        
-        # Order by date and entry ID
-        journal_items = (
-            journal_items
-            .order_by(JournalEntry.entry_date, JournalEntry.id)
-            .all()
-        )
-        
-        # Calculate running balance and prepare entries
-        running_balance = starting_balance
-        
-        for item in journal_items:
-            # Get parent journal entry
-            entry = item.journal_entry
-            
-            # Calculate debit and credit amounts
-            debit_amount = Decimal(item.debit_amount) if item.debit_amount else Decimal('0.00')
-            credit_amount = Decimal(item.credit_amount) if item.credit_amount else Decimal('0.00')
-            
-            # Update running balance based on account type
-            # For asset and expense accounts, debits increase, credits decrease
-            # For liability, equity, and revenue accounts, credits increase, debits decrease
-            if account.account_type.name in ['Asset', 'Expense']:
-                running_balance += (debit_amount - credit_amount)
-            else:
-                running_balance += (credit_amount - debit_amount)
-            
-            # Add to report totals
-            report_data['totals']['debit_total'] += debit_amount
-            report_data['totals']['credit_total'] += credit_amount
-            
-            # Create entry data
-            entry_data = {
-                'entry_id': entry.id,
-                'entry_date': entry.entry_date,
-                'reference': entry.reference or f"JE-{entry.id}",
-                'entry_description': entry.description,
-                'account_code': account.code,
-                'item_description': item.description,
-                'debit_amount': debit_amount,
-                'credit_amount': credit_amount,
-                'running_balance': running_balance
+    # Opening balances and running balances are computed set-based in the database
+    account_data = None
+    for account, entry in iter_general_ledger(start_date, end_date, account_ids, account_type_ids, include_unposted):
+        if account_data is None or account_data['id'] != account['id']:
+            account_data = {
+                'id': account['id'],
+                'code': account['code'],
+                'name': account['name'],
+                'starting_balance': account['starting_balance'],
+                'ending_balance': account['starting_balance'],
+                'entries': []
             }
-            
-            account_data['entries'].append(entry_data)
+            report_data['accounts'].append(account_data)
         
-        # Update ending balance
-        account_data['ending_balance'] = running_balance
+        if entry is None:
+            continue
         
-        # Only include account if it has entries or non-zero starting balance
-        if account_data['entries'] or starting_balance != 0:
-            report_data['accounts'].append(account_data)
+        account_data['entries'].append(entry)
+        account_data['ending_balance'] = entry['running_balance']
+        
+        # Add to report totals
+        report_data['totals']['debit_total'] += entry['debit_amount']
+        report_data['totals']['credit_total'] += entry['credit_amount']
     
     return report_data
 
@@ -156,4 +156,6 @@ def initialize_database():
 
 if __name__ == "__main__":
     with app.app_context():
+        # Tables are no longer created on app import
+        db.create_all()
         initialize_database()
\ No newline at end of file
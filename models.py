@@ -134,11 +134,18 @@ class Account(db.Model):
 
 # Journal Entries
 class JournalEntry(db.Model):
+    __table_args__ = (
+        # Posted entries in a date range
+        db.Index('idx_journal_entry_posted_date', 'is_posted', 'entry_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    entry_date = db.Column(db.Date, nullable=False)
+    # The balance rollups need the old date and posting state even when the
+    # attribute was expired (e.g. by a commit) before it changed
+    entry_date = db.column_property(db.Column(db.Date, nullable=False), active_history=True)
     reference = db.Column(db.String(50))
     description = db.Column(db.String(255))
-    is_posted = db.Column(db.Boolean, default=False)
+    is_posted = db.column_property(db.Column(db.Boolean, default=False), active_history=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.relationship('User')
@@ -148,18 +155,46 @@ class JournalEntry(db.Model):
 
 # Journal Entry Line Items
 class JournalItem(db.Model):
+    __table_args__ = (
+        # Covers balance queries: lines per account with their amounts
+        db.Index('idx_journal_item_account_entry', 'account_id', 'journal_entry_id', 'debit_amount', 'credit_amount'),
+        db.Index('idx_journal_item_entry', 'journal_entry_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entry.id'), nullable=False)
+    # Old values are loaded on change for the balance rollups (see JournalEntry)
+    journal_entry_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('journal_entry.id'), nullable=False), active_history=True
+    )
     journal_entry = db.relationship('JournalEntry', backref='items')
-    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    account_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False), active_history=True
+    )
     account = db.relationship('Account')
     description = db.Column(db.String(255))
-    debit_amount = db.Column(db.Numeric(14, 2), default=0)
-    credit_amount = db.Column(db.Numeric(14, 2), default=0)
+    debit_amount = db.column_property(db.Column(db.Numeric(14, 2), default=0), active_history=True)
+    credit_amount = db.column_property(db.Column(db.Numeric(14, 2), default=0), active_history=True)
     
     def __repr__(self):
         return f'<JournalItem {self.id} - {self.account.name}>'
 
+# Per-account, per-month posted totals (maintained by utils.balances)
+class AccountPeriodBalance(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'year', 'month', name='uq_account_period_balance'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    account = db.relationship('Account')
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)  # Fiscal month (1-12)
+    debit_total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    credit_total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AccountPeriodBalance {self.account_id} - {self.year}-{self.month:02d}>'
+
 # Entity Type (Customer or Vendor)
 class EntityType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -438,27 +473,7 @@ class Product(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.relationship('User')
     
-    @property
-    def current_stock(self):
-        """Get current stock quantity from inventory transactions"""
-        from sqlalchemy import func
-        
-        # Calculate total quantity from transactions
-        in_quantity = db.session.query(
-            func.sum(InventoryTransaction.quantity)
-        ).filter(
-            InventoryTransaction.product_id == self.id,
-            InventoryTransaction.transaction_type == 'IN'
-        ).scalar() or 0
-        
-        out_quantity = db.session.query(
-            func.sum(InventoryTransaction.quantity)
-        ).filter(
-            InventoryTransaction.product_id == self.id,
-            InventoryTransaction.transaction_type == 'OUT'
-        ).scalar() or 0
-        
-        return in_quantity - out_quantity
+    # current_stock is a column property defined after ProductStock
     
     def __repr__(self):
         return f'<Product {self.sku} - {self.name}>'
@@ -481,16 +496,38 @@ class InventoryTransactionType(db.Model):
 
 # Inventory Transactions
 class InventoryTransaction(db.Model):
+    __table_args__ = (
+        # Covers stock level sums per product and direction
+        db.Index('idx_inventory_transaction_product_type', 'product_id', 'transaction_type', 'quantity'),
+        # Movements of one warehouse, per product and in date order
+        db.Index('idx_inventory_transaction_warehouse', 'warehouse_id', 'product_id', 'transaction_date'),
+        # Movements in date order, and the ones after a valuation snapshot
+        db.Index('idx_inventory_transaction_date', 'transaction_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    transaction_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    transaction_type = db.Column(db.String(5), nullable=False)  # IN or OUT
+    # The stock and valuation snapshot listeners need the old values even
+    # when the attribute was expired (e.g. by a commit) before it changed
+    transaction_date = db.column_property(
+        db.Column(db.DateTime, default=datetime.utcnow, nullable=False), active_history=True
+    )
+    transaction_type = db.column_property(
+        db.Column(db.String(5), nullable=False), active_history=True
+    )  # IN or OUT
     transaction_type_id = db.Column(db.Integer, db.ForeignKey('inventory_transaction_type.id'))
     transaction_type_obj = db.relationship('InventoryTransactionType')
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False), active_history=True
+    )
     product = db.relationship('Product')
-    quantity = db.Column(db.Numeric(10, 2), nullable=False)
-    unit_price = db.Column(db.Numeric(14, 2))
-    location = db.Column(db.String(100))
+    quantity = db.column_property(db.Column(db.Numeric(10, 2), nullable=False), active_history=True)
+    unit_price = db.column_property(db.Column(db.Numeric(14, 2)), active_history=True)
+    # Warehouse name, or free text for other locations
+    location = db.column_property(db.Column(db.String(100)), active_history=True)
+    warehouse_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('warehouse.id')), active_history=True
+    )
+    warehouse = db.relationship('Warehouse')
     reference_type = db.Column(db.String(50))  # Invoice, PO, Adjustment, etc.
     reference_id = db.Column(db.Integer)  # ID of the reference document
     notes = db.Column(db.Text)
@@ -503,6 +540,59 @@ class InventoryTransaction(db.Model):
     def __repr__(self):
         return f'<InventoryTransaction {self.id} - {self.product.name} ({self.quantity})>'
 
+# On-hand stock per product and location (maintained by utils.stock)
+class ProductStock(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'location', name='uq_product_stock_location'),
+        # Per-warehouse stock without touching the transactions
+        db.Index('idx_product_stock_warehouse', 'warehouse_id', 'product_id', 'quantity'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product = db.relationship('Product')
+    location = db.Column(db.String(100), nullable=False, default='')  # '' when no location was given
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'))  # None for non-warehouse locations
+    warehouse = db.relationship('Warehouse')
+    quantity = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    value = db.Column(db.Numeric(16, 2), nullable=False, default=0)  # Net cost of the movements
+
+    def __repr__(self):
+        return f'<ProductStock {self.product_id} @ {self.location or "-"}: {self.quantity}>'
+
+# Stock on hand across all locations, loaded in the same query as the product
+Product.current_stock = db.column_property(
+    db.select(
+        db.func.coalesce(db.func.sum(ProductStock.quantity), 0)
+    ).where(
+        ProductStock.product_id == Product.id
+    ).correlate_except(ProductStock).scalar_subquery()
+)
+
+# Stock value per product and location at a month-end close (maintained by utils.valuation_snapshots)
+class InventoryValuationSnapshot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('period_end', 'method', 'product_id', 'location', name='uq_inventory_valuation_snapshot'),
+        # Latest snapshot per product and location on or before a date
+        db.Index('idx_inventory_valuation_snapshot_product', 'method', 'product_id', 'location', 'period_end'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_end = db.Column(db.Date, nullable=False)  # Last day of the closed month
+    method = db.Column(db.String(20), nullable=False)  # standard, weighted_average or fifo
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product = db.relationship('Product')
+    location = db.Column(db.String(100), nullable=False, default='')
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'))
+    warehouse = db.relationship('Warehouse')
+    quantity = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    value = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    cost_state = db.Column(db.Text)  # JSON cost layers/average to resume the replay from
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<InventoryValuationSnapshot {self.product_id} @ {self.location or "-"} {self.period_end} {self.method}>'
+
 #
 # Fixed Asset Management Models
 #
@@ -806,6 +896,11 @@ class AssetDocument(db.Model):
 
 # Warehouse Locations
 class Warehouse(db.Model):
+    __table_args__ = (
+        # Stock rows and snapshots are keyed by the warehouse name (see utils.stock)
+        db.Index('uq_warehouse_name', 'name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     code = db.Column(db.String(20), unique=True, nullable=False)
@@ -926,6 +1021,13 @@ class BankStatement(db.Model):
 
 class BankTransaction(db.Model):
     """Model for individual bank transactions from a statement"""
+    __table_args__ = (
+        db.Index('idx_bank_transaction_statement_reconciled', 'statement_id', 'is_reconciled'),
+        db.Index('idx_bank_transaction_gl_entry', 'gl_entry_id'),
+        # Imported rows are unique per bank account (see utils.bank_import)
+        db.Index('idx_bank_transaction_fingerprint', 'fingerprint', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     statement_id = db.Column(db.Integer, db.ForeignKey('bank_statement.id'), nullable=False)
     transaction_date = db.Column(db.Date, nullable=False)
@@ -936,19 +1038,72 @@ class BankTransaction(db.Model):
     is_reconciled = db.Column(db.Boolean, default=False)
     reconciled_date = db.Column(db.Date)
     gl_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entry.id'))
+    fingerprint = db.Column(db.String(64))  # Set on imported rows
     
     # Relationships
     gl_entry = db.relationship('JournalEntry', backref='bank_transactions')
+    matches = db.relationship('BankTransactionMatch', backref='bank_transaction', lazy=True, cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"<BankTransaction {self.description} {self.amount}>"
 
+class BankTransactionMatch(db.Model):
+    """Journal entry of a bank transaction matched to several entries (e.g. a batched deposit)"""
+    __table_args__ = (
+        # A journal entry is matched to at most one bank transaction
+        db.UniqueConstraint('journal_entry_id', name='uq_bank_transaction_match_entry'),
+        db.Index('idx_bank_transaction_match_transaction', 'bank_transaction_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bank_transaction_id = db.Column(db.Integer, db.ForeignKey('bank_transaction.id'), nullable=False)
+    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entry.id'), nullable=False)
+    amount = db.Column(db.Numeric(precision=15, scale=2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    journal_entry = db.relationship('JournalEntry')
+    
+    def __repr__(self):
+        return f"<BankTransactionMatch {self.bank_transaction_id} -> {self.journal_entry_id}>"
+
+class BankStatementImport(db.Model):
+    """A statement file imported into a bank account, so re-uploads are recognised"""
+    __table_args__ = (
+        db.UniqueConstraint('bank_account_id', 'file_fingerprint', name='uq_bank_statement_import_file'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bank_account_id = db.Column(db.Integer, db.ForeignKey('bank_account.id'), nullable=False)
+    statement_id = db.Column(db.Integer, db.ForeignKey('bank_statement.id'), nullable=False)
+    file_fingerprint = db.Column(db.String(64), nullable=False)
+    filename = db.Column(db.String(255))
+    imported_count = db.Column(db.Integer, default=0)
+    duplicate_count = db.Column(db.Integer, default=0)
+    skipped_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    
+    # Relationships
+    statement = db.relationship('BankStatement', backref=db.backref('imports', cascade="all, delete-orphan"))
+    
+    def __repr__(self):
+        return f"<BankStatementImport {self.filename} ({self.imported_count} rows)>"
+
 class ReconciliationRule(db.Model):
     """Model for automatic reconciliation rules"""
+    # Match types
+    CONTAINS = 'contains'
+    REGEX = 'regex'
+
     id = db.Column(db.Integer, primary_key=True)
     bank_account_id = db.Column(db.Integer, db.ForeignKey('bank_account.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     match_pattern = db.Column(db.String(255), nullable=False)
+    match_type = db.Column(db.String(20), default=CONTAINS)  # 'contains' or 'regex'
+    priority = db.Column(db.Integer, default=100)  # Lower numbers are tried first
+    min_amount = db.Column(db.Numeric(precision=15, scale=2))
+    max_amount = db.Column(db.Numeric(precision=15, scale=2))
     gl_account_id = db.Column(db.Integer, db.ForeignKey('account.id'))
     is_active = db.Column(db.Boolean, default=True)
     
@@ -1091,6 +1246,10 @@ class JobTask(db.Model):
 
 # Time Entry
 class TimeEntry(db.Model):
+    __table_args__ = (
+        db.Index('idx_time_entry_project_approved', 'project_id', 'is_approved'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     project = db.relationship('Project', backref='time_entries')
@@ -3,13 +3,12 @@ from flask_login import login_required, current_user
 from models import Role, BankAccount, BankStatement, BankTransaction, ReconciliationRule, Account, JournalEntry, JournalItem, AccountType
 from app import db
 from sqlalchemy import desc, func
+from sqlalchemy.orm import selectinload
 import datetime
 from decimal import Decimal
-import csv
-import io
 from werkzeug.utils import secure_filename
 import os
-import pandas as pd
+from utils import bank_group_matching, bank_import, bank_matching, bank_statement_formats, rule_engine
 
 # Create blueprint
 bank_reconciliation_bp = Blueprint('bank_reconciliation', __name__)
@@ -240,7 +239,9 @@ def transactions(statement_id):
     statement = BankStatement.query.get_or_404(statement_id)
     
     # Get all transactions for this statement
-    transactions = BankTransaction.query.filter_by(statement_id=statement_id).order_by(
+    transactions = BankTransaction.query.filter_by(statement_id=statement_id).options(
+        selectinload(BankTransaction.matches)
+    ).order_by(
         BankTransaction.transaction_date
     ).all()
     
@@ -258,7 +259,7 @@ def transactions(statement_id):
 @bank_reconciliation_bp.route('/statements/<int:statement_id>/import-transactions', methods=['GET', 'POST'])
 @login_required
 def import_transactions(statement_id):
-    """Import transactions from a CSV file"""
+    """Import transactions from a CSV, OFX/QFX or CAMT.053 file"""
     # Check permission
     if not current_user.has_permission(Role.CAN_CREATE):
         flash('You do not have permission to import bank transactions.', 'danger')
@@ -280,6 +281,9 @@ def import_transactions(statement_id):
             flash('No file selected.', 'danger')
             return redirect(request.url)
             
+        # OFX/QFX and CAMT.053 files carry their own layout; CSV files need the column mapping
+        statement_format = bank_statement_formats.detect_statement_format(file.stream, file.filename)
+        
         # Get form data for column mapping
         date_col = request.form.get('date_column')
         description_col = request.form.get('description_column')
@@ -287,214 +291,77 @@ def import_transactions(statement_id):
         reference_col = request.form.get('reference_column')
         
         # Validate required fields
-        if not date_col or not description_col or not amount_col:
+        if statement_format == bank_statement_formats.CSV and (not date_col or not description_col or not amount_col):
             flash('Please map all required columns.', 'danger')
             return render_template('bank_reconciliation/import_transactions.html', statement=statement)
         
-        # Try to parse the CSV file
+        # Parse the file and bulk insert the new rows chunk by chunk
         try:
-            # Read the file contents
-            file_content = file.read()
-            
-            # Try to decode with UTF-8 first
-            try:
-                file_content = file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                # If UTF-8 fails, try other common encodings
-                try:
-                    file_content = file_content.decode('latin-1')
-                except UnicodeDecodeError:
-                    try:
-                        file_content = file_content.decode('cp1252')
-                    except UnicodeDecodeError:
-                        flash('Unable to decode the CSV file. Please ensure it is properly encoded.', 'danger')
-                        return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-            
-            csv_file = io.StringIO(file_content)
-            
-            # Check if the file has content
-            if len(file_content.strip()) == 0:
-                flash('The uploaded file appears to be empty.', 'danger')
-                return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-            
-            # Try to detect the CSV delimiter
-            dialect = csv.Sniffer().sniff(csv_file.read(1024))
-            csv_file.seek(0)
-            
-            # Use pandas to read the CSV file which is more flexible with different formats
-            try:
-                # Try with auto-detected delimiter
-                df = pd.read_csv(csv_file, dialect=dialect)
-            except:
-                # If that fails, reset and try with comma delimiter
-                csv_file.seek(0)
-                try:
-                    df = pd.read_csv(csv_file)
-                except Exception as e:
-                    flash(f'Error parsing CSV: {str(e)}. Please check the file format.', 'danger')
-                    return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-            
-            # Get column names for debugging
-            column_names = list(df.columns)
-            
-            # Convert column references to actual column names or indices
-            try:
-                # Map columns - try to handle both column names and indices
-                if date_col.isdigit():
-                    date_col_idx = int(date_col) - 1  # Convert to 0-based index
-                    if date_col_idx >= len(column_names):
-                        flash(f'Date column index {date_col} is out of range. File has {len(column_names)} columns.', 'danger')
-                        return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                    date_col = column_names[date_col_idx]
-                elif date_col not in df.columns:
-                    flash(f'Date column "{date_col}" not found in CSV. Available columns: {", ".join(column_names)}', 'danger')
-                    return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                
-                if description_col.isdigit():
-                    desc_col_idx = int(description_col) - 1
-                    if desc_col_idx >= len(column_names):
-                        flash(f'Description column index {description_col} is out of range. File has {len(column_names)} columns.', 'danger')
-                        return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                    description_col = column_names[desc_col_idx]
-                elif description_col not in df.columns:
-                    flash(f'Description column "{description_col}" not found in CSV. Available columns: {", ".join(column_names)}', 'danger')
-                    return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                
-                if amount_col.isdigit():
-                    amount_col_idx = int(amount_col) - 1
-                    if amount_col_idx >= len(column_names):
-                        flash(f'Amount column index {amount_col} is out of range. File has {len(column_names)} columns.', 'danger')
-                        return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                    amount_col = column_names[amount_col_idx]
-                elif amount_col not in df.columns:
-                    flash(f'Amount column "{amount_col}" not found in CSV. Available columns: {", ".join(column_names)}', 'danger')
-                    return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                
-                if reference_col:
-                    if reference_col.isdigit():
-                        ref_col_idx = int(reference_col) - 1
-                        if ref_col_idx >= len(column_names):
-                            flash(f'Reference column index {reference_col} is out of range. File has {len(column_names)} columns.', 'danger')
-                            return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-                        reference_col = column_names[ref_col_idx]
-                    elif reference_col not in df.columns:
-                        flash(f'Reference column "{reference_col}" not found in CSV. Available columns: {", ".join(column_names)}', 'danger')
-                        return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-            except Exception as e:
-                flash(f'Error mapping columns: {str(e)}', 'danger')
-                return render_template('bank_reconciliation/import_transactions.html', statement=statement)
-            
-            # Process each row
-            transaction_count = 0
-            skipped_rows = 0
-            errors = []
+            if statement_format == bank_statement_formats.CSV:
+                result = bank_import.import_statement_csv(
+                    statement_id, file.read(), date_col, description_col, amount_col, reference_col,
+                    filename=file.filename, created_by_id=current_user.id
+                )
+            else:
+                result = bank_statement_formats.import_statement_file(
+                    statement_id, file.stream, statement_format,
+                    filename=file.filename, created_by_id=current_user.id
+                )
+        except bank_import.BankImportError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return render_template('bank_reconciliation/import_transactions.html', statement=statement)
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error importing transactions: {str(e)}', 'danger')
+            return render_template('bank_reconciliation/import_transactions.html', statement=statement)
+        
+        # The same file was imported before: nothing to do
+        previous_import = result['previous_import']
+        if previous_import is not None:
+            flash(f'This file was already imported on {previous_import.created_at.strftime("%Y-%m-%d %H:%M")} '
+                  f'({previous_import.imported_count} transactions). No transactions were added.', 'info')
+            return redirect(url_for('bank_reconciliation.transactions', statement_id=previous_import.statement_id))
+        
+        transaction_count = result['imported']
+        duplicate_count = result['duplicates']
+        skipped_rows = result['skipped']
+        errors = result['errors']
+        
+        if transaction_count > 0 or duplicate_count > 0:
+            db.session.commit()
+            message = f'Successfully imported {transaction_count} transactions.'
+            if duplicate_count > 0:
+                message += f' Skipped {duplicate_count} transactions that were already imported.'
+            if skipped_rows > 0:
+                message += f' Skipped {skipped_rows} rows.'
+            if result.get('statement_fields'):
+                updated_fields = ', '.join(field.replace('_', ' ') for field in result['statement_fields'])
+                message += f' Updated the {updated_fields} from the file.'
+            if result.get('skipped_fields'):
+                skipped_fields = ', '.join(field.replace('_', ' ') for field in result['skipped_fields'])
+                message += f' Kept the existing {skipped_fields} because the statement already had transactions.'
+            flash(message, 'success' if transaction_count > 0 else 'info')
             
-            for index, row in df.iterrows():
-                try:
-                    # Get values from the row based on column mapping
-                    # Use .get method to avoid KeyErrors
-                    transaction_date_str = str(row.get(date_col, '')).strip()
-                    description = str(row.get(description_col, '')).strip()
-                    amount_str = str(row.get(amount_col, '')).strip()
-                    reference = str(row.get(reference_col, '')) if reference_col else ''
-                    
-                    # Skip rows with missing required values
-                    if not transaction_date_str or not description or not amount_str:
-                        skipped_rows += 1
-                        continue
-                    
-                    # Convert date string to date object
-                    # Try different date formats
-                    transaction_date = None
-                    date_formats = [
-                        '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y',
-                        '%Y/%m/%d', '%m.%d.%Y', '%d.%m.%Y', '%b %d, %Y', '%d %b %Y',
-                        '%d-%b-%Y', '%d/%b/%Y', '%B %d, %Y', '%d %B %Y'
-                    ]
-                    
-                    for date_format in date_formats:
-                        try:
-                            transaction_date = datetime.datetime.strptime(transaction_date_str, date_format).date()
-                            break
-                        except ValueError:
-                            continue
-                    
-                    if transaction_date is None:
-                        # If none of the formats worked, skip this row
-                        skipped_rows += 1
-                        errors.append(f"Row {index+1}: Unable to parse date format '{transaction_date_str}'")
-                        continue
-                    
-                    # Convert amount string to decimal
-                    try:
-                        # Remove any currency symbols, commas, parentheses, and handle negative signs
-                        # Handle parentheses notation for negative numbers (e.g., $(123.45) -> -123.45)
-                        if '(' in amount_str and ')' in amount_str:
-                            amount_str = amount_str.replace('(', '-').replace(')', '')
-                            
-                        amount_str = amount_str.replace('$', '').replace(',', '').replace(' ', '')
-                        amount = Decimal(amount_str)
-                        
-                        # Determine transaction type (debit/credit)
-                        transaction_type = 'debit' if amount < 0 else 'credit'
-                        
-                        # Make amount positive for storage
-                        amount = abs(amount)
-                    except Exception as e:
-                        skipped_rows += 1
-                        errors.append(f"Row {index+1}: Invalid amount format '{amount_str}': {str(e)}")
-                        continue
-                    
-                    # Create a new bank transaction
-                    transaction = BankTransaction(
-                        statement_id=statement_id,
-                        transaction_date=transaction_date,
-                        description=description,
-                        reference=reference,
-                        amount=amount,
-                        transaction_type=transaction_type,
-                        is_reconciled=False
-                    )
-                    
-                    db.session.add(transaction)
-                    transaction_count += 1
-                except Exception as e:
-                    skipped_rows += 1
-                    errors.append(f"Row {index+1}: {str(e)}")
+            # Report any errors in a separate flash message
+            if errors:
+                error_details = '<br>'.join(errors[:5])  # Show first 5 errors
+                if len(errors) > 5:
+                    error_details += f'<br>... and {len(errors) - 5} more errors'
+                flash(f'Some rows had errors:<br>{error_details}', 'warning')
             
-            # Commit all transactions to the database
-            if transaction_count > 0:
-                try:
-                    db.session.commit()
-                    message = f'Successfully imported {transaction_count} transactions.'
-                    if skipped_rows > 0:
-                        message += f' Skipped {skipped_rows} rows.'
-                    flash(message, 'success')
-                    
-                    # Report any errors in a separate flash message
-                    if errors:
-                        error_details = '<br>'.join(errors[:5])  # Show first 5 errors
-                        if len(errors) > 5:
-                            error_details += f'<br>... and {len(errors) - 5} more errors'
-                        flash(f'Some rows had errors:<br>{error_details}', 'warning')
-                    
-                    return redirect(url_for('bank_reconciliation.transactions', statement_id=statement_id))
-                except Exception as e:
-                    db.session.rollback()
-                    flash(f'Error importing transactions: {str(e)}', 'danger')
-            else:
-                if skipped_rows > 0:
-                    flash(f'No valid transactions found. Skipped {skipped_rows} rows due to errors.', 'danger')
-                    if errors:
-                        error_details = '<br>'.join(errors[:5])  # Show first 5 errors
-                        if len(errors) > 5:
-                            error_details += f'<br>... and {len(errors) - 5} more errors'
-                        flash(f'Error details:<br>{error_details}', 'warning')
-                else:
-                    flash('No transactions found in the file.', 'warning')
+            return redirect(url_for('bank_reconciliation.transactions', statement_id=statement_id))
         
-        except Exception as e:
-            flash(f'Error reading CSV file: {str(e)}', 'danger')
+        db.session.rollback()
+        if skipped_rows > 0:
+            flash(f'No valid transactions found. Skipped {skipped_rows} rows due to errors.', 'danger')
+            if errors:
+                error_details = '<br>'.join(errors[:5])  # Show first 5 errors
+                if len(errors) > 5:
+                    error_details += f'<br>... and {len(errors) - 5} more errors'
+                flash(f'Error details:<br>{error_details}', 'warning')
+        else:
+            flash('No transactions found in the file.', 'warning')
     
     return render_template('bank_reconciliation/import_transactions.html', statement=statement)
 
@@ -535,11 +402,9 @@ def reconcile(statement_id):
         JournalEntry.entry_date <= statement.end_date,
         JournalItem.account_id == gl_account_id
     ).filter(
-        ~JournalEntry.id.in_(
-            db.session.query(BankTransaction.gl_entry_id).filter(
-                BankTransaction.gl_entry_id.isnot(None)
-            )
-        )
+        bank_matching.unmatched_entry_filter()
+    ).options(
+        selectinload(JournalEntry.items)
     ).distinct().all()
     
     return render_template('bank_reconciliation/reconcile.html', 
@@ -548,6 +413,168 @@ def reconcile(statement_id):
                         journal_entries=journal_entries)
 
 
+@bank_reconciliation_bp.route('/statements/<int:statement_id>/auto-match', methods=['GET', 'POST'])
+@login_required
+def auto_match(statement_id):
+    """Propose bank-to-ledger matches and confirm the selected ones"""
+    # Check permission
+    if not current_user.has_permission(Role.CAN_EDIT):
+        flash('You do not have permission to reconcile bank statements.', 'danger')
+        return redirect(url_for('bank_reconciliation.transactions', statement_id=statement_id))
+
+    # Get the bank statement
+    statement = BankStatement.query.get_or_404(statement_id)
+    
+    if request.method == 'POST':
+        # Selected proposals are posted as "transaction_id:entry_id" and
+        # grouped ones as "transaction_id:entry_id,entry_id,..."
+        pairs = []
+        for value in request.form.getlist('matches'):
+            transaction_id, _, entry_id = value.partition(':')
+            if transaction_id.isdigit() and entry_id.isdigit():
+                pairs.append((int(transaction_id), int(entry_id)))
+        groups = []
+        for value in request.form.getlist('groups'):
+            transaction_id, _, entry_ids = value.partition(':')
+            entry_ids = entry_ids.split(',')
+            if transaction_id.isdigit() and all(entry_id.isdigit() for entry_id in entry_ids):
+                groups.append((int(transaction_id), [int(entry_id) for entry_id in entry_ids]))
+        
+        if not pairs and not groups:
+            flash('No matches were selected.', 'warning')
+            return redirect(url_for('bank_reconciliation.auto_match', statement_id=statement_id))
+        
+        try:
+            result = bank_matching.confirm_matches(statement, pairs)
+            group_result = bank_group_matching.confirm_group_matches(statement, groups)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error confirming matches: {str(e)}', 'danger')
+            return redirect(url_for('bank_reconciliation.auto_match', statement_id=statement_id))
+        
+        errors = result['errors'] + group_result['errors']
+        flash(f"Matched {result['matched'] + group_result['matched']} transactions.", 'success')
+        if errors:
+            flash(f"{len(errors)} matches were rejected: {'; '.join(errors[:5])}", 'warning')
+        return redirect(url_for('bank_reconciliation.reconcile', statement_id=statement_id))
+    
+    # Matching options
+    date_window = request.args.get('date_window', bank_matching.DATE_WINDOW_DAYS, type=int)
+    min_score = request.args.get('min_score', bank_matching.MIN_SCORE, type=float)
+    assignment = request.args.get('assignment', bank_matching.OPTIMAL)
+    
+    try:
+        proposals = bank_matching.propose_matches(
+            statement, date_window=date_window, min_score=min_score, assignment=assignment
+        )
+        
+        # Deposits and payments covering several entries, among what is left
+        groups = bank_group_matching.propose_group_matches(
+            statement,
+            exclude_transactions={proposal['transaction_id'] for proposal in proposals},
+            exclude_entries={proposal['entry_id'] for proposal in proposals}
+        )
+    except bank_matching.BankMatchError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('bank_reconciliation.reconcile', statement_id=statement_id))
+    
+    unreconciled_count = BankTransaction.query.filter_by(
+        statement_id=statement_id,
+        is_reconciled=False
+    ).count()
+    
+    return render_template('bank_reconciliation/auto_match.html',
+                        statement=statement,
+                        proposals=proposals,
+                        groups=groups,
+                        unreconciled_count=unreconciled_count,
+                        date_window=date_window,
+                        min_score=min_score,
+                        assignment=assignment,
+                        assignment_methods=bank_matching.ASSIGNMENT_METHODS)
+
+
+@bank_reconciliation_bp.route('/api/statements/<int:statement_id>/auto-match', methods=['POST'])
+@login_required
+def api_auto_match(statement_id):
+    """
+    Propose matches for a statement's unreconciled transactions as JSON.
+
+    Accepts optional date_window, min_score and assignment ('greedy' or
+    'optimal'), and groups to also propose many-to-one matches; with
+    confirm set, the selected proposals are also saved. Groups are only
+    saved when listed in confirm_groups as {transaction_id, entry_ids}.
+    """
+    # Check permission
+    if not current_user.has_permission(Role.CAN_EDIT):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    statement = BankStatement.query.get_or_404(statement_id)
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        confirm_groups = [
+            (int(group['transaction_id']), [int(entry_id) for entry_id in group['entry_ids']])
+            for group in data.get('confirm_groups') or []
+        ]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'confirm_groups must be a list of {transaction_id, entry_ids}.'
+        }), 400
+    
+    try:
+        proposals = bank_matching.propose_matches(
+            statement,
+            date_window=int(data.get('date_window', bank_matching.DATE_WINDOW_DAYS)),
+            min_score=float(data.get('min_score', bank_matching.MIN_SCORE)),
+            assignment=data.get('assignment', bank_matching.OPTIMAL)
+        )
+        groups = []
+        if data.get('groups'):
+            groups = bank_group_matching.propose_group_matches(
+                statement,
+                exclude_transactions={proposal['transaction_id'] for proposal in proposals},
+                exclude_entries={proposal['entry_id'] for proposal in proposals}
+            )
+    except (bank_matching.BankMatchError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    response = {
+        'success': True,
+        'proposals': [
+            dict(proposal,
+                 transaction_date=proposal['transaction_date'].isoformat(),
+                 entry_date=proposal['entry_date'].isoformat())
+            for proposal in proposals
+        ],
+        'groups': [
+            dict(group,
+                 transaction_date=group['transaction_date'].isoformat(),
+                 entries=[dict(entry, entry_date=entry['entry_date'].isoformat()) for entry in group['entries']])
+            for group in groups
+        ],
+    }
+    
+    if data.get('confirm'):
+        try:
+            result = bank_matching.confirm_matches(
+                statement,
+                [(proposal['transaction_id'], proposal['entry_id']) for proposal in proposals if proposal['selected']]
+            )
+            # Grouped matches are less certain: only the ones the caller picked are saved
+            group_result = bank_group_matching.confirm_group_matches(statement, confirm_groups)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': f'Error confirming matches: {str(e)}'}), 500
+        response['matched'] = result['matched'] + group_result['matched']
+        response['errors'] = result['errors'] + group_result['errors']
+    
+    return jsonify(response)
+
+
 @bank_reconciliation_bp.route('/transactions/<int:transaction_id>/match/<int:entry_id>', methods=['POST'])
 @login_required
 def match_transaction(transaction_id, entry_id):
@@ -620,8 +647,9 @@ def unmatch_transaction(transaction_id):
     # Get the transaction
     transaction = BankTransaction.query.get_or_404(transaction_id)
     
-    # Unmatch the transaction
+    # Unmatch the transaction (and any grouped entries)
     transaction.gl_entry_id = None
+    transaction.matches.clear()
     transaction.is_reconciled = False
     transaction.reconciled_date = None
     
@@ -684,8 +712,11 @@ def reconciliation_rules():
         flash('You do not have permission to view reconciliation rules.', 'danger')
         return redirect(url_for('dashboard.index'))
 
-    # Get all reconciliation rules
-    rules = ReconciliationRule.query.filter_by(is_active=True).all()
+    # Get all reconciliation rules, in the order they are tried
+    rules = ReconciliationRule.query.filter_by(is_active=True).order_by(
+        func.coalesce(ReconciliationRule.priority, rule_engine.DEFAULT_PRIORITY),
+        ReconciliationRule.id
+    ).all()
     
     return render_template('bank_reconciliation/rules.html', rules=rules)
 
@@ -710,6 +741,7 @@ def add_rule():
         name = request.form.get('name')
         bank_account_id = request.form.get('bank_account_id')
         match_pattern = request.form.get('match_pattern')
+        match_type = request.form.get('match_type') or ReconciliationRule.CONTAINS
         gl_account_id = request.form.get('gl_account_id')
         
         # Validate required fields
@@ -718,11 +750,28 @@ def add_rule():
             return render_template('bank_reconciliation/add_rule.html', 
                                 bank_accounts=bank_accounts, gl_accounts=gl_accounts)
         
+        # Validate the pattern and the optional conditions
+        error = rule_engine.validate_rule_pattern(match_pattern, match_type)
+        try:
+            priority = int(request.form.get('priority') or rule_engine.DEFAULT_PRIORITY)
+            min_amount = Decimal(request.form['min_amount']) if request.form.get('min_amount') else None
+            max_amount = Decimal(request.form['max_amount']) if request.form.get('max_amount') else None
+        except (ValueError, ArithmeticError):
+            error = 'Priority and amounts must be numbers.'
+        if error:
+            flash(error, 'danger')
+            return render_template('bank_reconciliation/add_rule.html', 
+                                bank_accounts=bank_accounts, gl_accounts=gl_accounts)
+        
         # Create new reconciliation rule
         rule = ReconciliationRule(
             name=name,
             bank_account_id=bank_account_id,
             match_pattern=match_pattern,
+            match_type=match_type,
+            priority=priority,
+            min_amount=min_amount,
+            max_amount=max_amount,
             gl_account_id=gl_account_id,
             is_active=True
         )
@@ -764,6 +813,7 @@ def edit_rule(rule_id):
         name = request.form.get('name')
         bank_account_id = request.form.get('bank_account_id')
         match_pattern = request.form.get('match_pattern')
+        match_type = request.form.get('match_type') or ReconciliationRule.CONTAINS
         gl_account_id = request.form.get('gl_account_id')
         is_active = 'is_active' in request.form
         
@@ -773,10 +823,27 @@ def edit_rule(rule_id):
             return render_template('bank_reconciliation/edit_rule.html', 
                                 rule=rule, bank_accounts=bank_accounts, gl_accounts=gl_accounts)
         
+        # Validate the pattern and the optional conditions
+        error = rule_engine.validate_rule_pattern(match_pattern, match_type)
+        try:
+            priority = int(request.form.get('priority') or rule_engine.DEFAULT_PRIORITY)
+            min_amount = Decimal(request.form['min_amount']) if request.form.get('min_amount') else None
+            max_amount = Decimal(request.form['max_amount']) if request.form.get('max_amount') else None
+        except (ValueError, ArithmeticError):
+            error = 'Priority and amounts must be numbers.'
+        if error:
+            flash(error, 'danger')
+            return render_template('bank_reconciliation/edit_rule.html', 
+                                rule=rule, bank_accounts=bank_accounts, gl_accounts=gl_accounts)
+        
         # Update reconciliation rule
         rule.name = name
         rule.bank_account_id = bank_account_id
         rule.match_pattern = match_pattern
+        rule.match_type = match_type
+        rule.priority = priority
+        rule.min_amount = min_amount
+        rule.max_amount = max_amount
         rule.gl_account_id = gl_account_id
         rule.is_active = is_active
         
@@ -805,91 +872,12 @@ def apply_rules(statement_id):
     # Get the bank statement
     statement = BankStatement.query.get_or_404(statement_id)
     
-    # Get unreconciled transactions for this statement
-    transactions = BankTransaction.query.filter_by(
-        statement_id=statement_id,
-        is_reconciled=False
-    ).all()
-    
-    # Get active rules for this bank account
-    rules = ReconciliationRule.query.filter_by(
-        bank_account_id=statement.bank_account_id,
-        is_active=True
-    ).all()
-    
-    # Apply rules to transactions
-    matched_count = 0
-    for transaction in transactions:
-        for rule in rules:
-            # Check if transaction description matches the rule pattern
-            if rule.match_pattern.lower() in transaction.description.lower():
-                # For matching transactions, create a new journal entry
-                journal_entry = JournalEntry(
-                    entry_date=transaction.transaction_date,
-                    reference=f"Auto-matched: {transaction.reference or transaction.description[:20]}",
-                    description=transaction.description
-                )
-                
-                # Add journal entry to the database
-                db.session.add(journal_entry)
-                db.session.flush()  # This assigns an ID to the journal entry
-                
-                # Create journal items (line items) for the entry
-                if transaction.transaction_type == 'credit':
-                    # Money coming in - credit the bank account, debit the matched account
-                    # Create the credit item (bank account)
-                    credit_item = JournalItem(
-                        journal_entry_id=journal_entry.id,
-                        account_id=statement.bank_account.gl_account_id,
-                        description=f"Bank deposit: {transaction.description[:30]}",
-                        credit_amount=transaction.amount,
-                        debit_amount=0
-                    )
-                    db.session.add(credit_item)
-                    
-                    # Create the debit item (income account from rule)
-                    debit_item = JournalItem(
-                        journal_entry_id=journal_entry.id,
-                        account_id=rule.gl_account_id,
-                        description=f"Income matched by rule: {rule.name}",
-                        debit_amount=transaction.amount,
-                        credit_amount=0
-                    )
-                    db.session.add(debit_item)
-                else:
-                    # Money going out - debit the bank account, credit the matched account
-                    # Create the debit item (bank account)
-                    debit_item = JournalItem(
-                        journal_entry_id=journal_entry.id,
-                        account_id=statement.bank_account.gl_account_id,
-                        description=f"Bank withdrawal: {transaction.description[:30]}",
-                        debit_amount=transaction.amount,
-                        credit_amount=0
-                    )
-                    db.session.add(debit_item)
-                    
-                    # Create the credit item (expense account from rule)
-                    credit_item = JournalItem(
-                        journal_entry_id=journal_entry.id,
-                        account_id=rule.gl_account_id,
-                        description=f"Expense matched by rule: {rule.name}",
-                        credit_amount=transaction.amount,
-                        debit_amount=0
-                    )
-                    db.session.add(credit_item)
-                
-                # Link the journal entry to the transaction
-                transaction.gl_entry_id = journal_entry.id
-                transaction.is_reconciled = True
-                transaction.reconciled_date = datetime.date.today()
-                
-                matched_count += 1
-                break  # Stop after first matching rule
-    
-    # Save all changes to the database
+    # Match the unreconciled transactions against the compiled rules and
+    # create their journal entries in bulk
     try:
+        result = rule_engine.apply_reconciliation_rules(statement)
         db.session.commit()
-        flash(f'Successfully matched {matched_count} transactions using reconciliation rules.', 'success')
+        flash(f"Successfully matched {result['matched']} transactions using reconciliation rules.", 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error applying reconciliation rules: {str(e)}', 'danger')
@@ -6,7 +6,8 @@ from models import (
     Forecast, ForecastItem, Account, AccountType, Role,
     JournalEntry, JournalItem
 )
-import utils
+from utils.balances import get_account_balances
+from utils.report_cache import cached_report
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 import calendar
@@ -20,54 +21,12 @@ from app import db
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Copy needed functions from utils.py to avoid import issues
 def get_account_balance(account_id, start_date=None, end_date=None):
     """Get the balance of an account for a specific date range"""
-    from models import Account, JournalItem, JournalEntry, AccountType
-    from sqlalchemy import func
-    from decimal import Decimal
-    
     logger.debug(f"Local get_account_balance for account {account_id} from {start_date} to {end_date}")
     
-    # Get the account
-    account = Account.query.get(account_id)
-    if not account:
-        logger.debug(f"Account {account_id} not found")
-        return Decimal('0.00')
-    
-    # Base query
-    query = db.session.query(
-        func.sum(JournalItem.debit_amount).label('total_debit'),
-        func.sum(JournalItem.credit_amount).label('total_credit')
-    ).join(
-        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
-    ).filter(
-        JournalItem.account_id == account_id,
-        JournalEntry.is_posted == True
-    )
-    
-    # Apply date filters
-    if start_date:
-        query = query.filter(JournalEntry.entry_date >= start_date)
-    if end_date:
-        query = query.filter(JournalEntry.entry_date <= end_date)
-    
-    # Execute query
-    result = query.first()
-    
-    # Calculate balance based on account type
-    total_debit = result.total_debit or Decimal('0.00')
-    total_credit = result.total_credit or Decimal('0.00')
-    
-    # For asset and expense accounts, debit increases the balance
-    if account.account_type.name in [AccountType.ASSET, AccountType.EXPENSE]:
-        balance = total_debit - total_credit
-    # For liability, equity, and revenue accounts, credit increases the balance
-    else:
-        balance = total_credit - total_debit
-    
-    logger.debug(f"Account balance for {account.name}: {balance}")
-    return balance
+    balances = get_account_balances([account_id], start_date, end_date)
+    return balances.get(account_id, Decimal('0.00'))
 
 def month_name(month_number):
     """Get the name of a month from its number (1-12)"""
@@ -123,6 +82,27 @@ def generate_budget_periods(period_type, year):
     
     return periods
 
+def get_period_actuals(account_ids, periods, start_date, end_date):
+    """Get account balances for each budget period overlapping the date range"""
+    period_actuals = {}
+    
+    for period_info in periods:
+        period_start = period_info['start_date']
+        period_end = period_info['end_date']
+        
+        # Only get data for periods in our date range
+        if period_end < start_date or period_start > end_date:
+            continue
+        
+        try:
+            logger.debug(f"Getting balances for {len(account_ids)} accounts from {period_start} to {period_end}")
+            period_actuals[period_info['period']] = get_account_balances(list(account_ids), period_start, period_end)
+        except Exception as e:
+            logger.error(f"Error getting account balances: {str(e)}")
+            period_actuals[period_info['period']] = {}
+    
+    return period_actuals
+
 def get_actual_vs_budget(budget_id, start_date, end_date):
     """
     Get actual vs budget data for the given budget and date range
@@ -168,42 +148,32 @@ def get_actual_vs_budget(budget_id, start_date, end_date):
             budget_amounts[item.account_id] = {}
         budget_amounts[item.account_id][item.period] = item.amount
     
-    # Get actual data from journal entries
-    actuals = {}
+    # Get actual data from journal entries, one bulk balance query per period
+    actuals = {account.id: {} for account in accounts}
     
-    for account in accounts:
-        actuals[account.id] = {}
-        
-        # Create a mapping of period to date range
-        try:
-            periods = generate_budget_periods(budget.period_type.name, budget.year)
-            logger.debug(f"Generated {len(periods)} periods for account {account.id}")
-        except Exception as e:
-            logger.error(f"Error generating periods: {str(e)}")
-            periods = []
-        
-        for period_info in periods:
-            period = period_info['period']
-            period_start = period_info['start_date']
-            period_end = period_info['end_date']
-            
-            # Only get data for periods in our date range
-            if period_end < start_date or period_start > end_date:
-                continue
-            
-            # Get actual amounts from journal entries
-            try:
-                logger.debug(f"Getting balance for account {account.id} from {period_start} to {period_end}")
-                actual_amount = get_account_balance(
-                    account.id, 
-                    period_start, 
-                    period_end
-                )
-                logger.debug(f"Got actual amount: {actual_amount}")
-                actuals[account.id][period] = actual_amount
-            except Exception as e:
-                logger.error(f"Error getting account balance: {str(e)}")
-                actuals[account.id][period] = Decimal('0.00')
+    try:
+        periods = generate_budget_periods(budget.period_type.name, budget.year)
+        logger.debug(f"Generated {len(periods)} periods")
+    except Exception as e:
+        logger.error(f"Error generating periods: {str(e)}")
+        periods = []
+    
+    # Actuals depend only on the ledger, so they are cached per ledger version
+    period_actuals = cached_report(
+        'budget_actuals',
+        {
+            'account_ids': account_ids,
+            'period_type': budget.period_type.name if budget.period_type else None,
+            'year': budget.year,
+            'start_date': start_date,
+            'end_date': end_date
+        },
+        lambda: get_period_actuals(account_ids, periods, start_date, end_date)
+    )
+    
+    for period, period_balances in period_actuals.items():
+        for account in accounts:
+            actuals[account.id][period] = period_balances.get(account.id, Decimal('0.00'))
     
     # Prepare result
     result = {
@@ -7,12 +7,13 @@ import datetime
 from decimal import Decimal
 import os, sys
 from datetime import date
+from dateutil.relativedelta import relativedelta
 
 # Import functions from core_utils.py
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 sys.path.insert(0, root_dir)
-from core_utils import get_financial_summary, get_monthly_trends
+from core_utils import get_income_expense_trends
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -38,17 +39,24 @@ def index():
         desc(JournalEntry.entry_date)
     ).limit(5).all()
     
-    # Get current month's financial summary
+    # Get income and expenses per month for the chart and YTD in one query
     today = date.today()
     current_month_start = today.replace(day=1)
-    current_month_summary = get_financial_summary(current_month_start, today)
-    
-    # Get financial summaries for YTD
     current_year_start = date(today.year, 1, 1)
-    ytd_summary = get_financial_summary(current_year_start, today)
+    chart_start = current_month_start - relativedelta(months=5)
+    
+    trends = get_income_expense_trends(min(chart_start, current_year_start), today)
+    
+    # Past 6 months for the chart
+    monthly_trends = [month_data for month_data in trends if month_data['start_date'] >= chart_start]
     
-    # Get monthly trends data for the past 6 months
-    monthly_trends = get_monthly_trends(6)
+    # Current month and year-to-date summaries
+    current_month_summary = trends[-1]
+    ytd_months = [month_data for month_data in trends if month_data['start_date'] >= current_year_start]
+    ytd_summary = {
+        'income': sum(month_data['income'] for month_data in ytd_months),
+        'expenses': sum(month_data['expenses'] for month_data in ytd_months)
+    }
     
     # Extract data for the chart - use absolute values to avoid minus signs
     months = [month_data['month'].split()[0] for month_data in monthly_trends]  # Just show the month name, not the year
@@ -1,7 +1,12 @@
-from flask import Response, send_file
+from flask import Response, send_file, stream_with_context
 import pandas as pd
 import io
 import csv
+import tempfile
+import xlsxwriter
+
+# Flush streamed CSV output to the client in chunks of roughly this size
+STREAM_CHUNK_SIZE = 64 * 1024
 
 def export_general_ledger_report(report_data, format='csv'):
     """Helper to export General Ledger report in various formats"""
@@ -142,4 +147,301 @@ def export_general_ledger_report(report_data, format='csv'):
     
     # Default to PDF (requires additional packages like weasyprint)
     else:
-        return "Export format not supported", 400
\ No newline at end of file
+        return "Export format not supported", 400
+
+def _iter_general_ledger_csv(start_date, end_date, account_ids, account_type_ids, include_unposted):
+    """Yield the General Ledger CSV report in chunks as ledger lines are read"""
+    from utils.ledger import iter_general_ledger
+    from decimal import Decimal
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    
+    # Header
+    writer.writerow(['General Ledger Report'])
+    writer.writerow([f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"])
+    writer.writerow([])
+    
+    debit_total = Decimal('0.00')
+    credit_total = Decimal('0.00')
+    current_account = None
+    ending_balance = None
+    
+    def write_ending_balance():
+        writer.writerow(['Ending Balance', '', '', '', '', '', f"${ending_balance:.2f}"])
+        writer.writerow([])  # Empty row between accounts
+    
+    for account, entry in iter_general_ledger(start_date, end_date, account_ids, account_type_ids, include_unposted):
+        if current_account is None or current_account['id'] != account['id']:
+            if current_account is not None:
+                write_ending_balance()
+            
+            current_account = account
+            ending_balance = account['starting_balance']
+            writer.writerow([f"Account: {account['code']} - {account['name']}"])
+            writer.writerow(['Starting Balance', '', '', '', '', '', f"${account['starting_balance']:.2f}"])
+            writer.writerow(['Date', 'Reference', 'Account', 'Description', 'Debit', 'Credit', 'Balance'])
+        
+        if entry is not None:
+            debit_str = f"${entry['debit_amount']:.2f}" if entry['debit_amount'] > 0 else ""
+            credit_str = f"${entry['credit_amount']:.2f}" if entry['credit_amount'] > 0 else ""
+            
+            writer.writerow([
+                entry['entry_date'].strftime('%Y-%m-%d'),
+                entry['reference'],
+                entry['account_code'],
+                entry['item_description'] or entry['entry_description'],
+                debit_str,
+                credit_str,
+                f"${entry['running_balance']:.2f}"
+            ])
+            
+            ending_balance = entry['running_balance']
+            debit_total += entry['debit_amount']
+            credit_total += entry['credit_amount']
+        
+        if output.tell() >= STREAM_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    
+    if current_account is not None:
+        write_ending_balance()
+    
+    # Totals
+    writer.writerow(['Grand Total', '', '', '', f"${debit_total:.2f}", f"${credit_total:.2f}", ''])
+    yield output.getvalue()
+
+def _write_general_ledger_xlsx(output, start_date, end_date, account_ids, account_type_ids, include_unposted):
+    """Write the General Ledger workbook row by row in constant memory mode"""
+    from utils.ledger import iter_general_ledger
+    from decimal import Decimal
+    
+    # constant_memory flushes each row to disk as soon as the next one starts
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    try:
+        header_format = workbook.add_format({
+            'bold': True,
+            'font_size': 14,
+            'align': 'center'
+        })
+        
+        bold_format = workbook.add_format({'bold': True})
+        money_format = workbook.add_format({'num_format': '$#,##0.00'})
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        
+        worksheet = workbook.add_worksheet('General Ledger')
+        
+        # Format column widths
+        worksheet.set_column(0, 0, 12)  # Date
+        worksheet.set_column(1, 1, 15)  # Reference
+        worksheet.set_column(2, 2, 15)  # Account
+        worksheet.set_column(3, 3, 40)  # Description
+        worksheet.set_column(4, 6, 15)  # Amounts
+        
+        # Write headers
+        worksheet.write(0, 0, 'General Ledger Report', header_format)
+        worksheet.write(1, 0, f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+        
+        row = 3
+        debit_total = Decimal('0.00')
+        credit_total = Decimal('0.00')
+        current_account = None
+        ending_balance = None
+        
+        for account, entry in iter_general_ledger(start_date, end_date, account_ids, account_type_ids, include_unposted):
+            if current_account is None or current_account['id'] != account['id']:
+                if current_account is not None:
+                    worksheet.write(row, 0, 'Ending Balance', bold_format)
+                    worksheet.write(row, 6, ending_balance, money_format)
+                    row += 2  # Empty row between accounts
+                
+                current_account = account
+                ending_balance = account['starting_balance']
+                
+                worksheet.write(row, 0, f"Account: {account['code']} - {account['name']}", bold_format)
+                row += 1
+                
+                worksheet.write(row, 0, 'Starting Balance', bold_format)
+                worksheet.write(row, 6, account['starting_balance'], money_format)
+                row += 1
+                
+                # Column headers
+                for col, title in enumerate(['Date', 'Reference', 'Account', 'Description', 'Debit', 'Credit', 'Balance']):
+                    worksheet.write(row, col, title, bold_format)
+                row += 1
+            
+            if entry is None:
+                continue
+            
+            worksheet.write(row, 0, entry['entry_date'], date_format)
+            worksheet.write(row, 1, entry['reference'])
+            worksheet.write(row, 2, entry['account_code'])
+            worksheet.write(row, 3, entry['item_description'] or entry['entry_description'])
+            
+            if entry['debit_amount'] > 0:
+                worksheet.write(row, 4, entry['debit_amount'], money_format)
+            
+            if entry['credit_amount'] > 0:
+                worksheet.write(row, 5, entry['credit_amount'], money_format)
+            
+            worksheet.write(row, 6, entry['running_balance'], money_format)
+            row += 1
+            
+            ending_balance = entry['running_balance']
+            debit_total += entry['debit_amount']
+            credit_total += entry['credit_amount']
+        
+        if current_account is not None:
+            worksheet.write(row, 0, 'Ending Balance', bold_format)
+            worksheet.write(row, 6, ending_balance, money_format)
+            row += 2
+        
+        # Totals
+        worksheet.write(row, 0, 'Grand Total', bold_format)
+        worksheet.write(row, 4, debit_total, money_format)
+        worksheet.write(row, 5, credit_total, money_format)
+    finally:
+        workbook.close()
+
+def stream_general_ledger_report(start_date, end_date, account_ids=None, account_type_ids=None,
+                                 include_unposted=False, format='csv'):
+    """
+    Export the General Ledger without building the report in memory.
+    
+    CSV is streamed to the client while ledger lines are still being read
+    from a server-side cursor. Excel workbooks are written in xlsxwriter's
+    constant_memory mode to a temporary file, which is then sent in chunks.
+    """
+    if format == 'csv':
+        return Response(
+            stream_with_context(_iter_general_ledger_csv(
+                start_date, end_date, account_ids, account_type_ids, include_unposted
+            )),
+            mimetype='text/csv',
+            headers={
+                'Content-Disposition': 'attachment;filename=general_ledger_report.csv'
+            }
+        )
+    
+    elif format == 'excel':
+        # Anonymous temporary file, removed by the OS once the response closes it
+        output = tempfile.TemporaryFile()
+        _write_general_ledger_xlsx(output, start_date, end_date, account_ids, account_type_ids, include_unposted)
+        output.seek(0)
+        
+        return send_file(
+            output,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name='general_ledger_report.xlsx'
+        )
+    
+    else:
+        return "Export format not supported", 400
+
+def export_stock_valuation_report(rows, method_label, as_of, format='excel'):
+    """
+    Export stock valuation rows (from utils.stock_valuation.get_stock_valuation).
+    
+    Excel workbooks are written in constant_memory mode so exports covering
+    every product and location stay small in memory.
+    """
+    headers = ['SKU', 'Product', 'Category', 'Location', 'Quantity', 'UOM', 'Unit Cost', 'Total Value']
+    title = f"Stock Valuation Report ({method_label}) as of {as_of.strftime('%Y-%m-%d')}"
+    
+    def row_values(row):
+        product = row['product']
+        return [
+            product.sku,
+            product.name,
+            product.category.name if product.category else 'Uncategorized',
+            row['location'] or 'Unassigned',
+            row['quantity'],
+            product.uom.abbreviation if product.uom else '',
+            row['unit_cost'],
+            row['value']
+        ]
+    
+    if format == 'csv':
+        def generate():
+            output = io.StringIO()
+            writer = csv.writer(output)
+            
+            writer.writerow([title])
+            writer.writerow([])
+            writer.writerow(headers)
+            
+            total_value = 0
+            for row in rows:
+                values = row_values(row)
+                values[6] = f"{row['unit_cost']:.2f}"
+                values[7] = f"{row['value']:.2f}"
+                writer.writerow(values)
+                total_value += row['value']
+                
+                if output.tell() >= STREAM_CHUNK_SIZE:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+            
+            writer.writerow(['Total', '', '', '', '', '', '', f"{total_value:.2f}"])
+            yield output.getvalue()
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={
+                'Content-Disposition': 'attachment;filename=stock_valuation_report.csv'
+            }
+        )
+    
+    elif format == 'excel':
+        output = tempfile.TemporaryFile()
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        try:
+            header_format = workbook.add_format({'bold': True, 'font_size': 14})
+            bold_format = workbook.add_format({'bold': True})
+            quantity_format = workbook.add_format({'num_format': '#,##0.00'})
+            money_format = workbook.add_format({'num_format': '$#,##0.00'})
+            
+            worksheet = workbook.add_worksheet('Stock Valuation')
+            worksheet.set_column(0, 0, 15)  # SKU
+            worksheet.set_column(1, 1, 35)  # Product
+            worksheet.set_column(2, 3, 20)  # Category, Location
+            worksheet.set_column(4, 7, 14)  # Quantity, UOM, amounts
+            
+            worksheet.write(0, 0, title, header_format)
+            for col, header in enumerate(headers):
+                worksheet.write(2, col, header, bold_format)
+            
+            row_number = 3
+            total_value = 0
+            for row in rows:
+                values = row_values(row)
+                worksheet.write_string(row_number, 0, values[0])
+                worksheet.write_string(row_number, 1, values[1])
+                worksheet.write_string(row_number, 2, values[2])
+                worksheet.write_string(row_number, 3, values[3])
+                worksheet.write_number(row_number, 4, float(values[4]), quantity_format)
+                worksheet.write_string(row_number, 5, values[5])
+                worksheet.write_number(row_number, 6, float(values[6]), money_format)
+                worksheet.write_number(row_number, 7, float(values[7]), money_format)
+                total_value += row['value']
+                row_number += 1
+            
+            worksheet.write(row_number, 0, 'Total', bold_format)
+            worksheet.write_number(row_number, 7, float(total_value), money_format)
+        finally:
+            workbook.close()
+        
+        output.seek(0)
+        return send_file(
+            output,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name='stock_valuation_report.xlsx'
+        )
+    
+    else:
+        return "Export format not supported", 400
@@ -9,8 +9,16 @@ from models import (
 )
 import utils
 import core_utils
+from routes.exports import export_stock_valuation_report
+from utils import inventory_import, po_receiving, reorder
+from utils.stock import (
+    find_warehouse_by_name, get_warehouse_stock_summary, low_stock_condition, rename_warehouse_locations,
+    stock_on_hand_subquery
+)
+from utils.stock_valuation import STANDARD, VALUATION_METHODS, get_stock_valuation
 from datetime import datetime, timedelta
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
 inventory_bp = Blueprint('inventory', __name__)
 
@@ -232,7 +240,11 @@ def delete_uom(uom_id):
 def warehouses():
     """List warehouses"""
     warehouses = Warehouse.query.all()
-    return render_template('inventory/warehouses.html', warehouses=warehouses)
+    
+    # On-hand stock per warehouse in one grouped query
+    stock_summary = get_warehouse_stock_summary()
+    
+    return render_template('inventory/warehouses.html', warehouses=warehouses, stock_summary=stock_summary)
 
 @inventory_bp.route('/warehouses/create', methods=['GET', 'POST'])
 @login_required
@@ -248,6 +260,11 @@ def create_warehouse():
         description = request.form.get('description')
         is_active = 'is_active' in request.form
         
+        # Stock levels are keyed by the warehouse name
+        if find_warehouse_by_name(name) is not None:
+            flash(f'A warehouse named {name} already exists.', 'danger')
+            return redirect(url_for('inventory.warehouses'))
+        
         warehouse = Warehouse(
             name=name,
             location=location,
@@ -257,6 +274,10 @@ def create_warehouse():
         )
         
         db.session.add(warehouse)
+        db.session.flush()
+        
+        # Movements already recorded at a location of that name belong to the new warehouse
+        rename_warehouse_locations(warehouse.id, warehouse.name)
         db.session.commit()
         
         flash('Warehouse created successfully.', 'success')
@@ -275,12 +296,29 @@ def edit_warehouse(warehouse_id):
     warehouse = Warehouse.query.get_or_404(warehouse_id)
     
     if request.method == 'POST':
-        warehouse.name = request.form.get('name')
+        old_name = warehouse.name
+        name = (request.form.get('name') or '').strip()
+        
+        # Stock levels are keyed by the warehouse name
+        if find_warehouse_by_name(name, exclude_id=warehouse.id) is not None:
+            flash(f'A warehouse named {name} already exists.', 'danger')
+            return redirect(url_for('inventory.warehouses'))
+        
+        warehouse.name = name
         warehouse.location = request.form.get('location')
         warehouse.description = request.form.get('description')
         warehouse.is_active = 'is_active' in request.form
         
-        db.session.commit()
+        # Transactions and stock levels show the warehouse name as their location
+        if warehouse.name != old_name:
+            rename_warehouse_locations(warehouse.id, warehouse.name)
+        
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash(f'A warehouse named {name} already exists.', 'danger')
+            return redirect(url_for('inventory.warehouses'))
         
         flash('Warehouse updated successfully.', 'success')
         return redirect(url_for('inventory.warehouses'))
@@ -303,6 +341,12 @@ def delete_warehouse(warehouse_id):
         flash(f'Cannot delete warehouse. It is used by {purchase_orders} purchase orders.', 'danger')
         return redirect(url_for('inventory.warehouses'))
     
+    # Check if there are inventory transactions in this warehouse
+    transactions = InventoryTransaction.query.filter_by(warehouse_id=warehouse_id).count()
+    if transactions > 0:
+        flash(f'Cannot delete warehouse. It has {transactions} inventory transactions.', 'danger')
+        return redirect(url_for('inventory.warehouses'))
+    
     db.session.delete(warehouse)
     db.session.commit()
     
@@ -322,20 +366,24 @@ def products():
     page = request.args.get('page', 1, type=int)
     per_page = 10
     
-    # Base query
-    query = Product.query
+    # Base query, with stock on hand joined so it can be filtered and sorted on
+    stock = stock_on_hand_subquery()
+    on_hand = func.coalesce(stock.c.quantity, 0)
+    query = Product.query.outerjoin(stock, stock.c.product_id == Product.id)
     
     # Apply filters
     if search:
         query = query.filter(Product.name.ilike(f'%{search}%') | Product.sku.ilike(f'%{search}%'))
     
     if category:
-        query = query.filter_by(category_id=category)
+        query = query.filter(Product.category_id == category)
     
     if status == 'active':
-        query = query.filter_by(is_active=True)
+        query = query.filter(Product.is_active == True)
     elif status == 'inactive':
-        query = query.filter_by(is_active=False)
+        query = query.filter(Product.is_active == False)
+    elif status == 'low_stock':
+        query = query.filter(Product.is_active == True, low_stock_condition(on_hand))
     
     # Apply sorting
     if sort == 'name':
@@ -343,12 +391,9 @@ def products():
     elif sort == 'sku':
         query = query.order_by(Product.sku)
     elif sort == 'stock_low':
-        # This assumes current_stock is a property or hybrid property
-        # For simplicity, we'll just sort by ID here
-        query = query.order_by(Product.id)
+        query = query.order_by(on_hand, Product.name)
     elif sort == 'stock_high':
-        # Similar to above
-        query = query.order_by(Product.id.desc())
+        query = query.order_by(on_hand.desc(), Product.name)
     elif sort == 'price_low':
         query = query.order_by(Product.sales_price)
     elif sort == 'price_high':
@@ -807,6 +852,83 @@ def adjust_inventory(product_id):
         current_stock=product.current_stock
     )
 
+@inventory_bp.route('/transactions/import', methods=['GET', 'POST'])
+@login_required
+def import_inventory_transactions():
+    """Import inventory movements from a CSV or JSON file"""
+    if not current_user.has_permission(Role.CAN_EDIT):
+        flash('You do not have permission to adjust inventory.', 'danger')
+        return redirect(url_for('inventory.dashboard'))
+    
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('import_file')
+        if not file or file.filename == '':
+            flash('No file selected.', 'danger')
+            return redirect(request.url)
+        
+        file_format = 'json' if file.filename.lower().endswith('.json') else 'csv'
+        try:
+            rows = inventory_import.read_inventory_rows(file.read(), file_format)
+        except inventory_import.InventoryImportError as e:
+            flash(str(e), 'danger')
+            return redirect(request.url)
+        
+        try:
+            result = inventory_import.import_inventory_transactions(
+                rows,
+                created_by_id=current_user.id,
+                skip_invalid='skip_invalid' in request.form,
+                validate_only='validate_only' in request.form
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error importing inventory transactions: {str(e)}', 'danger')
+            return redirect(request.url)
+        
+        if result['imported']:
+            flash(f"Imported {result['imported']} of {result['total_rows']} rows ({result['reference']}).", 'success')
+        elif result['errors']:
+            flash(f"{len(result['errors'])} row(s) have errors; nothing was imported.", 'danger')
+        else:
+            flash(f"All {result['total_rows']} rows are valid.", 'success')
+    
+    return render_template('inventory/import_transactions.html', result=result)
+
+@inventory_bp.route('/api/transactions/import', methods=['POST'])
+@login_required
+def api_import_inventory_transactions():
+    """Batch adjustment API: import inventory movements posted as JSON"""
+    if not current_user.has_permission(Role.CAN_EDIT):
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({'success': False, 'error': 'Expected a JSON body'}), 400
+    
+    try:
+        rows = inventory_import.inventory_rows_from_json(data)
+    except inventory_import.InventoryImportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    options = data if isinstance(data, dict) else {}
+    try:
+        result = inventory_import.import_inventory_transactions(
+            rows,
+            created_by_id=current_user.id,
+            skip_invalid=bool(options.get('skip_invalid')),
+            validate_only=bool(options.get('validate_only'))
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Failed to import inventory transactions: {str(e)}'}), 500
+    
+    # Rows with errors that blocked the import are reported as unprocessable
+    success = not result['errors'] or result['imported'] > 0
+    return jsonify(dict(result, success=success)), 200 if success else 422
+
 @inventory_bp.route('/products/<int:product_id>/transactions')
 @login_required
 def product_transactions(product_id):
@@ -854,93 +976,66 @@ def product_transactions(product_id):
         transaction_type=transaction_type
     )
 
+def _stock_valuation_filters():
+    """Read the stock valuation filters shared by the report and its export"""
+    method = request.args.get('method', STANDARD)
+    if method not in VALUATION_METHODS:
+        method = STANDARD
+    
+    as_of = request.args.get('as_of')
+    as_of = datetime.strptime(as_of, '%Y-%m-%d').date() if as_of else None
+    
+    return {
+        'method': method,
+        'as_of': as_of,
+        'category_id': request.args.get('category_id'),
+        'warehouse_id': request.args.get('warehouse_id', type=int),
+        'search': request.args.get('search')
+    }
+
 @inventory_bp.route('/reports/stock-valuation')
 @login_required
 def stock_valuation_report():
     """Stock valuation report"""
     # Get filters
-    warehouse_id = request.args.get('warehouse_id')
-    category_id = request.args.get('category_id')
-    search = request.args.get('search')
+    filters = _stock_valuation_filters()
     sort = request.args.get('sort', 'name')
     
-    # Create a simple version that doesn't rely on complex SQLAlchemy case statements
-    # Get all products
-    products = Product.query.filter_by(is_active=True).all()
-    
-    # Calculate current stock and values manually
-    stock_items_data = []
+    # Value the stock with the chosen costing method
+    stock_items = []
     total_value = 0
     category_totals = {}
     warehouse_totals = {}
     
-    for product in products:
-        # Get current stock for product
-        current_stock = 0
-        transactions = InventoryTransaction.query.filter_by(product_id=product.id).all()
-        
-        for tx in transactions:
-            if tx.transaction_type == 'IN':
-                current_stock += tx.quantity
-            elif tx.transaction_type == 'OUT':
-                current_stock -= tx.quantity
-        
-        # Skip if no stock
-        if current_stock <= 0:
-            continue
-            
-        # Calculate value
-        item_value = current_stock * product.cost_price
+    for row in get_stock_valuation(**filters):
+        item_value = float(row['value'])
         total_value += item_value
         
-        # Add to stock items
-        stock_items_data.append({
-            'product': product,
-            'quantity': current_stock,
+        warehouse_name = row['location'] or 'Unassigned'
+        stock_items.append({
+            'product': row['product'],
+            'quantity': row['quantity'],
+            'unit_cost': row['unit_cost'],
             'value': item_value,
-            'warehouse': {'name': 'Main Warehouse'}  # Default warehouse
+            'warehouse': {'name': warehouse_name}
         })
         
         # Calculate category totals
-        category_name = product.category.name if product.category else 'Uncategorized'
-        if category_name not in category_totals:
-            category_totals[category_name] = 0
-        category_totals[category_name] += item_value
+        category_name = row['product'].category.name if row['product'].category else 'Uncategorized'
+        category_totals[category_name] = category_totals.get(category_name, 0) + item_value
         
         # Calculate warehouse totals
-        warehouse_name = 'Main Warehouse'  # Default for now
-        if warehouse_name not in warehouse_totals:
-            warehouse_totals[warehouse_name] = 0
-        warehouse_totals[warehouse_name] += item_value
-    
-    # Apply filters for our simplified version
-    filtered_stock_items = []
-    
-    for item in stock_items_data:
-        # Apply category filter
-        if category_id and item['product'].category_id != int(category_id):
-            continue
-            
-        # Apply search filter
-        if search and search.lower() not in item['product'].name.lower() and search.lower() not in item['product'].sku.lower():
-            continue
-            
-        filtered_stock_items.append(item)
+        warehouse_totals[warehouse_name] = warehouse_totals.get(warehouse_name, 0) + item_value
     
-    # Apply sorting
-    if sort == 'name':
-        filtered_stock_items.sort(key=lambda x: x['product'].name)
-    elif sort == 'value_high':
-        filtered_stock_items.sort(key=lambda x: x['value'], reverse=True)
+    # Apply sorting (rows arrive ordered by name)
+    if sort == 'value_high':
+        stock_items.sort(key=lambda x: x['value'], reverse=True)
     elif sort == 'value_low':
-        filtered_stock_items.sort(key=lambda x: x['value'])
+        stock_items.sort(key=lambda x: x['value'])
     elif sort == 'quantity_high':
-        filtered_stock_items.sort(key=lambda x: x['quantity'], reverse=True)
+        stock_items.sort(key=lambda x: x['quantity'], reverse=True)
     elif sort == 'quantity_low':
-        filtered_stock_items.sort(key=lambda x: x['quantity'])
-    
-    # Our simplified version already built all the data we need
-    stock_items = filtered_stock_items
+        stock_items.sort(key=lambda x: x['quantity'])
     
     # Get categories and warehouses for filter dropdowns
     categories = ProductCategory.query.order_by(ProductCategory.name).all()
@@ -958,6 +1053,9 @@ def stock_valuation_report():
         warehouses=warehouses,
         category_totals=category_totals,
         warehouse_totals=warehouse_totals,
+        valuation_methods=VALUATION_METHODS,
+        method=filters['method'],
+        as_of=filters['as_of'],
         show_by_category=True,
         show_by_warehouse=True,
         datetime_now=datetime.now()
@@ -966,17 +1064,29 @@ def stock_valuation_report():
 @inventory_bp.route('/reports/stock-valuation/export')
 @login_required
 def export_stock_valuation():
-    """Export stock valuation report to Excel"""
-    # Similar logic as stock_valuation_report but exports to Excel
-    flash('Export feature coming soon.', 'info')
-    return redirect(url_for('inventory.stock_valuation_report'))
+    """Export stock valuation report to CSV or Excel"""
+    filters = _stock_valuation_filters()
+    export_format = request.args.get('format', 'excel')
+    
+    rows = get_stock_valuation(**filters)
+    
+    return export_stock_valuation_report(
+        rows,
+        VALUATION_METHODS[filters['method']],
+        filters['as_of'] or datetime.now().date(),
+        export_format
+    )
 
 @inventory_bp.route('/reports/low-stock')
 @login_required
 def low_stock_report():
     """Low stock report"""
+    # Get filters
+    category_id = request.args.get('category_id', type=int)
+    warehouse_id = request.args.get('warehouse_id', type=int)
+    
     # Get low stock products
-    low_stock = core_utils.get_low_stock_products()
+    low_stock = core_utils.get_low_stock_products(category_id=category_id, warehouse_id=warehouse_id)
     
     # Get warehouses for filter
     warehouses = Warehouse.query.filter_by(is_active=True).order_by(Warehouse.name).all()
@@ -992,6 +1102,95 @@ def low_stock_report():
         datetime_now=datetime.now()
     )
 
+def _reorder_options():
+    """Read the reorder calculation options from the request"""
+    as_of = request.values.get('as_of')
+    return {
+        'as_of': datetime.strptime(as_of, '%Y-%m-%d').date() if as_of else None,
+        'window_days': max(request.values.get('window_days', reorder.DEFAULT_WINDOW_DAYS, type=int), 1),
+        'service_level': min(max(request.values.get('service_level', reorder.DEFAULT_SERVICE_LEVEL, type=float), 0.5), 0.999),
+        'default_lead_time': max(request.values.get('lead_time', reorder.DEFAULT_LEAD_TIME_DAYS, type=int), 0),
+        'review_days': max(request.values.get('review_days', reorder.DEFAULT_REVIEW_DAYS, type=int), 0)
+    }
+
+@inventory_bp.route('/reports/reorder-suggestions')
+@login_required
+def reorder_suggestions():
+    """Reorder suggestions from demand and lead time history"""
+    options = _reorder_options()
+    
+    suggestions = reorder.get_reorder_suggestions(**options)
+    
+    # Vendor names for grouping, in one query
+    vendor_ids = {item['preferred_vendor_id'] for item in suggestions if item['preferred_vendor_id']}
+    vendors = {}
+    if vendor_ids:
+        vendors = {vendor.id: vendor for vendor in Entity.query.filter(Entity.id.in_(vendor_ids)).all()}
+    
+    return render_template(
+        'inventory/reorder_suggestions.html',
+        suggestions=suggestions,
+        vendors=vendors,
+        options=options,
+        datetime_now=datetime.now()
+    )
+
+@inventory_bp.route('/reports/reorder-suggestions/purchase-orders', methods=['POST'])
+@login_required
+def create_reorder_purchase_orders():
+    """Create draft purchase orders for the selected reorder suggestions"""
+    if not current_user.has_permission(Role.CAN_CREATE):
+        flash('You do not have permission to create purchase orders.', 'danger')
+        return redirect(url_for('inventory.reorder_suggestions'))
+    
+    # Selected products and the quantities entered for them
+    quantities = {}
+    for product_id in request.form.getlist('product_id[]'):
+        try:
+            quantities[int(product_id)] = float(request.form.get(f'quantity_{product_id}', 0))
+        except (ValueError, TypeError):
+            continue
+    
+    if not quantities:
+        flash('Select at least one product to order.', 'warning')
+        return redirect(url_for('inventory.reorder_suggestions'))
+    
+    purchase_orders, skipped = reorder.create_draft_purchase_orders(quantities, created_by_id=current_user.id)
+    db.session.commit()
+    
+    if purchase_orders:
+        flash(f'Created {len(purchase_orders)} draft purchase order(s).', 'success')
+    if skipped:
+        flash(f"No preferred vendor for: {', '.join(product.sku for product in skipped)}", 'warning')
+    
+    if len(purchase_orders) == 1:
+        return redirect(url_for('inventory.view_purchase_order', po_id=purchase_orders[0].id))
+    return redirect(url_for('inventory.purchase_orders'))
+
+@inventory_bp.route('/reports/reorder-suggestions/reorder-levels', methods=['POST'])
+@login_required
+def apply_reorder_levels():
+    """Store the computed reorder points as product reorder levels"""
+    if not current_user.has_permission(Role.CAN_EDIT):
+        flash('You do not have permission to edit products.', 'danger')
+        return redirect(url_for('inventory.reorder_suggestions'))
+    
+    options = _reorder_options()
+    points = reorder.compute_reorder_points(**options)
+    
+    # Only products with demand get a computed level
+    levels = {
+        int(product_id): round(float(point), 2)
+        for product_id, point, demand in zip(points['product_id'], points['reorder_point'], points['daily_demand'])
+        if demand > 0
+    }
+    
+    count = reorder.update_reorder_levels(levels)
+    db.session.commit()
+    
+    flash(f'Updated reorder levels for {count} product(s).', 'success')
+    return redirect(url_for('inventory.reorder_suggestions', **request.form.to_dict()))
+
 # Purchase Orders
 @inventory_bp.route('/purchase-orders')
 @login_required
@@ -1229,4 +1428,102 @@ def view_purchase_order(po_id):
         vendor=vendor,
         warehouse=warehouse,
         status=status
-    )
\ No newline at end of file
+    )
+
+@inventory_bp.route('/purchase-orders/<int:po_id>/receive', methods=['GET', 'POST'])
+@login_required
+def receive_purchase_order(po_id):
+    """Record a receipt against a purchase order"""
+    if not current_user.has_permission(Role.CAN_EDIT):
+        flash('You do not have permission to receive purchase orders.', 'danger')
+        return redirect(url_for('inventory.view_purchase_order', po_id=po_id))
+    
+    purchase_order = PurchaseOrder.query.get_or_404(po_id)
+    items = PurchaseOrderItem.query.filter_by(po_id=po_id).order_by(PurchaseOrderItem.id).all()
+    
+    if request.method == 'POST':
+        receipt_date = request.form.get('receipt_date')
+        try:
+            receipt_date = datetime.strptime(receipt_date, '%Y-%m-%d') if receipt_date else datetime.now()
+        except ValueError:
+            flash('Invalid receipt date.', 'danger')
+            return redirect(url_for('inventory.receive_purchase_order', po_id=po_id))
+        
+        # Lines with a quantity entered
+        lines = []
+        for item in items:
+            quantity = request.form.get(f'quantity_{item.id}', '').strip()
+            if quantity and quantity not in ('0', '0.00'):
+                lines.append({'po_item_id': item.id, 'quantity': quantity})
+        
+        if not lines:
+            flash('Enter a quantity for at least one line.', 'warning')
+            return redirect(url_for('inventory.receive_purchase_order', po_id=po_id))
+        
+        result = po_receiving.receive_purchase_orders(
+            lines,
+            receipt_date=receipt_date,
+            location=request.form.get('location') or None,
+            notes=request.form.get('notes') or None,
+            created_by_id=current_user.id
+        )
+        if result['errors']:
+            for error in result['errors']:
+                flash('; '.join(error['messages']), 'danger')
+            return redirect(url_for('inventory.receive_purchase_order', po_id=po_id))
+        
+        db.session.commit()
+        flash(f"Received {result['lines']} line(s) ({result['reference']}).", 'success')
+        return redirect(url_for('inventory.view_purchase_order', po_id=po_id))
+    
+    warehouses = Warehouse.query.filter_by(is_active=True).order_by(Warehouse.name).all()
+    
+    return render_template(
+        'inventory/purchase_order_receive.html',
+        po=purchase_order,
+        items=items,
+        warehouses=warehouses,
+        today=datetime.now().strftime('%Y-%m-%d')
+    )
+
+@inventory_bp.route('/api/purchase-orders/receive', methods=['POST'])
+@login_required
+def api_receive_purchase_orders():
+    """Batch receiving API: receive a whole receipt document posted as JSON"""
+    if not current_user.has_permission(Role.CAN_EDIT):
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('lines'), list):
+        return jsonify({'success': False, 'error': 'Expected a JSON object with a "lines" list'}), 400
+    
+    try:
+        receipt_date = datetime.fromisoformat(data['receipt_date']) if data.get('receipt_date') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid receipt_date'}), 400
+    
+    try:
+        result = po_receiving.receive_purchase_orders(
+            [line for line in data['lines'] if isinstance(line, dict)],
+            receipt_date=receipt_date,
+            location=data.get('location'),
+            reference=data.get('reference'),
+            notes=data.get('notes'),
+            created_by_id=current_user.id
+        )
+        if result['errors']:
+            db.session.rollback()
+            return jsonify({'success': False, 'errors': result['errors']}), 422
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Failed to receive purchase orders: {str(e)}'}), 500
+    
+    return jsonify({
+        'success': True,
+        'reference': result['reference'],
+        'lines': result['lines'],
+        'quantity': float(result['quantity']),
+        'purchase_orders': {str(po_id): status for po_id, status in result['purchase_orders'].items()},
+        'journal_entry_id': result['journal_entry_id']
+    })
@@ -1,13 +1,13 @@
-from flask import Blueprint, render_template, request, Response, send_file
-from flask_login import login_required
+from flask import Blueprint, render_template, request, Response, send_file, jsonify
+from flask_login import login_required, current_user
 from app import db
-from models import AccountType, Account, JournalEntry, JournalItem
+from models import AccountType, Account, JournalEntry, JournalItem, Role
 from datetime import datetime, timedelta
 import pandas as pd
 import io
 import csv
 import sys, os
-from routes.exports import export_general_ledger_report
+from routes.exports import stream_general_ledger_report
 
 # Import functions from core_utils.py (renamed utils.py to avoid conflicts)
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +15,7 @@ root_dir = os.path.dirname(current_dir)
 sys.path.insert(0, root_dir)
 
 from core_utils import generate_pl_report, generate_balance_sheet, generate_general_ledger
+from utils.report_cache import cached_report, get_report_cache
 
 reports_bp = Blueprint('reports', __name__)
 
@@ -44,7 +45,11 @@ def pl():
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
     
     # Generate report
-    report_data = generate_pl_report(start_date, end_date)
+    report_data = cached_report(
+        'profit_loss',
+        {'start_date': start_date, 'end_date': end_date},
+        lambda: generate_pl_report(start_date, end_date)
+    )
     
     return render_template(
         'report_pl.html',
@@ -67,7 +72,11 @@ def balance_sheet():
         as_of_date = datetime.strptime(as_of_date, '%Y-%m-%d').date()
     
     # Generate report
-    report_data = generate_balance_sheet(as_of_date)
+    report_data = cached_report(
+        'balance_sheet',
+        {'as_of_date': as_of_date},
+        lambda: generate_balance_sheet(as_of_date)
+    )
     
     return render_template(
         'report_balance_sheet.html',
@@ -107,12 +116,22 @@ def custom_report():
     report_data = None
     if request.args:  # Only generate report if filters are submitted
         if report_type == 'general_ledger':
-            report_data = generate_general_ledger(
-                start_date, 
-                end_date, 
-                account_ids, 
-                account_type_ids,
-                include_unposted
+            report_data = cached_report(
+                'general_ledger',
+                {
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'account_ids': account_ids,
+                    'account_type_ids': account_type_ids,
+                    'include_unposted': include_unposted
+                },
+                lambda: generate_general_ledger(
+                    start_date, 
+                    end_date, 
+                    account_ids, 
+                    account_type_ids,
+                    include_unposted
+                )
             )
     
     return render_template(
@@ -154,7 +173,11 @@ def export_report():
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
         # Generate P&L report
-        report_data = generate_pl_report(start_date, end_date)
+        report_data = cached_report(
+            'profit_loss',
+            {'start_date': start_date, 'end_date': end_date},
+            lambda: generate_pl_report(start_date, end_date)
+        )
         return export_pl_report(report_data, export_format)
     
     elif report_type == 'bs':
@@ -168,7 +191,11 @@ def export_report():
             as_of_date = datetime.strptime(as_of_date, '%Y-%m-%d').date()
         
         # Generate Balance Sheet report
-        report_data = generate_balance_sheet(as_of_date)
+        report_data = cached_report(
+            'balance_sheet',
+            {'as_of_date': as_of_date},
+            lambda: generate_balance_sheet(as_of_date)
+        )
         return export_balance_sheet_report(report_data, export_format)
     
     elif report_type == 'custom':
@@ -193,14 +220,15 @@ def export_report():
         
         # Generate report based on type
         if custom_report_type == 'general_ledger':
-            report_data = generate_general_ledger(
+            # Stream the ledger straight from the database
+            return stream_general_ledger_report(
                 start_date, 
                 end_date, 
                 account_ids, 
                 account_type_ids,
-                include_unposted
+                include_unposted,
+                export_format
             )
-            return export_general_ledger_report(report_data, export_format)
         
         # Add more custom report types here as needed
         
@@ -464,4 +492,27 @@ def export_balance_sheet_report(report_data, format='csv'):
     
     # Default to PDF (requires additional packages like weasyprint)
     else:
-        return "Export format not supported", 400
\ No newline at end of file
+        return "Export format not supported", 400
+
+
+@reports_bp.route('/reports/api/cache')
+@login_required
+def api_cache_stats():
+    """Report cache stats of the worker serving the request (all workers for the sqlite backend)"""
+    if not current_user.has_permission(Role.CAN_ADMIN):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    cache = get_report_cache()
+    return jsonify({'success': True, 'shared': cache.shared, 'stats': cache.stats()})
+
+
+@reports_bp.route('/reports/api/cache/clear', methods=['POST'])
+@login_required
+def api_clear_cache():
+    """Clear the report cache (only this worker's for the memory backend)"""
+    if not current_user.has_permission(Role.CAN_ADMIN):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    cache = get_report_cache()
+    cache.clear()
+    return jsonify({'success': True, 'shared': cache.shared})
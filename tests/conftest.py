@@ -0,0 +1,177 @@
+"""
+Shared pytest fixtures
+
+The app runs against a throwaway SQLite database that is initialized the same
+way as `flask riska init-db` and seeded with a small posted ledger.
+"""
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+# Point the app at a temporary database before it is imported
+_db_dir = tempfile.mkdtemp(prefix='riska-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault('REPORT_CACHE_BACKEND', 'none')
+
+from app import app as flask_app, db  # noqa: E402
+from utils.query_counter import assert_max_queries  # noqa: E402
+
+
+def seed_ledger():
+    """Create account types, a few accounts and posted journal entries"""
+    from models import Account, AccountType, JournalEntry, JournalItem, User
+
+    types = {}
+    for name in (AccountType.ASSET, AccountType.LIABILITY, AccountType.EQUITY,
+                 AccountType.REVENUE, AccountType.EXPENSE):
+        types[name] = AccountType(name=name)
+    db.session.add_all(types.values())
+
+    cash = Account(code='1000', name='Cash', account_type=types[AccountType.ASSET])
+    capital = Account(code='3000', name='Capital', account_type=types[AccountType.EQUITY])
+    sales = Account(code='4000', name='Sales', account_type=types[AccountType.REVENUE])
+    rent = Account(code='5000', name='Rent', account_type=types[AccountType.EXPENSE])
+    db.session.add_all([cash, capital, sales, rent])
+
+    admin = User.query.filter_by(username='admin').first()
+    today = date.today()
+    for offset in range(30):
+        entry = JournalEntry(
+            entry_date=today - timedelta(days=offset * 7),
+            reference=f"T-{offset}",
+            description='Test entry',
+            is_posted=True,
+            created_by=admin
+        )
+        amount = Decimal(100 + offset)
+        credit_account = sales if offset % 3 else capital
+        entry.items = [
+            JournalItem(account=cash, debit_amount=amount, credit_amount=0),
+            JournalItem(account=credit_account, debit_amount=0, credit_amount=amount),
+        ]
+        db.session.add(entry)
+
+        expense = JournalEntry(
+            entry_date=today - timedelta(days=offset * 7 + 1),
+            reference=f"R-{offset}",
+            description='Rent',
+            is_posted=True,
+            created_by=admin
+        )
+        expense.items = [
+            JournalItem(account=rent, debit_amount=Decimal(40), credit_amount=0),
+            JournalItem(account=cash, debit_amount=0, credit_amount=Decimal(40)),
+        ]
+        db.session.add(expense)
+
+    db.session.commit()
+
+
+@pytest.fixture(scope='session')
+def app():
+    from click.testing import CliRunner
+    from commands import init_db_command
+
+    flask_app.config.update(TESTING=True)
+    with flask_app.app_context():
+        result = CliRunner().invoke(init_db_command, [], catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        seed_ledger()
+        yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as the default admin"""
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'adminpassword'})
+    assert response.status_code in (200, 302)
+    return client
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Assert a query budget for a block:
+
+        with query_budget(10, max_repeats=3):
+            client.get('/dashboard')
+    """
+    return assert_max_queries
+
+
+def create_bank_statement(transactions=(), entries=(), start_date=date(2020, 3, 1), end_date=date(2020, 3, 31)):
+    """
+    A bank statement on a GL account of its own, with bank transactions and
+    posted journal entries on that account.
+
+    `transactions` are (date, 'credit'/'debit', amount, description,
+    reference) and `entries` (date, 'credit'/'debit', amount, reference), the
+    side being the bank GL line's. Returns (statement, transaction ids,
+    entry ids).
+    """
+    from models import Account, AccountType, BankAccount, BankStatement, BankTransaction, JournalEntry, JournalItem
+
+    number = BankAccount.query.count() + 1
+    asset = AccountType.query.filter_by(name=AccountType.ASSET).one()
+    offset = Account.query.filter_by(code='3000').one()
+    gl_account = Account(code=f"1{number:03d}B", name=f"Bank {number}", account_type=asset)
+    bank_account = BankAccount(name=f"Bank {number}", account_number=f"ACCT-{number}", gl_account=gl_account)
+    statement = BankStatement(
+        bank_account=bank_account, statement_date=end_date, start_date=start_date, end_date=end_date,
+        beginning_balance=0, ending_balance=0
+    )
+    bank_transactions = [
+        BankTransaction(
+            statement=statement, transaction_date=transaction_date, transaction_type=side,
+            amount=Decimal(str(amount)), description=description, reference=reference, is_reconciled=False
+        )
+        for transaction_date, side, amount, description, reference in transactions
+    ]
+    journal_entries = []
+    for entry_date, side, amount, reference in entries:
+        amount = Decimal(str(amount))
+        bank_line = JournalItem(account=gl_account, debit_amount=amount if side == 'debit' else 0,
+                                credit_amount=amount if side == 'credit' else 0)
+        offset_line = JournalItem(account=offset, debit_amount=amount if side == 'credit' else 0,
+                                  credit_amount=amount if side == 'debit' else 0)
+        journal_entries.append(JournalEntry(
+            entry_date=entry_date, reference=reference, description=f"Entry {reference}", is_posted=True,
+            items=[bank_line, offset_line]
+        ))
+    db.session.add_all([statement, *bank_transactions, *journal_entries])
+    db.session.commit()
+    return statement, [transaction.id for transaction in bank_transactions], [entry.id for entry in journal_entries]
+
+
+@pytest.fixture
+def bank_statement(app):
+    """Factory for a bank statement with transactions and ledger entries (see create_bank_statement)"""
+    return create_bank_statement
+
+
+def create_product(sku, cost_price=0):
+    """An active product valued on the seeded cash account"""
+    from models import Account, Product, UnitOfMeasure
+
+    uom = UnitOfMeasure.query.filter_by(abbreviation='ea').first()
+    if uom is None:
+        uom = UnitOfMeasure(name='Each', abbreviation='ea')
+        db.session.add(uom)
+        db.session.flush()
+    product = Product(
+        sku=sku, name=f"Product {sku}", uom_id=uom.id, cost_price=Decimal(str(cost_price)),
+        asset_account_id=Account.query.filter_by(code='1000').one().id
+    )
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+@pytest.fixture
+def product_factory(app):
+    """Factory for products (see create_product)"""
+    return create_product
@@ -0,0 +1,55 @@
+"""
+Materialized account balances kept by the flush listeners
+"""
+from datetime import date
+from decimal import Decimal
+
+
+def _period_balances():
+    from models import AccountPeriodBalance
+
+    return {
+        (row.account_id, row.year, row.month): (row.debit_total, row.credit_total)
+        for row in AccountPeriodBalance.query
+        if row.debit_total or row.credit_total
+    }
+
+
+def _posted_entry(entry_date, amount, debit_account, credit_account):
+    from app import db
+    from models import JournalEntry, JournalItem
+
+    entry = JournalEntry(entry_date=entry_date, reference='BAL', description='Balance test', is_posted=True)
+    entry.items = [
+        JournalItem(account=debit_account, debit_amount=amount, credit_amount=0),
+        JournalItem(account=credit_account, debit_amount=0, credit_amount=amount),
+    ]
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+def test_changes_after_commit_match_rebuild(app):
+    from app import db
+    from models import Account
+    from utils.balances import rebuild_account_period_balances
+
+    cash = Account.query.filter_by(code='1000').one()
+    sales = Account.query.filter_by(code='4000').one()
+    rent = Account.query.filter_by(code='5000').one()
+    redated = _posted_entry(date(2019, 1, 15), Decimal('120.00'), cash, sales)
+    unposted = _posted_entry(date(2019, 2, 15), Decimal('80.00'), rent, cash)
+    edited = _posted_entry(date(2019, 3, 15), Decimal('50.00'), rent, cash)
+
+    # The commits expired every attribute, so nothing old is in the history
+    redated.entry_date = date(2019, 4, 1)
+    unposted.is_posted = False
+    edited.items[0].account_id = sales.id
+    edited.items[0].debit_amount = Decimal('55.00')
+    edited.items[1].credit_amount = Decimal('55.00')
+    db.session.commit()
+
+    maintained = _period_balances()
+    rebuild_account_period_balances()
+    assert maintained == _period_balances()
+    assert (cash.id, 2019, 1) not in maintained
@@ -0,0 +1,121 @@
+"""
+Many-to-one bank matching: subset search, coincidence cut-off, confirmation
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import combinations
+
+from utils.bank_group_matching import find_subset
+
+
+def _brute_force(candidates, target, max_lines, tolerance):
+    """Fewest lines, then fewest total days, over every non-empty subset"""
+    best = None
+    for size in range(1, min(len(candidates), max_lines) + 1):
+        for positions in combinations(range(len(candidates)), size):
+            if abs(sum(candidates[position][0] for position in positions) - target) > tolerance:
+                continue
+            key = (size, sum(candidates[position][1] for position in positions))
+            if best is None or key < best:
+                best = key
+        if best is not None:
+            return best
+    return None
+
+
+def test_find_subset_matches_brute_force():
+    import random
+
+    rng = random.Random(5)
+    for _ in range(300):
+        # Few distinct amounts, so that many subsets share a total
+        candidates = [(rng.randint(1, 12) * 25, rng.randint(0, 7)) for _ in range(rng.randint(2, 14))]
+        target = sum(cents for cents, _ in rng.sample(candidates, rng.randint(2, len(candidates))))
+        target += rng.choice((0, 0, 1, 3))
+
+        positions = find_subset(candidates, target, max_lines=6, tolerance=1)
+        expected = _brute_force(candidates, target, 6, 1)
+        if expected is None:
+            assert positions is None
+            continue
+        assert abs(sum(candidates[position][0] for position in positions) - target) <= 1
+        assert (len(positions), sum(candidates[position][1] for position in positions)) == expected
+
+
+def test_group_and_single_matches_are_proposed(bank_statement):
+    from utils.bank_group_matching import propose_group_matches
+    from utils.bank_matching import propose_matches
+
+    statement, (single, deposit), (entry, first, second, unrelated) = bank_statement(
+        transactions=[
+            (date(2020, 3, 5), 'credit', '100.00', 'Payment', 'INV-1'),
+            (date(2020, 3, 12), 'credit', '325.50', 'Deposit', ''),
+        ],
+        entries=[
+            (date(2020, 3, 5), 'credit', '100.00', 'INV-1'),
+            (date(2020, 3, 10), 'credit', '200.25', 'R-1'),
+            (date(2020, 3, 11), 'credit', '125.25', 'R-2'),
+            (date(2020, 3, 12), 'credit', '80.00', 'R-3'),
+        ]
+    )
+
+    proposals = propose_matches(statement)
+    assert [(proposal['transaction_id'], proposal['entry_id']) for proposal in proposals] == [(single, entry)]
+
+    groups = propose_group_matches(
+        statement,
+        exclude_transactions={proposal['transaction_id'] for proposal in proposals},
+        exclude_entries={proposal['entry_id'] for proposal in proposals}
+    )
+    assert len(groups) == 1
+    assert groups[0]['transaction_id'] == deposit
+    assert [group_entry['entry_id'] for group_entry in groups[0]['entries']] == [first, second]
+    assert unrelated not in [group_entry['entry_id'] for group_entry in groups[0]['entries']]
+
+
+def test_groups_likely_by_coincidence_are_not_proposed(bank_statement):
+    from utils.bank_group_matching import propose_group_matches
+
+    # Two small lines add up to the deposit, but so would many other pairs
+    entries = [(date(2020, 3, 10), 'credit', '0.50', 'R-1'), (date(2020, 3, 10), 'credit', '1.00', 'R-2')]
+    statement, _, _ = bank_statement(
+        transactions=[(date(2020, 3, 10), 'credit', '1.50', 'Deposit', '')],
+        entries=entries
+    )
+    assert len(propose_group_matches(statement)) == 1
+
+    busy_statement, _, _ = bank_statement(
+        transactions=[(date(2020, 3, 10), 'credit', '1.50', 'Deposit', '')],
+        entries=entries + [
+            (date(2020, 3, 10) + timedelta(days=day % 5), 'credit', f"0.{day + 10}", f"N-{day}")
+            for day in range(18)
+        ]
+    )
+    assert propose_group_matches(busy_statement) == []
+
+
+def test_confirm_group_matches_checks_the_total(bank_statement):
+    from app import db
+    from models import BankTransaction, BankTransactionMatch
+    from utils.bank_group_matching import confirm_group_matches
+
+    statement, (deposit,), (first, second, third) = bank_statement(
+        transactions=[(date(2020, 3, 12), 'credit', '300.00', 'Deposit', '')],
+        entries=[
+            (date(2020, 3, 10), 'credit', '200.00', 'R-1'),
+            (date(2020, 3, 11), 'credit', '100.00', 'R-2'),
+            (date(2020, 3, 11), 'credit', '90.00', 'R-3'),
+        ]
+    )
+
+    result = confirm_group_matches(statement, [(deposit, [first, third])])
+    assert result['matched'] == 0
+    assert 'total' in result['errors'][0]
+
+    result = confirm_group_matches(statement, [(deposit, [first, second])])
+    db.session.commit()
+    assert result['matched'] == 1
+    assert db.session.get(BankTransaction, deposit).is_reconciled
+    assert {
+        (match.journal_entry_id, match.amount) for match in BankTransactionMatch.query.filter_by(bank_transaction_id=deposit)
+    } == {(first, Decimal('200.00')), (second, Decimal('100.00'))}
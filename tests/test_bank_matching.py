@@ -0,0 +1,76 @@
+"""
+Bank-to-ledger auto-matching: scoring, greedy and optimal assignment
+"""
+from datetime import date
+
+from utils.bank_matching import GREEDY, OPTIMAL
+
+
+def _pairs(proposals):
+    return sorted((proposal['transaction_id'], proposal['entry_id']) for proposal in proposals)
+
+
+def test_optimal_assignment_matches_what_greedy_leaves_out(bank_statement):
+    from utils.bank_matching import propose_matches
+
+    # The closest pair takes the only entry the later transaction can reach
+    statement, (first, second), (near, early) = bank_statement(
+        transactions=[
+            (date(2020, 3, 10), 'credit', '100.00', 'Payment', ''),
+            (date(2020, 3, 17), 'credit', '100.00', 'Payment', ''),
+        ],
+        entries=[
+            (date(2020, 3, 11), 'credit', '100.00', 'A'),
+            (date(2020, 3, 5), 'credit', '100.00', 'B'),
+        ]
+    )
+
+    assert _pairs(propose_matches(statement, assignment=GREEDY)) == [(first, near)]
+    assert _pairs(propose_matches(statement, assignment=OPTIMAL)) == [(first, early), (second, near)]
+
+
+def test_one_to_one_match_is_proposed_and_confirmed(bank_statement):
+    from app import db
+    from models import BankTransaction
+    from utils.bank_matching import confirm_matches, propose_matches
+
+    statement, (payment, refund), (entry, other_side, off_by_two) = bank_statement(
+        transactions=[
+            (date(2020, 3, 5), 'credit', '250.00', 'Customer payment', 'INV-77'),
+            (date(2020, 3, 20), 'debit', '40.00', 'Refund', ''),
+        ],
+        entries=[
+            (date(2020, 3, 4), 'credit', '250.00', 'INV-77'),
+            (date(2020, 3, 5), 'debit', '250.00', 'X-1'),
+            (date(2020, 3, 20), 'debit', '40.02', 'X-2'),
+        ]
+    )
+
+    proposals = propose_matches(statement)
+    assert _pairs(proposals) == [(payment, entry)]
+    assert proposals[0]['selected']
+
+    result = confirm_matches(statement, [(payment, entry), (refund, off_by_two), (refund, other_side)])
+    db.session.commit()
+    assert result['matched'] == 1
+    assert len(result['errors']) == 2
+    assert db.session.get(BankTransaction, payment).gl_entry_id == entry
+    assert propose_matches(statement) == []
+
+
+def test_amounts_within_tolerance_score_lower(bank_statement):
+    from utils.bank_matching import propose_matches
+
+    statement, _, (exact, cent_off) = bank_statement(
+        transactions=[
+            (date(2020, 3, 5), 'credit', '10.00', 'Payment', ''),
+            (date(2020, 3, 25), 'credit', '20.00', 'Payment', ''),
+        ],
+        entries=[
+            (date(2020, 3, 5), 'credit', '10.00', 'A'),
+            (date(2020, 3, 25), 'credit', '20.01', 'B'),
+        ]
+    )
+
+    scores = {proposal['entry_id']: proposal['score'] for proposal in propose_matches(statement)}
+    assert scores[exact] > scores[cent_off] > 0
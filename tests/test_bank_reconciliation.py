@@ -0,0 +1,70 @@
+"""
+Bank reconciliation auto-match routes
+"""
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def deposit_statement(bank_statement):
+    """One transaction with a single matching entry and a deposit covering two entries"""
+    return bank_statement(
+        transactions=[
+            (date(2020, 3, 5), 'credit', '100.00', 'Customer payment', 'INV-1'),
+            (date(2020, 3, 10), 'credit', '350.00', 'Deposit', 'DEP-1'),
+        ],
+        entries=[
+            (date(2020, 3, 5), 'credit', '100.00', 'INV-1'),
+            (date(2020, 3, 9), 'credit', '200.00', 'RCPT-1'),
+            (date(2020, 3, 10), 'credit', '150.00', 'RCPT-2'),
+        ]
+    )
+
+
+def test_auto_match_page(client, deposit_statement):
+    statement, _, _ = deposit_statement
+
+    response = client.get(f'/banking/statements/{statement.id}/auto-match')
+
+    assert response.status_code == 200
+    assert b'RCPT-1' in response.data
+
+
+def test_api_auto_match_confirms_listed_groups_only(app, client, deposit_statement):
+    from app import db
+    from models import BankTransaction, BankTransactionMatch
+
+    statement, (single_id, deposit_id), (entry_id, *group_entry_ids) = deposit_statement
+    url = f'/banking/api/statements/{statement.id}/auto-match'
+
+    response = client.post(url, json={'groups': True, 'confirm': True})
+    assert response.status_code == 200
+    assert [group['transaction_id'] for group in response.json['groups']] == [deposit_id]
+    assert response.json['matched'] == 1
+    db.session.expire_all()
+    assert db.session.get(BankTransaction, single_id).gl_entry_id == entry_id
+    assert not db.session.get(BankTransaction, deposit_id).is_reconciled
+
+    response = client.post(url, json={
+        'confirm': True,
+        'confirm_groups': [{'transaction_id': deposit_id, 'entry_ids': group_entry_ids}]
+    })
+    assert response.status_code == 200
+    assert response.json['matched'] == 1
+    db.session.expire_all()
+    assert db.session.get(BankTransaction, deposit_id).is_reconciled
+    assert sorted(
+        match.journal_entry_id for match in BankTransactionMatch.query.filter_by(bank_transaction_id=deposit_id)
+    ) == sorted(group_entry_ids)
+
+
+def test_api_auto_match_rejects_malformed_groups(client, deposit_statement):
+    statement, (_, deposit_id), _ = deposit_statement
+
+    response = client.post(f'/banking/api/statements/{statement.id}/auto-match', json={
+        'confirm': True, 'confirm_groups': [{'transaction_id': deposit_id}]
+    })
+
+    assert response.status_code == 400
+    assert 'confirm_groups' in response.json['message']
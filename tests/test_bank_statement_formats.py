@@ -0,0 +1,169 @@
+"""
+OFX/QFX and CAMT.053 statement parsing and import
+"""
+import io
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from utils import bank_statement_formats as formats
+
+OFX_SGML = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+ENCODING:UTF-8
+CHARSET:NONE
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>EUR
+<BANKTRANLIST><DTSTART>20240101<DTEND>20240131120000[-5:EST]
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240105120000.000
+<TRNAMT>1250.00
+<FITID>F1
+<NAME>Café &amp; Co
+<MEMO>Invoice 17
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240110<TRNAMT>-75.5<FITID>F2<CHECKNUM>1001<NAME>Rent</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>bad<TRNAMT>-1<FITID>F3</STMTTRN>
+</BANKTRANLIST>
+<LEDGERBAL><BALAMT>2000.00<DTASOF>20240131</LEDGERBAL>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+""".encode('utf-8')
+
+OFX_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<?OFX OFXHEADER="200" VERSION="220"?>
+<OFX><CREDITCARDMSGSRSV1><CCSTMTTRNRS><CCSTMTRS>
+<BANKTRANLIST><DTSTART>20240301</DTSTART><DTEND>20240331</DTEND>
+<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20240302</DTPOSTED><TRNAMT>-19.99</TRNAMT><FITID>X1</FITID>
+<NAME>Books &amp; More</NAME><MEMO>Books &amp; More</MEMO></STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTUSER>20240315</DTUSER><TRNAMT>5.00</TRNAMT><FITID>X2</FITID>
+<MEMO>Cashback</MEMO></STMTTRN>
+</BANKTRANLIST>
+<LEDGERBAL><BALAMT>-314.99</BALAMT><DTASOF>20240330</DTASOF></LEDGERBAL>
+</CCSTMTRS></CCSTMTTRNRS></CREDITCARDMSGSRSV1></OFX>
+"""
+
+CAMT053 = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.08"><BkToCstmrStmt>
+<GrpHdr><MsgId>M1</MsgId></GrpHdr>
+<Stmt><Id>S1</Id><FrToDt><FrDtTm>2024-02-01T00:00:00</FrDtTm><ToDtTm>2024-02-29T23:59:59</ToDtTm></FrToDt>
+<Bal><Tp><CdOrPrtry><Cd>OPBD</Cd></CdOrPrtry></Tp><Amt Ccy="EUR">100.00</Amt><CdtDbtInd>DBIT</CdtDbtInd>
+<Dt><Dt>2024-02-01</Dt></Dt></Bal>
+<Bal><Tp><CdOrPrtry><Cd>CLBD</Cd></CdOrPrtry></Tp><Amt Ccy="EUR">150.25</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+<Dt><Dt>2024-02-29</Dt></Dt></Bal>
+<Ntry><NtryRef>N1</NtryRef><Amt Ccy="EUR">300.25</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+<BookgDt><Dt>2024-02-03</Dt></BookgDt><ValDt><Dt>2024-02-05</Dt></ValDt><AcctSvcrRef>A1</AcctSvcrRef>
+<NtryDtls><TxDtls><RltdPties><Dbtr><Pty><Nm>ACME Ltd</Nm></Pty></Dbtr><Cdtr><Pty><Nm>Us</Nm></Pty></Cdtr></RltdPties>
+<RmtInf><Ustrd>INV 9</Ustrd><Ustrd>part 2</Ustrd></RmtInf></TxDtls></NtryDtls></Ntry>
+<Ntry><NtryRef>N2</NtryRef><Amt Ccy="EUR">50.00</Amt><CdtDbtInd>DBIT</CdtDbtInd>
+<ValDt><DtTm>2024-02-10T08:00:00</DtTm></ValDt><AddtlNtryInf>Card fee</AddtlNtryInf></Ntry>
+</Stmt></BkToCstmrStmt></Document>
+"""
+
+SGML_ROWS = [
+    (date(2024, 1, 5), 'Café & Co Invoice 17', 'F1', 125000),
+    (date(2024, 1, 10), 'Rent', '1001', -7550),
+]
+
+
+def _parse(statement_format, content):
+    parser = formats.PARSERS[statement_format](io.BytesIO(content))
+    return parser, list(parser)
+
+
+@pytest.mark.parametrize('content,filename,expected', [
+    (OFX_SGML, 'statement.txt', formats.OFX),
+    (OFX_XML, 'statement.xml', formats.OFX),
+    (CAMT053, 'statement.txt', formats.CAMT053),
+    (b'Date,Amount\n2024-01-01,1.00\n', 'statement.qfx', formats.OFX),
+    (b'Date,Amount\n2024-01-01,1.00\n', 'statement.csv', formats.CSV),
+])
+def test_detect_statement_format(content, filename, expected):
+    assert formats.detect_statement_format(io.BytesIO(content), filename) == expected
+
+
+def test_ofx_sgml():
+    parser, rows = _parse(formats.OFX, OFX_SGML)
+
+    assert rows == SGML_ROWS
+    assert (parser.skipped, len(parser.errors)) == (1, 1)
+    assert (parser.start_date, parser.end_date, parser.statement_date) == (
+        date(2024, 1, 1), date(2024, 1, 31), date(2024, 1, 31)
+    )
+    assert parser.closing_cents == 200000
+    assert parser.opening_cents == 200000 - (125000 - 7550)
+
+
+def test_ofx_sgml_across_block_boundaries(monkeypatch):
+    # Tags, values and the two-byte "é" split at every possible place
+    monkeypatch.setattr(formats, '_SNIFF_SIZE', 80)
+    for block_size in range(1, 64):
+        monkeypatch.setattr(formats, 'READ_BLOCK_SIZE', block_size)
+        parser, rows = _parse(formats.OFX, OFX_SGML)
+        assert rows == SGML_ROWS, block_size
+        assert parser.closing_cents == 200000, block_size
+
+
+def test_ofx_xml(monkeypatch):
+    monkeypatch.setattr(formats, 'READ_BLOCK_SIZE', 7)
+    parser, rows = _parse(formats.OFX, OFX_XML)
+
+    assert rows == [
+        (date(2024, 3, 2), 'Books & More', 'X1', -1999),
+        (date(2024, 3, 15), 'Cashback', 'X2', 500),
+    ]
+    assert (parser.start_date, parser.end_date, parser.statement_date) == (
+        date(2024, 3, 1), date(2024, 3, 31), date(2024, 3, 30)
+    )
+    assert (parser.opening_cents, parser.closing_cents) == (-31499 + 1499, -31499)
+
+
+def test_camt053_signs_and_balances():
+    parser, rows = _parse(formats.CAMT053, CAMT053)
+
+    assert rows == [
+        (date(2024, 2, 3), 'ACME Ltd INV 9 part 2', 'A1', 30025),
+        (date(2024, 2, 10), 'Card fee', 'N2', -5000),
+    ]
+    assert (parser.opening_cents, parser.closing_cents) == (-10000, 15025)
+    assert (parser.start_date, parser.end_date, parser.statement_date) == (
+        date(2024, 2, 1), date(2024, 2, 29), date(2024, 2, 29)
+    )
+
+
+def test_import_fills_an_empty_statement_and_skips_reuploads(bank_statement):
+    from app import db
+
+    statement, _, _ = bank_statement(start_date=date(2024, 1, 1), end_date=date(2024, 1, 15))
+
+    result = formats.import_statement_file(statement.id, io.BytesIO(OFX_SGML), formats.OFX, chunk_size=1)
+    db.session.commit()
+    assert (result['imported'], result['duplicates'], result['skipped']) == (2, 0, 1)
+    assert (statement.end_date, statement.beginning_balance, statement.ending_balance) == (
+        date(2024, 1, 31), Decimal('825.50'), Decimal('2000.00')
+    )
+
+    result = formats.import_statement_file(statement.id, io.BytesIO(OFX_SGML), formats.OFX)
+    assert result['previous_import'] is not None
+    assert result['imported'] == 0
+
+
+def test_import_keeps_balances_of_a_statement_with_transactions(bank_statement):
+    from app import db
+
+    statement, _, _ = bank_statement(
+        transactions=[(date(2023, 12, 20), 'credit', '10.00', 'Earlier', 'E-1')],
+        start_date=date(2023, 12, 1), end_date=date(2023, 12, 31)
+    )
+
+    result = formats.import_statement_file(statement.id, io.BytesIO(CAMT053), formats.CAMT053)
+    db.session.commit()
+    assert result['imported'] == 2
+    assert result['statement_fields'] == ['end_date']
+    assert sorted(result['skipped_fields']) == ['beginning_balance', 'ending_balance', 'statement_date']
+    assert (statement.start_date, statement.end_date, statement.ending_balance) == (
+        date(2023, 12, 1), date(2024, 2, 29), Decimal('0.00')
+    )
@@ -0,0 +1,17 @@
+"""
+flask riska CLI commands
+"""
+from sqlalchemy import text
+
+
+def test_optimize_db_analyzes_sqlite(app):
+    from click.testing import CliRunner
+
+    from app import db
+    from commands import optimize_db_command
+
+    result = CliRunner().invoke(optimize_db_command, [], catch_exceptions=False)
+
+    assert result.exit_code == 0, result.output
+    # ANALYZE stores the planner statistics in sqlite_stat1
+    assert db.session.execute(text("SELECT count(*) FROM sqlite_stat1")).scalar() > 0
@@ -0,0 +1,198 @@
+"""
+Query budgets for the main pages
+
+Budgets are set a little above the current counts so that a new lazy load
+inside a loop (N+1) fails here instead of surfacing in production.
+"""
+import pytest
+
+from utils.query_counter import count_queries, fingerprint
+
+# (route, max queries, max times one statement shape may repeat)
+ROUTE_BUDGETS = [
+    ('/dashboard', 8, 2),
+    ('/reports/profit-loss', 5, 2),
+    ('/reports/balance-sheet', 5, 2),
+    ('/reports/custom?report_type=general_ledger', 8, 2),
+    ('/budgeting/reports/variance', 5, 2),
+]
+
+
+@pytest.mark.parametrize('route,max_queries,max_repeats', ROUTE_BUDGETS)
+def test_route_query_budget(client, query_budget, route, max_queries, max_repeats):
+    with query_budget(max_queries, max_repeats=max_repeats):
+        response = client.get(route)
+    assert response.status_code == 200
+
+
+def test_fingerprint_ignores_literals():
+    first = fingerprint("SELECT * FROM account WHERE id = 1 AND code IN (?, ?, ?)")
+    second = fingerprint("SELECT *  FROM account\nWHERE id = 42 AND code IN (?)")
+    assert first == second
+
+
+def test_count_queries_counts_nested_blocks(app):
+    from app import db
+    from models import Account
+
+    with count_queries() as outer:
+        Account.query.first()
+        with count_queries() as inner:
+            Account.query.first()
+
+    assert inner.count == 1
+    assert outer.count == 2
+    assert not outer.repeated(threshold=3)
+    db.session.rollback()
+
+
+def _purchase_order(line_count):
+    """An approved purchase order with `line_count` lines of distinct products"""
+    from app import db
+    from datetime import date
+    from models import (
+        Account, AccountType, Entity, EntityType, InventoryTransactionType, Product, PurchaseOrder,
+        PurchaseOrderItem, PurchaseOrderStatus, UnitOfMeasure, Warehouse
+    )
+
+    def get_or_create(model, **fields):
+        instance = model.query.filter_by(**fields).first()
+        if instance is None:
+            instance = model(**fields)
+            db.session.add(instance)
+        return instance
+
+    # Looked up or created on first use by receiving; create them up front
+    # so every receipt below runs the same statements
+    statuses = {
+        name: get_or_create(PurchaseOrderStatus, name=name)
+        for name in (PurchaseOrderStatus.APPROVED, PurchaseOrderStatus.PARTIALLY_RECEIVED,
+                     PurchaseOrderStatus.RECEIVED)
+    }
+    get_or_create(InventoryTransactionType, name=InventoryTransactionType.PURCHASE)
+    liability = AccountType.query.filter_by(name=AccountType.LIABILITY).one()
+    if not Account.query.filter_by(name='Accounts Payable').first():
+        db.session.add(Account(code='2000', name='Accounts Payable', account_type=liability))
+    inventory = Account.query.filter_by(code='1000').one()
+
+    uom = get_or_create(UnitOfMeasure, name='Each', abbreviation='ea')
+    vendor_type = get_or_create(EntityType, name=EntityType.VENDOR)
+    db.session.flush()
+    vendor = get_or_create(Entity, name='Budget Vendor', entity_type_id=vendor_type.id)
+    warehouse = get_or_create(Warehouse, name='Budget Warehouse', code='BUDGET')
+    db.session.flush()
+
+    order = PurchaseOrder(
+        po_number=f"PO-BUDGET-{line_count}",
+        vendor_id=vendor.id,
+        order_date=date.today(),
+        status_id=statuses[PurchaseOrderStatus.APPROVED].id,
+        warehouse_id=warehouse.id
+    )
+    for number in range(line_count):
+        product = Product(
+            sku=f"BUDGET-{line_count}-{number}", name=f"Budget product {number}", uom_id=uom.id,
+            asset_account_id=inventory.id
+        )
+        order.items.append(PurchaseOrderItem(
+            product=product, description=product.name, quantity_ordered=10, unit_price=5
+        ))
+    db.session.add(order)
+    db.session.commit()
+    return order
+
+
+@pytest.mark.parametrize('line_count', [5, 200])
+def test_receive_purchase_orders_query_budget(app, query_budget, line_count):
+    from app import db
+    from utils.po_receiving import receive_purchase_orders
+
+    order = _purchase_order(line_count)
+    lines = [{'po_item_id': item.id, 'quantity': 4} for item in order.items]
+
+    # The same budget for any number of lines
+    with query_budget(16, max_repeats=2):
+        result = receive_purchase_orders(lines)
+
+    assert not result['errors']
+    assert result['lines'] == line_count
+    db.session.rollback()
+
+
+def _bank_statement():
+    from app import db
+    from datetime import date
+    from models import Account, BankAccount, BankStatement
+
+    bank_account = BankAccount(
+        name='Budget Bank', account_number='000-BUDGET', gl_account_id=Account.query.filter_by(code='1000').one().id
+    )
+    db.session.add(bank_account)
+    db.session.flush()
+    statement = BankStatement(
+        bank_account_id=bank_account.id, statement_date=date(2026, 1, 31), start_date=date(2026, 1, 1),
+        end_date=date(2026, 1, 31), beginning_balance=0, ending_balance=0
+    )
+    db.session.add(statement)
+    db.session.commit()
+    return statement
+
+
+def _statement_csv(rows):
+    lines = ['Date,Description,Amount,Reference']
+    lines += [f"2026-01-{row % 28 + 1:02d},Payee {row},{row % 7 - 3}.{row % 100:02d},REF-{row}" for row in rows]
+    return '\n'.join(lines).encode()
+
+
+def _import_csv(statement, content):
+    from utils.bank_import import import_statement_csv
+
+    return import_statement_csv(statement.id, content, 'Date', 'Description', 'Amount', 'Reference')
+
+
+@pytest.mark.parametrize('row_count', [10, 2000])
+def test_statement_csv_import_query_budget(app, query_budget, row_count):
+    from app import db
+
+    statement = _bank_statement()
+
+    # The same budget for any number of rows within one chunk
+    with query_budget(7, max_repeats=2):
+        result = _import_csv(statement, _statement_csv(range(row_count)))
+        db.session.flush()
+
+    assert result['imported'] == row_count
+    db.session.rollback()
+
+
+def test_statement_csv_reupload_query_budget(app, query_budget):
+    from app import db
+
+    statement = _bank_statement()
+    content = _statement_csv(range(500))
+    _import_csv(statement, content)
+    db.session.flush()
+
+    # An identical file is recognized before it is parsed
+    with query_budget(3):
+        result = _import_csv(statement, content)
+
+    assert result['previous_import'] is not None
+    db.session.rollback()
+
+
+def test_statement_csv_overlap_query_budget(app, query_budget):
+    from app import db
+
+    statement = _bank_statement()
+    _import_csv(statement, _statement_csv(range(1000)))
+    db.session.flush()
+
+    # Duplicates are found with one query per chunk, not one per row
+    with query_budget(7, max_repeats=2):
+        result = _import_csv(statement, _statement_csv(range(500, 1500)))
+        db.session.flush()
+
+    assert result['imported'] == 500
+    assert result['duplicates'] == 500
+    db.session.rollback()
@@ -0,0 +1,29 @@
+"""
+ProductStock read model kept by the flush listeners
+"""
+from datetime import datetime
+from decimal import Decimal
+
+
+def test_changes_after_commit_match_recomputation(product_factory):
+    from app import db
+    from models import InventoryTransaction, ProductStock
+    from utils.stock import check_product_stock
+
+    product = product_factory('STOCK-1', cost_price=5)
+    movement = InventoryTransaction(
+        transaction_date=datetime(2020, 5, 1), transaction_type='IN', product_id=product.id,
+        quantity=Decimal('10'), unit_price=Decimal('5.00'), location='Main'
+    )
+    db.session.add(movement)
+    db.session.commit()
+
+    # The commit expired every attribute, so nothing old is in the history
+    movement.quantity = Decimal('4')
+    movement.location = 'Back room'
+    db.session.commit()
+
+    assert check_product_stock() == []
+    stock = {row.location: row.quantity for row in ProductStock.query.filter_by(product_id=product.id)}
+    assert stock.get('Back room') == Decimal('4')
+    assert not stock.get('Main')
@@ -0,0 +1,122 @@
+"""
+Stock valuation engine: FIFO and weighted average against a Decimal replay
+"""
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from utils.stock_valuation import FIFO, STANDARD, WEIGHTED_AVERAGE
+
+CENT = Decimal('0.01')
+START = date(2021, 1, 1)
+
+
+def random_movements(seed, count=120):
+    """(type, quantity, unit price) with issues never exceeding the stock on hand"""
+    rng = random.Random(seed)
+    movements = []
+    on_hand = Decimal(0)
+    for _ in range(count):
+        if on_hand and rng.random() < 0.45:
+            quantity = min(on_hand, Decimal(rng.randint(1, 4000)).scaleb(-2))
+            movements.append(('OUT', quantity, None))
+            on_hand -= quantity
+        else:
+            quantity = Decimal(rng.randint(1, 4000)).scaleb(-2)
+            movements.append(('IN', quantity, Decimal(rng.randint(1, 99999)).scaleb(-2)))
+            on_hand += quantity
+    return movements
+
+
+def decimal_replay(method, movements):
+    """Reference (quantity, value) computed with exact Decimal arithmetic"""
+    if method == FIFO:
+        layers = []
+        for transaction_type, quantity, unit_price in movements:
+            if transaction_type == 'IN':
+                layers.append([quantity, unit_price])
+                continue
+            while quantity:
+                taken = min(quantity, layers[0][0])
+                layers[0][0] -= taken
+                quantity -= taken
+                if not layers[0][0]:
+                    layers.pop(0)
+        return sum((layer[0] for layer in layers), Decimal(0)), sum(
+            (layer[0] * layer[1] for layer in layers), Decimal(0)
+        ).quantize(CENT)
+
+    on_hand, value = Decimal(0), Decimal(0)
+    for transaction_type, quantity, unit_price in movements:
+        if transaction_type == 'IN':
+            on_hand += quantity
+            value += quantity * unit_price
+        else:
+            value -= value * quantity / on_hand
+            on_hand -= quantity
+    return on_hand, value.quantize(CENT)
+
+
+def record_movements(product, movements, location='Main', start=START):
+    """One movement a day from `start`, committed through the ORM"""
+    from app import db
+    from models import InventoryTransaction
+
+    db.session.add_all([
+        InventoryTransaction(
+            transaction_date=datetime.combine(start + timedelta(days=day), datetime.min.time()),
+            transaction_type=transaction_type, product_id=product.id, quantity=quantity,
+            unit_price=unit_price, location=location
+        )
+        for day, (transaction_type, quantity, unit_price) in enumerate(movements)
+    ])
+    db.session.commit()
+
+
+def product_valuation(product, method, as_of=None, use_snapshots=False):
+    from utils.stock_valuation import compute_stock_valuation
+
+    valuation = compute_stock_valuation(method, as_of, [product.id], use_snapshots=use_snapshots)
+    return valuation[(product.id, 'Main')]
+
+
+@pytest.mark.parametrize('method,seed', [(FIFO, 1), (FIFO, 2), (WEIGHTED_AVERAGE, 1), (WEIGHTED_AVERAGE, 2)])
+def test_streamed_methods_match_decimal_replay(product_factory, method, seed):
+    product = product_factory(f"VAL-{method}-{seed}")
+    movements = random_movements(seed)
+    record_movements(product, movements)
+
+    for days in (40, len(movements) - 1):
+        quantity, value = product_valuation(product, method, as_of=START + timedelta(days=days))
+        expected_quantity, expected_value = decimal_replay(method, movements[:days + 1])
+        assert quantity == expected_quantity
+        # Integer cents x hundredths round each issue to 1/10000 of a unit
+        assert abs(value - expected_value) <= CENT
+
+
+def test_missing_unit_price_uses_cost_price(product_factory):
+    product = product_factory('VAL-COST', cost_price='4.00')
+    record_movements(product, [('IN', Decimal('10'), Decimal('2.50')), ('IN', Decimal('5'), None)])
+
+    assert product_valuation(product, FIFO) == (Decimal('15.00'), Decimal('45.00'))
+    assert product_valuation(product, WEIGHTED_AVERAGE) == (Decimal('15.00'), Decimal('45.00'))
+    assert product_valuation(product, STANDARD) == (Decimal('15.00'), Decimal('60.00'))
+
+
+def test_fifo_issues_oldest_layers_and_fills_shortfalls(product_factory):
+    product = product_factory('VAL-FIFO')
+    record_movements(product, [
+        ('IN', Decimal('5'), Decimal('2.00')),
+        ('IN', Decimal('5'), Decimal('4.00')),
+        ('OUT', Decimal('7'), None),
+    ])
+    assert product_valuation(product, FIFO) == (Decimal('3.00'), Decimal('12.00'))
+
+    # Issued beyond stock, then received: the receipt covers the shortfall first
+    record_movements(product, [
+        ('OUT', Decimal('5'), None),
+        ('IN', Decimal('6'), Decimal('3.00')),
+    ], start=START + timedelta(days=10))
+    assert product_valuation(product, FIFO) == (Decimal('4.00'), Decimal('12.00'))
@@ -0,0 +1,81 @@
+"""
+Month-end valuation snapshots: resumed valuations against a full replay
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from utils.stock_valuation import FIFO, STANDARD, WEIGHTED_AVERAGE
+
+METHODS = (STANDARD, WEIGHTED_AVERAGE, FIFO)
+
+# Month ends, and days after the last close
+AS_OF_DATES = (date(2022, 1, 31), date(2022, 2, 28), date(2022, 3, 15), date(2022, 3, 31), date(2022, 5, 20))
+
+
+def _valuations(product, use_snapshots):
+    from utils.stock_valuation import compute_stock_valuation
+
+    return {
+        (method, as_of): compute_stock_valuation(method, as_of, [product.id], use_snapshots=use_snapshots)
+        for method in METHODS
+        for as_of in AS_OF_DATES
+    }
+
+
+@pytest.fixture
+def moved_product(request, product_factory):
+    """A product received and issued across several months in two locations"""
+    from app import db
+    from models import InventoryTransaction
+
+    product = product_factory(f"SNAP-{request.node.name[-30:]}", cost_price='3.00')
+    movements = []
+    for month in range(1, 6):
+        for day, transaction_type, quantity, unit_price, location in (
+            (3, 'IN', '12.5', '2.10', 'Main'),
+            (9, 'OUT', '4.25', None, 'Main'),
+            (14, 'IN', '7', None, 'Back'),
+            (21, 'IN', '3.33', '2.95', 'Main'),
+            (26, 'OUT', '9.5', None, 'Main'),
+        ):
+            movements.append(InventoryTransaction(
+                transaction_date=datetime(2022, month, day), transaction_type=transaction_type,
+                product_id=product.id, quantity=Decimal(quantity), location=location,
+                unit_price=Decimal(unit_price) + month if unit_price else None
+            ))
+    db.session.add_all(movements)
+    db.session.commit()
+    return product, movements
+
+
+def test_snapshots_match_full_replay(moved_product):
+    from utils.valuation_snapshots import close_inventory_periods, latest_snapshot_period
+
+    product, _ = moved_product
+    close_inventory_periods(through=date(2022, 2, 28))
+    close_inventory_periods(through=date(2022, 4, 30))
+
+    assert latest_snapshot_period(FIFO) == date(2022, 4, 30)
+    assert _valuations(product, use_snapshots=True) == _valuations(product, use_snapshots=False)
+
+
+def test_backdated_edit_invalidates_snapshots(moved_product):
+    from app import db
+    from utils.valuation_snapshots import close_inventory_periods, latest_snapshot_period
+
+    product, movements = moved_product
+    close_inventory_periods(through=date(2022, 4, 30))
+
+    # Move a February receipt into May after a commit expired its attributes
+    movements[5].transaction_date = datetime(2022, 5, 2)
+    db.session.commit()
+
+    assert latest_snapshot_period(FIFO) == date(2022, 1, 31)
+    assert _valuations(product, use_snapshots=True) == _valuations(product, use_snapshots=False)
+
+    # Reclosing rebuilds the dropped months from the remaining snapshot
+    close_inventory_periods(through=date(2022, 4, 30))
+    assert latest_snapshot_period(FIFO) == date(2022, 4, 30)
+    assert _valuations(product, use_snapshots=True) == _valuations(product, use_snapshots=False)
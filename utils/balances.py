@@ -0,0 +1,471 @@
+"""
+Materialized account balances
+
+Posted journal activity is rolled up into AccountPeriodBalance rows (one per
+account and month). The rollups are maintained inside the same flush that
+posts, edits or deletes journal data, so they commit or roll back together
+with the journal entry itself.
+"""
+import calendar
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from sqlalchemy import event, extract, func, or_, select, union_all, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from app import db
+from models import Account, AccountPeriodBalance, AccountType, JournalEntry, JournalItem
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+_PENDING_KEY = 'pending_account_period_deltas'
+
+
+def _to_decimal(value):
+    if value is None:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _old_and_new(obj, key):
+    """Return the (committed, current) values of an attribute"""
+    history = get_history(obj, key)
+    if history.deleted:
+        old = history.deleted[0]
+    elif history.unchanged:
+        old = history.unchanged[0]
+    else:
+        old = None
+    if history.added:
+        new = history.added[0]
+    elif history.unchanged:
+        new = history.unchanged[0]
+    else:
+        new = None
+    return old, new
+
+
+def _entry_states(session, entry):
+    """Return ((was_posted, old_date), (is_posted, new_date)) for an entry"""
+    if entry is None:
+        return (False, None), (False, None)
+
+    old_posted, new_posted = _old_and_new(entry, 'is_posted')
+    old_date, new_date = _old_and_new(entry, 'entry_date')
+
+    if entry in session.new:
+        old_posted = False
+    if entry in session.deleted:
+        new_posted = False
+
+    return (bool(old_posted), old_date), (bool(new_posted), new_date)
+
+
+def _add_delta(deltas, account_id, entry_date, debit, credit, sign):
+    if account_id is None or entry_date is None:
+        return
+    key = (int(account_id), entry_date.year, entry_date.month)
+    deltas[key][0] += sign * _to_decimal(debit)
+    deltas[key][1] += sign * _to_decimal(credit)
+
+
+def collect_balance_deltas(session):
+    """Work out how the pending flush changes posted per-period totals"""
+    deltas = defaultdict(lambda: [ZERO, ZERO])
+    seen_items = set()
+
+    def item_delta(item, entry_old, entry_new, is_new=False, is_deleted=False):
+        old_account, new_account = _old_and_new(item, 'account_id')
+        old_debit, new_debit = _old_and_new(item, 'debit_amount')
+        old_credit, new_credit = _old_and_new(item, 'credit_amount')
+        if new_account is None and item.account is not None:
+            # Set through the relationship; the id is only copied over during the flush
+            new_account = item.account.id
+
+        was_posted, old_date = entry_old
+        is_posted, new_date = entry_new
+
+        if was_posted and not is_new:
+            _add_delta(deltas, old_account, old_date, old_debit, old_credit, -1)
+        if is_posted and not is_deleted:
+            _add_delta(deltas, new_account, new_date, new_debit, new_credit, 1)
+
+    def entry_for(entry_id):
+        if entry_id is None:
+            return None
+        return session.get(JournalEntry, entry_id)
+
+    with session.no_autoflush:
+        # Line items that were added, changed or removed directly
+        for collection, is_new, is_deleted in (
+            (session.new, True, False),
+            (session.dirty, False, False),
+            (session.deleted, False, True),
+        ):
+            for item in list(collection):
+                if not isinstance(item, JournalItem):
+                    continue
+                seen_items.add(id(item))
+
+                old_entry_id, new_entry_id = _old_and_new(item, 'journal_entry_id')
+                old_entry = item.journal_entry if old_entry_id is None else entry_for(old_entry_id)
+                new_entry = item.journal_entry if new_entry_id is None else entry_for(new_entry_id)
+
+                entry_old, _ = _entry_states(session, old_entry)
+                _, entry_new = _entry_states(session, new_entry)
+                item_delta(item, entry_old, entry_new, is_new=is_new, is_deleted=is_deleted)
+
+        # Entries that were posted, unposted, re-dated or deleted carry their
+        # untouched persistent items with them
+        for entry in list(session.dirty) + list(session.deleted):
+            if not isinstance(entry, JournalEntry):
+                continue
+            entry_old, entry_new = _entry_states(session, entry)
+            if entry_old == entry_new:
+                continue
+
+            items = session.query(JournalItem).filter_by(journal_entry_id=entry.id).all()
+            for item in items:
+                if id(item) in seen_items:
+                    continue
+                seen_items.add(id(item))
+                item_delta(item, entry_old, entry_new)
+
+    return {
+        key: (debit, credit)
+        for key, (debit, credit) in deltas.items()
+        if debit != 0 or credit != 0
+    }
+
+
+def apply_balance_deltas(connection, deltas):
+    """
+    Add debit/credit deltas to AccountPeriodBalance rows.
+
+    `deltas` maps (account_id, year, month) to (debit, credit). Increments are
+    applied in SQL so concurrent postings to the same period do not overwrite
+    each other.
+    """
+    if not deltas:
+        return
+
+    table = AccountPeriodBalance.__table__
+    dialect = connection.dialect.name
+
+    rows = [
+        {
+            'account_id': account_id,
+            'year': year,
+            'month': month,
+            'debit_total': debit,
+            'credit_total': credit,
+        }
+        for (account_id, year, month), (debit, credit) in sorted(deltas.items())
+    ]
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.account_id, table.c.year, table.c.month],
+            set_={
+                'debit_total': table.c.debit_total + stmt.excluded.debit_total,
+                'credit_total': table.c.credit_total + stmt.excluded.credit_total,
+            }
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            update(table).where(
+                table.c.account_id == row['account_id'],
+                table.c.year == row['year'],
+                table.c.month == row['month']
+            ).values(
+                debit_total=table.c.debit_total + row['debit_total'],
+                credit_total=table.c.credit_total + row['credit_total']
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+def _before_flush(session, flush_context, instances):
+    session.info[_PENDING_KEY] = collect_balance_deltas(session)
+
+
+def _after_flush(session, flush_context):
+    deltas = session.info.pop(_PENDING_KEY, None)
+    if deltas:
+        apply_balance_deltas(session.connection(), deltas)
+
+
+def register_balance_listeners():
+    """Keep AccountPeriodBalance in step with every ORM flush"""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+def rebuild_account_period_balances():
+    """Recompute every AccountPeriodBalance row from posted journal items"""
+    table = AccountPeriodBalance.__table__
+
+    year_col = extract('year', JournalEntry.entry_date)
+    month_col = extract('month', JournalEntry.entry_date)
+
+    totals = select(
+        JournalItem.account_id,
+        year_col,
+        month_col,
+        func.coalesce(func.sum(JournalItem.debit_amount), 0),
+        func.coalesce(func.sum(JournalItem.credit_amount), 0)
+    ).join(
+        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
+    ).where(
+        JournalEntry.is_posted == True
+    ).group_by(
+        JournalItem.account_id, year_col, month_col
+    )
+
+    db.session.execute(table.delete())
+    db.session.execute(
+        table.insert().from_select(
+            ['account_id', 'year', 'month', 'debit_total', 'credit_total'],
+            totals
+        )
+    )
+    db.session.commit()
+
+    count = db.session.query(func.count(AccountPeriodBalance.id)).scalar()
+    logger.info(f"Rebuilt {count} account period balances")
+    return count
+
+
+def ensure_account_period_balances():
+    """Build the rollups once for databases that predate them"""
+    has_rollups = db.session.query(AccountPeriodBalance.id).first() is not None
+    if has_rollups:
+        return False
+
+    has_posted_items = db.session.query(JournalItem.id).join(
+        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
+    ).filter(
+        JournalEntry.is_posted == True
+    ).first() is not None
+    if not has_posted_items:
+        return False
+
+    rebuild_account_period_balances()
+    return True
+
+
+def _month_index(value):
+    return value.year * 12 + value.month
+
+
+def _month_end(value):
+    return value.replace(day=calendar.monthrange(value.year, value.month)[1])
+
+
+def _period_total_sources(account_ids, start_date, end_date):
+    """
+    Build the selects whose rows add up to posted totals for a date range.
+
+    Whole months inside the range come from AccountPeriodBalance; only the
+    partial months at either edge are read from journal items. Every select
+    yields (account_id, debit_total, credit_total) rows.
+    """
+    if start_date and end_date and start_date > end_date:
+        return []
+
+    # First and last day covered by whole months
+    if start_date is None:
+        full_start = None
+    elif start_date.day == 1:
+        full_start = start_date
+    else:
+        full_start = _month_end(start_date) + timedelta(days=1)
+
+    if end_date is None:
+        full_end = None
+    elif end_date == _month_end(end_date):
+        full_end = end_date
+    else:
+        full_end = end_date.replace(day=1) - timedelta(days=1)
+
+    sources = []
+    edge_ranges = []
+
+    if full_start is not None and full_end is not None and full_start > full_end:
+        # The range sits inside one or two partial months
+        edge_ranges.append((start_date, end_date))
+    else:
+        period_index = AccountPeriodBalance.year * 12 + AccountPeriodBalance.month
+        rollups = select(
+            AccountPeriodBalance.account_id.label('account_id'),
+            AccountPeriodBalance.debit_total.label('debit_total'),
+            AccountPeriodBalance.credit_total.label('credit_total')
+        )
+        if account_ids is not None:
+            rollups = rollups.where(AccountPeriodBalance.account_id.in_(account_ids))
+        if full_start is not None:
+            rollups = rollups.where(period_index >= _month_index(full_start))
+        if full_end is not None:
+            rollups = rollups.where(period_index <= _month_index(full_end))
+        sources.append(rollups)
+
+        if start_date is not None and start_date < full_start:
+            edge_ranges.append((start_date, full_start - timedelta(days=1)))
+        if end_date is not None and end_date > full_end:
+            edge_ranges.append((full_end + timedelta(days=1), end_date))
+
+    if edge_ranges:
+        edges = select(
+            JournalItem.account_id.label('account_id'),
+            JournalItem.debit_amount.label('debit_total'),
+            JournalItem.credit_amount.label('credit_total')
+        ).join(
+            JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
+        ).where(
+            JournalEntry.is_posted == True,
+            or_(*[JournalEntry.entry_date.between(start, end) for start, end in edge_ranges])
+        )
+        if account_ids is not None:
+            edges = edges.where(JournalItem.account_id.in_(account_ids))
+        sources.append(edges)
+
+    return sources
+
+
+def _period_totals_subquery(account_ids, start_date, end_date):
+    sources = _period_total_sources(account_ids, start_date, end_date)
+    if not sources:
+        return None
+    if len(sources) == 1:
+        return sources[0].subquery()
+    return union_all(*sources).subquery()
+
+
+def get_account_period_totals(account_ids=None, start_date=None, end_date=None):
+    """
+    Get posted debit and credit totals per account for a date range.
+
+    Returns a dict of account_id -> (total_debit, total_credit), answered from
+    the monthly rollups plus the partial edge months in one query.
+    """
+    if account_ids is not None:
+        account_ids = list(account_ids)
+        if not account_ids:
+            return {}
+
+    totals = _period_totals_subquery(account_ids, start_date, end_date)
+    if totals is None:
+        return {}
+
+    rows = db.session.execute(
+        select(
+            totals.c.account_id,
+            func.sum(totals.c.debit_total),
+            func.sum(totals.c.credit_total)
+        ).group_by(totals.c.account_id)
+    )
+
+    return {
+        account_id: (_to_decimal(debit), _to_decimal(credit))
+        for account_id, debit, credit in rows
+    }
+
+
+def is_debit_normal(account_type_name):
+    """Asset and expense accounts increase with debits; the rest with credits"""
+    return account_type_name in (AccountType.ASSET, AccountType.EXPENSE)
+
+
+def get_account_balances(account_ids=None, start_date=None, end_date=None, account_types=None):
+    """
+    Get signed balances for many accounts in a single query.
+
+    Posted totals are grouped by account and joined to AccountType so the
+    debit-normal (asset, expense) or credit-normal (liability, equity,
+    revenue) sign rule can be applied per account. `account_types` optionally
+    limits the result to the given AccountType names. Returns a dict of
+    account_id -> Decimal balance; accounts without activity are omitted.
+    """
+    if account_ids is not None:
+        account_ids = list(account_ids)
+        if not account_ids:
+            return {}
+
+    totals = _period_totals_subquery(account_ids, start_date, end_date)
+    if totals is None:
+        return {}
+
+    query = select(
+        totals.c.account_id,
+        AccountType.name,
+        func.sum(totals.c.debit_total),
+        func.sum(totals.c.credit_total)
+    ).join(
+        Account, Account.id == totals.c.account_id
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).group_by(
+        totals.c.account_id, AccountType.name
+    )
+    if account_types:
+        query = query.where(AccountType.name.in_(list(account_types)))
+
+    balances = {}
+    for account_id, type_name, debit, credit in db.session.execute(query):
+        debit = _to_decimal(debit)
+        credit = _to_decimal(credit)
+        balances[account_id] = debit - credit if is_debit_normal(type_name) else credit - debit
+
+    return balances
+
+
+def get_account_type_balances(account_types=None, start_date=None, end_date=None):
+    """
+    Get signed balance totals per account type in a single query.
+
+    Returns a dict of AccountType name -> Decimal balance, using the same sign
+    rules as get_account_balances().
+    """
+    totals = _period_totals_subquery(None, start_date, end_date)
+    if totals is None:
+        return {}
+
+    query = select(
+        AccountType.name,
+        func.sum(totals.c.debit_total),
+        func.sum(totals.c.credit_total)
+    ).join(
+        Account, Account.id == totals.c.account_id
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).group_by(
+        AccountType.name
+    )
+    if account_types:
+        query = query.where(AccountType.name.in_(list(account_types)))
+
+    balances = {}
+    for type_name, debit, credit in db.session.execute(query):
+        debit = _to_decimal(debit)
+        credit = _to_decimal(credit)
+        balances[type_name] = debit - credit if is_debit_normal(type_name) else credit - debit
+
+    return balances
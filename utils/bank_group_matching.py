@@ -0,0 +1,321 @@
+"""
+Many-to-one bank matching
+
+Finds groups of unmatched journal entries whose bank-account lines add up to
+one bank transaction: a deposit covering several customer receipts, or one
+bulk payment covering several bills. Matched groups are stored as
+BankTransactionMatch rows, one per entry.
+
+Each bank transaction is a bounded subset-sum over integer cents:
+
+    candidates - unmatched lines on the same side, dated within the window
+                 and no larger than the bank amount; the closest dates are
+                 kept, at most MAX_CANDIDATES
+    search     - meet in the middle: the candidates are split in two halves,
+                 each half's reachable sums (up to the bank amount) are built
+                 with a DP that keeps the best subset per sum, and the halves
+                 are joined on target - sum
+
+The best group has the fewest lines, then the smallest total date distance.
+On a busy account enough candidates make some total likely by chance, so a
+group is only proposed when few of the subsets searched would be expected to
+hit the amount by coincidence. Transactions are solved in date order and an
+entry joins at most one group.
+"""
+import logging
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import bindparam, update
+
+from app import db
+from models import BankTransaction, BankTransactionMatch
+from utils.bank_matching import (
+    AMOUNT_TOLERANCE_CENTS, BankMatchError, _load_bank_transactions, _load_confirmation_rows,
+    _load_ledger_lines,
+)
+
+logger = logging.getLogger(__name__)
+
+# Receipts banked together usually span a few days
+GROUP_DATE_WINDOW_DAYS = 7
+
+# Most entries one bank transaction is matched to
+MAX_GROUP_LINES = 8
+
+# Lines searched per bank transaction (2 x 2^(MAX_CANDIDATES / 2) subsets at most)
+MAX_CANDIDATES = 24
+
+# Groups are not proposed when more subsets of the candidates than this
+# would be expected to hit the amount by coincidence
+MAX_EXPECTED_COINCIDENCES = 0.1
+
+
+def _half_sums(candidates, first_bit, target, max_lines):
+    """
+    {sum: (lines, days, mask)} of the best subset of `candidates` per sum.
+
+    A 0/1 knapsack over sums up to `target`; keeping only the best subset per
+    sum is safe because size and days are additive.
+    """
+    best = {0: (0, 0, 0)}
+    for position, (cents, days) in enumerate(candidates):
+        bit = 1 << (first_bit + position)
+        for total, (lines, total_days, mask) in list(best.items()):
+            new_total = total + cents
+            if new_total > target or lines == max_lines:
+                continue
+            candidate = (lines + 1, total_days + days, mask | bit)
+            current = best.get(new_total)
+            if current is None or candidate < current:
+                best[new_total] = candidate
+    return best
+
+
+def find_subset(candidates, target, max_lines=MAX_GROUP_LINES, tolerance=AMOUNT_TOLERANCE_CENTS):
+    """
+    Best subset of (cents, days) candidates summing to `target` cents.
+
+    Sums within `tolerance` count. Returns the candidate positions (fewest
+    lines, then fewest total days), or None.
+    """
+    middle = len(candidates) // 2
+    left = _half_sums(candidates[:middle], 0, target + tolerance, max_lines)
+    right = _half_sums(candidates[middle:], middle, target + tolerance, max_lines)
+
+    best = None
+    for total, (lines, days, mask) in left.items():
+        for offset in range(-tolerance, tolerance + 1):
+            other = right.get(target + offset - total)
+            if other is None or lines + other[0] > max_lines or lines + other[0] == 0:
+                continue
+            candidate = (lines + other[0], days + other[1], mask | other[2])
+            if best is None or candidate < best:
+                best = candidate
+    if best is None:
+        return None
+    return [position for position in range(len(candidates)) if best[2] >> position & 1]
+
+
+def _entry_lines(lines):
+    """One line per entry and side, with the entry's bank-account amounts summed"""
+    merged = {}
+    for line in lines:
+        key = (line['entry_id'], line['side'])
+        if key in merged:
+            merged[key] = dict(merged[key], cents=merged[key]['cents'] + line['cents'])
+        else:
+            merged[key] = line
+    return list(merged.values())
+
+
+def propose_group_matches(statement, date_window=GROUP_DATE_WINDOW_DAYS, max_lines=MAX_GROUP_LINES,
+                          amount_tolerance=AMOUNT_TOLERANCE_CENTS, exclude_transactions=(), exclude_entries=()):
+    """
+    Propose groups of journal entries for unreconciled bank transactions.
+
+    Transactions in `exclude_transactions` and entries in `exclude_entries`
+    (e.g. the one-to-one proposals) are left out, as are transactions a
+    single entry matches. Returns proposals ordered by transaction date,
+    each a dict with the transaction fields, total, days (widest date gap)
+    and entries (entry_id, entry_date, entry_description, entry_reference,
+    amount).
+    """
+    gl_account_id = statement.bank_account.gl_account_id
+    if not gl_account_id:
+        raise BankMatchError('The bank account has no GL account to match against.')
+
+    exclude_transactions = set(exclude_transactions)
+    transactions = [
+        transaction for transaction in _load_bank_transactions(statement)
+        if transaction['id'] not in exclude_transactions
+    ]
+    if not transactions:
+        return []
+
+    window = timedelta(days=date_window)
+    exclude_entries = set(exclude_entries)
+    lines = [
+        line for line in _entry_lines(_load_ledger_lines(
+            gl_account_id,
+            min(statement.start_date, transactions[0]['date']) - window,
+            max(statement.end_date, transactions[-1]['date']) + window
+        ))
+        if line['entry_id'] not in exclude_entries
+    ]
+
+    # Lines per side in date order, for the window lookups
+    by_side = defaultdict(list)
+    for line in sorted(lines, key=lambda line: (line['date'], line['entry_id'])):
+        by_side[line['side']].append(line)
+    ordinals = {side: [line['date'].toordinal() for line in side_lines] for side, side_lines in by_side.items()}
+
+    used_entries = set()
+    proposals = []
+    for transaction in transactions:
+        target = transaction['cents']
+        ordinal = transaction['date'].toordinal()
+        side_lines = by_side.get(transaction['side'], [])
+        side_ordinals = ordinals.get(transaction['side'], [])
+        window_lines = side_lines[
+            bisect_left(side_ordinals, ordinal - date_window):bisect_right(side_ordinals, ordinal + date_window)
+        ]
+
+        candidates = []
+        single_match = False
+        for line in window_lines:
+            if line['entry_id'] in used_entries or line['cents'] > target + amount_tolerance:
+                continue
+            if abs(line['cents'] - target) <= amount_tolerance:
+                single_match = True
+                break
+            candidates.append((abs(line['date'].toordinal() - ordinal), line))
+
+        # One-to-one matches are left to the pairwise matcher
+        if single_match or len(candidates) < 2:
+            continue
+        candidates.sort(key=lambda candidate: (candidate[0], candidate[1]['entry_id']))
+        candidates = candidates[:MAX_CANDIDATES]
+        if sum(line['cents'] for _, line in candidates) < target - amount_tolerance:
+            continue
+
+        positions = find_subset(
+            [(line['cents'], days) for days, line in candidates], target, max_lines, amount_tolerance
+        )
+        if positions is None:
+            continue
+
+        # Many candidates and a large group make a chance total likely
+        subsets = sum(math.comb(len(candidates), size) for size in range(2, len(positions) + 1))
+        if subsets * (2 * amount_tolerance + 1) / target > MAX_EXPECTED_COINCIDENCES:
+            continue
+
+        group = [candidates[position] for position in positions]
+        used_entries.update(line['entry_id'] for _, line in group)
+        proposals.append({
+            'transaction_id': transaction['id'],
+            'transaction_date': transaction['date'],
+            'transaction_description': transaction['description'],
+            'transaction_reference': transaction['reference'],
+            'transaction_type': transaction['side'],
+            'amount': target / 100,
+            'total': sum(line['cents'] for _, line in group) / 100,
+            'days': max(days for days, _ in group),
+            'entries': [
+                {
+                    'entry_id': line['entry_id'],
+                    'entry_date': line['date'],
+                    'entry_description': line['entry_description'] or line['description'],
+                    'entry_reference': line['reference'],
+                    'amount': line['cents'] / 100,
+                }
+                for _, line in sorted(group, key=lambda item: (item[1]['date'], item[1]['entry_id']))
+            ],
+        })
+
+    logger.info(
+        f"Proposed {len(proposals)} grouped matches for {len(transactions)} bank transactions "
+        f"against {len(lines)} ledger lines"
+    )
+    return proposals
+
+
+def confirm_group_matches(statement, groups, amount_tolerance=AMOUNT_TOLERANCE_CENTS, reconciled_date=None):
+    """
+    Match bank transactions to groups of journal entries (caller commits).
+
+    `groups` is an iterable of (transaction_id, entry_ids). A group is saved
+    when the transaction belongs to the statement and is unreconciled, it has
+    at least two entries, none matched elsewhere, and their lines on the bank
+    GL account on the transaction's side add up to its amount. Links are
+    inserted and transactions updated with one executemany each. Returns a
+    dict with matched (transactions) and errors.
+    """
+    groups = [
+        (int(transaction_id), sorted({int(entry_id) for entry_id in entry_ids}))
+        for transaction_id, entry_ids in groups
+    ]
+    result = {'matched': 0, 'errors': []}
+    if not groups:
+        return result
+
+    transactions, lines, matched_entries = _load_confirmation_rows(
+        statement,
+        [transaction_id for transaction_id, _ in groups],
+        [entry_id for _, entry_ids in groups for entry_id in entry_ids]
+    )
+
+    links = []
+    updates = []
+    used_transactions, used_entries = set(), set()
+    created_at = datetime.utcnow()
+    for transaction_id, entry_ids in groups:
+        transaction = transactions.get(transaction_id)
+        if transaction is None:
+            result['errors'].append(f"Transaction {transaction_id} is not on this statement.")
+            continue
+        cents, transaction_type, is_reconciled = transaction
+        side = 'debit' if transaction_type == 'debit' else 'credit'
+        if is_reconciled or transaction_id in used_transactions:
+            result['errors'].append(f"Transaction {transaction_id} is already reconciled.")
+            continue
+        if len(entry_ids) < 2:
+            result['errors'].append(f"Transaction {transaction_id}: a group needs at least two journal entries.")
+            continue
+        taken = [entry_id for entry_id in entry_ids if entry_id in matched_entries or entry_id in used_entries]
+        if taken:
+            result['errors'].append(
+                f"Journal entries {', '.join(map(str, taken))} are already matched to a bank transaction."
+            )
+            continue
+
+        amounts = {}
+        for entry_id in entry_ids:
+            amounts[entry_id] = sum(
+                line_cents for line_side, line_cents in lines.get(entry_id, ()) if line_side == side
+            )
+        missing = [entry_id for entry_id, amount in amounts.items() if not amount]
+        if missing:
+            result['errors'].append(
+                f"Journal entries {', '.join(map(str, missing))} have no {side} line on the bank account."
+            )
+            continue
+        total = sum(amounts.values())
+        if abs(total - cents) > amount_tolerance:
+            result['errors'].append(
+                f"Transaction {transaction_id}: the entries total {total / 100:,.2f}, not {cents / 100:,.2f}."
+            )
+            continue
+
+        used_transactions.add(transaction_id)
+        used_entries.update(entry_ids)
+        updates.append({'transaction_id': transaction_id})
+        links.extend(
+            {
+                'bank_transaction_id': transaction_id,
+                'journal_entry_id': entry_id,
+                'amount': Decimal(amount).scaleb(-2),
+                'created_at': created_at,
+            }
+            for entry_id, amount in amounts.items()
+        )
+
+    if updates:
+        db.session.execute(BankTransactionMatch.__table__.insert(), links)
+        table = BankTransaction.__table__
+        db.session.execute(
+            update(table).where(
+                table.c.id == bindparam('transaction_id')
+            ).values(
+                is_reconciled=True,
+                reconciled_date=reconciled_date or date.today()
+            ),
+            updates
+        )
+        # The ORM copies of the updated transactions are stale now
+        db.session.expire_all()
+    result['matched'] = len(updates)
+    return result
@@ -0,0 +1,510 @@
+"""
+Bank-to-ledger auto-matching
+
+Proposes a journal entry for each unreconciled bank transaction of a
+statement. The candidate ledger lines (journal items on the bank account's
+GL account, in the statement period widened by the date window, whose entry
+no bank transaction is matched to yet) are loaded with one query and hashed
+by (side, amount in cents, date bucket). Each bank transaction then probes
+only the buckets within its amount tolerance and date window, so the work
+grows with the number of plausible pairs rather than statement x ledger.
+
+Every candidate pair is scored on
+
+    amount - exact cents, or within the tolerance
+    date   - days between the bank and ledger dates, relative to the window
+    text   - bank reference found in the entry, else token overlap of the
+             descriptions and references
+
+and the pairs are assigned one-to-one, either greedily by score or optimally
+(maximum total score) within each group of transactions and entries that
+compete for each other. Sides follow match_transaction(): a bank credit
+matches a credit line on the bank GL account and a debit a debit line.
+
+Confirming proposals updates the bank transactions with one executemany.
+"""
+import logging
+import re
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import BigInteger, and_, bindparam, cast, exists, func, select, update
+
+from app import db
+from models import BankTransaction, BankTransactionMatch, JournalEntry, JournalItem
+
+logger = logging.getLogger(__name__)
+
+# Days a ledger date may differ from the bank date
+DATE_WINDOW_DAYS = 7
+
+# Cents an amount may differ by (rounding differences)
+AMOUNT_TOLERANCE_CENTS = 1
+
+# Pairs scoring below this are not proposed
+MIN_SCORE = 0.5
+
+# Proposals at or above this score are preselected for confirmation
+AUTO_CONFIRM_SCORE = 0.8
+
+AMOUNT_WEIGHT = 0.5
+DATE_WEIGHT = 0.3
+TEXT_WEIGHT = 0.2
+
+GREEDY = 'greedy'
+OPTIMAL = 'optimal'
+ASSIGNMENT_METHODS = (GREEDY, OPTIMAL)
+
+# Larger groups of competing pairs are assigned greedily
+OPTIMAL_GROUP_LIMIT = 60
+
+# Ids per IN list when loading rows for confirmation
+_CHUNK_SIZE = 1000
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+class BankMatchError(Exception):
+    """Raised when a statement cannot be matched"""
+
+
+def _cents(column):
+    return cast(func.round(column * 100), BigInteger)
+
+
+def unmatched_entry_filter():
+    """Entries no bank transaction is matched to, alone or in a group (index probes per entry)"""
+    return and_(
+        ~exists().where(BankTransaction.gl_entry_id == JournalEntry.id),
+        ~exists().where(BankTransactionMatch.journal_entry_id == JournalEntry.id)
+    )
+
+
+def _tokens(*texts):
+    return frozenset(
+        token for text in texts if text
+        for token in _TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1
+    )
+
+
+def _load_bank_transactions(statement):
+    rows = db.session.execute(
+        select(
+            BankTransaction.id,
+            BankTransaction.transaction_date,
+            BankTransaction.description,
+            BankTransaction.reference,
+            _cents(BankTransaction.amount),
+            BankTransaction.transaction_type
+        ).where(
+            BankTransaction.statement_id == statement.id,
+            BankTransaction.is_reconciled == False
+        ).order_by(BankTransaction.transaction_date, BankTransaction.id)
+    )
+    return [
+        {
+            'id': transaction_id,
+            'date': transaction_date,
+            'description': description or '',
+            'reference': (reference or '').strip(),
+            'cents': abs(cents or 0),
+            'side': 'debit' if transaction_type == 'debit' else 'credit',
+        }
+        for transaction_id, transaction_date, description, reference, cents, transaction_type in rows
+    ]
+
+
+def _load_ledger_lines(gl_account_id, start_date, end_date):
+    """Unmatched journal lines on the bank GL account, as plain dicts"""
+    rows = db.session.execute(
+        select(
+            JournalEntry.id,
+            JournalEntry.entry_date,
+            JournalEntry.reference,
+            JournalEntry.description,
+            JournalItem.description,
+            _cents(func.coalesce(JournalItem.debit_amount, 0)),
+            _cents(func.coalesce(JournalItem.credit_amount, 0))
+        ).join(
+            JournalItem, JournalItem.journal_entry_id == JournalEntry.id
+        ).where(
+            JournalItem.account_id == gl_account_id,
+            JournalEntry.entry_date >= start_date,
+            JournalEntry.entry_date <= end_date,
+            unmatched_entry_filter()
+        )
+    )
+    lines = []
+    for entry_id, entry_date, reference, description, item_description, debit, credit in rows:
+        for side, cents in (('debit', debit), ('credit', credit)):
+            if cents:
+                lines.append({
+                    'entry_id': entry_id,
+                    'date': entry_date,
+                    'reference': reference or '',
+                    'description': item_description or description or '',
+                    'entry_description': description or '',
+                    'cents': abs(cents),
+                    'side': side,
+                })
+    return lines
+
+
+def _text_score(transaction, transaction_tokens, line, line_tokens):
+    """1 when the bank reference appears in the entry, else the token overlap (Jaccard)"""
+    reference = transaction['reference'].lower()
+    if len(reference) > 2 and (
+        reference in line['reference'].lower() or reference in line['entry_description'].lower()
+    ):
+        return 1.0
+    if not transaction_tokens or not line_tokens:
+        return 0.0
+    return len(transaction_tokens & line_tokens) / len(transaction_tokens | line_tokens)
+
+
+def score_candidates(transactions, lines, date_window=DATE_WINDOW_DAYS,
+                     amount_tolerance=AMOUNT_TOLERANCE_CENTS, min_score=MIN_SCORE):
+    """
+    Score every plausible (bank transaction, ledger line) pair.
+
+    Lines are hashed by (side, cents, date bucket); buckets are date_window
+    days wide, so a probe of the transaction's bucket and its neighbours
+    covers the whole window. Returns {(transaction index, entry id): (score,
+    line index)} keeping the best line per entry.
+    """
+    width = max(date_window, 1)
+    index = defaultdict(list)
+    for line_index, line in enumerate(lines):
+        index[(line['side'], line['cents'], line['date'].toordinal() // width)].append(line_index)
+
+    line_tokens = {}
+    pairs = {}
+    for transaction_index, transaction in enumerate(transactions):
+        transaction_tokens = None
+        ordinal = transaction['date'].toordinal()
+        bucket = ordinal // width
+        for cents in range(transaction['cents'] - amount_tolerance, transaction['cents'] + amount_tolerance + 1):
+            amount_score = 1.0 if cents == transaction['cents'] else 0.8
+            for probe in (bucket - 1, bucket, bucket + 1):
+                for line_index in index.get((transaction['side'], cents, probe), ()):
+                    line = lines[line_index]
+                    days = abs(line['date'].toordinal() - ordinal)
+                    if days > date_window:
+                        continue
+
+                    # Tokens are built only for the rows that meet a candidate
+                    if transaction_tokens is None:
+                        transaction_tokens = _tokens(transaction['description'], transaction['reference'])
+                    tokens = line_tokens.get(line_index)
+                    if tokens is None:
+                        tokens = line_tokens[line_index] = _tokens(line['description'], line['reference'])
+                    score = (
+                        AMOUNT_WEIGHT * amount_score
+                        + DATE_WEIGHT * (1 - days / (date_window + 1))
+                        + TEXT_WEIGHT * _text_score(transaction, transaction_tokens, line, tokens)
+                    )
+                    if score < min_score:
+                        continue
+
+                    key = (transaction_index, line['entry_id'])
+                    if key not in pairs or score > pairs[key][0]:
+                        pairs[key] = (score, line_index)
+    return pairs
+
+
+def _greedy(pairs):
+    """Highest score first; ties go to the earlier transaction and entry"""
+    taken_transactions, taken_entries = set(), set()
+    assigned = []
+    for (transaction_index, entry_id), (score, line_index) in sorted(
+        pairs.items(), key=lambda item: (-item[1][0], item[0])
+    ):
+        if transaction_index in taken_transactions or entry_id in taken_entries:
+            continue
+        taken_transactions.add(transaction_index)
+        taken_entries.add(entry_id)
+        assigned.append((transaction_index, entry_id))
+    return assigned
+
+
+def _hungarian(weights):
+    """
+    Maximum-weight assignment of a dense rows x columns matrix (rows <= columns).
+
+    Shortest augmenting path version of the Hungarian algorithm, O(rows^2 x
+    columns). Returns {row: column}.
+    """
+    rows, columns = len(weights), len(weights[0])
+    infinity = float('inf')
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (columns + 1)
+    match = [0] * (columns + 1)
+    way = [0] * (columns + 1)
+    for row in range(1, rows + 1):
+        match[0] = row
+        column = 0
+        slack = [infinity] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[column] = True
+            current_row = match[column]
+            delta, next_column = infinity, 0
+            for j in range(1, columns + 1):
+                if used[j]:
+                    continue
+                cost = -weights[current_row - 1][j - 1] - u[current_row] - v[j]
+                if cost < slack[j]:
+                    slack[j] = cost
+                    way[j] = column
+                if slack[j] < delta:
+                    delta, next_column = slack[j], j
+            for j in range(columns + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    slack[j] -= delta
+            column = next_column
+            if match[column] == 0:
+                break
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+    return {match[j] - 1: j - 1 for j in range(1, columns + 1) if match[j]}
+
+
+def _optimal(pairs):
+    """Maximum total score within each group of competing pairs"""
+    # Union-find over transactions and entries to split the pairs into groups
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while node != root:
+            parent[node], node = root, parent.get(node, node)
+        return root
+
+    for transaction_index, entry_id in pairs:
+        parent[find(('t', transaction_index))] = find(('e', entry_id))
+
+    groups = defaultdict(dict)
+    for key, value in pairs.items():
+        groups[find(('t', key[0]))][key] = value
+
+    assigned = []
+    for group in groups.values():
+        if len(group) == 1:
+            assigned.extend(group)
+            continue
+
+        transaction_ids = sorted({transaction_index for transaction_index, _ in group})
+        entry_ids = sorted({entry_id for _, entry_id in group})
+        if len(transaction_ids) + len(entry_ids) > OPTIMAL_GROUP_LIMIT:
+            assigned.extend(_greedy(group))
+            continue
+
+        flipped = len(transaction_ids) > len(entry_ids)
+        row_ids, column_ids = (entry_ids, transaction_ids) if flipped else (transaction_ids, entry_ids)
+        row_positions = {node: position for position, node in enumerate(row_ids)}
+        column_positions = {node: position for position, node in enumerate(column_ids)}
+        weights = [[0.0] * len(column_ids) for _ in row_ids]
+        for (transaction_index, entry_id), (score, _) in group.items():
+            row, column = (entry_id, transaction_index) if flipped else (transaction_index, entry_id)
+            weights[row_positions[row]][column_positions[column]] = score
+
+        for row, column in _hungarian(weights).items():
+            row_id, column_id = row_ids[row], column_ids[column]
+            key = (column_id, row_id) if flipped else (row_id, column_id)
+            # Cells without a candidate pair carry no weight; drop them
+            if key in group:
+                assigned.append(key)
+    return assigned
+
+
+def propose_matches(statement, date_window=DATE_WINDOW_DAYS, min_score=MIN_SCORE, assignment=OPTIMAL,
+                    amount_tolerance=AMOUNT_TOLERANCE_CENTS):
+    """
+    Propose one journal entry per unreconciled bank transaction of a statement.
+
+    Loads the statement's unreconciled transactions and the candidate ledger
+    lines with two queries. Returns proposals ordered by transaction date,
+    each a dict with transaction_id, entry_id, score (0-1), days, the
+    amount and display fields of both sides, and selected (score at least
+    AUTO_CONFIRM_SCORE).
+    """
+    if assignment not in ASSIGNMENT_METHODS:
+        raise BankMatchError(f"Unknown assignment method: {assignment}")
+
+    gl_account_id = statement.bank_account.gl_account_id
+    if not gl_account_id:
+        raise BankMatchError('The bank account has no GL account to match against.')
+
+    transactions = _load_bank_transactions(statement)
+    if not transactions:
+        return []
+
+    window = timedelta(days=date_window)
+    lines = _load_ledger_lines(
+        gl_account_id,
+        min(statement.start_date, transactions[0]['date']) - window,
+        max(statement.end_date, transactions[-1]['date']) + window
+    )
+
+    pairs = score_candidates(transactions, lines, date_window, amount_tolerance, min_score)
+    assigned = _optimal(pairs) if assignment == OPTIMAL else _greedy(pairs)
+
+    proposals = []
+    for transaction_index, entry_id in assigned:
+        transaction = transactions[transaction_index]
+        score, line_index = pairs[(transaction_index, entry_id)]
+        line = lines[line_index]
+        proposals.append({
+            'transaction_id': transaction['id'],
+            'transaction_date': transaction['date'],
+            'transaction_description': transaction['description'],
+            'transaction_reference': transaction['reference'],
+            'transaction_type': transaction['side'],
+            'amount': transaction['cents'] / 100,
+            'entry_id': entry_id,
+            'entry_date': line['date'],
+            'entry_description': line['entry_description'] or line['description'],
+            'entry_reference': line['reference'],
+            'entry_amount': line['cents'] / 100,
+            'days': abs((line['date'] - transaction['date']).days),
+            'score': round(score, 3),
+            'selected': score >= AUTO_CONFIRM_SCORE,
+        })
+
+    proposals.sort(key=lambda proposal: (proposal['transaction_date'], proposal['transaction_id']))
+    logger.info(
+        f"Proposed {len(proposals)} matches for {len(transactions)} bank transactions "
+        f"against {len(lines)} ledger lines ({len(pairs)} candidate pairs)"
+    )
+    return proposals
+
+
+def _load_confirmation_rows(statement, transaction_ids, entry_ids):
+    """
+    What confirming needs to know, loaded in chunks of ids.
+
+    Returns (transactions, lines, matched_entries): {transaction_id: (cents,
+    type, is_reconciled)} for the statement's transactions, {entry_id:
+    [(side, cents)]} of the entries' lines on the bank GL account (identical
+    lines kept, so group totals match the proposals), and the entries
+    already matched to a bank transaction.
+    """
+    gl_account_id = statement.bank_account.gl_account_id
+    transaction_ids = sorted(set(transaction_ids))
+    entry_ids = sorted(set(entry_ids))
+
+    transactions = {}
+    lines = defaultdict(list)
+    matched_entries = set()
+    for start in range(0, max(len(transaction_ids), len(entry_ids)), _CHUNK_SIZE):
+        transaction_chunk = transaction_ids[start:start + _CHUNK_SIZE]
+        entry_chunk = entry_ids[start:start + _CHUNK_SIZE]
+        if transaction_chunk:
+            for transaction_id, cents, transaction_type, is_reconciled in db.session.execute(
+                select(
+                    BankTransaction.id, _cents(BankTransaction.amount),
+                    BankTransaction.transaction_type, BankTransaction.is_reconciled
+                ).where(
+                    BankTransaction.statement_id == statement.id,
+                    BankTransaction.id.in_(transaction_chunk)
+                )
+            ):
+                transactions[transaction_id] = (abs(cents or 0), transaction_type, is_reconciled)
+        if entry_chunk:
+            for entry_id, debit, credit in db.session.execute(
+                select(
+                    JournalItem.journal_entry_id,
+                    _cents(func.coalesce(JournalItem.debit_amount, 0)),
+                    _cents(func.coalesce(JournalItem.credit_amount, 0))
+                ).where(
+                    JournalItem.account_id == gl_account_id,
+                    JournalItem.journal_entry_id.in_(entry_chunk)
+                )
+            ):
+                if debit:
+                    lines[entry_id].append(('debit', abs(debit)))
+                if credit:
+                    lines[entry_id].append(('credit', abs(credit)))
+            matched_entries.update(db.session.execute(
+                select(BankTransaction.gl_entry_id).where(BankTransaction.gl_entry_id.in_(entry_chunk))
+            ).scalars())
+            matched_entries.update(db.session.execute(
+                select(BankTransactionMatch.journal_entry_id).where(
+                    BankTransactionMatch.journal_entry_id.in_(entry_chunk)
+                )
+            ).scalars())
+    return transactions, lines, matched_entries
+
+
+def confirm_matches(statement, pairs, amount_tolerance=AMOUNT_TOLERANCE_CENTS, reconciled_date=None):
+    """
+    Match bank transactions to journal entries in bulk (caller commits).
+
+    `pairs` is an iterable of (transaction_id, entry_id). Each pair is
+    checked like match_transaction() does: the transaction belongs to the
+    statement and is unreconciled, the entry is not matched elsewhere and
+    has a line on the bank GL account on the same side with the same
+    amount. Valid pairs are saved with one executemany. Returns a dict with
+    matched and errors (one message per rejected pair).
+    """
+    pairs = [(int(transaction_id), int(entry_id)) for transaction_id, entry_id in pairs]
+    result = {'matched': 0, 'errors': []}
+    if not pairs:
+        return result
+
+    transactions, lines, matched_entries = _load_confirmation_rows(
+        statement, [transaction_id for transaction_id, _ in pairs], [entry_id for _, entry_id in pairs]
+    )
+
+    updates = []
+    used_transactions, used_entries = set(), set()
+    for transaction_id, entry_id in pairs:
+        transaction = transactions.get(transaction_id)
+        if transaction is None:
+            result['errors'].append(f"Transaction {transaction_id} is not on this statement.")
+            continue
+        cents, transaction_type, is_reconciled = transaction
+        side = 'debit' if transaction_type == 'debit' else 'credit'
+        if is_reconciled or transaction_id in used_transactions:
+            result['errors'].append(f"Transaction {transaction_id} is already reconciled.")
+            continue
+        if entry_id in matched_entries or entry_id in used_entries:
+            result['errors'].append(f"Journal entry {entry_id} is already matched to a bank transaction.")
+            continue
+        if not any(
+            line_side == side and abs(line_cents - cents) <= amount_tolerance
+            for line_side, line_cents in lines.get(entry_id, ())
+        ):
+            result['errors'].append(
+                f"Journal entry {entry_id} has no {side} line on the bank account for {cents / 100:,.2f}."
+            )
+            continue
+
+        used_transactions.add(transaction_id)
+        used_entries.add(entry_id)
+        updates.append({'transaction_id': transaction_id, 'entry_id': entry_id})
+
+    if updates:
+        table = BankTransaction.__table__
+        db.session.execute(
+            update(table).where(
+                table.c.id == bindparam('transaction_id')
+            ).values(
+                gl_entry_id=bindparam('entry_id'),
+                is_reconciled=True,
+                reconciled_date=reconciled_date or date.today()
+            ),
+            updates
+        )
+        # The ORM copies of the updated transactions are stale now
+        db.session.expire_all()
+    result['matched'] = len(updates)
+    return result
@@ -0,0 +1,501 @@
+"""
+OFX/QFX and CAMT.053 bank statement import
+
+Statement files are parsed as a stream of elements instead of being loaded
+whole, so memory stays flat however many years a file covers:
+
+    OFX 1.x  - SGML without closing tags on the values; a small tokenizer
+               reads the file in blocks and emits start/end events
+    OFX 2.x  - XML, fed block by block to an XMLPullParser
+    CAMT.053 - ISO 20022 XML, read with iterparse
+
+Elements are dropped from the tree as soon as they are read. Transactions are
+collected into chunks of IMPORT_CHUNK_SIZE, fingerprinted and bulk inserted
+by the same steps as CSV imports (see utils.bank_import). The statement's
+period and balances are taken from the file: OFX gives the ledger balance
+and the opening balance is derived from the transactions, CAMT.053 gives
+both.
+"""
+import codecs
+import html
+import logging
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter, deque
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from itertools import islice
+
+import pandas as pd
+
+from app import db
+from models import BankStatement, BankStatementImport, BankTransaction
+from utils.bank_import import (
+    IMPORT_CHUNK_SIZE, BankImportError, file_fingerprint, find_previous_import, insert_bank_transactions,
+    row_fingerprints,
+)
+
+logger = logging.getLogger(__name__)
+
+CSV = 'csv'
+OFX = 'ofx'
+CAMT053 = 'camt053'
+
+FORMAT_LABELS = {CSV: 'CSV', OFX: 'OFX/QFX', CAMT053: 'CAMT.053'}
+
+# Bytes read from the upload at a time
+READ_BLOCK_SIZE = 1 << 16
+
+_SNIFF_SIZE = 4096
+_OFX_TOKEN = re.compile(r'<(/?)([A-Za-z0-9_.]+)\s*>([^<]*)')
+_ROW_COLUMNS = ['transaction_date', 'description', 'reference', 'cents']
+
+# CAMT.053 balance types
+_OPENING_BALANCES = ('OPBD', 'PRCD')
+_CLOSING_BALANCES = ('CLBD',)
+
+
+def detect_statement_format(stream, filename=None):
+    """
+    The format of an uploaded statement: OFX, CAMT053 or CSV.
+
+    Looks at the start of the (seekable) stream first and falls back to the
+    file extension.
+    """
+    head = stream.read(_SNIFF_SIZE)
+    stream.seek(0)
+    if isinstance(head, bytes):
+        head = head.decode('latin-1')
+    upper = head.upper()
+    if upper.lstrip().startswith('OFXHEADER') or '<OFX>' in upper or '<?OFX' in upper:
+        return OFX
+    if 'CAMT.053' in head or '<BkToCstmrStmt' in head or ':BkToCstmrStmt' in head:
+        return CAMT053
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in ('ofx', 'qfx'):
+        return OFX
+    if extension == 'xml':
+        return CAMT053
+    return CSV
+
+
+def _cents(text):
+    """Integer cents of a decimal amount string, or None"""
+    text = text.strip().replace(' ', '')
+    if ',' in text and '.' not in text:
+        text = text.replace(',', '.')
+    try:
+        return int((Decimal(text) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return None
+
+
+class StatementParser:
+    """
+    Base class of the streaming statement parsers.
+
+    Iterating a parser yields (transaction_date, description, reference,
+    cents) tuples. Once iterated, start_date, end_date, statement_date,
+    opening_cents and closing_cents hold what the file says about the
+    statement (None when it does not say), skipped counts the transactions
+    left out and errors describes the unreadable ones.
+    """
+
+    label = None
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.start_date = None
+        self.end_date = None
+        self.statement_date = None
+        self.opening_cents = None
+        self.closing_cents = None
+        self.first_date = None
+        self.last_date = None
+        self.net_cents = 0
+        self.count = 0
+        self.skipped = 0
+        self.errors = []
+
+    def __iter__(self):
+        try:
+            yield from self._transactions()
+        except ET.ParseError as e:
+            raise BankImportError(f'Error parsing the {self.label} file: {e}. Please check the file format.')
+
+    def _transactions(self):
+        raise NotImplementedError
+
+    def _parse_date(self, text):
+        raise NotImplementedError
+
+    def _row(self, date_text, amount_text, description, reference):
+        """The transaction tuple for the raw values, or None (counted as skipped)"""
+        self.count += 1
+        if not date_text or not amount_text:
+            self.skipped += 1
+            return None
+        transaction_date = self._parse_date(date_text)
+        if transaction_date is None:
+            self.skipped += 1
+            self.errors.append(f"Transaction {self.count}: Unable to parse date '{date_text}'")
+            return None
+        cents = _cents(amount_text)
+        if cents is None:
+            self.skipped += 1
+            self.errors.append(f"Transaction {self.count}: Invalid amount format '{amount_text}'")
+            return None
+
+        self.net_cents += cents
+        if self.first_date is None or transaction_date < self.first_date:
+            self.first_date = transaction_date
+        if self.last_date is None or transaction_date > self.last_date:
+            self.last_date = transaction_date
+        return transaction_date, ' '.join(description.split())[:255], reference.strip()[:100], cents
+
+
+class OFXParser(StatementParser):
+    """
+    OFX and QFX (Quicken) statements, SGML (1.x) or XML (2.x).
+
+    Both are reduced to a stream of (event, tag, text) tuples. Bank and
+    credit card statements are read alike: STMTTRN gives the transactions,
+    BANKTRANLIST's DTSTART/DTEND the period and LEDGERBAL the closing
+    balance.
+    """
+
+    label = 'OFX'
+
+    def _parse_date(self, text):
+        # YYYYMMDD[HHMMSS[.XXX]][[-5:EST]]; only the day matters
+        text = text.strip()
+        try:
+            return date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+        except ValueError:
+            return None
+
+    def _events(self):
+        head = self.stream.read(_SNIFF_SIZE)
+        if head.lstrip().startswith(b'<?xml'):
+            return self._xml_events(head)
+        return self._sgml_events(head)
+
+    def _xml_events(self, head):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        stack = []
+        block = head
+        while block:
+            parser.feed(block)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    stack.append(element)
+                    yield 'start', element.tag.upper(), None
+                    continue
+                stack.pop()
+                yield 'end', element.tag.upper(), element.text
+                # Read elements are dropped so the tree never grows
+                element.clear()
+                if stack:
+                    stack[-1].remove(element)
+            block = self.stream.read(READ_BLOCK_SIZE)
+        parser.close()
+
+    def _sgml_events(self, head):
+        # The header is "NAME:VALUE" lines before the first tag
+        header = head.split(b'<', 1)[0].decode('latin-1').upper()
+        encoding = 'utf-8' if 'UTF-8' in header else 'cp1252'
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+        stack = []
+        pending = decoder.decode(head)
+        pending = pending[pending.find('<'):] if '<' in pending else ''
+        while True:
+            block = self.stream.read(READ_BLOCK_SIZE)
+            pending += decoder.decode(block, final=not block)
+            # The last tag's value may continue in the next block
+            end = len(pending) if not block else pending.rfind('<')
+            for match in _OFX_TOKEN.finditer(pending, 0, max(end, 0)):
+                closing, tag, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+                if closing:
+                    # Values were closed when read; aggregates close everything opened inside them
+                    if tag in stack:
+                        while stack:
+                            opened = stack.pop()
+                            yield 'end', opened, None
+                            if opened == tag:
+                                break
+                elif value:
+                    yield 'start', tag, None
+                    yield 'end', tag, html.unescape(value)
+                else:
+                    stack.append(tag)
+                    yield 'start', tag, None
+            if not block:
+                break
+            pending = pending[end:] if end > 0 else pending
+        while stack:
+            yield 'end', stack.pop(), None
+
+    def _transactions(self):
+        path = []
+        transaction = None
+        for event, tag, text in self._events():
+            if event == 'start':
+                path.append(tag)
+                if tag == 'STMTTRN':
+                    transaction = {}
+                continue
+            path.pop()
+            parent = path[-1] if path else None
+            text = (text or '').strip()
+
+            if tag == 'STMTTRN':
+                name, memo = transaction.get('NAME', ''), transaction.get('MEMO', '')
+                description = f'{name} {memo}' if name and memo and memo != name else name or memo
+                row = self._row(
+                    transaction.get('DTPOSTED') or transaction.get('DTUSER'),
+                    transaction.get('TRNAMT'),
+                    description or transaction.get('TRNTYPE', ''),
+                    transaction.get('CHECKNUM') or transaction.get('REFNUM') or transaction.get('FITID', '')
+                )
+                transaction = None
+                if row is not None:
+                    yield row
+            elif transaction is not None:
+                if text:
+                    transaction.setdefault(tag, text)
+            elif parent == 'BANKTRANLIST' and tag in ('DTSTART', 'DTEND'):
+                value = self._parse_date(text)
+                if value is None:
+                    continue
+                if tag == 'DTSTART' and (self.start_date is None or value < self.start_date):
+                    self.start_date = value
+                if tag == 'DTEND' and (self.end_date is None or value > self.end_date):
+                    self.end_date = value
+            elif parent == 'LEDGERBAL':
+                if tag == 'BALAMT':
+                    self.closing_cents = _cents(text)
+                elif tag == 'DTASOF':
+                    self.statement_date = self._parse_date(text)
+
+        # OFX has no opening balance: it is the closing one before the transactions
+        if self.closing_cents is not None:
+            self.opening_cents = self.closing_cents - self.net_cents
+
+
+class CAMT053Parser(StatementParser):
+    """
+    ISO 20022 CAMT.053 bank-to-customer statements (any camt.053.001 version).
+
+    Each Ntry is one transaction: its booking date (value date otherwise),
+    amount signed by CdtDbtInd, the remittance information or counterparty
+    as description and the servicer's reference. A file with several Stmt
+    blocks covers their combined period, from the first opening balance
+    to the last closing one.
+    """
+
+    label = 'CAMT.053'
+
+    def _parse_date(self, text):
+        # Dt (YYYY-MM-DD) or DtTm (YYYY-MM-DDThh:mm:ss...)
+        try:
+            return date.fromisoformat(text.strip()[:10])
+        except ValueError:
+            return None
+
+    def _leaves(self, element):
+        """
+        {path: [texts]} of the values under an element.
+
+        Paths are relative to the element, without namespaces (e.g.
+        'BookgDt/Dt'). One walk of the subtree is much cheaper than a
+        wildcard-namespace find per field. Breadth first, so repeated
+        values (several Ustrd lines) keep their document order.
+        """
+        leaves = {}
+        queue = deque([(element, '')])
+        while queue:
+            node, prefix = queue.popleft()
+            for child in node:
+                path = prefix + child.tag.rsplit('}', 1)[-1]
+                if len(child):
+                    queue.append((child, path + '/'))
+                elif child.text and child.text.strip():
+                    leaves.setdefault(path, []).append(child.text.strip())
+        return leaves
+
+    def _signed_amount(self, leaves):
+        """The Amt text, negated for debits ('' when missing)"""
+        amount_text = leaves.get('Amt', [''])[0]
+        if amount_text and leaves.get('CdtDbtInd', [''])[0] == 'DBIT':
+            amount_text = '-' + amount_text
+        return amount_text
+
+    def _entry(self, entry):
+        leaves = self._leaves(entry)
+
+        def first(*paths):
+            for path in paths:
+                if path in leaves:
+                    return leaves[path][0]
+            return ''
+
+        indicator = first('CdtDbtInd')
+
+        # The other party (nested under Pty from version 8) and the unstructured remittance lines
+        party = 'Dbtr' if indicator == 'CRDT' else 'Cdtr'
+        name = first(f'NtryDtls/TxDtls/RltdPties/{party}/Nm', f'NtryDtls/TxDtls/RltdPties/{party}/Pty/Nm')
+        remittance = ' '.join(leaves.get('NtryDtls/TxDtls/RmtInf/Ustrd', ()))
+        description = (
+            f'{name} {remittance}'.strip() or first('AddtlNtryInf')
+            or {'CRDT': 'Credit', 'DBIT': 'Debit'}.get(indicator, '')
+        )
+
+        return self._row(
+            first('BookgDt/Dt', 'BookgDt/DtTm', 'ValDt/Dt', 'ValDt/DtTm'),
+            self._signed_amount(leaves),
+            description,
+            first('AcctSvcrRef', 'NtryRef', 'NtryDtls/TxDtls/Refs/EndToEndId')
+        )
+
+    def _balance(self, balance):
+        leaves = self._leaves(balance)
+        cents = _cents(self._signed_amount(leaves))
+        if cents is None:
+            return
+        code = leaves.get('Tp/CdOrPrtry/Cd', [''])[0]
+        if code in _OPENING_BALANCES and self.opening_cents is None:
+            self.opening_cents = cents
+        elif code in _CLOSING_BALANCES:
+            self.closing_cents = cents
+            date_text = (leaves.get('Dt/Dt') or leaves.get('Dt/DtTm') or [''])[0]
+            self.statement_date = self._parse_date(date_text) or self.statement_date
+
+    def _transactions(self):
+        stack = []
+        for event, element in ET.iterparse(self.stream, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element)
+                continue
+            stack.pop()
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag == 'Ntry':
+                row = self._entry(element)
+                if row is not None:
+                    yield row
+            elif tag == 'Bal':
+                self._balance(element)
+            elif tag == 'FrToDt':
+                start = self._parse_date(element.findtext('{*}FrDtTm') or '')
+                end = self._parse_date(element.findtext('{*}ToDtTm') or '')
+                if start is not None and (self.start_date is None or start < self.start_date):
+                    self.start_date = start
+                if end is not None and (self.end_date is None or end > self.end_date):
+                    self.end_date = end
+            else:
+                continue
+            # Entries and balances are dropped once read so the tree never grows
+            element.clear()
+            if stack:
+                stack[-1].remove(element)
+
+
+PARSERS = {OFX: OFXParser, CAMT053: CAMT053Parser}
+
+
+def apply_statement_details(statement, parser, had_transactions=False):
+    """
+    Copy the period, date and balances a parsed file gives onto the statement.
+
+    The period falls back to the transaction dates. When the statement
+    already had transactions before this file, the period is only widened
+    and the statement date and balances are only filled in if unset, since
+    the file covers part of the statement at most. Returns (updated,
+    skipped), the names of the fields changed and of the fields left alone
+    although the file gave a different value.
+    """
+    values = {
+        'start_date': parser.start_date or parser.first_date,
+        'end_date': parser.end_date or parser.last_date,
+        'statement_date': parser.statement_date or parser.end_date or parser.last_date,
+        'beginning_balance': Decimal(parser.opening_cents).scaleb(-2) if parser.opening_cents is not None else None,
+        'ending_balance': Decimal(parser.closing_cents).scaleb(-2) if parser.closing_cents is not None else None,
+    }
+    updated = []
+    skipped = []
+    for field, value in values.items():
+        current = getattr(statement, field)
+        if value is None or current == value:
+            continue
+        if had_transactions and current is not None:
+            if field == 'start_date':
+                value = min(current, value)
+            elif field == 'end_date':
+                value = max(current, value)
+            else:
+                skipped.append(field)
+                continue
+            if value == current:
+                continue
+        setattr(statement, field, value)
+        updated.append(field)
+    return updated, skipped
+
+
+def import_statement_file(statement_id, stream, statement_format, chunk_size=IMPORT_CHUNK_SIZE,
+                          filename=None, created_by_id=None):
+    """
+    Stream an OFX/QFX or CAMT.053 file into a bank statement (caller commits).
+
+    `stream` is a seekable binary file object. Transactions are inserted in
+    chunks as they are parsed, skipping the ones already imported into the
+    bank account, and the statement's dates and balances are updated from
+    the file (see apply_statement_details()). Returns a dict like
+    import_statement_csv() plus statement_fields and skipped_fields, the
+    statement fields updated and left alone. Raises BankImportError when
+    the file cannot be parsed.
+    """
+    statement = db.session.get(BankStatement, statement_id)
+    bank_account_id = statement.bank_account_id
+    fingerprint = file_fingerprint(stream, statement_format)
+    previous_import = find_previous_import(bank_account_id, fingerprint)
+    if previous_import is not None:
+        return {'imported': 0, 'duplicates': 0, 'skipped': 0, 'errors': [], 'previous_import': previous_import,
+                'statement_fields': [], 'skipped_fields': []}
+
+    had_transactions = db.session.query(
+        BankTransaction.query.filter_by(statement_id=statement_id).exists()
+    ).scalar()
+    parser = PARSERS[statement_format](stream)
+    transactions = iter(parser)
+    seen = Counter()
+    imported = duplicates = 0
+    while True:
+        chunk = list(islice(transactions, chunk_size))
+        if not chunk:
+            break
+        rows = pd.DataFrame(chunk, columns=_ROW_COLUMNS)
+        rows['fingerprint'] = row_fingerprints(rows, bank_account_id, seen)
+        inserted, skipped_duplicates = insert_bank_transactions(statement_id, rows, chunk_size)
+        imported += inserted
+        duplicates += skipped_duplicates
+
+    statement_fields = skipped_fields = []
+    if imported or duplicates:
+        statement_fields, skipped_fields = apply_statement_details(statement, parser, had_transactions)
+        db.session.add(BankStatementImport(
+            bank_account_id=bank_account_id,
+            statement_id=statement_id,
+            file_fingerprint=fingerprint,
+            filename=filename,
+            imported_count=imported,
+            duplicate_count=duplicates,
+            skipped_count=parser.skipped,
+            created_by_id=created_by_id
+        ))
+    logger.info(
+        f"Imported {imported} bank transactions from {FORMAT_LABELS[statement_format]} into statement "
+        f"{statement_id} ({duplicates} duplicates, {parser.skipped} skipped)"
+    )
+    return {'imported': imported, 'duplicates': duplicates, 'skipped': parser.skipped, 'errors': parser.errors,
+            'previous_import': None, 'statement_fields': statement_fields, 'skipped_fields': skipped_fields}
@@ -1,9 +1,9 @@
 """
-PostgreSQL database utilities
+Database utilities (PostgreSQL tuning and portable index management)
 """
 import os
 import logging
-from sqlalchemy import text
+from sqlalchemy import func, inspect, text
 from app import db
 
 logger = logging.getLogger(__name__)
@@ -13,6 +13,24 @@ def is_using_postgresql():
     database_url = os.environ.get("DATABASE_URL", "")
     return database_url.startswith(("postgres://", "postgresql://"))
 
+def month_bucket(column):
+    """SQL expression that buckets a date column by calendar month.
+    
+    PostgreSQL uses date_trunc('month', ...) and returns a timestamp; SQLite
+    uses strftime('%Y-%m', ...) and returns a 'YYYY-MM' string. Use
+    bucket_to_year_month() to normalize the values.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc('month', column)
+    return func.strftime('%Y-%m', column)
+
+def bucket_to_year_month(value):
+    """Convert a month_bucket() value to a (year, month) tuple"""
+    if isinstance(value, str):
+        year, month = value[:7].split('-')
+        return int(year), int(month)
+    return value.year, value.month
+
 def create_index(table_name, column_name, index_name=None, unique=False):
     """Create an index on a table column"""
     if not is_using_postgresql():
@@ -25,25 +43,69 @@ def create_index(table_name, column_name, index_name=None, unique=False):
     unique_clause = "UNIQUE" if unique else ""
     
     try:
-        with db.engine.connect() as conn:
-            # Check if index already exists
-            result = conn.execute(text(
-                "SELECT 1 FROM pg_indexes WHERE indexname = :index_name"
-            ), {"index_name": index_name})
-            
-            if result.fetchone():
-                logger.info(f"Index {index_name} already exists")
-                return
-            
-            # Create the index
+        with db.engine.begin() as conn:
+            # IF NOT EXISTS avoids a separate pg_indexes lookup per index
             conn.execute(text(
-                f"CREATE {unique_clause} INDEX {index_name} ON {table_name} ({column_name})"
+                f"CREATE {unique_clause} INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_name})"
             ))
             
-            logger.info(f"Created index {index_name} on {table_name}.{column_name}")
+            logger.info(f"Ensured index {index_name} on {table_name}.{column_name}")
     except Exception as e:
         logger.error(f"Error creating index {index_name}: {e}")
 
+def create_model_indexes():
+    """Create the indexes declared in model __table_args__ on existing tables.
+    
+    db.create_all() only builds indexes together with new tables, so this
+    adds indexes introduced later. Works on every backend.
+    """
+    created = []
+    with db.engine.begin() as conn:
+        existing_tables = set(inspect(conn).get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_indexes = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    created.append(index.name)
+                    logger.info(f"Created index {index.name} on {table.name}")
+    return created
+
+def add_missing_columns():
+    """Add nullable columns declared on the models to existing tables.
+
+    db.create_all() never alters existing tables, so this adds columns
+    introduced later (with their foreign key where the backend allows it).
+    Returns the added columns as 'table.column' strings.
+    """
+    added = []
+    with db.engine.begin() as conn:
+        existing_tables = set(inspect(conn).get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable:
+                    logger.warning(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+                    continue
+
+                column_type = column.type.compile(dialect=conn.dialect)
+                definition = f"{column.name} {column_type}"
+                foreign_keys = list(column.foreign_keys)
+                if len(foreign_keys) == 1:
+                    target = foreign_keys[0].column
+                    definition += f" REFERENCES {target.table.name} ({target.name})"
+
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+                added.append(f"{table.name}.{column.name}")
+                logger.info(f"Added column {table.name}.{column.name}")
+    return added
+
 def create_search_index(table_name, column_name, index_name=None):
     """Create a full-text search index on a text column"""
     if not is_using_postgresql():
@@ -54,19 +116,10 @@ def create_search_index(table_name, column_name, index_name=None):
         index_name = f"idx_search_{table_name}_{column_name}"
     
     try:
-        with db.engine.connect() as conn:
-            # Check if index already exists
-            result = conn.execute(text(
-                "SELECT 1 FROM pg_indexes WHERE indexname = :index_name"
-            ), {"index_name": index_name})
-            
-            if result.fetchone():
-                logger.info(f"Index {index_name} already exists")
-                return
-            
+        with db.engine.begin() as conn:
             # Create the GIN index for full-text search
             conn.execute(text(
-                f"CREATE INDEX {index_name} ON {table_name} USING gin(to_tsvector('english', {column_name}))"
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} USING gin(to_tsvector('english', {column_name}))"
             ))
             
             logger.info(f"Created full-text search index {index_name} on {table_name}.{column_name}")
@@ -103,7 +156,7 @@ def analyze_table(table_name):
         # Handle PostgreSQL reserved keywords like 'user' by quoting the table name
         quoted_table_name = f'"{table_name}"' if table_name.lower() in ('user', 'order', 'group', 'table') else table_name
         
-        with db.engine.connect() as conn:
+        with db.engine.begin() as conn:
             conn.execute(text(f"ANALYZE {quoted_table_name}"))
             logger.info(f"Analyzed table {table_name}")
     except Exception as e:
@@ -111,20 +164,24 @@ def analyze_table(table_name):
 
 def optimize_queries():
     """Create indexes on commonly queried columns to optimize performance"""
+    # Composite and covering indexes declared on the models (all backends)
+    create_model_indexes()
+    
     if not is_using_postgresql():
+        # Refresh SQLite planner statistics
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.begin() as conn:
+                conn.execute(text("ANALYZE"))
         return
     
     # Create indexes for commonly queried columns
+    # (journal_item and journal_entry lookups are covered by the model indexes)
     create_index("invoice", "entity_id")
     create_index("invoice", "status_id")
     create_index("invoice", "issue_date")
     create_index("invoice", "invoice_number", unique=True)
     
     create_index("journal_entry", "entry_date")
-    create_index("journal_entry", "is_posted")
-    
-    create_index("journal_item", "journal_entry_id")
-    create_index("journal_item", "account_id")
     
     create_index("account", "account_type_id")
     create_index("account", "code", unique=True)
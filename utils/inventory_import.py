@@ -0,0 +1,486 @@
+"""
+Bulk inventory transaction import
+
+Imports stock movements (stock counts, warehouse transfers, adjustments)
+from CSV or JSON in batches. Every row is validated first against indexes of
+products, warehouses and transaction types that are loaded once per import,
+and problems are reported per row. Valid rows are then inserted with one
+executemany statement per batch, with the stock levels updated in the same
+transaction. Each batch posts one consolidated journal entry per date
+instead of one per line.
+
+Accepted fields per row (CSV headers or JSON keys, case-insensitive):
+
+    sku               required
+    quantity          required; a negative quantity is an OUT movement
+    type              IN/OUT (also increase/decrease); defaults to the
+                      sign of the quantity, and a negative quantity must
+                      not be IN
+    unit_price        defaults to the product's cost price
+    location          warehouse name or code
+    date              YYYY-MM-DD or ISO date and time; defaults to now
+    transaction_type  Adjustment, Purchase, Sale, Transfer, ...; defaults
+                      to Adjustment
+    notes
+"""
+import csv
+import io
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func, select
+
+from app import db
+from models import (
+    Account, AccountType, InventoryTransaction, InventoryTransactionType, JournalEntry, JournalItem,
+    Product, Warehouse
+)
+from utils.balances import apply_balance_deltas
+from utils.report_cache import bump_ledger_version
+from utils.stock import apply_stock_deltas
+from utils.valuation_snapshots import invalidate_valuation_snapshots
+
+logger = logging.getLogger(__name__)
+
+IMPORT_REFERENCE_TYPE = 'Import'
+IMPORT_BATCH_SIZE = 5000
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+_TYPE_ALIASES = {
+    'in': 'IN', 'increase': 'IN', 'receipt': 'IN', '+': 'IN',
+    'out': 'OUT', 'decrease': 'OUT', 'issue': 'OUT', '-': 'OUT',
+}
+
+
+class InventoryImportError(Exception):
+    """Raised when an import file cannot be read at all"""
+    pass
+
+
+#
+# Reading files
+#
+
+def _normalize_keys(row):
+    return {
+        str(key).strip().lower().replace(' ', '_'): value
+        for key, value in row.items()
+        if key is not None
+    }
+
+
+def inventory_rows_from_json(data):
+    """Import rows from parsed JSON: a list of objects or {"transactions": [...]}"""
+    if isinstance(data, dict):
+        data = data.get('transactions')
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise InventoryImportError('JSON must be a list of transactions or {"transactions": [...]}.')
+    return [_normalize_keys(row) for row in data]
+
+
+def read_inventory_rows(content, file_format):
+    """
+    Read import rows from CSV or JSON content (bytes or text).
+
+    JSON may be a list of objects or an object with a "transactions" list.
+    Returns a list of dicts with lower-case keys.
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            content = content.decode('latin-1')
+
+    if not content.strip():
+        raise InventoryImportError('The file is empty.')
+
+    if file_format == 'json':
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise InventoryImportError(f'Invalid JSON: {e}')
+        return inventory_rows_from_json(data)
+
+    if file_format == 'csv':
+        reader = csv.DictReader(io.StringIO(content))
+        if not reader.fieldnames:
+            raise InventoryImportError('The CSV file has no header row.')
+        return [_normalize_keys(row) for row in reader]
+
+    raise InventoryImportError(f'Unsupported file format: {file_format}')
+
+
+#
+# Validation
+#
+
+def _text(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _decimal(value):
+    text = _text(value).replace(',', '')
+    if not text:
+        return None
+    amount = Decimal(text)
+    if not amount.is_finite():
+        raise InvalidOperation
+    return amount
+
+
+def _parse_date(value):
+    text = _text(value)
+    if not text:
+        return None
+    return datetime.fromisoformat(text)
+
+
+class _ImportIndexes:
+    """Products, warehouses and transaction types, each loaded with one query"""
+
+    def __init__(self, skus):
+        skus = {sku.upper() for sku in skus if sku}
+        self.products = {}
+        # Chunk the IN list so very large files stay within bind parameter limits
+        skus = sorted(skus)
+        for start in range(0, len(skus), 1000):
+            chunk = skus[start:start + 1000]
+            for row in db.session.execute(
+                select(
+                    Product.id, Product.sku, Product.name, Product.cost_price, Product.is_active,
+                    Product.asset_account_id, Product.expense_account_id, Product.revenue_account_id
+                ).where(func.upper(Product.sku).in_(chunk))
+            ):
+                self.products[row.sku.upper()] = row
+
+        self.warehouses = {}
+        for warehouse_id, name, code in db.session.execute(
+            select(Warehouse.id, Warehouse.name, Warehouse.code).where(Warehouse.is_active == True)
+        ):
+            self.warehouses[code.strip().lower()] = (warehouse_id, name)
+            self.warehouses[name.strip().lower()] = (warehouse_id, name)
+
+        self.transaction_types = {
+            name.lower(): type_id
+            for type_id, name in db.session.execute(select(InventoryTransactionType.id, InventoryTransactionType.name))
+        }
+
+    def transaction_type_id(self, name):
+        """Id of a transaction type, creating a standard one on first use"""
+        type_id = self.transaction_types.get(name.lower())
+        if type_id is None:
+            transaction_type = InventoryTransactionType(name=name)
+            db.session.add(transaction_type)
+            db.session.flush()
+            type_id = self.transaction_types[name.lower()] = transaction_type.id
+        return type_id
+
+
+_STANDARD_TRANSACTION_TYPES = {
+    name.lower(): name
+    for name in (
+        InventoryTransactionType.PURCHASE, InventoryTransactionType.SALE, InventoryTransactionType.ADJUSTMENT,
+        InventoryTransactionType.RETURN_IN, InventoryTransactionType.RETURN_OUT, InventoryTransactionType.TRANSFER
+    )
+}
+
+
+def _validate_row(row, indexes, default_date):
+    """Return (movement dict, errors) for one import row"""
+    errors = []
+
+    sku = _text(row.get('sku'))
+    product = indexes.products.get(sku.upper()) if sku else None
+    if not sku:
+        errors.append('SKU is required')
+    elif product is None:
+        errors.append(f'Unknown SKU "{sku}"')
+    elif not product.is_active:
+        errors.append(f'Product "{sku}" is inactive')
+
+    quantity = None
+    try:
+        quantity = _decimal(row.get('quantity'))
+        if quantity is None:
+            errors.append('Quantity is required')
+        elif quantity == 0:
+            errors.append('Quantity must not be zero')
+    except InvalidOperation:
+        errors.append(f'Invalid quantity "{_text(row.get("quantity"))}"')
+
+    direction = _text(row.get('type')).lower()
+    if direction:
+        direction = _TYPE_ALIASES.get(direction)
+        if direction is None:
+            errors.append(f'Invalid type "{_text(row.get("type"))}" (use IN or OUT)')
+        elif direction == 'IN' and quantity is not None and quantity < 0:
+            errors.append('A negative quantity cannot have type IN')
+    elif quantity:
+        direction = 'IN' if quantity > 0 else 'OUT'
+
+    unit_price = None
+    try:
+        unit_price = _decimal(row.get('unit_price'))
+        if unit_price is not None and unit_price < 0:
+            errors.append('Unit price must not be negative')
+    except InvalidOperation:
+        errors.append(f'Invalid unit price "{_text(row.get("unit_price"))}"')
+
+    location = _text(row.get('location'))
+    warehouse_id = None
+    if location:
+        warehouse = indexes.warehouses.get(location.lower())
+        if warehouse is None and indexes.warehouses:
+            errors.append(f'Unknown location "{location}"')
+        elif warehouse is not None:
+            warehouse_id, location = warehouse
+
+    transaction_date = default_date
+    try:
+        transaction_date = _parse_date(row.get('date')) or default_date
+    except ValueError:
+        errors.append(f'Invalid date "{_text(row.get("date"))}"')
+
+    type_name = _text(row.get('transaction_type')) or InventoryTransactionType.ADJUSTMENT
+    if type_name.lower() in _STANDARD_TRANSACTION_TYPES:
+        type_name = _STANDARD_TRANSACTION_TYPES[type_name.lower()]
+    elif type_name.lower() not in indexes.transaction_types:
+        errors.append(f'Unknown transaction type "{type_name}"')
+
+    if errors:
+        return None, errors
+
+    if unit_price is None:
+        unit_price = Decimal(product.cost_price or 0)
+
+    return {
+        'product': product,
+        'transaction_type': direction,
+        'type_name': type_name,
+        'quantity': abs(quantity).quantize(CENT),
+        'unit_price': unit_price.quantize(CENT),
+        'location': location or None,
+        'warehouse_id': warehouse_id,
+        'transaction_date': transaction_date,
+        'notes': _text(row.get('notes')) or None,
+    }, []
+
+
+#
+# Journal entries
+#
+
+class _AdjustmentAccounts:
+    """
+    Offset accounts for stock adjustments, looked up once per import.
+
+    Increases are credited to the expense "Inventory Adjustment" account and
+    decreases debited to the revenue one, falling back to the product's own
+    expense/revenue account and finally to a default account created on
+    first use, as for single adjustments.
+    """
+
+    def __init__(self, created_by_id):
+        self.created_by_id = created_by_id
+        self.type_ids = {
+            name: type_id
+            for type_id, name in db.session.execute(
+                select(AccountType.id, AccountType.name).where(AccountType.name.in_((AccountType.EXPENSE, AccountType.REVENUE)))
+            )
+        }
+        self.named = {}
+        for type_name in (AccountType.EXPENSE, AccountType.REVENUE):
+            type_id = self.type_ids.get(type_name)
+            self.named[type_name] = db.session.execute(
+                select(Account.id).where(
+                    Account.account_type_id == type_id,
+                    Account.name.ilike('%inventory adjustment%')
+                ).order_by(Account.id).limit(1)
+            ).scalar() if type_id else None
+
+    def _default_account(self, type_name, code):
+        account = Account(
+            code=code,
+            name='Inventory Adjustment',
+            account_type_id=self.type_ids[type_name],
+            is_active=True,
+            created_by_id=self.created_by_id
+        )
+        db.session.add(account)
+        db.session.flush()
+        self.named[type_name] = account.id
+        return account.id
+
+    def account_for(self, product, transaction_type):
+        if transaction_type == 'IN':
+            type_name, own_account, code = AccountType.EXPENSE, product.expense_account_id, '5500'
+        else:
+            type_name, own_account, code = AccountType.REVENUE, product.revenue_account_id, '4900'
+
+        if self.named.get(type_name):
+            return self.named[type_name]
+        if own_account:
+            return own_account
+        if self.type_ids.get(type_name):
+            return self._default_account(type_name, code)
+        return None
+
+
+def _post_batch_journal_entries(connection, movements, accounts, reference, created_by_id):
+    """
+    Post one journal entry per date for a batch of movements.
+
+    Lines are netted per account, so an entry has one line per inventory
+    and offset account however many movements it covers. The lines are
+    inserted with one executemany statement and the period balances and
+    ledger version updated to match. Returns a dict of entry date -> journal
+    entry id.
+    """
+    totals = defaultdict(lambda: defaultdict(lambda: ZERO))
+    for movement in movements:
+        product = movement['product']
+        amount = (movement['quantity'] * movement['unit_price']).quantize(CENT)
+        if not amount or not product.asset_account_id:
+            continue
+        offset_account_id = accounts.account_for(product, movement['transaction_type'])
+        if offset_account_id is None:
+            continue
+
+        sign = 1 if movement['transaction_type'] == 'IN' else -1
+        entry_totals = totals[movement['transaction_date'].date()]
+        # Debit inventory on increases, credit it on decreases
+        entry_totals[product.asset_account_id] += sign * amount
+        entry_totals[offset_account_id] -= sign * amount
+
+    entry_ids = {}
+    lines = []
+    balance_deltas = {}
+    for entry_date, account_totals in sorted(totals.items()):
+        account_totals = {account_id: amount for account_id, amount in account_totals.items() if amount}
+        if not account_totals:
+            continue
+
+        journal_entry = JournalEntry(
+            entry_date=entry_date,
+            reference=reference,
+            description=f"Inventory import {reference}",
+            is_posted=True,
+            created_by_id=created_by_id
+        )
+        db.session.add(journal_entry)
+        db.session.flush()
+        entry_ids[entry_date] = journal_entry.id
+
+        for account_id, amount in sorted(account_totals.items()):
+            debit = amount if amount > 0 else ZERO
+            credit = -amount if amount < 0 else ZERO
+            lines.append({
+                'journal_entry_id': journal_entry.id,
+                'account_id': account_id,
+                'description': f"Inventory import {reference}",
+                'debit_amount': debit,
+                'credit_amount': credit,
+            })
+            key = (account_id, entry_date.year, entry_date.month)
+            previous_debit, previous_credit = balance_deltas.get(key, (ZERO, ZERO))
+            balance_deltas[key] = (previous_debit + debit, previous_credit + credit)
+
+    if lines:
+        # Core executemany: the balance listeners do not see these lines
+        connection.execute(JournalItem.__table__.insert(), lines)
+        apply_balance_deltas(connection, balance_deltas)
+        bump_ledger_version(connection)
+
+    return entry_ids
+
+
+#
+# Import
+#
+
+def import_inventory_transactions(rows, created_by_id=None, skip_invalid=False, validate_only=False,
+                                  batch_size=IMPORT_BATCH_SIZE, reference=None):
+    """
+    Validate and import inventory movements in batches.
+
+    `rows` are dicts as returned by read_inventory_rows(). Every row is
+    validated before anything is written; when any row has errors nothing is
+    imported unless `skip_invalid` is set. `validate_only` checks the rows
+    without writing.
+
+    Returns a dict with total_rows, imported, errors (a list of dicts with the
+    1-based row number, sku and messages), journal_entry_ids and reference.
+    The caller commits.
+    """
+    reference = reference or f"IMP-{datetime.now():%Y%m%d%H%M%S}"
+    result = {
+        'reference': reference,
+        'total_rows': len(rows),
+        'imported': 0,
+        'errors': [],
+        'journal_entry_ids': [],
+    }
+
+    indexes = _ImportIndexes(_text(row.get('sku')) for row in rows)
+    default_date = datetime.now()
+
+    movements = []
+    for row_number, row in enumerate(rows, start=1):
+        movement, errors = _validate_row(row, indexes, default_date)
+        if errors:
+            result['errors'].append({'row': row_number, 'sku': _text(row.get('sku')), 'messages': errors})
+        else:
+            movements.append(movement)
+
+    if validate_only or not movements or (result['errors'] and not skip_invalid):
+        return result
+
+    accounts = _AdjustmentAccounts(created_by_id)
+    table = InventoryTransaction.__table__
+    connection = db.session.connection()
+
+    for start in range(0, len(movements), batch_size):
+        batch = movements[start:start + batch_size]
+        entry_ids = _post_batch_journal_entries(connection, batch, accounts, reference, created_by_id)
+
+        stock_deltas = defaultdict(lambda: [ZERO, ZERO])
+        warehouse_ids = {}
+        values = []
+        for movement in batch:
+            product = movement['product']
+            sign = 1 if movement['transaction_type'] == 'IN' else -1
+            key = (product.id, movement['location'])
+            stock_deltas[key][0] += sign * movement['quantity']
+            stock_deltas[key][1] += sign * movement['quantity'] * movement['unit_price']
+            warehouse_ids[movement['location']] = movement['warehouse_id']
+
+            values.append({
+                'transaction_date': movement['transaction_date'],
+                'transaction_type': movement['transaction_type'],
+                'transaction_type_id': indexes.transaction_type_id(movement['type_name']),
+                'product_id': product.id,
+                'quantity': movement['quantity'],
+                'unit_price': movement['unit_price'],
+                'location': movement['location'],
+                'warehouse_id': movement['warehouse_id'],
+                'reference_type': IMPORT_REFERENCE_TYPE,
+                'notes': movement['notes'],
+                'journal_entry_id': entry_ids.get(movement['transaction_date'].date()),
+                'created_by_id': created_by_id,
+            })
+
+        # The stock listeners do not see Core inserts either
+        connection.execute(table.insert(), values)
+        apply_stock_deltas(connection, {key: tuple(delta) for key, delta in stock_deltas.items()}, warehouse_ids)
+        invalidate_valuation_snapshots(connection, min(movement['transaction_date'] for movement in batch))
+
+        result['imported'] += len(batch)
+        result['journal_entry_ids'].extend(entry_ids.values())
+
+    logger.info(f"Imported {result['imported']} inventory transactions ({reference})")
+    return result
@@ -0,0 +1,166 @@
+"""
+Set-based general ledger
+
+Opening balances for every account come from one grouped balance query and
+the period's journal lines from one ordered query, with running balances
+computed by the database using SUM() OVER (PARTITION BY account_id ...).
+Lines are streamed in batches so callers never need the whole ledger in
+memory.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from sqlalchemy import Numeric, case, func, select, type_coerce
+
+from app import db
+from models import Account, AccountType, JournalEntry, JournalItem
+from utils.balances import get_account_balances
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+# Rows fetched per round trip when streaming ledger lines
+LEDGER_BATCH_SIZE = 2000
+
+
+def _parse_ids(ids):
+    """Convert a list of (string) ids from request args to integers"""
+    if not ids:
+        return []
+    return [int(value) for value in ids if str(value).isdigit()]
+
+
+def _account_filters(account_ids, account_type_ids):
+    filters = [Account.is_active == True]
+    if account_ids:
+        filters.append(Account.id.in_(account_ids))
+    if account_type_ids:
+        filters.append(Account.account_type_id.in_(account_type_ids))
+    return filters
+
+
+def get_ledger_accounts(account_ids=None, account_type_ids=None):
+    """Get the active accounts a ledger covers, ordered by code"""
+    return db.session.execute(
+        select(
+            Account.id,
+            Account.code,
+            Account.name,
+            AccountType.name.label('account_type')
+        ).join(
+            AccountType, Account.account_type_id == AccountType.id
+        ).where(
+            *_account_filters(account_ids, account_type_ids)
+        ).order_by(Account.code)
+    ).all()
+
+
+def ledger_lines_query(start_date, end_date, account_ids=None, account_type_ids=None, include_unposted=False):
+    """
+    Build the ordered journal line query with a database-side running total.
+
+    `running_total` is the signed sum of the account's lines in the period up
+    to and including the current line; add the opening balance to get the
+    running balance.
+    """
+    debit = func.coalesce(JournalItem.debit_amount, 0)
+    credit = func.coalesce(JournalItem.credit_amount, 0)
+    signed_amount = case(
+        (AccountType.name.in_([AccountType.ASSET, AccountType.EXPENSE]), debit - credit),
+        else_=credit - debit
+    )
+    running_total = func.sum(signed_amount).over(
+        partition_by=JournalItem.account_id,
+        order_by=(JournalEntry.entry_date, JournalEntry.id, JournalItem.id)
+    )
+
+    query = select(
+        JournalItem.id.label('item_id'),
+        JournalItem.account_id,
+        Account.code.label('account_code'),
+        JournalEntry.id.label('entry_id'),
+        JournalEntry.entry_date,
+        JournalEntry.reference,
+        JournalEntry.description.label('entry_description'),
+        JournalItem.description.label('item_description'),
+        JournalItem.debit_amount,
+        JournalItem.credit_amount,
+        type_coerce(running_total, Numeric(16, 2)).label('running_total')
+    ).join(
+        JournalEntry, JournalItem.journal_entry_id == JournalEntry.id
+    ).join(
+        Account, JournalItem.account_id == Account.id
+    ).join(
+        AccountType, Account.account_type_id == AccountType.id
+    ).where(
+        JournalEntry.entry_date >= start_date,
+        JournalEntry.entry_date <= end_date,
+        *_account_filters(account_ids, account_type_ids)
+    )
+
+    if not include_unposted:
+        query = query.where(JournalEntry.is_posted == True)
+
+    return query.order_by(Account.code, JournalEntry.entry_date, JournalEntry.id, JournalItem.id)
+
+
+def iter_general_ledger(start_date, end_date, account_ids=None, account_type_ids=None,
+                        include_unposted=False, batch_size=LEDGER_BATCH_SIZE):
+    """
+    Stream the general ledger as (account, entry) pairs in account code order.
+
+    `account` is a dict with id, code, name, type and starting_balance. Each
+    ledger line yields one pair with its entry dict; an account with an
+    opening balance but no lines in the period yields a single pair with
+    entry set to None. Accounts with neither are skipped.
+    """
+    account_ids = _parse_ids(account_ids)
+    account_type_ids = _parse_ids(account_type_ids)
+
+    accounts = get_ledger_accounts(account_ids, account_type_ids)
+    if not accounts:
+        return
+
+    # Opening balances for every account in one grouped query
+    filtered = bool(account_ids or account_type_ids)
+    opening_balances = get_account_balances(
+        [account.id for account in accounts] if filtered else None,
+        end_date=start_date - timedelta(days=1)
+    )
+
+    lines = db.session.execute(
+        ledger_lines_query(start_date, end_date, account_ids, account_type_ids, include_unposted),
+        execution_options={'yield_per': batch_size}
+    )
+    lines = iter(lines)
+    line = next(lines, None)
+
+    for account in accounts:
+        account_data = {
+            'id': account.id,
+            'code': account.code,
+            'name': account.name,
+            'type': account.account_type,
+            'starting_balance': opening_balances.get(account.id, ZERO)
+        }
+
+        has_entries = False
+        while line is not None and line.account_id == account.id:
+            has_entries = True
+            yield account_data, {
+                'entry_id': line.entry_id,
+                'entry_date': line.entry_date,
+                'reference': line.reference or f"JE-{line.entry_id}",
+                'entry_description': line.entry_description,
+                'account_code': line.account_code,
+                'item_description': line.item_description,
+                'debit_amount': Decimal(line.debit_amount) if line.debit_amount else ZERO,
+                'credit_amount': Decimal(line.credit_amount) if line.credit_amount else ZERO,
+                'running_balance': account_data['starting_balance'] + (line.running_total or ZERO)
+            }
+            line = next(lines, None)
+
+        if not has_entries and account_data['starting_balance'] != 0:
+            yield account_data, None
@@ -0,0 +1,412 @@
+"""
+Batch purchase order receiving
+
+Records a receipt document covering any number of purchase orders and
+lines in one pass: quantities received are added to the PO lines, an IN
+inventory transaction is written per line, stock levels are updated and
+every PO touched moves to Partially Received or Received. The receipt posts
+one journal entry (inventory debited, accounts payable credited) netted per
+account.
+
+All lines are loaded and validated up front and the writes are executemany
+statements, so a receipt takes the same number of queries whether it has
+ten lines or ten thousand.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import bindparam, func, or_, select
+
+from app import db
+from models import (
+    Account, AccountType, InventoryTransaction, InventoryTransactionType, JournalEntry, JournalItem,
+    Product, PurchaseOrder, PurchaseOrderItem, PurchaseOrderStatus, Warehouse
+)
+from utils.balances import apply_balance_deltas
+from utils.inventory_import import _decimal, _text
+from utils.reorder import PO_REFERENCE_TYPE
+from utils.report_cache import bump_ledger_version
+from utils.stock import apply_stock_deltas, stock_location, warehouse_index
+from utils.valuation_snapshots import invalidate_valuation_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Purchase orders that can be received against
+RECEIVABLE_STATUSES = (
+    PurchaseOrderStatus.SUBMITTED,
+    PurchaseOrderStatus.APPROVED,
+    PurchaseOrderStatus.PARTIALLY_RECEIVED,
+)
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def _status_ids():
+    """Purchase order status name -> id, creating missing statuses"""
+    statuses = {name: status_id for status_id, name in db.session.execute(
+        select(PurchaseOrderStatus.id, PurchaseOrderStatus.name)
+    )}
+    missing = [
+        name for name in (PurchaseOrderStatus.PARTIALLY_RECEIVED, PurchaseOrderStatus.RECEIVED)
+        if name not in statuses
+    ]
+    if missing:
+        new_statuses = [PurchaseOrderStatus(name=name) for name in missing]
+        db.session.add_all(new_statuses)
+        db.session.flush()
+        statuses.update({status.name: status.id for status in new_statuses})
+    return statuses
+
+
+def _purchase_type_id():
+    type_id = db.session.execute(
+        select(InventoryTransactionType.id).where(InventoryTransactionType.name == InventoryTransactionType.PURCHASE)
+    ).scalar()
+    if type_id is None:
+        transaction_type = InventoryTransactionType(name=InventoryTransactionType.PURCHASE)
+        db.session.add(transaction_type)
+        db.session.flush()
+        type_id = transaction_type.id
+    return type_id
+
+
+def _load_order_lines(item_ids, po_ids, po_numbers):
+    """
+    Every line of the purchase orders referenced by the receipt, in one query.
+
+    All lines are needed, not only the received ones, to work out whether
+    each purchase order is now fully received.
+    """
+    conditions = []
+    if item_ids:
+        conditions.append(PurchaseOrder.id.in_(
+            select(PurchaseOrderItem.po_id).where(PurchaseOrderItem.id.in_(item_ids)).scalar_subquery()
+        ))
+    if po_ids:
+        conditions.append(PurchaseOrder.id.in_(po_ids))
+    if po_numbers:
+        # Generated numbers are upper case; keep the lookup on the unique index
+        conditions.append(PurchaseOrder.po_number.in_(po_numbers | {number.upper() for number in po_numbers}))
+    if not conditions:
+        return []
+
+    return db.session.execute(
+        select(
+            PurchaseOrderItem.id,
+            PurchaseOrderItem.po_id,
+            PurchaseOrderItem.quantity_ordered,
+            PurchaseOrderItem.quantity_received,
+            PurchaseOrderItem.unit_price,
+            PurchaseOrder.po_number,
+            PurchaseOrderStatus.name.label('status'),
+            PurchaseOrder.warehouse_id,
+            Warehouse.name.label('warehouse'),
+            Product.id.label('product_id'),
+            Product.sku,
+            Product.asset_account_id
+        ).join(
+            PurchaseOrder, PurchaseOrderItem.po_id == PurchaseOrder.id
+        ).join(
+            PurchaseOrderStatus, PurchaseOrder.status_id == PurchaseOrderStatus.id
+        ).join(
+            Product, PurchaseOrderItem.product_id == Product.id
+        ).outerjoin(
+            Warehouse, PurchaseOrder.warehouse_id == Warehouse.id
+        ).where(
+            or_(*conditions)
+        ).order_by(
+            PurchaseOrderItem.po_id, PurchaseOrderItem.id
+        )
+    ).all()
+
+
+def _payable_account_id(created_by_id):
+    """Accounts payable account credited for received goods"""
+    liability_type_id = db.session.execute(
+        select(AccountType.id).where(AccountType.name == AccountType.LIABILITY)
+    ).scalar()
+    if liability_type_id is None:
+        return None
+
+    account_id = db.session.execute(
+        select(Account.id).where(
+            Account.account_type_id == liability_type_id,
+            Account.name.like('%Accounts Payable%')
+        ).order_by(Account.id).limit(1)
+    ).scalar()
+    if account_id is None:
+        account = Account(
+            code='2000',
+            name='Accounts Payable',
+            account_type_id=liability_type_id,
+            is_active=True,
+            created_by_id=created_by_id
+        )
+        db.session.add(account)
+        db.session.flush()
+        account_id = account.id
+    return account_id
+
+
+def _validate_lines(lines, order_lines):
+    """Match receipt lines to PO lines; returns (quantities per item id, prices, errors)"""
+    by_id = {line.id: line for line in order_lines}
+    by_po_sku = {(line.po_number.upper(), line.sku.upper()): line for line in order_lines}
+    by_po_id_sku = {(line.po_id, line.sku.upper()): line for line in order_lines}
+
+    received = defaultdict(lambda: ZERO)
+    prices = {}
+    errors = []
+    for number, line in enumerate(lines, start=1):
+        messages = []
+
+        order_line = None
+        if line.get('po_item_id'):
+            try:
+                order_line = by_id.get(int(line['po_item_id']))
+            except (TypeError, ValueError):
+                pass
+        elif line.get('sku'):
+            sku = _text(line['sku']).upper()
+            if line.get('po_id'):
+                try:
+                    order_line = by_po_id_sku.get((int(line['po_id']), sku))
+                except (TypeError, ValueError):
+                    pass
+            elif line.get('po_number'):
+                order_line = by_po_sku.get((_text(line['po_number']).upper(), sku))
+        else:
+            messages.append('Give po_item_id, or sku with po_id or po_number')
+
+        if order_line is None and not messages:
+            messages.append('No matching purchase order line')
+        elif order_line is not None and order_line.status not in RECEIVABLE_STATUSES:
+            messages.append(f'Purchase order {order_line.po_number} is {order_line.status}')
+
+        try:
+            quantity = _decimal(line.get('quantity'))
+            if quantity is None or quantity <= 0:
+                messages.append('Quantity must be greater than zero')
+        except InvalidOperation:
+            quantity = None
+            messages.append(f'Invalid quantity "{_text(line.get("quantity"))}"')
+
+        try:
+            unit_price = _decimal(line.get('unit_price'))
+            if unit_price is not None and unit_price < 0:
+                messages.append('Unit price must not be negative')
+        except InvalidOperation:
+            unit_price = None
+            messages.append(f'Invalid unit price "{_text(line.get("unit_price"))}"')
+
+        if messages:
+            errors.append({'line': number, 'messages': messages})
+            continue
+
+        received[order_line.id] += quantity.quantize(CENT)
+        if unit_price is not None:
+            prices[order_line.id] = unit_price.quantize(CENT)
+
+    # Over-receipt is checked on the totals, so split lines are caught too
+    for item_id, quantity in received.items():
+        order_line = by_id[item_id]
+        outstanding = Decimal(order_line.quantity_ordered) - Decimal(order_line.quantity_received or 0)
+        if quantity > outstanding:
+            errors.append({
+                'line': None,
+                'messages': [
+                    f'{order_line.po_number} {order_line.sku}: receiving {quantity} but only {outstanding} outstanding'
+                ]
+            })
+
+    return received, prices, errors
+
+
+def receive_purchase_orders(lines, receipt_date=None, location=None, reference=None, notes=None,
+                            created_by_id=None):
+    """
+    Receive a receipt document against purchase orders.
+
+    Each line is a dict with `quantity` and either `po_item_id`, or `sku`
+    with `po_id` or `po_number`; `unit_price` overrides the PO price. Stock
+    goes to the warehouse named (or coded) `location`, or the PO's warehouse
+    when none is given. Nothing is written if any line is invalid or receives
+    more than is outstanding.
+
+    Returns a dict with lines, quantity, purchase_orders (ids and new
+    statuses), journal_entry_id and errors. The caller commits.
+    """
+    receipt_date = receipt_date or datetime.now()
+    result = {
+        'lines': 0,
+        'quantity': ZERO,
+        'purchase_orders': {},
+        'journal_entry_id': None,
+        'errors': [],
+    }
+    if not lines:
+        result['errors'].append({'line': None, 'messages': ['The receipt has no lines']})
+        return result
+
+    item_ids, po_ids, po_numbers = set(), set(), set()
+    for line in lines:
+        try:
+            if line.get('po_item_id'):
+                item_ids.add(int(line['po_item_id']))
+            elif line.get('po_id'):
+                po_ids.add(int(line['po_id']))
+        except (TypeError, ValueError):
+            continue
+        if line.get('po_number'):
+            po_numbers.add(_text(line['po_number']))
+
+    order_lines = _load_order_lines(item_ids, po_ids, po_numbers)
+    received, prices, errors = _validate_lines(lines, order_lines)
+
+    # Receiving warehouse given for the whole document
+    warehouse = None
+    if location:
+        warehouse = warehouse_index(db.session.connection()).get(_text(location).lower())
+        if warehouse is None:
+            errors.append({'line': None, 'messages': [f'Unknown warehouse "{location}"']})
+
+    if errors:
+        result['errors'] = errors
+        return result
+
+    statuses = _status_ids()
+    purchase_type_id = _purchase_type_id()
+    payable_account_id = _payable_account_id(created_by_id)
+
+    by_id = {line.id: line for line in order_lines}
+    reference = reference or f"RCV-{receipt_date:%Y%m%d%H%M%S}"
+
+    # Journal entry: debit each inventory account, credit accounts payable
+    inventory_totals = defaultdict(lambda: ZERO)
+    for item_id, quantity in received.items():
+        order_line = by_id[item_id]
+        amount = (quantity * prices.get(item_id, Decimal(order_line.unit_price))).quantize(CENT)
+        if amount and order_line.asset_account_id:
+            inventory_totals[order_line.asset_account_id] += amount
+
+    journal_entry_id = None
+    connection = db.session.connection()
+    if inventory_totals and payable_account_id:
+        journal_entry = JournalEntry(
+            entry_date=receipt_date.date(),
+            reference=reference,
+            description=f"Goods received {reference}",
+            is_posted=True,
+            created_by_id=created_by_id
+        )
+        db.session.add(journal_entry)
+        db.session.flush()
+        journal_entry_id = journal_entry.id
+
+        total = sum(inventory_totals.values(), ZERO)
+        journal_lines = [
+            {
+                'journal_entry_id': journal_entry_id,
+                'account_id': account_id,
+                'description': f"Goods received {reference}",
+                'debit_amount': amount,
+                'credit_amount': ZERO,
+            }
+            for account_id, amount in sorted(inventory_totals.items())
+        ]
+        journal_lines.append({
+            'journal_entry_id': journal_entry_id,
+            'account_id': payable_account_id,
+            'description': f"Goods received {reference}",
+            'debit_amount': ZERO,
+            'credit_amount': total,
+        })
+
+        balance_deltas = defaultdict(lambda: [ZERO, ZERO])
+        for journal_line in journal_lines:
+            key = (journal_line['account_id'], receipt_date.year, receipt_date.month)
+            balance_deltas[key][0] += journal_line['debit_amount']
+            balance_deltas[key][1] += journal_line['credit_amount']
+
+        # Core inserts: the balance listeners do not see these lines
+        connection.execute(JournalItem.__table__.insert(), journal_lines)
+        apply_balance_deltas(connection, {key: tuple(delta) for key, delta in balance_deltas.items()})
+        bump_ledger_version(connection)
+
+    # PO lines
+    item_table = PurchaseOrderItem.__table__
+    connection.execute(
+        item_table.update().where(
+            item_table.c.id == bindparam('item_id')
+        ).values(
+            # Lines created outside the ORM may have no quantity received yet
+            quantity_received=func.coalesce(item_table.c.quantity_received, 0) + bindparam('quantity')
+        ),
+        [{'item_id': item_id, 'quantity': quantity} for item_id, quantity in sorted(received.items())]
+    )
+
+    # Inventory movements and stock levels
+    transactions = []
+    stock_deltas = defaultdict(lambda: [ZERO, ZERO])
+    warehouse_ids = {}
+    for item_id, quantity in sorted(received.items()):
+        order_line = by_id[item_id]
+        unit_price = prices.get(item_id, Decimal(order_line.unit_price))
+        warehouse_id, stock_at = warehouse or (order_line.warehouse_id, order_line.warehouse)
+        warehouse_ids[stock_location(stock_at)] = warehouse_id
+        transactions.append({
+            'transaction_date': receipt_date,
+            'transaction_type': 'IN',
+            'transaction_type_id': purchase_type_id,
+            'product_id': order_line.product_id,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'location': stock_at,
+            'warehouse_id': warehouse_id,
+            'reference_type': PO_REFERENCE_TYPE,
+            'reference_id': order_line.po_id,
+            'notes': notes or f"Received {reference}",
+            'journal_entry_id': journal_entry_id,
+            'created_by_id': created_by_id,
+        })
+        key = (order_line.product_id, stock_location(stock_at))
+        stock_deltas[key][0] += quantity
+        stock_deltas[key][1] += quantity * unit_price
+
+    connection.execute(InventoryTransaction.__table__.insert(), transactions)
+    apply_stock_deltas(connection, {key: tuple(delta) for key, delta in stock_deltas.items()}, warehouse_ids)
+    invalidate_valuation_snapshots(connection, receipt_date)
+
+    # PO statuses from the received totals of all their lines
+    fully_received = {}
+    for order_line in order_lines:
+        total_received = Decimal(order_line.quantity_received or 0) + received.get(order_line.id, ZERO)
+        complete = total_received >= Decimal(order_line.quantity_ordered)
+        fully_received[order_line.po_id] = fully_received.get(order_line.po_id, True) and complete
+
+    touched = {by_id[item_id].po_id for item_id in received}
+    new_statuses = {
+        po_id: PurchaseOrderStatus.RECEIVED if fully_received[po_id] else PurchaseOrderStatus.PARTIALLY_RECEIVED
+        for po_id in sorted(touched)
+    }
+    order_table = PurchaseOrder.__table__
+    connection.execute(
+        order_table.update().where(order_table.c.id == bindparam('order_id')).values(status_id=bindparam('status_id')),
+        [{'order_id': po_id, 'status_id': statuses[status]} for po_id, status in new_statuses.items()]
+    )
+
+    # Receipts were written with Core; drop any stale copies from the session
+    db.session.expire_all()
+
+    result.update({
+        'lines': len(received),
+        'quantity': sum(received.values(), ZERO),
+        'purchase_orders': new_statuses,
+        'journal_entry_id': journal_entry_id,
+        'reference': reference,
+    })
+    logger.info(f"Received {len(received)} lines on {len(touched)} purchase orders ({reference})")
+    return result
@@ -0,0 +1,178 @@
+"""
+SQL query counter and N+1 detector
+
+Records the number of queries, total database time and repeated statement
+fingerprints while a block of code (or a request) runs. A statement shape
+that repeats many times in one request is almost always a lazy load inside a
+loop, so those are logged as probable N+1 patterns.
+
+Per-request profiling is opt-in (QUERY_PROFILING=1) and adds
+X-Query-Count and Server-Timing headers to every response. The
+count_queries() / assert_max_queries() helpers work without it and are
+what tests use to enforce query budgets.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# A fingerprint seen this many times in one request is flagged as N+1
+N_PLUS_ONE_THRESHOLD = 10
+
+_local = threading.local()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_RE = re.compile(r'%\([^)]+\)s|%s|:\w+|\?')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def fingerprint(statement):
+    """Reduce a SQL statement to its shape, ignoring literal values"""
+    statement = _WHITESPACE_RE.sub(' ', statement.strip())
+    statement = _STRING_RE.sub('?', statement)
+    statement = _PARAM_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _IN_LIST_RE.sub('(?)', statement)
+    return statement
+
+
+class QueryStats:
+    """Queries executed while a collector is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self.fingerprints = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements.append(statement)
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """Statement fingerprints executed at least `threshold` times"""
+        return [(shape, count) for shape, count in self.fingerprints.most_common() if count >= threshold]
+
+    def summary(self, limit=5):
+        lines = [f"{self.count} queries in {self.duration * 1000:.1f} ms"]
+        for shape, count in self.fingerprints.most_common(limit):
+            lines.append(f"  {count}x {shape[:200]}")
+        return '\n'.join(lines)
+
+
+def _active_collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_collectors():
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _active_collectors()
+    if not collectors:
+        return
+    start_times = conn.info.get('query_start_time')
+    duration = time.perf_counter() - start_times.pop() if start_times else 0.0
+    for stats in collectors:
+        stats.record(statement, duration)
+
+
+def register_query_listeners():
+    """Listen to every engine's cursor executions (idempotent)"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """Collect the queries executed inside the block into a QueryStats"""
+    register_query_listeners()
+    stats = QueryStats()
+    collectors = _active_collectors()
+    collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        collectors.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_queries, max_repeats=None):
+    """
+    Fail if the block runs more than `max_queries` queries, or (when given)
+    repeats one statement shape more than `max_repeats` times.
+    """
+    with count_queries() as stats:
+        yield stats
+
+    if stats.count > max_queries:
+        raise AssertionError(f"Query budget exceeded: expected at most {max_queries}, got {stats.summary()}")
+    if max_repeats is not None:
+        repeated = stats.repeated(max_repeats + 1)
+        if repeated:
+            shape, count = repeated[0]
+            raise AssertionError(f"Probable N+1: statement ran {count} times (max {max_repeats}): {shape[:200]}")
+
+
+#
+# Per-request profiling
+#
+
+def _start_request_profiling():
+    g._query_stats = QueryStats()
+    g._request_start_time = time.perf_counter()
+    _active_collectors().append(g._query_stats)
+
+
+def _finish_request_profiling(response):
+    stats = g.pop('_query_stats', None)
+    if stats is None:
+        return response
+    if stats in _active_collectors():
+        _active_collectors().remove(stats)
+
+    total = time.perf_counter() - g.pop('_request_start_time', time.perf_counter())
+    response.headers['X-Query-Count'] = str(stats.count)
+    response.headers['Server-Timing'] = (
+        f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", '
+        f'app;dur={total * 1000:.1f}'
+    )
+
+    for shape, count in stats.repeated():
+        logger.warning(f"Probable N+1 on {request.method} {request.path}: {count}x {shape[:300]}")
+    return response
+
+
+def _discard_request_profiling(exc):
+    # Make sure a failed request does not leave its collector active
+    stats = g.pop('_query_stats', None)
+    if stats is not None and stats in _active_collectors():
+        _active_collectors().remove(stats)
+
+
+def init_query_profiler(app):
+    """Enable per-request query counting when QUERY_PROFILING is set"""
+    if not app.config.get('QUERY_PROFILING'):
+        return
+
+    register_query_listeners()
+    app.before_request(_start_request_profiling)
+    app.after_request(_finish_request_profiling)
+    app.teardown_request(_discard_request_profiling)
@@ -0,0 +1,410 @@
+"""
+Demand forecasting and reorder points
+
+Computes, for every active product in one batch, the average daily demand
+and its variability over a trailing window of OUT movements, the supplier
+lead time observed on past purchase orders, and from those the safety stock,
+reorder point and suggested order quantity.
+
+Demand and lead times are aggregated in SQL (one row per product and day,
+one row per purchase order line) and the statistics are computed with NumPy
+over whole arrays, so tens of thousands of SKUs take seconds.
+
+    safety stock  = z * sqrt(L * sd_d^2 + d^2 * sd_L^2)
+    reorder point = d * L + safety stock
+    order-up-to   = reorder point + d * review days
+    suggested qty = order-up-to - (on hand + on order), when stock is at or
+                    below the reorder point
+"""
+import logging
+import math
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app import db
+from models import (
+    InventoryTransaction, Product, ProductStock, PurchaseOrder, PurchaseOrderItem,
+    PurchaseOrderStatus
+)
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the reorder calculation
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_SERVICE_LEVEL = 0.95
+DEFAULT_LEAD_TIME_DAYS = 14
+DEFAULT_REVIEW_DAYS = 14
+
+# reference_type of inventory receipts against a purchase order
+PO_REFERENCE_TYPE = 'PO'
+
+# Purchase orders whose remaining quantity no longer counts as on order
+_CLOSED_PO_STATUSES = (PurchaseOrderStatus.RECEIVED, PurchaseOrderStatus.CANCELLED)
+
+
+def _product_arrays(product_ids):
+    """Active products as parallel arrays ordered by id"""
+    query = select(
+        Product.id,
+        Product.reorder_level,
+        Product.preferred_vendor_id
+    ).where(Product.is_active == True).order_by(Product.id)
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+
+    rows = db.session.execute(query).all()
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    reorder_levels = np.fromiter((float(row[1] or 0) for row in rows), dtype=np.float64, count=len(rows))
+    vendor_ids = np.fromiter((row[2] or 0 for row in rows), dtype=np.int64, count=len(rows))
+    return ids, reorder_levels, vendor_ids
+
+
+def _index_of(ids, values):
+    """Row index in the sorted `ids` array for each value, -1 when absent"""
+    values = np.asarray(values, dtype=np.int64)
+    if not len(ids) or not len(values):
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.searchsorted(ids, values)
+    positions = np.minimum(positions, len(ids) - 1)
+    return np.where(ids[positions] == values, positions, -1)
+
+
+def _daily_demand(ids, start, end):
+    """
+    Mean and standard deviation of daily OUT quantity per product.
+
+    Days without movements count as zero demand. The query returns one row
+    per product and day; the per-product sums and sums of squares come from
+    np.bincount.
+    """
+    day = func.date(InventoryTransaction.transaction_date)
+    rows = db.session.execute(
+        select(
+            InventoryTransaction.product_id,
+            func.sum(InventoryTransaction.quantity)
+        ).where(
+            InventoryTransaction.transaction_type == 'OUT',
+            InventoryTransaction.transaction_date >= datetime.combine(start, time.min),
+            InventoryTransaction.transaction_date < datetime.combine(end + timedelta(days=1), time.min)
+        ).group_by(
+            InventoryTransaction.product_id, day
+        )
+    ).all()
+
+    days = (end - start).days + 1
+    if not rows:
+        zeros = np.zeros(len(ids))
+        return zeros, zeros.copy()
+
+    index = _index_of(ids, [row[0] for row in rows])
+    quantities = np.fromiter((float(row[1] or 0) for row in rows), dtype=np.float64, count=len(rows))
+    known = index >= 0
+
+    totals = np.bincount(index[known], weights=quantities[known], minlength=len(ids))
+    squares = np.bincount(index[known], weights=quantities[known] ** 2, minlength=len(ids))
+
+    mean = totals / days
+    variance = np.maximum(squares / days - mean ** 2, 0.0)
+    return mean, np.sqrt(variance)
+
+
+def _lead_times(ids, vendor_ids, default_lead_time):
+    """
+    Mean and standard deviation of supplier lead time (days) per product.
+
+    Each purchase order line contributes order date -> first receipt of the
+    product against that order, or the expected delivery date when nothing
+    was received yet. Products without history fall back to their preferred
+    vendor's average, then to `default_lead_time`.
+    """
+    first_receipt = select(
+        InventoryTransaction.reference_id.label('po_id'),
+        InventoryTransaction.product_id.label('product_id'),
+        func.min(InventoryTransaction.transaction_date).label('received_at')
+    ).where(
+        InventoryTransaction.reference_type == PO_REFERENCE_TYPE,
+        InventoryTransaction.transaction_type == 'IN'
+    ).group_by(
+        InventoryTransaction.reference_id, InventoryTransaction.product_id
+    ).subquery()
+
+    rows = db.session.execute(
+        select(
+            PurchaseOrderItem.product_id,
+            PurchaseOrder.vendor_id,
+            PurchaseOrder.order_date,
+            PurchaseOrder.expected_delivery_date,
+            first_receipt.c.received_at
+        ).join(
+            PurchaseOrder, PurchaseOrderItem.po_id == PurchaseOrder.id
+        ).outerjoin(
+            first_receipt,
+            (first_receipt.c.po_id == PurchaseOrder.id) & (first_receipt.c.product_id == PurchaseOrderItem.product_id)
+        )
+    ).all()
+
+    mean = np.full(len(ids), float(default_lead_time))
+    std = np.zeros(len(ids))
+
+    samples = []
+    for product_id, vendor_id, order_date, expected_date, received_at in rows:
+        arrived = received_at or expected_date
+        if order_date is None or arrived is None:
+            continue
+        if isinstance(arrived, str):
+            arrived = datetime.fromisoformat(arrived)
+        if isinstance(arrived, datetime):
+            arrived = arrived.date()
+        samples.append((product_id, vendor_id, max((arrived - order_date).days, 0)))
+
+    if not samples:
+        return mean, std
+
+    sample_products = np.array([sample[0] for sample in samples], dtype=np.int64)
+    sample_vendors = np.array([sample[1] or 0 for sample in samples], dtype=np.int64)
+    sample_days = np.array([sample[2] for sample in samples], dtype=np.float64)
+
+    # Per product
+    index = _index_of(ids, sample_products)
+    known = index >= 0
+    counts = np.bincount(index[known], minlength=len(ids))
+    totals = np.bincount(index[known], weights=sample_days[known], minlength=len(ids))
+    squares = np.bincount(index[known], weights=sample_days[known] ** 2, minlength=len(ids))
+    has_history = counts > 0
+    safe_counts = np.maximum(counts, 1)
+    product_mean = totals / safe_counts
+    product_std = np.sqrt(np.maximum(squares / safe_counts - product_mean ** 2, 0.0))
+
+    # Per vendor, for products never ordered before
+    vendor_keys, vendor_index = np.unique(sample_vendors, return_inverse=True)
+    vendor_mean = np.bincount(vendor_index, weights=sample_days) / np.bincount(vendor_index)
+    product_vendor = _index_of(vendor_keys, vendor_ids)
+    has_vendor = (product_vendor >= 0) & (vendor_ids != 0)
+
+    mean = np.where(has_vendor, vendor_mean[np.maximum(product_vendor, 0)], mean)
+    mean = np.where(has_history, product_mean, mean)
+    std = np.where(has_history, product_std, std)
+    return mean, std
+
+
+def _stock_positions(ids):
+    """On-hand quantity and quantity still on order per product"""
+    on_hand = np.zeros(len(ids))
+    on_order = np.zeros(len(ids))
+
+    stock_rows = db.session.execute(
+        select(ProductStock.product_id, func.sum(ProductStock.quantity)).group_by(ProductStock.product_id)
+    ).all()
+    if stock_rows:
+        index = _index_of(ids, [row[0] for row in stock_rows])
+        quantities = np.array([float(row[1] or 0) for row in stock_rows])
+        known = index >= 0
+        on_hand[index[known]] = quantities[known]
+
+    open_rows = db.session.execute(
+        select(
+            PurchaseOrderItem.product_id,
+            func.sum(PurchaseOrderItem.quantity_ordered - func.coalesce(PurchaseOrderItem.quantity_received, 0))
+        ).join(
+            PurchaseOrder, PurchaseOrderItem.po_id == PurchaseOrder.id
+        ).join(
+            PurchaseOrderStatus, PurchaseOrder.status_id == PurchaseOrderStatus.id
+        ).where(
+            PurchaseOrderStatus.name.notin_(_CLOSED_PO_STATUSES)
+        ).group_by(PurchaseOrderItem.product_id)
+    ).all()
+    if open_rows:
+        index = _index_of(ids, [row[0] for row in open_rows])
+        quantities = np.array([max(float(row[1] or 0), 0.0) for row in open_rows])
+        known = index >= 0
+        on_order[index[known]] = quantities[known]
+
+    return on_hand, on_order
+
+
+def compute_reorder_points(as_of=None, window_days=DEFAULT_WINDOW_DAYS, service_level=DEFAULT_SERVICE_LEVEL,
+                           default_lead_time=DEFAULT_LEAD_TIME_DAYS, review_days=DEFAULT_REVIEW_DAYS,
+                           product_ids=None):
+    """
+    Compute demand statistics and reorder points for every active product.
+
+    Returns a dict of NumPy arrays aligned on `product_id`: daily_demand,
+    demand_std, lead_time, lead_time_std, safety_stock, reorder_point,
+    on_hand, on_order, days_of_cover and suggested_quantity, plus the
+    current reorder_level and preferred_vendor_id (0 when unset).
+    """
+    if not 0 < service_level < 1:
+        raise ValueError("Service level must be between 0 and 1")
+
+    as_of = as_of or date.today()
+    start = as_of - timedelta(days=window_days - 1)
+
+    ids, reorder_levels, vendor_ids = _product_arrays(product_ids)
+
+    daily_demand, demand_std = _daily_demand(ids, start, as_of)
+    lead_time, lead_time_std = _lead_times(ids, vendor_ids, default_lead_time)
+    on_hand, on_order = _stock_positions(ids)
+
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = z * np.sqrt(lead_time * demand_std ** 2 + daily_demand ** 2 * lead_time_std ** 2)
+    reorder_point = daily_demand * lead_time + safety_stock
+    order_up_to = reorder_point + daily_demand * review_days
+
+    position = on_hand + on_order
+    needs_order = (daily_demand > 0) & (position <= reorder_point)
+    suggested = np.where(needs_order, np.ceil(np.maximum(order_up_to - position, 0.0)), 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(daily_demand > 0, on_hand / daily_demand, np.inf)
+
+    return {
+        'product_id': ids,
+        'preferred_vendor_id': vendor_ids,
+        'reorder_level': reorder_levels,
+        'daily_demand': daily_demand,
+        'demand_std': demand_std,
+        'lead_time': lead_time,
+        'lead_time_std': lead_time_std,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'on_hand': on_hand,
+        'on_order': on_order,
+        'days_of_cover': days_of_cover,
+        'suggested_quantity': suggested,
+    }
+
+
+def get_reorder_suggestions(limit=None, **options):
+    """
+    Products that should be reordered now, most urgent (fewest days of stock) first.
+
+    Accepts the options of compute_reorder_points(). Each suggestion is a dict
+    with the product and its computed figures; products are loaded in one
+    query for the suggestions only.
+    """
+    points = compute_reorder_points(**options)
+
+    selected = np.flatnonzero(points['suggested_quantity'] > 0)
+    selected = selected[np.argsort(points['days_of_cover'][selected], kind='stable')]
+    if limit:
+        selected = selected[:limit]
+    if not len(selected):
+        return []
+
+    product_ids = [int(value) for value in points['product_id'][selected]]
+    products = {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(product_ids)).all()
+    }
+
+    suggestions = []
+    for row in selected:
+        product = products.get(int(points['product_id'][row]))
+        if product is None:
+            continue
+        days_of_cover = float(points['days_of_cover'][row])
+        suggestions.append({
+            'product': product,
+            'preferred_vendor_id': int(points['preferred_vendor_id'][row]) or None,
+            'daily_demand': round(float(points['daily_demand'][row]), 2),
+            'demand_std': round(float(points['demand_std'][row]), 2),
+            'lead_time': round(float(points['lead_time'][row]), 1),
+            'safety_stock': math.ceil(float(points['safety_stock'][row])),
+            'reorder_point': math.ceil(float(points['reorder_point'][row])),
+            'on_hand': float(points['on_hand'][row]),
+            'on_order': float(points['on_order'][row]),
+            'days_of_cover': round(days_of_cover, 1) if math.isfinite(days_of_cover) else None,
+            'suggested_quantity': int(points['suggested_quantity'][row]),
+        })
+    return suggestions
+
+
+def update_reorder_levels(levels):
+    """
+    Store computed reorder points as the products' reorder levels.
+
+    `levels` maps product_id to the new reorder level; all rows are updated
+    with one executemany statement. The caller commits.
+    """
+    if not levels:
+        return 0
+
+    table = Product.__table__
+    db.session.execute(
+        table.update().where(table.c.id == db.bindparam('product_id')).values(reorder_level=db.bindparam('level')),
+        [{'product_id': product_id, 'level': level} for product_id, level in levels.items()]
+    )
+    return len(levels)
+
+
+def create_draft_purchase_orders(quantities, created_by_id=None, order_date=None):
+    """
+    Turn reorder quantities into draft purchase orders, one per preferred vendor.
+
+    `quantities` maps product_id to the quantity to order. Lines are priced at
+    the product's cost price. Returns (purchase_orders, skipped_products),
+    where skipped products have no preferred vendor. The caller commits.
+    """
+    from core_utils import generate_po_number
+
+    quantities = {
+        int(product_id): Decimal(str(quantity))
+        for product_id, quantity in quantities.items()
+        if quantity and quantity > 0
+    }
+    if not quantities:
+        return [], []
+
+    products = Product.query.filter(Product.id.in_(list(quantities))).order_by(Product.name).all()
+
+    by_vendor = {}
+    skipped = []
+    for product in products:
+        if not product.preferred_vendor_id:
+            skipped.append(product)
+            continue
+        by_vendor.setdefault(product.preferred_vendor_id, []).append(product)
+
+    if not by_vendor:
+        return [], skipped
+
+    draft_status = PurchaseOrderStatus.query.filter_by(name=PurchaseOrderStatus.DRAFT).first()
+    if not draft_status:
+        draft_status = PurchaseOrderStatus(name=PurchaseOrderStatus.DRAFT)
+        db.session.add(draft_status)
+        db.session.flush()
+
+    order_date = order_date or date.today()
+    purchase_orders = []
+    for vendor_id, vendor_products in sorted(by_vendor.items()):
+        lines = [
+            PurchaseOrderItem(
+                product_id=product.id,
+                description=product.name,
+                quantity_ordered=quantities[product.id],
+                quantity_received=0,
+                unit_price=product.cost_price or Decimal('0'),
+                tax_rate=0
+            )
+            for product in vendor_products
+        ]
+        purchase_order = PurchaseOrder(
+            po_number=generate_po_number(),
+            vendor_id=vendor_id,
+            order_date=order_date,
+            status_id=draft_status.id,
+            total_amount=sum(line.quantity_ordered * line.unit_price for line in lines),
+            notes='Created from reorder suggestions',
+            created_by_id=created_by_id,
+            items=lines
+        )
+        db.session.add(purchase_order)
+        # Flush so the next generate_po_number() sees this order's number
+        db.session.flush()
+        purchase_orders.append(purchase_order)
+
+    return purchase_orders, skipped
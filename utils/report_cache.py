@@ -0,0 +1,369 @@
+"""
+Report result cache
+
+Report results are cached under (report name, normalized parameters, ledger
+version). The ledger version is a counter in the Sequence table that is
+bumped in the same transaction as any change to journal entries, journal
+items or accounts, so a new posting makes every older cached report
+unreachable without explicit invalidation.
+
+Backends:
+    memory  - in-process LRU bounded by entry count and total bytes
+    sqlite  - on-disk cache shared by all worker processes on the host
+    none    - caching disabled
+
+Hit/miss counts live where the entries do: in each process for the memory
+backend (see the /reports/api/cache endpoints) and in the cache file for
+the sqlite backend, so `flask riska cache-stats` reports every worker.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Account, AccountType, JournalEntry, JournalItem, Sequence
+
+logger = logging.getLogger(__name__)
+
+LEDGER_VERSION_SEQUENCE = 'ledger_version'
+
+_LEDGER_MODELS = (JournalEntry, JournalItem, Account, AccountType)
+_LEDGER_CHANGED_KEY = 'ledger_changed'
+
+
+#
+# Ledger version
+#
+
+def get_ledger_version():
+    """Get the current ledger version"""
+    value = db.session.query(Sequence.value).filter_by(name=LEDGER_VERSION_SEQUENCE).scalar()
+    return value or 0
+
+
+def bump_ledger_version(connection):
+    """Increment the ledger version inside the caller's transaction"""
+    table = Sequence.__table__
+    result = connection.execute(
+        update(table).where(
+            table.c.name == LEDGER_VERSION_SEQUENCE
+        ).values(value=table.c.value + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert(), {'name': LEDGER_VERSION_SEQUENCE, 'value': 1})
+
+
+def _ledger_changed(session):
+    for obj in session.new:
+        if isinstance(obj, _LEDGER_MODELS):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, _LEDGER_MODELS):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, _LEDGER_MODELS) and session.is_modified(obj):
+            return True
+    return False
+
+
+def _before_flush(session, flush_context, instances):
+    if _ledger_changed(session):
+        session.info[_LEDGER_CHANGED_KEY] = True
+
+
+def _after_flush(session, flush_context):
+    if session.info.pop(_LEDGER_CHANGED_KEY, False):
+        bump_ledger_version(session.connection())
+
+
+def register_ledger_version_listeners():
+    """Bump the ledger version whenever ledger data is flushed"""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+#
+# Cache keys
+#
+
+def normalize_params(value):
+    """Convert report parameters to a canonical JSON-compatible form"""
+    if isinstance(value, dict):
+        return {str(key): normalize_params(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalize_params(item) for item in value]
+        if not isinstance(value, (list, tuple)) or all(isinstance(item, (str, int)) for item in items):
+            # Id filters are unordered; compare them as sorted strings
+            items = sorted(str(item) for item in items)
+        return items
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def make_cache_key(report_name, params, ledger_version):
+    """Build the cache key for a report"""
+    payload = json.dumps(
+        [report_name, normalize_params(params or {}), ledger_version],
+        sort_keys=True,
+        default=str
+    )
+    return f"{report_name}:{ledger_version}:" + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+#
+# Backends
+#
+
+class NullCacheBackend:
+    """Backend that never stores anything"""
+    name = 'none'
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'entries': 0, 'bytes': 0}
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache limited by entry count and total size"""
+    name = 'memory'
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+
+            self._entries[key] = value
+            self._bytes += len(value)
+
+            # Evict least recently used entries
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes}
+
+
+class SQLiteCacheBackend:
+    """On-disk cache in a SQLite file shared by every worker process"""
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=2000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS report_cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_report_cache_accessed ON report_cache (accessed_at)"
+            )
+            # Hit/miss counts of every process using the file
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS report_cache_counters ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO report_cache_counters (name, value) VALUES ('hits', 0), ('misses', 0)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value FROM report_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "UPDATE report_cache_counters SET value = value + 1 WHERE name = ?",
+                    ('misses' if row is None else 'hits',)
+                )
+                if row is None:
+                    return None
+                conn.execute("UPDATE report_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                return row[0]
+        except sqlite3.Error as e:
+            logger.error(f"Report cache read failed: {e}")
+            return None
+
+    def set(self, key, value):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO report_cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), time.time())
+                )
+                # Keep only the most recently used entries
+                conn.execute(
+                    "DELETE FROM report_cache WHERE key IN ("
+                    "SELECT key FROM report_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Report cache write failed: {e}")
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM report_cache")
+            conn.execute("UPDATE report_cache_counters SET value = 0")
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report_cache").fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM report_cache_counters"))
+        return {'entries': entries, 'bytes': size, 'hits': counters.get('hits', 0), 'misses': counters.get('misses', 0)}
+
+
+#
+# Cache front end
+#
+
+class ReportCache:
+    """
+    Caches report results per ledger version and keeps hit/miss counts.
+
+    The counts are this process's, unless the backend keeps shared ones
+    (its stats() returns hits and misses).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, report_name, params, compute):
+        """Return the cached result for a report, computing it on a miss"""
+        if isinstance(self.backend, NullCacheBackend):
+            return compute()
+
+        key = make_cache_key(report_name, params, get_ledger_version())
+
+        data = self.backend.get(key)
+        if data is not None:
+            try:
+                result = pickle.loads(data)
+                with self._lock:
+                    self.hits += 1
+                return result
+            except Exception as e:
+                logger.error(f"Discarding unreadable cached report {report_name}: {e}")
+
+        with self._lock:
+            self.misses += 1
+
+        result = compute()
+        try:
+            self.backend.set(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"Report {report_name} result could not be cached: {e}")
+        return result
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    @property
+    def shared(self):
+        """Whether every process sees the same entries and counts"""
+        return isinstance(self.backend, SQLiteCacheBackend)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        stats = {'backend': self.backend.name, 'pid': os.getpid(), 'hits': hits, 'misses': misses}
+        stats.update(self.backend.stats())
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] / requests) if requests else 0.0
+        return stats
+
+
+def create_cache_backend(config):
+    """Create the cache backend described by the app config"""
+    backend = (config.get('REPORT_CACHE_BACKEND') or 'memory').lower()
+
+    if backend == 'sqlite':
+        return SQLiteCacheBackend(
+            config.get('REPORT_CACHE_PATH') or os.path.join('instance', 'report_cache.sqlite'),
+            max_entries=int(config.get('REPORT_CACHE_MAX_ENTRIES') or 2000)
+        )
+    if backend == 'memory':
+        return MemoryCacheBackend(
+            max_entries=int(config.get('REPORT_CACHE_MAX_ENTRIES') or 256),
+            max_bytes=int(config.get('REPORT_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+        )
+    if backend == 'none':
+        return NullCacheBackend()
+
+    raise ValueError(f"Unknown report cache backend: {backend}")
+
+
+def init_report_cache(app):
+    """Attach a ReportCache to the app and start tracking the ledger version"""
+    register_ledger_version_listeners()
+    app.extensions['report_cache'] = ReportCache(create_cache_backend(app.config))
+    return app.extensions['report_cache']
+
+
+def get_report_cache():
+    return current_app.extensions['report_cache']
+
+
+def cached_report(report_name, params, compute):
+    """Get a report through the app's report cache"""
+    return get_report_cache().get_or_compute(report_name, params, compute)
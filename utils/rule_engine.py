@@ -0,0 +1,382 @@
+"""
+Reconciliation rule engine
+
+The active rules of a bank account are compiled once into a RuleSet:
+
+    contains - every pattern goes into one Aho-Corasick automaton, so a
+               description is scanned once whatever the number of rules
+    regex    - compiled case-insensitive patterns, only searched when no
+               higher priority rule has matched yet
+    amounts  - optional min/max bounds compared in integer cents
+
+Rules are tried in priority order (lower first, then by id) and the first
+one whose pattern and amount range match wins. Compiled rule sets are cached
+per bank account under the rule-set version, a Sequence counter bumped in the
+same transaction as any change to a rule.
+
+Applying the rules to a statement creates one journal entry per matched bank
+transaction; the entries, their items and the bank transaction updates are
+written with one executemany per chunk.
+"""
+import logging
+import re
+import threading
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import BigInteger, bindparam, cast, event, func, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import BankTransaction, JournalEntry, JournalItem, ReconciliationRule, Sequence
+from utils.report_cache import bump_ledger_version
+
+logger = logging.getLogger(__name__)
+
+RULES_VERSION_SEQUENCE = 'reconciliation_rules_version'
+
+# Rules without a priority sort with this one
+DEFAULT_PRIORITY = 100
+
+# Bank transactions written per executemany
+RULES_CHUNK_SIZE = 1000
+
+_RULES_CHANGED_KEY = 'reconciliation_rules_changed'
+
+# {(database url, bank account id): (rules version, RuleSet)}
+_rule_sets = {}
+_rule_sets_lock = threading.Lock()
+
+
+#
+# Rule-set version
+#
+
+def get_rules_version():
+    """Get the current rule-set version"""
+    value = db.session.query(Sequence.value).filter_by(name=RULES_VERSION_SEQUENCE).scalar()
+    return value or 0
+
+
+def bump_rules_version(connection):
+    """Increment the rule-set version inside the caller's transaction"""
+    table = Sequence.__table__
+    result = connection.execute(
+        update(table).where(
+            table.c.name == RULES_VERSION_SEQUENCE
+        ).values(value=table.c.value + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert(), {'name': RULES_VERSION_SEQUENCE, 'value': 1})
+
+
+def _rules_changed(session):
+    for obj in session.new:
+        if isinstance(obj, ReconciliationRule):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, ReconciliationRule):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, ReconciliationRule) and session.is_modified(obj):
+            return True
+    return False
+
+
+def _before_flush(session, flush_context, instances):
+    if _rules_changed(session):
+        session.info[_RULES_CHANGED_KEY] = True
+
+
+def _after_flush(session, flush_context):
+    if session.info.pop(_RULES_CHANGED_KEY, False):
+        bump_rules_version(session.connection())
+
+
+def register_rule_listeners():
+    """Bump the rule-set version whenever a reconciliation rule is flushed"""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+#
+# Compiled rules
+#
+
+def _to_cents(amount):
+    if amount is None:
+        return None
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def validate_rule_pattern(match_pattern, match_type):
+    """Return an error message for a pattern that cannot be compiled, else None"""
+    if match_type not in (ReconciliationRule.CONTAINS, ReconciliationRule.REGEX):
+        return f"Unknown match type: {match_type}"
+    if match_type == ReconciliationRule.REGEX:
+        try:
+            re.compile(match_pattern)
+        except re.error as e:
+            return f"Invalid regular expression: {e}"
+    return None
+
+
+class RuleSet:
+    """Active rules of a bank account, compiled for matching many transactions"""
+
+    def __init__(self, rules):
+        """`rules` are rows with id, name, match_pattern, match_type, priority, min_amount, max_amount and gl_account_id"""
+        self.rules = []
+        for rule in sorted(rules, key=lambda rule: (
+            rule.priority if rule.priority is not None else DEFAULT_PRIORITY, rule.id
+        )):
+            match_type = rule.match_type or ReconciliationRule.CONTAINS
+            regex = None
+            if match_type == ReconciliationRule.REGEX:
+                try:
+                    regex = re.compile(rule.match_pattern, re.IGNORECASE)
+                except re.error as e:
+                    logger.warning(f"Skipping reconciliation rule {rule.id}: invalid regular expression ({e})")
+                    continue
+            self.rules.append({
+                'id': rule.id,
+                'name': rule.name,
+                'gl_account_id': rule.gl_account_id,
+                'regex': regex,
+                'pattern': (rule.match_pattern or '').lower(),
+                'min_cents': _to_cents(rule.min_amount),
+                'max_cents': _to_cents(rule.max_amount),
+            })
+        self._build_automaton()
+
+    def _build_automaton(self):
+        """Aho-Corasick automaton over the contains patterns; outputs are rule positions"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for position, rule in enumerate(self.rules):
+            if rule['regex'] is not None:
+                continue
+            state = 0
+            for character in rule['pattern']:
+                next_state = self._goto[state].get(character)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][character] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(position)
+
+        # Failure links, breadth first; outputs inherit the fallback state's
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self._goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fallback = self._fail[state]
+                    while fallback and character not in self._goto[fallback]:
+                        fallback = self._fail[fallback]
+                    self._fail[next_state] = self._goto[fallback].get(character, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def _contained(self, text):
+        """Positions of the contains rules whose pattern occurs in `text` (lowercase)"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set(output[0])
+        state = 0
+        for character in text:
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def match(self, description, cents):
+        """The first rule (by priority) matching a description and amount in cents, or None"""
+        description = description or ''
+        contained = self._contained(description.lower())
+        for position, rule in enumerate(self.rules):
+            if rule['regex'] is None:
+                if position not in contained:
+                    continue
+            elif not rule['regex'].search(description):
+                continue
+            if rule['min_cents'] is not None and cents < rule['min_cents']:
+                continue
+            if rule['max_cents'] is not None and cents > rule['max_cents']:
+                continue
+            return rule
+        return None
+
+
+def get_rule_set(bank_account_id):
+    """The compiled active rules of a bank account, rebuilt when the rule-set version moves"""
+    version = get_rules_version()
+    key = (str(db.engine.url), bank_account_id)
+    with _rule_sets_lock:
+        cached = _rule_sets.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rule_set = RuleSet(db.session.execute(
+        select(
+            ReconciliationRule.id,
+            ReconciliationRule.name,
+            ReconciliationRule.match_pattern,
+            ReconciliationRule.match_type,
+            ReconciliationRule.priority,
+            ReconciliationRule.min_amount,
+            ReconciliationRule.max_amount,
+            ReconciliationRule.gl_account_id
+        ).where(
+            ReconciliationRule.bank_account_id == bank_account_id,
+            ReconciliationRule.is_active == True
+        )
+    ).all())
+    with _rule_sets_lock:
+        _rule_sets[key] = (version, rule_set)
+    return rule_set
+
+
+#
+# Applying rules
+#
+
+def _insert_entries(connection, rows):
+    """Insert journal entry rows and return their ids in the same order"""
+    table = JournalEntry.__table__
+    if connection.dialect.name == 'sqlite':
+        # SQLite would return sorted ids one row at a time; but no other
+        # writer can run while this transaction holds the write lock, so the
+        # rows get consecutive ids ending at the new maximum
+        connection.execute(table.insert(), rows)
+        last_id = connection.execute(select(func.max(table.c.id))).scalar()
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+    if connection.dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = connection.execute(
+            table.insert().returning(table.c.id, sort_by_parameter_order=True), rows
+        )
+        return [row[0] for row in result]
+    return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def apply_reconciliation_rules(statement, reconciled_date=None, chunk_size=RULES_CHUNK_SIZE):
+    """
+    Apply the bank account's active rules to a statement (caller commits).
+
+    Each unreconciled bank transaction matching a rule gets an unposted
+    journal entry between the bank GL account and the rule's account (money
+    in credits the bank line, as match_transaction() expects) and is marked
+    reconciled against it. Returns a dict with matched and entry_ids.
+    """
+    gl_account_id = statement.bank_account.gl_account_id
+    rule_set = get_rule_set(statement.bank_account_id)
+    result = {'matched': 0, 'entry_ids': []}
+    if not rule_set.rules:
+        return result
+
+    transactions = db.session.execute(
+        select(
+            BankTransaction.id,
+            BankTransaction.transaction_date,
+            BankTransaction.description,
+            BankTransaction.reference,
+            BankTransaction.amount,
+            cast(func.round(BankTransaction.amount * 100), BigInteger).label('cents'),
+            BankTransaction.transaction_type
+        ).where(
+            BankTransaction.statement_id == statement.id,
+            BankTransaction.is_reconciled == False
+        ).order_by(BankTransaction.id)
+    ).all()
+
+    matches = []
+    for transaction in transactions:
+        rule = rule_set.match(transaction.description, abs(transaction.cents or 0))
+        if rule is not None:
+            matches.append((transaction, rule))
+    if not matches:
+        return result
+
+    connection = db.session.connection()
+    created_at = datetime.utcnow()
+    reconciled_date = reconciled_date or date.today()
+    transaction_table = BankTransaction.__table__
+    for start in range(0, len(matches), chunk_size):
+        chunk = matches[start:start + chunk_size]
+        entry_ids = _insert_entries(connection, [
+            {
+                'entry_date': transaction.transaction_date,
+                'reference': f"Auto-matched: {transaction.reference or transaction.description[:20]}"[:50],
+                'description': transaction.description,
+                'is_posted': False,
+                'created_at': created_at,
+            }
+            for transaction, _ in chunk
+        ])
+
+        items = []
+        updates = []
+        for entry_id, (transaction, rule) in zip(entry_ids, chunk):
+            amount = transaction.amount
+            if transaction.transaction_type == 'credit':
+                # Money coming in - credit the bank account, debit the rule's account
+                items.append({
+                    'journal_entry_id': entry_id,
+                    'account_id': gl_account_id,
+                    'description': f"Bank deposit: {transaction.description[:30]}",
+                    'debit_amount': 0,
+                    'credit_amount': amount,
+                })
+                items.append({
+                    'journal_entry_id': entry_id,
+                    'account_id': rule['gl_account_id'],
+                    'description': f"Income matched by rule: {rule['name']}",
+                    'debit_amount': amount,
+                    'credit_amount': 0,
+                })
+            else:
+                # Money going out - debit the bank account, credit the rule's account
+                items.append({
+                    'journal_entry_id': entry_id,
+                    'account_id': gl_account_id,
+                    'description': f"Bank withdrawal: {transaction.description[:30]}",
+                    'debit_amount': amount,
+                    'credit_amount': 0,
+                })
+                items.append({
+                    'journal_entry_id': entry_id,
+                    'account_id': rule['gl_account_id'],
+                    'description': f"Expense matched by rule: {rule['name']}",
+                    'debit_amount': 0,
+                    'credit_amount': amount,
+                })
+            updates.append({'transaction_id': transaction.id, 'entry_id': entry_id})
+
+        # Core inserts: the listeners do not see these rows. The entries are
+        # unposted, so only the ledger version moves.
+        connection.execute(JournalItem.__table__.insert(), items)
+        connection.execute(
+            update(transaction_table).where(
+                transaction_table.c.id == bindparam('transaction_id')
+            ).values(
+                gl_entry_id=bindparam('entry_id'),
+                is_reconciled=True,
+                reconciled_date=reconciled_date
+            ),
+            updates
+        )
+        result['entry_ids'].extend(entry_ids)
+
+    bump_ledger_version(connection)
+    # The ORM copies of the updated transactions are stale now
+    db.session.expire_all()
+    result['matched'] = len(matches)
+    logger.info(f"Reconciliation rules matched {len(matches)} of {len(transactions)} transactions on statement {statement.id}")
+    return result
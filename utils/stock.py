@@ -0,0 +1,583 @@
+"""
+Materialized stock levels
+
+Every inventory movement is rolled up into a ProductStock row (one per
+product and location) holding the quantity on hand and the net cost of the
+movements. The rows are maintained inside the same flush that writes the
+InventoryTransaction, so stock levels commit or roll back together with it.
+
+Movements are valued at their unit price, falling back to the product's
+cost price when none was recorded.
+
+Transactions and stock rows are also keyed to their Warehouse: the flush
+listener fills in warehouse_id from the location name (or the location name
+from warehouse_id), so per-warehouse stock is an indexed lookup on
+ProductStock.warehouse_id. migrate_transaction_warehouses() does the same
+for transactions recorded before warehouse_id existed.
+
+Stock rows are keyed by (product, location) with the warehouse name as the
+location, so warehouse names are unique (compared case-insensitively, see
+find_warehouse_by_name()); renaming a warehouse onto a free-text location
+takes that location's movements over.
+"""
+import logging
+import re
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import and_, bindparam, case, delete, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import InventoryTransaction, InventoryValuationSnapshot, Product, ProductStock, Warehouse
+from utils.balances import _old_and_new, _to_decimal
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+_PENDING_KEY = 'pending_product_stock_deltas'
+_PENDING_WAREHOUSES_KEY = 'pending_product_stock_warehouses'
+
+
+def stock_location(location):
+    """Key used for a transaction's location ('' when none was given)"""
+    return (location or '').strip()
+
+
+def warehouse_index(connection):
+    """Lower-case warehouse name and code -> (warehouse id, name), from one query"""
+    index = {}
+    warehouses = connection.execute(select(Warehouse.id, Warehouse.name, Warehouse.code)).all()
+    # Codes first so that a name always wins over an identical code
+    for warehouse_id, name, code in warehouses:
+        if code:
+            index[code.strip().lower()] = (warehouse_id, name)
+    for warehouse_id, name, code in warehouses:
+        if name:
+            index[name.strip().lower()] = (warehouse_id, name)
+    return index
+
+
+def assign_transaction_warehouses(session):
+    """
+    Keep warehouse_id and location of pending InventoryTransactions in step.
+
+    A transaction given a warehouse_id gets that warehouse's name as its
+    location; one given only a location is matched to a warehouse by name or
+    code. Locations that match no warehouse stay free text.
+    """
+    pending = [
+        transaction for transaction in list(session.new) + list(session.dirty)
+        if isinstance(transaction, InventoryTransaction)
+    ]
+    if not pending:
+        return
+
+    index = None
+    with session.no_autoflush:
+        for transaction in pending:
+            state = inspect(transaction)
+            location_changed = state.attrs.location.history.has_changes()
+            warehouse_changed = state.attrs.warehouse_id.history.has_changes()
+            if not location_changed and not warehouse_changed:
+                continue
+
+            if transaction.warehouse_id is not None and (warehouse_changed or not location_changed):
+                warehouse = session.get(Warehouse, transaction.warehouse_id)
+                if warehouse is not None and transaction.location != warehouse.name:
+                    transaction.location = warehouse.name
+                continue
+
+            location = stock_location(transaction.location)
+            if not location:
+                transaction.warehouse_id = None
+                continue
+            if index is None:
+                index = warehouse_index(session.connection())
+            warehouse_id, name = index.get(location.lower(), (None, location))
+            transaction.warehouse_id = warehouse_id
+            if transaction.location != name:
+                transaction.location = name
+
+
+def _add_delta(deltas, product_id, location, transaction_type, quantity, value, sign):
+    if product_id is None or transaction_type not in ('IN', 'OUT'):
+        return
+    if transaction_type == 'OUT':
+        sign = -sign
+    key = (int(product_id), stock_location(location))
+    deltas[key][0] += sign * _to_decimal(quantity)
+    deltas[key][1] += sign * _to_decimal(value)
+
+
+def collect_stock_deltas(session):
+    """Work out how the pending flush changes stock per product and location"""
+    deltas = defaultdict(lambda: [ZERO, ZERO])
+
+    def movement_value(product_id, quantity, unit_price):
+        if unit_price is None:
+            product = session.get(Product, product_id) if product_id is not None else None
+            unit_price = product.cost_price if product is not None else None
+        return _to_decimal(quantity) * _to_decimal(unit_price)
+
+    with session.no_autoflush:
+        for collection, is_new, is_deleted in (
+            (session.new, True, False),
+            (session.dirty, False, False),
+            (session.deleted, False, True),
+        ):
+            for transaction in list(collection):
+                if not isinstance(transaction, InventoryTransaction):
+                    continue
+
+                old, new = {}, {}
+                for key in ('product_id', 'location', 'transaction_type', 'quantity', 'unit_price'):
+                    old[key], new[key] = _old_and_new(transaction, key)
+                if not is_new and not is_deleted and old == new:
+                    continue
+
+                if not is_new:
+                    _add_delta(
+                        deltas, old['product_id'], old['location'], old['transaction_type'], old['quantity'],
+                        movement_value(old['product_id'], old['quantity'], old['unit_price']), -1
+                    )
+                if not is_deleted:
+                    _add_delta(
+                        deltas, new['product_id'], new['location'], new['transaction_type'], new['quantity'],
+                        movement_value(new['product_id'], new['quantity'], new['unit_price']), 1
+                    )
+
+    return {
+        key: (quantity, value)
+        for key, (quantity, value) in deltas.items()
+        if quantity != 0 or value != 0
+    }
+
+
+def apply_stock_deltas(connection, deltas, warehouse_ids=None):
+    """
+    Add quantity/value deltas to ProductStock rows.
+
+    `deltas` maps (product_id, location) to (quantity, value). Bulk loaders
+    that insert InventoryTransaction rows with Core must call this in the same
+    transaction, because the ORM listeners do not see those rows.
+
+    `warehouse_ids` maps locations to their warehouse id; when it is not
+    given the locations are matched to warehouses by name with one query.
+    """
+    if not deltas:
+        return
+
+    table = ProductStock.__table__
+    dialect = connection.dialect.name
+
+    if warehouse_ids is None:
+        index = warehouse_index(connection)
+        warehouse_ids = {
+            location: index.get(stock_location(location).lower(), (None, None))[0]
+            for _, location in deltas
+        }
+
+    rows = [
+        {
+            'product_id': product_id,
+            'location': stock_location(location),
+            'warehouse_id': warehouse_ids.get(location),
+            'quantity': quantity,
+            'value': value,
+        }
+        for (product_id, location), (quantity, value) in sorted(deltas.items(), key=lambda item: (item[0][0], stock_location(item[0][1])))
+    ]
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id, table.c.location],
+            set_={
+                'quantity': table.c.quantity + stmt.excluded.quantity,
+                'value': table.c.value + stmt.excluded.value,
+                'warehouse_id': func.coalesce(stmt.excluded.warehouse_id, table.c.warehouse_id),
+            }
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            update(table).where(
+                table.c.product_id == row['product_id'],
+                table.c.location == row['location']
+            ).values(
+                quantity=table.c.quantity + row['quantity'],
+                value=table.c.value + row['value'],
+                warehouse_id=func.coalesce(row['warehouse_id'], table.c.warehouse_id)
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+def _before_flush(session, flush_context, instances):
+    assign_transaction_warehouses(session)
+    session.info[_PENDING_KEY] = collect_stock_deltas(session)
+    # Warehouses of the locations touched, as just assigned to the transactions
+    session.info[_PENDING_WAREHOUSES_KEY] = {
+        stock_location(transaction.location): transaction.warehouse_id
+        for transaction in list(session.new) + list(session.dirty)
+        if isinstance(transaction, InventoryTransaction) and transaction.warehouse_id is not None
+    }
+
+
+def _after_flush(session, flush_context):
+    deltas = session.info.pop(_PENDING_KEY, None)
+    warehouse_ids = session.info.pop(_PENDING_WAREHOUSES_KEY, None) or {}
+    if deltas:
+        apply_stock_deltas(
+            session.connection(), deltas,
+            {location: warehouse_ids.get(stock_location(location)) for _, location in deltas}
+        )
+
+
+def register_stock_listeners():
+    """Keep ProductStock in step with every ORM flush"""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+def _expected_stock_query(warehouse_id=None):
+    """(product_id, location, quantity, value, warehouse_id) recomputed from every movement (of one warehouse)"""
+    sign = case((InventoryTransaction.transaction_type == 'OUT', -1), else_=1)
+    unit_price = func.coalesce(InventoryTransaction.unit_price, Product.cost_price, 0)
+    location = func.coalesce(func.trim(InventoryTransaction.location), '')
+
+    query = select(
+        InventoryTransaction.product_id,
+        location,
+        func.coalesce(func.sum(sign * InventoryTransaction.quantity), 0),
+        func.coalesce(func.sum(sign * InventoryTransaction.quantity * unit_price), 0),
+        func.max(InventoryTransaction.warehouse_id)
+    ).join(
+        Product, InventoryTransaction.product_id == Product.id
+    ).where(
+        InventoryTransaction.transaction_type.in_(('IN', 'OUT'))
+    ).group_by(
+        InventoryTransaction.product_id, location
+    )
+    if warehouse_id is not None:
+        query = query.where(InventoryTransaction.warehouse_id == warehouse_id)
+    return query
+
+
+def rebuild_product_stock():
+    """Recompute every ProductStock row from the inventory transactions"""
+    table = ProductStock.__table__
+
+    db.session.execute(table.delete())
+    db.session.execute(
+        table.insert().from_select(
+            ['product_id', 'location', 'quantity', 'value', 'warehouse_id'],
+            _expected_stock_query()
+        )
+    )
+    db.session.commit()
+
+    count = db.session.query(func.count(ProductStock.id)).scalar()
+    logger.info(f"Rebuilt {count} product stock rows")
+    return count
+
+
+def ensure_product_stock():
+    """Build the stock levels once for databases that predate them"""
+    if db.session.query(ProductStock.id).first() is not None:
+        return False
+    if db.session.query(InventoryTransaction.id).first() is None:
+        return False
+
+    rebuild_product_stock()
+    return True
+
+
+def check_product_stock(tolerance=Decimal('0.01')):
+    """
+    Compare ProductStock with a full recomputation from the transactions.
+
+    Returns a list of dicts describing every product/location whose stored
+    quantity or value differs from the recomputed one; an empty list means
+    the read model is consistent.
+    """
+    expected = {
+        (product_id, location): (_to_decimal(quantity), _to_decimal(value))
+        for product_id, location, quantity, value, _ in db.session.execute(_expected_stock_query())
+    }
+    stored = {
+        (product_id, location): (_to_decimal(quantity), _to_decimal(value))
+        for product_id, location, quantity, value in db.session.execute(
+            select(ProductStock.product_id, ProductStock.location, ProductStock.quantity, ProductStock.value)
+        )
+    }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        expected_quantity, expected_value = expected.get(key, (ZERO, ZERO))
+        stored_quantity, stored_value = stored.get(key, (ZERO, ZERO))
+        if abs(expected_quantity - stored_quantity) > tolerance or abs(expected_value - stored_value) > tolerance:
+            mismatches.append({
+                'product_id': key[0],
+                'location': key[1],
+                'stored_quantity': stored_quantity,
+                'expected_quantity': expected_quantity,
+                'stored_value': stored_value,
+                'expected_value': expected_value,
+            })
+    return mismatches
+
+
+def _warehouse_code(name, existing_codes):
+    """Unique warehouse code derived from a location name"""
+    base = re.sub(r'[^A-Z0-9]+', '-', name.upper()).strip('-')[:16] or 'WH'
+    code, suffix = base, 1
+    while code.lower() in existing_codes:
+        suffix += 1
+        code = f"{base}-{suffix}"
+    existing_codes.add(code.lower())
+    return code
+
+
+def migrate_transaction_warehouses(create_missing=False, created_by_id=None):
+    """
+    Key inventory transactions recorded without a warehouse_id to warehouses.
+
+    Distinct location strings are matched to warehouses by name or code
+    (case-insensitive); with `create_missing` a warehouse is created for
+    each location that matches none. Matched transactions get the warehouse
+    id and its name as location, then the stock levels are rebuilt.
+
+    Returns a dict with the number of transactions mapped, the warehouses
+    created and the locations left unmatched.
+    """
+    location = func.trim(InventoryTransaction.location)
+    locations = db.session.execute(
+        select(location, func.count(InventoryTransaction.id)).where(
+            InventoryTransaction.warehouse_id.is_(None),
+            location != ''
+        ).group_by(location)
+    ).all()
+
+    result = {'mapped': 0, 'created': [], 'unmatched': []}
+    if not locations:
+        return result
+
+    index = warehouse_index(db.session.connection())
+    existing_codes = {code.lower() for code in db.session.execute(select(Warehouse.code)).scalars() if code}
+
+    updates = []
+    for name, count in locations:
+        match = index.get(name.lower())
+        if match is None and create_missing:
+            warehouse = Warehouse(
+                name=name[:100],
+                code=_warehouse_code(name, existing_codes),
+                is_active=True,
+                created_by_id=created_by_id
+            )
+            db.session.add(warehouse)
+            db.session.flush()
+            match = index[name.lower()] = (warehouse.id, warehouse.name)
+            result['created'].append(warehouse.name)
+        if match is None:
+            result['unmatched'].append(name)
+            continue
+        updates.append({'location_key': name, 'target_warehouse_id': match[0], 'warehouse_name': match[1]})
+        result['mapped'] += count
+
+    if updates:
+        table = InventoryTransaction.__table__
+        db.session.execute(
+            table.update().where(
+                table.c.warehouse_id.is_(None),
+                func.trim(table.c.location) == bindparam('location_key')
+            ).values(
+                warehouse_id=bindparam('target_warehouse_id'),
+                location=bindparam('warehouse_name')
+            ),
+            updates
+        )
+        # Snapshot rows are keyed by the old location names
+        db.session.execute(delete(InventoryValuationSnapshot.__table__))
+        rebuild_product_stock()
+
+    logger.info(f"Mapped {result['mapped']} inventory transactions to warehouses")
+    return result
+
+
+def ensure_transaction_warehouses():
+    """Map transactions that predate warehouse_id onto existing warehouses"""
+    unkeyed = db.session.query(InventoryTransaction.id).filter(
+        InventoryTransaction.warehouse_id.is_(None),
+        func.trim(InventoryTransaction.location) != ''
+    ).first()
+    if unkeyed is None:
+        return None
+    return migrate_transaction_warehouses(create_missing=False)
+
+
+def find_warehouse_by_name(name, exclude_id=None):
+    """The warehouse using a name (compared case-insensitively and trimmed), or None"""
+    query = Warehouse.query.filter(func.lower(func.trim(Warehouse.name)) == (name or '').strip().lower())
+    if exclude_id is not None:
+        query = query.filter(Warehouse.id != exclude_id)
+    return query.first()
+
+
+def _unkeyed_location(table, name):
+    """Rows of `table` at the free-text location `name` (any case), outside every warehouse"""
+    return and_(
+        table.c.warehouse_id.is_(None),
+        func.lower(func.trim(table.c.location)) == name.strip().lower()
+    )
+
+
+def rename_warehouse_locations(warehouse_id, name):
+    """
+    Carry a warehouse's name over to its transactions, stock rows and snapshots (caller commits).
+
+    Movements recorded at a free-text location of the same name are taken
+    over by the warehouse, as migrate_transaction_warehouses() would map
+    them; the warehouse's stock rows are then recomputed from its movements
+    and the snapshots dropped, since they were keyed by both locations.
+    Returns the number of transactions taken over.
+    """
+    transactions = InventoryTransaction.__table__
+    stock = ProductStock.__table__
+    snapshots = InventoryValuationSnapshot.__table__
+
+    taken_over = db.session.execute(
+        update(transactions).where(
+            _unkeyed_location(transactions, name)
+        ).values(warehouse_id=warehouse_id, location=name)
+    ).rowcount
+    db.session.execute(
+        update(transactions).where(transactions.c.warehouse_id == warehouse_id).values(location=name)
+    )
+
+    clashes = taken_over or any(
+        db.session.execute(select(table.c.id).where(_unkeyed_location(table, name)).limit(1)).first()
+        for table in (stock, snapshots)
+    )
+    if not clashes:
+        for table in (stock, snapshots):
+            db.session.execute(update(table).where(table.c.warehouse_id == warehouse_id).values(location=name))
+        return 0
+
+    db.session.execute(delete(stock).where(stock.c.warehouse_id == warehouse_id))
+    db.session.execute(delete(stock).where(_unkeyed_location(stock, name)))
+    db.session.execute(
+        stock.insert().from_select(
+            ['product_id', 'location', 'quantity', 'value', 'warehouse_id'],
+            _expected_stock_query(warehouse_id)
+        )
+    )
+    db.session.execute(delete(snapshots))
+    logger.info(f"Warehouse {warehouse_id} took over {taken_over} inventory transactions at location {name}")
+    return taken_over
+
+
+def deduplicate_warehouse_names():
+    """
+    Give warehouses sharing a name distinct names, before uq_warehouse_name is created.
+
+    Names are compared case-insensitively. The oldest warehouse keeps the
+    name and the others get their code appended. Their stock had been
+    merged into shared rows, so the stock levels are rebuilt and the
+    snapshots dropped. Returns a list of (old name, new name).
+    """
+    warehouses = Warehouse.query.order_by(Warehouse.id).all()
+    used = {(warehouse.name or '').strip().lower() for warehouse in warehouses}
+
+    seen = set()
+    renamed = []
+    for warehouse in warehouses:
+        key = (warehouse.name or '').strip().lower()
+        if key not in seen:
+            seen.add(key)
+            continue
+        base = (warehouse.name or '').strip()
+        name, suffix = f"{base} ({warehouse.code})"[:100], 1
+        while name.lower() in used:
+            suffix += 1
+            name = f"{base} ({warehouse.code}-{suffix})"[:100]
+        used.add(name.lower())
+        renamed.append((warehouse.name, name))
+        warehouse.name = name
+        db.session.execute(
+            update(InventoryTransaction.__table__).where(
+                InventoryTransaction.__table__.c.warehouse_id == warehouse.id
+            ).values(location=name)
+        )
+
+    if renamed:
+        db.session.execute(delete(InventoryValuationSnapshot.__table__))
+        rebuild_product_stock()
+        logger.info(f"Renamed {len(renamed)} warehouses sharing a name")
+    return renamed
+
+
+def get_warehouse_stock_summary():
+    """
+    On-hand stock per warehouse from the stock levels, in one grouped query.
+
+    Returns a dict of warehouse id (None for stock outside any warehouse) to
+    a dict with products (lines in stock), quantity and value.
+    """
+    rows = db.session.execute(
+        select(
+            ProductStock.warehouse_id,
+            func.count(ProductStock.id),
+            func.coalesce(func.sum(ProductStock.quantity), 0),
+            func.coalesce(func.sum(ProductStock.value), 0)
+        ).where(
+            ProductStock.quantity > 0
+        ).group_by(ProductStock.warehouse_id)
+    )
+    return {
+        warehouse_id: {'products': products, 'quantity': _to_decimal(quantity), 'value': _to_decimal(value)}
+        for warehouse_id, products, quantity, value in rows
+    }
+
+
+def stock_on_hand_subquery(location=None, warehouse_id=None):
+    """
+    Grouped on-hand quantity per product, for outer joining onto Product.
+
+    Lets stock-based filters and sorting (low stock, stock high/low) run in
+    the same query as the product listing. `warehouse_id` or `location`
+    limits it to one warehouse or location.
+    """
+    query = select(
+        ProductStock.product_id.label('product_id'),
+        func.sum(ProductStock.quantity).label('quantity')
+    ).group_by(ProductStock.product_id)
+
+    if warehouse_id is not None:
+        query = query.where(ProductStock.warehouse_id == warehouse_id)
+    if location is not None:
+        query = query.where(ProductStock.location == stock_location(location))
+
+    return query.subquery('stock_on_hand')
+
+
+def reorder_level_expression():
+    """Product reorder level as a SQL expression, with no level counting as 0"""
+    return func.coalesce(Product.reorder_level, 0)
+
+
+def low_stock_condition(on_hand):
+    """Filter for products whose on-hand expression is at or below the reorder level"""
+    return on_hand <= reorder_level_expression()
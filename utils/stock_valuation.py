@@ -0,0 +1,415 @@
+"""
+Stock valuation engine
+
+Values the stock on hand per product and location with one of three costing
+methods:
+
+    standard          - quantity on hand at the product's current cost price,
+                        answered by grouped queries
+    weighted_average  - moving weighted average cost
+    fifo              - first-in, first-out cost layers
+
+The weighted average and FIFO methods make one streamed pass over the
+inventory transactions in date order, keeping a small cost state per product
+and location. Quantities and amounts
+are carried as integers (hundredths of a unit, cents) during the pass, so a
+million movements are valued in a few seconds without Decimal arithmetic.
+
+Movements are costed at their unit price, falling back to the product's cost
+price when none was recorded. `as_of` limits the valuation to movements up to
+the end of that day, and `warehouse_id` to one warehouse's movements (read
+through the warehouse index, so a filtered valuation scans only those).
+
+When month-end valuation snapshots exist (see utils.valuation_snapshots) the
+pass starts from the cost state saved at the latest close on or before
+`as_of` and replays only the movements after it.
+"""
+import json
+import logging
+from collections import deque
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import BigInteger, Integer, case, cast, func, select
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import InventoryTransaction, Product, ProductStock
+from utils.stock import stock_location
+
+logger = logging.getLogger(__name__)
+
+STANDARD = 'standard'
+WEIGHTED_AVERAGE = 'weighted_average'
+FIFO = 'fifo'
+
+VALUATION_METHODS = {
+    STANDARD: 'Standard Cost',
+    WEIGHTED_AVERAGE: 'Weighted Average',
+    FIFO: 'FIFO',
+}
+
+# Rows fetched per round trip when streaming inventory transactions
+VALUATION_BATCH_SIZE = 10000
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def _day_end(as_of):
+    """First moment after the as_of day, for transaction_date < comparisons"""
+    if isinstance(as_of, datetime):
+        as_of = as_of.date()
+    return datetime.combine(as_of + timedelta(days=1), time.min)
+
+
+def _quantity(hundredths):
+    return Decimal(hundredths).scaleb(-2)
+
+
+def _amount(units):
+    """Convert an amount in cents x hundredths of a unit to currency"""
+    return Decimal(units).scaleb(-4).quantize(CENT)
+
+
+def _transaction_filters(as_of, product_ids, warehouse_id=None, since=None):
+    """Filters for the movements up to `as_of` and, with `since`, after that day"""
+    filters = []
+    if warehouse_id is not None:
+        filters.append(InventoryTransaction.warehouse_id == warehouse_id)
+    if since is not None:
+        filters.append(InventoryTransaction.transaction_date >= _day_end(since))
+    if as_of is not None:
+        filters.append(InventoryTransaction.transaction_date < _day_end(as_of))
+    if product_ids is not None:
+        filters.append(InventoryTransaction.product_id.in_(product_ids))
+    return filters
+
+
+#
+# Standard cost
+#
+
+def _cost_prices(product_ids):
+    """Current cost price per product"""
+    query = select(Product.id, Product.cost_price)
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+    return {product_id: Decimal(cost_price or 0) for product_id, cost_price in db.session.execute(query)}
+
+
+def _standard_quantities(as_of, product_ids, warehouse_id=None, start=None):
+    """
+    Quantity on hand per product and location, from one grouped query.
+
+    `start` is a (period_end, {key: quantity}) snapshot; only the movements
+    after its period are summed onto it.
+    """
+    since, quantities = start if start is not None else (None, {})
+    quantities = dict(quantities)
+
+    sign = case((InventoryTransaction.transaction_type == 'OUT', -1), else_=1)
+    location = func.coalesce(func.trim(InventoryTransaction.location), '')
+    query = select(
+        InventoryTransaction.product_id,
+        location,
+        func.coalesce(func.sum(sign * InventoryTransaction.quantity), 0)
+    ).where(
+        InventoryTransaction.transaction_type.in_(('IN', 'OUT')),
+        *_transaction_filters(as_of, product_ids, warehouse_id, since)
+    ).group_by(
+        InventoryTransaction.product_id, location
+    )
+    for product_id, location, quantity in db.session.execute(query):
+        key = (product_id, location or '')
+        quantities[key] = quantities.get(key, ZERO) + Decimal(quantity or 0)
+    return quantities
+
+
+def _standard_valuation(as_of, product_ids, warehouse_id=None, start=None):
+    """Quantity on hand at current cost price, from grouped queries"""
+    if as_of is None and start is None:
+        # Current stock is already materialized per product and location
+        query = select(ProductStock.product_id, ProductStock.location, ProductStock.quantity)
+        if product_ids is not None:
+            query = query.where(ProductStock.product_id.in_(product_ids))
+        if warehouse_id is not None:
+            query = query.where(ProductStock.warehouse_id == warehouse_id)
+        rows = db.session.execute(query)
+    else:
+        rows = (
+            (product_id, location, quantity)
+            for (product_id, location), quantity in _standard_quantities(as_of, product_ids, warehouse_id, start).items()
+        )
+
+    cost_prices = _cost_prices(product_ids)
+    valuation = {}
+    for product_id, location, quantity in rows:
+        quantity = Decimal(quantity or 0).quantize(CENT)
+        value = (quantity * cost_prices.get(product_id, ZERO)).quantize(CENT)
+        valuation[(product_id, location or '')] = (quantity, value)
+    return valuation
+
+
+#
+# Streamed methods
+#
+
+def _movements_query(as_of, product_ids, warehouse_id=None, since=None):
+    """(product_id, location, type, quantity hundredths, unit price cents) in date order"""
+    # No join to Product: it makes SQLite walk an index in product order and
+    # sort a million rows from random reads; missing prices are filled in Python
+    return select(
+        InventoryTransaction.product_id,
+        InventoryTransaction.location,
+        InventoryTransaction.transaction_type,
+        cast(func.round(InventoryTransaction.quantity * 100), Integer).label('quantity'),
+        cast(func.round(InventoryTransaction.unit_price * 100), BigInteger).label('unit_price')
+    ).where(
+        *_transaction_filters(as_of, product_ids, warehouse_id, since)
+    ).order_by(
+        InventoryTransaction.transaction_date,
+        InventoryTransaction.id
+    )
+
+
+class _AverageCost:
+    """Moving weighted average: every receipt re-averages the unit cost"""
+    __slots__ = ('quantity', 'value', 'average_cost')
+
+    def __init__(self):
+        self.quantity = 0
+        self.value = 0
+        self.average_cost = 0
+
+    def dump(self):
+        return [self.quantity, self.value, self.average_cost]
+
+    @classmethod
+    def load(cls, state):
+        self = cls()
+        self.quantity, self.value, self.average_cost = state
+        return self
+
+    def receive(self, quantity, unit_cost):
+        if self.quantity < 0:
+            # A negative balance is filled, and so restated, at the receipt cost
+            self.value = self.quantity * unit_cost
+        self.quantity += quantity
+        self.value += quantity * unit_cost
+        if self.quantity > 0:
+            self.average_cost = (self.value + self.quantity // 2) // self.quantity
+        else:
+            self.average_cost = unit_cost
+
+    def issue(self, quantity):
+        if self.quantity > 0:
+            taken = min(quantity, self.quantity)
+            self.value -= (self.value * taken + self.quantity // 2) // self.quantity
+            self.quantity -= taken
+            quantity -= taken
+        if quantity:
+            # Issued beyond stock: carry the shortfall at the average cost
+            self.quantity -= quantity
+            self.value -= quantity * self.average_cost
+
+
+class _FifoLayers:
+    """FIFO: issues consume the oldest receipt layers first"""
+    __slots__ = ('layers', 'shortfall', 'last_cost')
+
+    def __init__(self):
+        self.layers = deque()
+        self.shortfall = 0
+        self.last_cost = 0
+
+    def dump(self):
+        return [self.shortfall, self.last_cost, [list(layer) for layer in self.layers]]
+
+    @classmethod
+    def load(cls, state):
+        self = cls()
+        # The decoded [quantity, unit cost] lists serve as the layers directly
+        self.shortfall, self.last_cost, layers = state
+        self.layers = deque(layers)
+        return self
+
+    @property
+    def quantity(self):
+        return sum(layer[0] for layer in self.layers) - self.shortfall
+
+    @property
+    def value(self):
+        return sum(layer[0] * layer[1] for layer in self.layers) - self.shortfall * self.last_cost
+
+    def receive(self, quantity, unit_cost):
+        self.last_cost = unit_cost
+        if self.shortfall:
+            covered = min(quantity, self.shortfall)
+            self.shortfall -= covered
+            quantity -= covered
+        if quantity:
+            self.layers.append([quantity, unit_cost])
+
+    def issue(self, quantity):
+        layers = self.layers
+        while quantity and layers:
+            layer = layers[0]
+            if layer[0] <= quantity:
+                quantity -= layer[0]
+                self.last_cost = layer[1]
+                layers.popleft()
+            else:
+                layer[0] -= quantity
+                quantity = 0
+        if quantity:
+            # Issued beyond stock: the shortfall is filled by the next receipts
+            self.shortfall += quantity
+
+
+def _state_class(method):
+    return _FifoLayers if method == FIFO else _AverageCost
+
+
+def dump_cost_state(state):
+    """Serialize a streamed cost state for a valuation snapshot"""
+    return json.dumps(state.dump(), separators=(',', ':'))
+
+
+def load_cost_state(method, cost_state):
+    """Rebuild a streamed cost state from a valuation snapshot"""
+    return _state_class(method).load(json.loads(cost_state))
+
+
+def _streamed_states(method, as_of, product_ids, batch_size, warehouse_id=None, start=None):
+    """
+    Replay the movements in date order through a cost state per product and location.
+
+    `start` is a (period_end, {key: state}) snapshot to resume from; only the
+    movements after its period are replayed.
+    """
+    state_class = _state_class(method)
+    since, states = start if start is not None else (None, {})
+    states = dict(states)
+    locations = {}
+
+    # Cost price in cents for movements recorded without a price
+    cost_prices = {
+        product_id: int((cost_price * 100).to_integral_value())
+        for product_id, cost_price in _cost_prices(product_ids).items()
+    }
+
+    # Plain Core rows: the ORM result layer would double the cost of the pass
+    movements = db.session.connection().execute(
+        _movements_query(as_of, product_ids, warehouse_id, since),
+        execution_options={'yield_per': batch_size}
+    )
+    for product_id, location, transaction_type, quantity, unit_price in movements:
+        # Normalize each distinct location string only once
+        if location not in locations:
+            locations[location] = stock_location(location)
+        key = (product_id, locations[location])
+
+        state = states.get(key)
+        if state is None:
+            state = states[key] = state_class()
+
+        if transaction_type == 'IN':
+            state.receive(quantity or 0, cost_prices.get(product_id, 0) if unit_price is None else unit_price)
+        elif transaction_type == 'OUT':
+            state.issue(quantity or 0)
+
+    return states
+
+
+def state_valuation(state):
+    """(quantity, value) as Decimals for a streamed cost state"""
+    return _quantity(state.quantity), _amount(state.value)
+
+
+def _streamed_valuation(method, as_of, product_ids, batch_size, warehouse_id=None, start=None):
+    states = _streamed_states(method, as_of, product_ids, batch_size, warehouse_id, start)
+    return {key: state_valuation(state) for key, state in states.items()}
+
+
+def compute_stock_valuation(method=STANDARD, as_of=None, product_ids=None, batch_size=VALUATION_BATCH_SIZE,
+                            warehouse_id=None, use_snapshots=True):
+    """
+    Value the stock on hand per product and location.
+
+    Returns a dict of (product_id, location) -> (quantity, value) as Decimals,
+    including locations whose stock has gone back to zero. `warehouse_id`
+    values one warehouse only. With `use_snapshots` the valuation resumes
+    from the latest month-end snapshot on or before `as_of`.
+    """
+    if method not in VALUATION_METHODS:
+        raise ValueError(f"Unknown valuation method: {method}")
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+
+    # Current standard cost valuation reads the stock levels directly
+    start = None
+    if use_snapshots and not (method == STANDARD and as_of is None):
+        from utils.valuation_snapshots import load_snapshot
+        start = load_snapshot(method, as_of, product_ids, warehouse_id)
+
+    if method == STANDARD:
+        return _standard_valuation(as_of, product_ids, warehouse_id, start)
+    return _streamed_valuation(method, as_of, product_ids, batch_size, warehouse_id, start)
+
+
+def get_stock_valuation(method=STANDARD, as_of=None, category_id=None, location=None, search=None,
+                        include_inactive=False, include_zero=False, warehouse_id=None):
+    """
+    Build the stock valuation report rows.
+
+    Products are loaded in one query after the valuation; each row is a dict
+    with product, location, quantity, unit_cost and value. Rows are ordered by
+    product name and location.
+    """
+    product_query = Product.query.options(
+        joinedload(Product.category),
+        joinedload(Product.uom)
+    )
+    filtered = False
+    if not include_inactive:
+        product_query = product_query.filter(Product.is_active == True)
+    if category_id:
+        product_query = product_query.filter(Product.category_id == int(category_id))
+        filtered = True
+    if search:
+        product_query = product_query.filter(Product.name.ilike(f'%{search}%') | Product.sku.ilike(f'%{search}%'))
+        filtered = True
+
+    products = {product.id: product for product in product_query.all()}
+    if not products:
+        return []
+
+    # Only pass product ids down when they narrow the scan
+    valuation = compute_stock_valuation(
+        method, as_of, list(products) if filtered else None, warehouse_id=warehouse_id
+    )
+
+    rows = []
+    for (product_id, stock_at), (quantity, value) in valuation.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        if location is not None and stock_at != stock_location(location):
+            continue
+        if quantity <= 0 and not include_zero:
+            continue
+
+        rows.append({
+            'product': product,
+            'location': stock_at,
+            'quantity': quantity,
+            'unit_cost': (value / quantity).quantize(CENT) if quantity else ZERO,
+            'value': value,
+        })
+
+    rows.sort(key=lambda row: (row['product'].name, row['location']))
+    return rows
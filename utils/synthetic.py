@@ -0,0 +1,795 @@
+"""
+Synthetic data generator for load and benchmark testing
+
+Builds a realistic, internally consistent dataset (chart of accounts, posted
+journal entries, customers and vendors, invoices, expenses, products with
+stock movements, fixed assets with depreciation history, projects with time
+entries, bank statements and a budget) using batched Core inserts with
+pre-assigned ids, so millions of journal items load in minutes.
+
+Output is deterministic for a given seed, scale and date range. Because the
+rows bypass the ORM, the per-period account balances and the ledger version
+are updated explicitly at the end.
+"""
+import logging
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import func, text
+
+from app import db
+from models import (
+    Account, AccountType, AssetCategory, AssetCondition, AssetDepreciation, AssetLocation, AssetStatus,
+    BankAccount, BankStatement, BankTransaction, Budget, BudgetItem, BudgetPeriodType, Entity, EntityType,
+    Expense, ExpenseItem, ExpenseStatus,
+    FixedAsset, InventoryTransaction, InventoryTransactionType, Invoice, InvoiceItem, InvoiceStatus,
+    JournalEntry, JournalItem, Product, ProductCategory, Project, ProjectStatus, TimeEntry, UnitOfMeasure,
+    User, Warehouse
+)
+from utils.balances import apply_balance_deltas
+from utils.report_cache import bump_ledger_version
+from utils.stock import apply_stock_deltas
+
+logger = logging.getLogger(__name__)
+
+# Dataset sizes by scale name; any count can be overridden individually
+SCALES = {
+    'tiny': {
+        'accounts': 40, 'journal_entries': 500, 'customers': 10, 'vendors': 10,
+        'invoices': 50, 'expenses': 50, 'products': 20, 'inventory_transactions': 200,
+        'fixed_assets': 5, 'projects': 3, 'time_entries': 100, 'bank_statements': 6,
+        'bank_transactions_per_statement': 20,
+    },
+    'small': {
+        'accounts': 100, 'journal_entries': 5000, 'customers': 50, 'vendors': 50,
+        'invoices': 500, 'expenses': 500, 'products': 100, 'inventory_transactions': 5000,
+        'fixed_assets': 25, 'projects': 10, 'time_entries': 2000, 'bank_statements': 12,
+        'bank_transactions_per_statement': 100,
+    },
+    'medium': {
+        'accounts': 300, 'journal_entries': 100000, 'customers': 500, 'vendors': 300,
+        'invoices': 10000, 'expenses': 10000, 'products': 1000, 'inventory_transactions': 100000,
+        'fixed_assets': 200, 'projects': 50, 'time_entries': 50000, 'bank_statements': 36,
+        'bank_transactions_per_statement': 500,
+    },
+    'large': {
+        'accounts': 1000, 'journal_entries': 4000000, 'customers': 5000, 'vendors': 2000,
+        'invoices': 200000, 'expenses': 200000, 'products': 10000, 'inventory_transactions': 2000000,
+        'fixed_assets': 2000, 'projects': 500, 'time_entries': 1000000, 'bank_statements': 60,
+        'bank_transactions_per_statement': 2000,
+    },
+}
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Share of leaf accounts per type; every type gets at least two leaves
+_ACCOUNT_TYPE_LAYOUT = [
+    (AccountType.ASSET, '1', 0.30),
+    (AccountType.LIABILITY, '2', 0.15),
+    (AccountType.EQUITY, '3', 0.05),
+    (AccountType.REVENUE, '4', 0.15),
+    (AccountType.EXPENSE, '5', 0.35),
+]
+
+_ACCOUNT_GROUPS = {
+    AccountType.ASSET: ['Cash', 'Receivables', 'Inventory', 'Prepaid', 'Equipment'],
+    AccountType.LIABILITY: ['Payables', 'Accrued', 'Loans'],
+    AccountType.EQUITY: ['Capital', 'Retained Earnings'],
+    AccountType.REVENUE: ['Sales', 'Services', 'Other Income'],
+    AccountType.EXPENSE: ['Payroll', 'Rent', 'Utilities', 'Travel', 'Supplies', 'Marketing'],
+}
+
+_WORDS = ['Alpha', 'Beacon', 'Cedar', 'Delta', 'Ember', 'Falcon', 'Granite', 'Harbor', 'Iris', 'Juniper',
+          'Kestrel', 'Lumen', 'Maple', 'Nimbus', 'Orchid', 'Pioneer', 'Quartz', 'Ridge', 'Summit', 'Tundra']
+_COMPANY_SUFFIXES = ['Ltd', 'LLC', 'Inc', 'Group', 'Partners', 'Supply', 'Trading', 'Services']
+
+
+def _cents(amount_cents):
+    return Decimal(amount_cents).scaleb(-2)
+
+
+class _BulkWriter:
+    """Buffers rows per table and inserts them in batches, parents first"""
+
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+        self.next_ids = {}
+
+    def next_id(self, model):
+        table = model.__table__
+        if table.name not in self.next_ids:
+            current = self.connection.execute(db.select(func.max(table.c.id))).scalar() or 0
+            self.next_ids[table.name] = current + 1
+        value = self.next_ids[table.name]
+        self.next_ids[table.name] = value + 1
+        return value
+
+    def add(self, model, row):
+        table = model.__table__
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Insert in the order tables were first used so parents precede children
+        for table, rows in self.buffers.items():
+            if rows:
+                self.connection.execute(table.insert(), rows)
+                self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+                rows.clear()
+
+    def reset_sequences(self):
+        """Move PostgreSQL id sequences past the pre-assigned ids"""
+        if self.connection.dialect.name != 'postgresql':
+            return
+        for table_name in self.next_ids:
+            self.connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM \"{table_name}\"))"
+            ))
+
+
+class SyntheticDataGenerator:
+    """Generates one synthetic dataset; see generate_synthetic_data()"""
+
+    def __init__(self, counts, seed, start_date, end_date, batch_size=DEFAULT_BATCH_SIZE, echo=None):
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.span_days = max((end_date - start_date).days, 0)
+        self.batch_size = batch_size
+        self.echo = echo or (lambda message: logger.info(message))
+        self.now = datetime.combine(end_date, datetime.min.time())
+        self.balance_deltas = {}
+        self.stock_deltas = {}
+
+    #
+    # Helpers
+    #
+
+    def random_date(self, start=None, end=None):
+        start = start or self.start_date
+        end = end or self.end_date
+        return start + timedelta(days=self.rng.randint(0, max((end - start).days, 0)))
+
+    def company_name(self):
+        return f"{self.rng.choice(_WORDS)} {self.rng.choice(_WORDS)} {self.rng.choice(_COMPANY_SUFFIXES)}"
+
+    def get_or_create(self, model, **values):
+        instance = model.query.filter_by(**values).first()
+        if instance is None:
+            instance = model(**values)
+            db.session.add(instance)
+            db.session.flush()
+        return instance
+
+    def add_journal_entry(self, entry_date, description, lines, is_posted=True):
+        """
+        Queue a journal entry with its items and return the entry id.
+
+        `lines` is a list of (account_id, debit_cents, credit_cents).
+        """
+        entry_id = self.writer.next_id(JournalEntry)
+        self.writer.add(JournalEntry, {
+            'id': entry_id,
+            'entry_date': entry_date,
+            'reference': f"SYN-{entry_id}",
+            'description': description,
+            'is_posted': is_posted,
+            'created_at': self.now,
+            'created_by_id': self.user_id,
+        })
+        for account_id, debit_cents, credit_cents in lines:
+            self.writer.add(JournalItem, {
+                'id': self.writer.next_id(JournalItem),
+                'journal_entry_id': entry_id,
+                'account_id': account_id,
+                'description': description,
+                'debit_amount': _cents(debit_cents),
+                'credit_amount': _cents(credit_cents),
+            })
+            if is_posted:
+                key = (account_id, entry_date.year, entry_date.month)
+                debit, credit = self.balance_deltas.get(key, (0, 0))
+                self.balance_deltas[key] = (debit + debit_cents, credit + credit_cents)
+        return entry_id
+
+    #
+    # Reference data
+    #
+
+    def create_reference_data(self):
+        self.types = {name: self.get_or_create(AccountType, name=name) for name, _, _ in _ACCOUNT_TYPE_LAYOUT}
+        self.customer_type = self.get_or_create(EntityType, name=EntityType.CUSTOMER)
+        self.vendor_type = self.get_or_create(EntityType, name=EntityType.VENDOR)
+        self.invoice_statuses = [self.get_or_create(InvoiceStatus, name=name).id for name in (
+            InvoiceStatus.DRAFT, InvoiceStatus.SENT, InvoiceStatus.PAID, InvoiceStatus.OVERDUE)]
+        self.expense_statuses = [self.get_or_create(ExpenseStatus, name=name).id for name in (
+            ExpenseStatus.PENDING, ExpenseStatus.APPROVED, ExpenseStatus.PAID)]
+        self.project_statuses = [self.get_or_create(ProjectStatus, name=name).id for name in (
+            ProjectStatus.PLANNED, ProjectStatus.IN_PROGRESS, ProjectStatus.COMPLETED)]
+        self.asset_status_id = self.get_or_create(AssetStatus, name=AssetStatus.ACTIVE).id
+        self.asset_condition_id = self.get_or_create(AssetCondition, name=AssetCondition.GOOD).id
+        self.uom_id = (UnitOfMeasure.query.filter_by(abbreviation='ea').first()
+                       or self.get_or_create(UnitOfMeasure, name='Each', abbreviation='ea')).id
+        self.inventory_type_ids = {
+            'IN': self.get_or_create(InventoryTransactionType, name=InventoryTransactionType.PURCHASE).id,
+            'OUT': self.get_or_create(InventoryTransactionType, name=InventoryTransactionType.SALE).id,
+        }
+        self.warehouses = []
+        for index in range(1, 4):
+            warehouse = Warehouse.query.filter_by(code=f"SYN-WH{index}").first()
+            if warehouse is None:
+                warehouse = Warehouse(code=f"SYN-WH{index}", name=f"Synthetic Warehouse {index}")
+                db.session.add(warehouse)
+                db.session.flush()
+            self.warehouses.append(warehouse)
+        self.asset_locations = [
+            self.get_or_create(AssetLocation, name=f"Synthetic Site {index}").id for index in range(1, 4)
+        ]
+        db.session.commit()
+
+    #
+    # Generators
+    #
+
+    def create_accounts(self):
+        total = max(self.counts['accounts'], len(_ACCOUNT_TYPE_LAYOUT) * 3)
+        self.leaf_accounts = {name: [] for name, _, _ in _ACCOUNT_TYPE_LAYOUT}
+        self.group_accounts = {name: {} for name, _, _ in _ACCOUNT_TYPE_LAYOUT}
+
+        for type_name, digit, share in _ACCOUNT_TYPE_LAYOUT:
+            type_id = self.types[type_name].id
+            groups = _ACCOUNT_GROUPS[type_name]
+            leaves = max(2, int(total * share) - len(groups) - 1)
+
+            header_id = self.writer.next_id(Account)
+            self.writer.add(Account, self._account_row(header_id, f"{digit}00000", type_name, type_id, None))
+
+            group_ids = []
+            for group_index, group in enumerate(groups, start=1):
+                group_id = self.writer.next_id(Account)
+                group_ids.append(group_id)
+                self.group_accounts[type_name][group] = []
+                self.writer.add(Account, self._account_row(
+                    group_id, f"{digit}{group_index:02d}000", f"{type_name} - {group}", type_id, header_id))
+
+            for leaf_index in range(leaves):
+                group_index = leaf_index % len(groups)
+                group = groups[group_index]
+                leaf_id = self.writer.next_id(Account)
+                self.writer.add(Account, self._account_row(
+                    leaf_id, f"{digit}{group_index + 1:02d}{leaf_index // len(groups) + 1:03d}",
+                    f"{group} {leaf_index // len(groups) + 1}", type_id, group_ids[group_index]))
+                self.leaf_accounts[type_name].append(leaf_id)
+                self.group_accounts[type_name][group].append(leaf_id)
+
+        self.writer.flush()
+        self.cash_accounts = self.group_accounts[AccountType.ASSET]['Cash']
+        self.receivable_accounts = self.group_accounts[AccountType.ASSET]['Receivables']
+        self.inventory_accounts = self.group_accounts[AccountType.ASSET]['Inventory']
+        self.equipment_accounts = self.group_accounts[AccountType.ASSET]['Equipment']
+        self.payable_accounts = self.group_accounts[AccountType.LIABILITY]['Payables']
+        self.echo(f"Accounts: {sum(len(ids) for ids in self.leaf_accounts.values())} postable")
+
+    def _account_row(self, account_id, code, name, type_id, parent_id):
+        return {
+            'id': account_id,
+            'code': code,
+            'name': name,
+            'description': 'Synthetic account',
+            'account_type_id': type_id,
+            'parent_id': parent_id,
+            'is_active': True,
+            'created_at': self.now,
+            'created_by_id': self.user_id,
+        }
+
+    def create_journal_entries(self):
+        all_leaves = [account_id for ids in self.leaf_accounts.values() for account_id in ids]
+        rng = self.rng
+        count = self.counts['journal_entries']
+
+        for index in range(count):
+            entry_date = self.random_date()
+            debit_count = rng.choice((1, 1, 1, 2))
+            credit_count = rng.choice((1, 1, 2))
+            amount = rng.randint(100, 500000)
+
+            debit_splits = self._split(amount, debit_count)
+            credit_splits = self._split(amount, credit_count)
+            lines = [(rng.choice(all_leaves), cents, 0) for cents in debit_splits]
+            lines += [(rng.choice(all_leaves), 0, cents) for cents in credit_splits]
+
+            self.add_journal_entry(entry_date, 'Synthetic journal entry', lines, is_posted=rng.random() < 0.97)
+
+            if (index + 1) % 100000 == 0:
+                self.echo(f"  {index + 1} / {count} journal entries")
+
+        self.writer.flush()
+        self.echo(f"Journal entries: {count}")
+
+    def _split(self, amount, parts):
+        if parts == 1 or amount < parts:
+            return [amount]
+        cuts = sorted(self.rng.sample(range(1, amount), parts - 1))
+        bounds = [0] + cuts + [amount]
+        return [bounds[i + 1] - bounds[i] for i in range(parts)]
+
+    def create_entities(self):
+        self.customer_ids = []
+        self.vendor_ids = []
+        for entity_ids, type_id, count, label in (
+            (self.customer_ids, self.customer_type.id, self.counts['customers'], 'customer'),
+            (self.vendor_ids, self.vendor_type.id, self.counts['vendors'], 'vendor'),
+        ):
+            for index in range(count):
+                entity_id = self.writer.next_id(Entity)
+                entity_ids.append(entity_id)
+                self.writer.add(Entity, {
+                    'id': entity_id,
+                    'name': f"{self.company_name()} {index + 1}",
+                    'entity_type_id': type_id,
+                    'contact_name': f"{self.rng.choice(_WORDS)} Contact",
+                    'email': f"{label}{entity_id}@example.com",
+                    'phone': f"555-{self.rng.randint(1000, 9999)}",
+                    'address': f"{self.rng.randint(1, 999)} {self.rng.choice(_WORDS)} Street",
+                    'created_at': self.now,
+                    'created_by_id': self.user_id,
+                })
+        self.writer.flush()
+        self.echo(f"Entities: {len(self.customer_ids)} customers, {len(self.vendor_ids)} vendors")
+
+    def create_invoices(self):
+        revenue_accounts = self.leaf_accounts[AccountType.REVENUE]
+        draft_status = self.invoice_statuses[0]
+
+        for index in range(self.counts['invoices']):
+            invoice_id = self.writer.next_id(Invoice)
+            issue_date = self.random_date()
+            status_id = self.rng.choice(self.invoice_statuses)
+
+            items = []
+            total = 0
+            for _ in range(self.rng.randint(1, 4)):
+                quantity = self.rng.randint(1, 20)
+                unit_cents = self.rng.randint(500, 50000)
+                account_id = self.rng.choice(revenue_accounts)
+                total += quantity * unit_cents
+                items.append((quantity, unit_cents, account_id))
+
+            journal_entry_id = None
+            if status_id != draft_status:
+                lines = [(self.rng.choice(self.receivable_accounts), total, 0)]
+                lines += [(account_id, 0, quantity * unit_cents) for quantity, unit_cents, account_id in items]
+                journal_entry_id = self.add_journal_entry(issue_date, f"Invoice SYN-INV-{invoice_id:07d}", lines)
+
+            self.writer.add(Invoice, {
+                'id': invoice_id,
+                'invoice_number': f"SYN-INV-{invoice_id:07d}",
+                'entity_id': self.rng.choice(self.customer_ids),
+                'issue_date': issue_date,
+                'due_date': issue_date + timedelta(days=30),
+                'status_id': status_id,
+                'total_amount': _cents(total),
+                'notes': None,
+                'journal_entry_id': journal_entry_id,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+            })
+            for quantity, unit_cents, account_id in items:
+                self.writer.add(InvoiceItem, {
+                    'id': self.writer.next_id(InvoiceItem),
+                    'invoice_id': invoice_id,
+                    'description': 'Synthetic goods and services',
+                    'quantity': Decimal(quantity),
+                    'unit_price': _cents(unit_cents),
+                    'account_id': account_id,
+                })
+        self.writer.flush()
+        self.echo(f"Invoices: {self.counts['invoices']}")
+
+    def create_expenses(self):
+        expense_accounts = self.leaf_accounts[AccountType.EXPENSE]
+        pending_status = self.expense_statuses[0]
+
+        for index in range(self.counts['expenses']):
+            expense_id = self.writer.next_id(Expense)
+            expense_date = self.random_date()
+            status_id = self.rng.choice(self.expense_statuses)
+
+            items = []
+            total = 0
+            for _ in range(self.rng.randint(1, 3)):
+                unit_cents = self.rng.randint(1000, 200000)
+                account_id = self.rng.choice(expense_accounts)
+                total += unit_cents
+                items.append((unit_cents, account_id))
+
+            journal_entry_id = None
+            if status_id != pending_status:
+                lines = [(account_id, unit_cents, 0) for unit_cents, account_id in items]
+                lines.append((self.rng.choice(self.payable_accounts), 0, total))
+                journal_entry_id = self.add_journal_entry(expense_date, f"Expense SYN-EXP-{expense_id:07d}", lines)
+
+            self.writer.add(Expense, {
+                'id': expense_id,
+                'expense_number': f"SYN-EXP-{expense_id:07d}",
+                'entity_id': self.rng.choice(self.vendor_ids),
+                'expense_date': expense_date,
+                'payment_due_date': expense_date + timedelta(days=30),
+                'status_id': status_id,
+                'total_amount': _cents(total),
+                'notes': None,
+                'journal_entry_id': journal_entry_id,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+            })
+            for unit_cents, account_id in items:
+                self.writer.add(ExpenseItem, {
+                    'id': self.writer.next_id(ExpenseItem),
+                    'expense_id': expense_id,
+                    'description': 'Synthetic expense',
+                    'quantity': Decimal(1),
+                    'unit_price': _cents(unit_cents),
+                    'account_id': account_id,
+                })
+        self.writer.flush()
+        self.echo(f"Expenses: {self.counts['expenses']}")
+
+    def create_products(self):
+        category = ProductCategory.query.filter_by(name='Synthetic').first()
+        if category is None:
+            category = ProductCategory(name='Synthetic', description='Synthetic products')
+            db.session.add(category)
+            db.session.flush()
+
+        self.products = []
+        for index in range(self.counts['products']):
+            product_id = self.writer.next_id(Product)
+            cost_cents = self.rng.randint(100, 50000)
+            self.products.append((product_id, cost_cents))
+            self.writer.add(Product, {
+                'id': product_id,
+                'sku': f"SYN-SKU-{product_id:06d}",
+                'name': f"{self.rng.choice(_WORDS)} Item {index + 1}",
+                'description': 'Synthetic product',
+                'category_id': category.id,
+                'uom_id': self.uom_id,
+                'cost_price': _cents(cost_cents),
+                'sales_price': _cents(int(cost_cents * self.rng.uniform(1.2, 2.0))),
+                'reorder_level': Decimal(self.rng.randint(5, 50)),
+                'preferred_vendor_id': self.rng.choice(self.vendor_ids) if self.vendor_ids else None,
+                'asset_account_id': self.rng.choice(self.inventory_accounts),
+                'expense_account_id': self.rng.choice(self.leaf_accounts[AccountType.EXPENSE]),
+                'revenue_account_id': self.rng.choice(self.leaf_accounts[AccountType.REVENUE]),
+                'is_active': True,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+            })
+        self.writer.flush()
+
+        # Stock movements in date order; sales never take stock below zero
+        if not self.products:
+            return
+        count = self.counts['inventory_transactions']
+        stock = {product_id: 0 for product_id, _ in self.products}
+        moments = sorted(self.rng.randint(0, self.span_days * 86400) for _ in range(count))
+        start = datetime.combine(self.start_date, datetime.min.time())
+
+        for offset in moments:
+            product_id, cost_cents = self.rng.choice(self.products)
+            quantity = self.rng.randint(1, 50)
+            transaction_type = 'IN'
+            if stock[product_id] > 0 and self.rng.random() < 0.55:
+                transaction_type = 'OUT'
+                quantity = min(quantity, stock[product_id])
+            stock[product_id] += quantity if transaction_type == 'IN' else -quantity
+            warehouse = self.rng.choice(self.warehouses)
+            location = warehouse.name
+            signed = quantity if transaction_type == 'IN' else -quantity
+            moved, value_cents = self.stock_deltas.get((product_id, location), (0, 0))
+            self.stock_deltas[(product_id, location)] = (moved + signed, value_cents + signed * cost_cents)
+
+            self.writer.add(InventoryTransaction, {
+                'id': self.writer.next_id(InventoryTransaction),
+                'transaction_date': start + timedelta(seconds=offset),
+                'transaction_type': transaction_type,
+                'transaction_type_id': self.inventory_type_ids[transaction_type],
+                'product_id': product_id,
+                'quantity': Decimal(quantity),
+                'unit_price': _cents(cost_cents),
+                'location': location,
+                'warehouse_id': warehouse.id,
+                'reference_type': 'Purchase' if transaction_type == 'IN' else 'Sale',
+                'reference_id': None,
+                'notes': None,
+                'journal_entry_id': None,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+            })
+        self.writer.flush()
+        self.echo(f"Products: {len(self.products)} with {count} stock movements")
+
+    def create_fixed_assets(self):
+        category = AssetCategory.query.filter_by(name='Synthetic Equipment').first()
+        if category is None:
+            category = AssetCategory(
+                name='Synthetic Equipment',
+                depreciation_method='straight-line',
+                useful_life_years=5,
+                asset_account_id=self.equipment_accounts[0],
+                depreciation_account_id=self.leaf_accounts[AccountType.EXPENSE][0],
+                accumulated_depreciation_account_id=self.equipment_accounts[-1]
+            )
+            db.session.add(category)
+            db.session.flush()
+
+        depreciation_rows = 0
+        for index in range(self.counts['fixed_assets']):
+            asset_id = self.writer.next_id(FixedAsset)
+            acquired = self.random_date()
+            cost_cents = self.rng.randint(100000, 5000000)
+            life_years = self.rng.choice((3, 5, 7, 10))
+            monthly_cents = cost_cents // (life_years * 12)
+
+            # Monthly straight-line depreciation up to the end of the range
+            book_cents = cost_cents
+            period_start = acquired.replace(day=1) + relativedelta(months=1)
+            last_date = None
+            depreciation = []
+            while period_start <= self.end_date and book_cents > 0:
+                period_end = period_start + relativedelta(months=1) - timedelta(days=1)
+                amount = min(monthly_cents, book_cents)
+                depreciation.append((period_start, period_end, amount, book_cents))
+                book_cents -= amount
+                last_date = period_end
+                period_start += relativedelta(months=1)
+
+            self.writer.add(FixedAsset, {
+                'id': asset_id,
+                'asset_number': f"SYN-FA-{asset_id:06d}",
+                'name': f"{self.rng.choice(_WORDS)} Equipment {index + 1}",
+                'description': 'Synthetic fixed asset',
+                'category_id': category.id,
+                'acquisition_date': acquired,
+                'purchase_cost': _cents(cost_cents),
+                'salvage_value': Decimal(0),
+                'useful_life_years': life_years,
+                'depreciation_method': 'straight-line',
+                'last_depreciation_date': last_date,
+                'current_value': _cents(book_cents),
+                'location_id': self.rng.choice(self.asset_locations),
+                'status_id': self.asset_status_id,
+                'condition_id': self.asset_condition_id,
+                'vendor_id': self.rng.choice(self.vendor_ids) if self.vendor_ids else None,
+                'is_fully_depreciated': book_cents == 0,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+            })
+            for period_start, period_end, amount, before in depreciation:
+                self.writer.add(AssetDepreciation, {
+                    'id': self.writer.next_id(AssetDepreciation),
+                    'asset_id': asset_id,
+                    'date': period_end,
+                    'amount': _cents(amount),
+                    'period_start': period_start,
+                    'period_end': period_end,
+                    'book_value_before': _cents(before),
+                    'book_value_after': _cents(before - amount),
+                    'journal_entry_id': None,
+                    'created_at': self.now,
+                    'created_by_id': self.user_id,
+                })
+            depreciation_rows += len(depreciation)
+        self.writer.flush()
+        self.echo(f"Fixed assets: {self.counts['fixed_assets']} with {depreciation_rows} depreciation records")
+
+    def create_projects(self):
+        project_ids = []
+        for index in range(self.counts['projects']):
+            project_id = self.writer.next_id(Project)
+            project_ids.append(project_id)
+            start = self.random_date()
+            self.writer.add(Project, {
+                'id': project_id,
+                'project_code': f"SYN-PRJ-{project_id:05d}",
+                'name': f"{self.rng.choice(_WORDS)} Project {index + 1}",
+                'description': 'Synthetic project',
+                'entity_id': self.rng.choice(self.customer_ids) if self.customer_ids else None,
+                'status_id': self.rng.choice(self.project_statuses),
+                'start_date': start,
+                'end_date': None,
+                'estimated_hours': Decimal(self.rng.randint(100, 5000)),
+                'budget_amount': _cents(self.rng.randint(1000000, 50000000)),
+                'is_billable': True,
+                'created_at': self.now,
+                'created_by_id': self.user_id,
+                'manager_id': self.user_id,
+            })
+
+        if project_ids:
+            for _ in range(self.counts['time_entries']):
+                hours = Decimal(self.rng.randint(1, 16)) / 2
+                cost_rate = Decimal(self.rng.randint(30, 90))
+                self.writer.add(TimeEntry, {
+                    'id': self.writer.next_id(TimeEntry),
+                    'project_id': self.rng.choice(project_ids),
+                    'task_id': None,
+                    'user_id': self.user_id,
+                    'date': self.random_date(),
+                    'hours': hours,
+                    'description': 'Synthetic work',
+                    'is_billable': self.rng.random() < 0.8,
+                    'billing_rate': cost_rate * 2,
+                    'cost_rate': cost_rate,
+                    'cost_amount': hours * cost_rate,
+                    'is_approved': self.rng.random() < 0.7,
+                    'approved_by_id': None,
+                    'created_at': self.now,
+                })
+        self.writer.flush()
+        self.echo(f"Projects: {len(project_ids)} with {self.counts['time_entries']} time entries")
+
+    def create_bank_statements(self):
+        if not self.counts['bank_statements']:
+            return
+
+        bank_account = BankAccount.query.filter_by(account_number='SYN-0001').first()
+        if bank_account is None:
+            bank_account = BankAccount(
+                name='Synthetic Operating Account',
+                account_number='SYN-0001',
+                gl_account_id=self.cash_accounts[0]
+            )
+            db.session.add(bank_account)
+            db.session.flush()
+
+        # One statement per month, ending at the end of the range
+        balance_cents = self.rng.randint(1000000, 10000000)
+        first_month = self.end_date.replace(day=1) - relativedelta(months=self.counts['bank_statements'] - 1)
+        for month_index in range(self.counts['bank_statements']):
+            period_start = first_month + relativedelta(months=month_index)
+            period_end = period_start + relativedelta(months=1) - timedelta(days=1)
+            statement_id = self.writer.next_id(BankStatement)
+
+            transactions = []
+            for _ in range(self.counts['bank_transactions_per_statement']):
+                amount = self.rng.randint(500, 500000)
+                is_credit = self.rng.random() < 0.45
+                transactions.append((self.random_date(period_start, period_end), amount, is_credit))
+            transactions.sort()
+
+            beginning = balance_cents
+            for _, amount, is_credit in transactions:
+                balance_cents += amount if is_credit else -amount
+
+            self.writer.add(BankStatement, {
+                'id': statement_id,
+                'bank_account_id': bank_account.id,
+                'statement_date': period_end,
+                'start_date': period_start,
+                'end_date': period_end,
+                'beginning_balance': _cents(beginning),
+                'ending_balance': _cents(balance_cents),
+                'is_reconciled': False,
+                'notes': None,
+            })
+            for transaction_date, amount, is_credit in transactions:
+                self.writer.add(BankTransaction, {
+                    'id': self.writer.next_id(BankTransaction),
+                    'statement_id': statement_id,
+                    'transaction_date': transaction_date,
+                    'description': f"{'DEPOSIT' if is_credit else 'PAYMENT'} {self.company_name().upper()}",
+                    'reference': f"{self.rng.randint(100000, 999999)}",
+                    'amount': _cents(amount),
+                    'transaction_type': 'credit' if is_credit else 'debit',
+                    'is_reconciled': False,
+                    'reconciled_date': None,
+                    'gl_entry_id': None,
+                })
+        self.writer.flush()
+        self.echo(f"Bank statements: {self.counts['bank_statements']}")
+
+    def create_budget(self):
+        """Monthly budget for the final year of the range, used by the variance report"""
+        period_type = self.get_or_create(BudgetPeriodType, name=BudgetPeriodType.MONTHLY)
+        year = self.end_date.year
+        budget_id = self.writer.next_id(Budget)
+        self.writer.add(Budget, {
+            'id': budget_id,
+            'name': f"Synthetic Budget {year}",
+            'description': 'Synthetic budget',
+            'year': year,
+            'period_type_id': period_type.id,
+            'start_date': date(year, 1, 1),
+            'end_date': date(year, 12, 31),
+            'is_active': True,
+            'created_at': self.now,
+            'created_by_id': self.user_id,
+        })
+        for account_id in self.leaf_accounts[AccountType.REVENUE] + self.leaf_accounts[AccountType.EXPENSE]:
+            monthly_cents = self.rng.randint(10000, 2000000)
+            for month in range(1, 13):
+                self.writer.add(BudgetItem, {
+                    'id': self.writer.next_id(BudgetItem),
+                    'budget_id': budget_id,
+                    'account_id': account_id,
+                    'period': month,
+                    'amount': _cents(monthly_cents),
+                })
+        self.writer.flush()
+        self.echo(f"Budget: {year}")
+
+    #
+    # Entry point
+    #
+
+    def run(self):
+        user = User.query.filter_by(username='admin').first() or User.query.first()
+        if user is None:
+            raise ValueError("No users found; run 'flask riska init-db' first")
+        self.user_id = user.id
+
+        if Invoice.query.filter(Invoice.invoice_number.like('SYN-%')).first() or \
+                Account.query.filter_by(code='100000').first():
+            raise ValueError("Synthetic data already present; use a fresh database")
+
+        self.create_reference_data()
+
+        connection = db.session.connection()
+        self.writer = _BulkWriter(connection, self.batch_size)
+
+        self.create_accounts()
+        self.create_entities()
+        self.create_journal_entries()
+        self.create_invoices()
+        self.create_expenses()
+        self.create_products()
+        self.create_fixed_assets()
+        self.create_projects()
+        self.create_bank_statements()
+        self.create_budget()
+
+        # The ORM balance and stock listeners did not see these rows
+        apply_balance_deltas(connection, {
+            key: (_cents(debit), _cents(credit)) for key, (debit, credit) in self.balance_deltas.items()
+        })
+        bump_ledger_version(connection)
+        apply_stock_deltas(connection, {
+            key: (Decimal(quantity), _cents(value)) for key, (quantity, value) in self.stock_deltas.items()
+        }, {warehouse.name: warehouse.id for warehouse in self.warehouses})
+        self.writer.reset_sequences()
+
+        db.session.commit()
+        return dict(self.writer.counts)
+
+
+def generate_synthetic_data(scale='small', seed=42, start_date=None, end_date=None,
+                            batch_size=DEFAULT_BATCH_SIZE, echo=None, **overrides):
+    """
+    Generate a synthetic dataset and return row counts per table.
+
+    `scale` picks the base sizes from SCALES; keyword overrides such as
+    journal_entries=1000 replace individual counts.
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale '{scale}'. Choose from: {', '.join(SCALES)}")
+
+    counts = dict(SCALES[scale])
+    counts.update({key: value for key, value in overrides.items() if value is not None})
+
+    end_date = end_date or date.today()
+    start_date = start_date or (end_date.replace(day=1) - relativedelta(years=3))
+    if start_date > end_date:
+        raise ValueError("Start date must be on or before end date")
+
+    generator = SyntheticDataGenerator(counts, seed, start_date, end_date, batch_size=batch_size, echo=echo)
+    return generator.run()
@@ -0,0 +1,280 @@
+"""
+Month-end inventory valuation snapshots
+
+Closing a month writes an InventoryValuationSnapshot row per product and
+location (with its warehouse) for each costing method: the quantity and
+value on hand at the month end, plus the integer cost state (FIFO layers or
+moving average) the streamed methods need to carry on from there.
+
+Snapshots are incremental: a close only recomputes the products with
+movements since the previous close, resuming from their saved cost states,
+and only those products get rows for the new month. The latest snapshot of a
+product on or before a date therefore holds its state at that date, and a
+historical valuation is that state plus the movements after the close (see
+compute_stock_valuation()).
+
+Closed periods freeze the cost prices used for movements recorded without a
+unit price. Any change to a movement dated in a closed period deletes the
+snapshots from that date on; the next close rebuilds them. Bulk loaders that
+insert InventoryTransaction rows with Core must call
+invalidate_valuation_snapshots() themselves.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, delete, event, func, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import InventoryTransaction, InventoryValuationSnapshot
+from utils.balances import _old_and_new
+from utils.stock import warehouse_index
+from utils.stock_valuation import (
+    CENT, STANDARD, VALUATION_BATCH_SIZE, VALUATION_METHODS, ZERO,
+    _cost_prices, _standard_quantities, _streamed_states, _transaction_filters,
+    dump_cost_state, load_cost_state, state_valuation,
+)
+
+logger = logging.getLogger(__name__)
+
+_INVALIDATE_FROM_KEY = 'inventory_snapshots_invalidate_from'
+
+# Changes to these attributes alter a movement's valuation
+_VALUED_ATTRIBUTES = (
+    'transaction_date', 'transaction_type', 'product_id', 'location', 'warehouse_id', 'quantity', 'unit_price'
+)
+
+
+def month_end(value):
+    """Last day of the month containing a date"""
+    if isinstance(value, datetime):
+        value = value.date()
+    next_month = value.replace(day=28) + timedelta(days=4)
+    return next_month - timedelta(days=next_month.day)
+
+
+def latest_snapshot_period(method, as_of=None):
+    """Latest closed month end for a method (on or before `as_of`), or None"""
+    query = select(func.max(InventoryValuationSnapshot.period_end)).where(
+        InventoryValuationSnapshot.method == method
+    )
+    if as_of is not None:
+        if isinstance(as_of, datetime):
+            as_of = as_of.date()
+        query = query.where(InventoryValuationSnapshot.period_end <= as_of)
+    return db.session.execute(query).scalar()
+
+
+def load_snapshot(method, as_of=None, product_ids=None, warehouse_id=None):
+    """
+    Cost states at the latest close on or before `as_of`.
+
+    Returns (period_end, {(product_id, location): state}) where a state is the
+    quantity for the standard method and a streamed cost state otherwise, or
+    None when no period has been closed yet. Each product and location gets
+    its latest row up to that close, from one grouped query.
+    """
+    period_end = latest_snapshot_period(method, as_of)
+    if period_end is None:
+        return None
+
+    snapshot = InventoryValuationSnapshot
+    latest = select(
+        snapshot.product_id,
+        snapshot.location,
+        func.max(snapshot.period_end).label('period_end')
+    ).where(
+        snapshot.method == method,
+        snapshot.period_end <= period_end
+    ).group_by(
+        snapshot.product_id, snapshot.location
+    )
+    if product_ids is not None:
+        latest = latest.where(snapshot.product_id.in_(product_ids))
+    if warehouse_id is not None:
+        latest = latest.where(snapshot.warehouse_id == warehouse_id)
+    latest = latest.subquery()
+
+    rows = db.session.connection().execute(
+        select(snapshot.product_id, snapshot.location, snapshot.quantity, snapshot.cost_state).join(
+            latest, and_(
+                snapshot.product_id == latest.c.product_id,
+                snapshot.location == latest.c.location,
+                snapshot.period_end == latest.c.period_end
+            )
+        ).where(snapshot.method == method)
+    )
+
+    states = {}
+    for product_id, location, quantity, cost_state in rows:
+        if method == STANDARD:
+            states[(product_id, location)] = Decimal(quantity or 0)
+        else:
+            states[(product_id, location)] = load_cost_state(method, cost_state)
+    return period_end, states
+
+
+def _month_ends(first, last):
+    period_end = month_end(first)
+    while period_end <= last:
+        yield period_end
+        period_end = month_end(period_end + timedelta(days=1))
+
+
+def _touched_products(since, period_end):
+    """Products with movements after `since` up to the end of `period_end`"""
+    return set(db.session.execute(
+        select(InventoryTransaction.product_id).where(
+            *_transaction_filters(period_end, None, since=since)
+        ).distinct()
+    ).scalars())
+
+
+def _close_method(method, through, batch_size):
+    """Close every month end after the method's latest snapshot up to `through`"""
+    last = latest_snapshot_period(method)
+    if last is not None:
+        first = last + timedelta(days=1)
+    else:
+        first = db.session.execute(select(func.min(InventoryTransaction.transaction_date))).scalar()
+        if first is None:
+            return []
+
+    # Cost states are carried in memory from one month to the next
+    start = load_snapshot(method) if last is not None else None
+    states = start[1] if start is not None else {}
+    cost_prices = _cost_prices(None) if method == STANDARD else None
+    warehouses = warehouse_index(db.session.connection())
+    table = InventoryValuationSnapshot.__table__
+
+    closed = []
+    created_at = datetime.utcnow()
+    since = last
+    for period_end in _month_ends(first, through):
+        touched = _touched_products(since, period_end)
+        if touched:
+            if method == STANDARD:
+                states = _standard_quantities(period_end, None, start=(since, states))
+            else:
+                states = _streamed_states(method, period_end, None, batch_size, start=(since, states))
+
+            rows = []
+            for (product_id, location), state in states.items():
+                if product_id not in touched:
+                    continue
+                if method == STANDARD:
+                    quantity = state.quantize(CENT)
+                    value = (quantity * cost_prices.get(product_id, ZERO)).quantize(CENT)
+                    cost_state = None
+                else:
+                    quantity, value = state_valuation(state)
+                    cost_state = dump_cost_state(state)
+                rows.append({
+                    'period_end': period_end,
+                    'method': method,
+                    'product_id': product_id,
+                    'location': location,
+                    'warehouse_id': warehouses.get(location.lower(), (None, None))[0],
+                    'quantity': quantity,
+                    'value': value,
+                    'cost_state': cost_state,
+                    'created_at': created_at,
+                })
+            db.session.execute(table.insert(), rows)
+            db.session.commit()
+            closed.append({'period_end': period_end, 'method': method, 'rows': len(rows)})
+        since = period_end
+
+    if closed:
+        logger.info(f"Closed {len(closed)} {VALUATION_METHODS[method]} valuation periods through {closed[-1]['period_end']}")
+    return closed
+
+
+def close_inventory_periods(through=None, methods=None, batch_size=VALUATION_BATCH_SIZE):
+    """
+    Write the valuation snapshots for every month end not yet closed.
+
+    `through` is the last month to close (default: the previous month); it
+    must have ended. `methods` defaults to every costing method. Months in
+    which no product moved write no rows. Commits after each month and
+    returns a list of {'period_end', 'method', 'rows'} for the months written.
+    """
+    if through is None:
+        through = date.today().replace(day=1) - timedelta(days=1)
+    through = month_end(through)
+    if through >= date.today():
+        raise ValueError(f"The period ending {through} has not ended yet")
+
+    methods = list(methods or VALUATION_METHODS)
+    for method in methods:
+        if method not in VALUATION_METHODS:
+            raise ValueError(f"Unknown valuation method: {method}")
+
+    closed = []
+    for method in methods:
+        closed.extend(_close_method(method, through, batch_size))
+    return closed
+
+
+def invalidate_valuation_snapshots(connection, from_date=None, methods=None):
+    """
+    Delete the snapshots of month ends on or after `from_date` (all when None).
+
+    Call in the same transaction as any bulk change to movements dated in a
+    closed period.
+    """
+    table = InventoryValuationSnapshot.__table__
+    statement = delete(table)
+    if from_date is not None:
+        if isinstance(from_date, datetime):
+            from_date = from_date.date()
+        # Only months that have ended are closed
+        if from_date >= date.today():
+            return
+        statement = statement.where(table.c.period_end >= from_date)
+    if methods is not None:
+        statement = statement.where(table.c.method.in_(list(methods)))
+    connection.execute(statement)
+
+
+def _earliest_change(session):
+    """Earliest old or new date of the valued movements in the pending flush"""
+    earliest = None
+    with session.no_autoflush:
+        for collection, is_dirty in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+            for transaction in list(collection):
+                if not isinstance(transaction, InventoryTransaction):
+                    continue
+                if is_dirty and not any(
+                    _old_and_new(transaction, key)[0] != _old_and_new(transaction, key)[1]
+                    for key in _VALUED_ATTRIBUTES
+                ):
+                    continue
+                for value in _old_and_new(transaction, 'transaction_date'):
+                    if value is None:
+                        continue
+                    if isinstance(value, datetime):
+                        value = value.date()
+                    if earliest is None or value < earliest:
+                        earliest = value
+    return earliest
+
+
+def _before_flush(session, flush_context, instances):
+    earliest = _earliest_change(session)
+    if earliest is not None and earliest < date.today():
+        session.info[_INVALIDATE_FROM_KEY] = earliest
+
+
+def _after_flush(session, flush_context):
+    earliest = session.info.pop(_INVALIDATE_FROM_KEY, None)
+    if earliest is not None:
+        invalidate_valuation_snapshots(session.connection(), earliest)
+
+
+def register_snapshot_listeners():
+    """Drop the snapshots a flushed change to a closed period makes stale"""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)